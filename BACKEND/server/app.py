@@ -3,7 +3,9 @@ from config import Config
 from flask_cors import CORS
 from extensions import db, migrate, jwt
 from models import User
-from flask_jwt_extended import JWTManager
+from utils.cache import cache
+from utils.storage import immutable_etag, IMMUTABLE_MAX_AGE
+from flask_jwt_extended import JWTManager, jwt_required, get_jwt_identity
 from routes.users_route import users_bp
 from routes.products_route import product_bp
 from routes.productImage_route import product_image_bp
@@ -27,6 +29,7 @@ from routes.settings_route import settings_bp
 from routes.shipping_route import shipping_bp
 from routes.wishlist_route import wishlist_bp
 
+import click
 import os
 
 app = Flask(__name__)
@@ -45,6 +48,7 @@ CORS(
 db.init_app(app)
 migrate.init_app(app, db)
 jwt.init_app(app)
+cache.init_app(app)
 
 # JWT Error Handlers
 @jwt.expired_token_loader
@@ -74,8 +78,160 @@ def token_not_fresh_callback(jwt_header, jwt_payload):
 
 
 
+# CLI commands
+
+@app.cli.command('rebuild-sales-stats')
+def rebuild_sales_stats_command():
+    """Recompute the product_sales_stats best-seller table from orders and reviews."""
+    from utils.sales_stats import rebuild_sales_stats
+    count = rebuild_sales_stats()
+    print(f"Rebuilt sales stats for {count} products")
+
+
+@app.cli.command('rebuild-sales-rollup')
+def rebuild_sales_rollup_command():
+    """Recompute the daily_sales_rollup table from orders and order items."""
+    from utils.sales_rollup import rebuild_sales_rollup
+    count = rebuild_sales_rollup()
+    print(f"Rebuilt daily sales rollup with {count} rows")
+
+
+@app.cli.command('rebuild-customer-metrics')
+def rebuild_customer_metrics_command():
+    """Recompute the customer_metrics table from orders."""
+    from utils.customer_metrics import rebuild_customer_metrics
+    count = rebuild_customer_metrics()
+    print(f"Rebuilt customer metrics for {count} customers")
+
+
+@app.cli.command('rebuild-cart-totals')
+def rebuild_cart_totals_command():
+    """Recompute every shopping cart's item count and total from its items."""
+    from utils.cart import rebuild_cart_totals
+    count = rebuild_cart_totals()
+    print(f"Rebuilt totals of {count} shopping carts")
+
+
+@app.cli.command('release-expired-reservations')
+def release_expired_reservations_command():
+    """Put stock held by unpaid orders past their reservation window back on sale."""
+    from utils.inventory import release_expired_reservations
+    count = release_expired_reservations()
+    print(f"Released stock held by {count} expired orders")
+
+
+@app.cli.command('purge-idempotency-keys')
+def purge_idempotency_keys_command():
+    """Delete stored Idempotency-Key responses past their TTL."""
+    from utils.idempotency import purge_expired_keys
+    count = purge_expired_keys()
+    print(f"Purged {count} expired idempotency keys")
+
+
+@app.cli.command('process-mpesa-callbacks')
+@click.option('--watch', is_flag=True, help='Keep polling for new callbacks.')
+def process_mpesa_callbacks_command(watch):
+    """Apply stored M-Pesa callbacks waiting in the inbox."""
+    import time
+    from utils.mpesa_inbox import drain
+    while True:
+        count = drain()
+        if count or not watch:
+            print(f"Processed {count} M-Pesa callbacks")
+        if not watch:
+            return
+        time.sleep(app.config.get('MPESA_CALLBACK_POLL_SECONDS', 2))
+
+
+@app.cli.command('process-stripe-events')
+@click.option('--watch', is_flag=True, help='Keep polling for new events.')
+def process_stripe_events_command(watch):
+    """Apply stored Stripe webhook events waiting to be processed."""
+    import time
+    from utils.stripe_events import drain
+    while True:
+        count = drain()
+        if count or not watch:
+            print(f"Processed {count} Stripe events")
+        if not watch:
+            return
+        time.sleep(app.config.get('STRIPE_EVENT_POLL_SECONDS', 2))
+
+
+@app.cli.command('export-stripe-events')
+@click.argument('path', type=click.Path(dir_okay=False, writable=True))
+def export_stripe_events_command(path):
+    """Write every stored Stripe webhook event to PATH as JSON lines (replay with benchmark_stripe_webhooks.py)."""
+    from utils.stripe_events import export_events
+    with open(path, 'w') as stream:
+        count = export_events(stream)
+    print(f"Exported {count} Stripe events to {path}")
+
+
+@app.cli.command('generate-image-variants')
+@click.option('--missing-only/--all', default=True, help='Skip images that already have variants.')
+def generate_image_variants_command(missing_only):
+    """Generate thumbnail/card/detail variants for existing product images."""
+    from models import ProductImage
+    from utils.image_variants import process_image
+    query = ProductImage.query
+    if missing_only:
+        query = query.filter(ProductImage.variants.is_(None))
+    image_ids = [image_id for (image_id,) in query.with_entities(ProductImage.image_id).all()]
+    for image_id in image_ids:
+        try:
+            if process_image(image_id) is None:
+                print("Pillow is not installed; no variants generated")
+                return
+        except Exception as e:
+            db.session.rollback()
+            print(f"Image {image_id}: {str(e)}")
+    print(f"Processed {len(image_ids)} images")
+
+
+@app.cli.command('rebuild-search-index')
+def rebuild_search_index_command():
+    """(Re)build the product and blog full-text search index."""
+    from utils.search import rebuild_search_index
+    counts = rebuild_search_index()
+    if not counts:
+        print("No index to rebuild for this database (PostgreSQL uses GIN expression indexes)")
+    for table, count in counts.items():
+        print(f"Indexed {count} rows into {table}")
+
+
+# Background workers (per serving process)
+
+def start_background_workers():
+    """
+    Start the periodic workers; each runs its first pass one poll interval after startup,
+    so M-Pesa callbacks and Stripe events stored before a restart are applied without
+    waiting for a new one to arrive.
+
+    Only the server entry points call this (`python app.py` and wsgi.py), never an
+    import of the app, so CLI commands and scripts run without the threads.
+    """
+    if not app.config.get('START_BACKGROUND_WORKERS'):
+        return
+    from utils.inventory import sweeper
+    from utils import mpesa_inbox, stripe_events
+    for workers in (sweeper, mpesa_inbox.workers, stripe_events.workers):
+        workers.start(app)
+
+
 #Create a Route
 
+@app.route('/cache/stats')
+@jwt_required()
+def cache_stats():
+    """Response cache keys and hit rates (admin only)"""
+    identity = get_jwt_identity()
+    user_id = identity.get('id') if isinstance(identity, dict) else identity
+    user = db.session.get(User, user_id)
+    if not user or not user.is_admin:
+        return jsonify({"error": "Admin access required"}), 403
+    return jsonify(cache.stats()), 200
+
 @app.route('/')
 def home():
     return 'Hello, World!'
@@ -83,7 +239,13 @@ def home():
 # Serve static files (uploads)
 @app.route('/static/uploads/<path:filename>')
 def serve_upload(filename):
-    return send_from_directory('static/uploads', filename)
+    # Content-addressed files never change, so clients may keep them for a year
+    etag = immutable_etag(f'uploads/{filename}')
+    if etag is None:
+        return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    response = send_from_directory(app.config['UPLOAD_FOLDER'], filename, etag=etag, max_age=IMMUTABLE_MAX_AGE)
+    response.headers['Cache-Control'] = f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+    return response
 
   
 
@@ -119,4 +281,7 @@ app.register_blueprint(shipping_bp, url_prefix = '/shipping')
 app.register_blueprint(wishlist_bp, url_prefix='/wishlist')
 
 if __name__ == '__main__':
+    # The debug reloader serves from a child process; the watching parent needs no workers
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_workers()
     app.run(debug=True, port=5000)
\ No newline at end of file
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Admin Listings Query-Count Check
+Counts the SQL statements behind the admin customer and user grids at growing
+page sizes in a throwaway SQLite database. Every listing must issue the same
+number of statements whatever the page size (no per-row queries); the script
+exits non-zero if any listing's count grows with the page.
+
+Usage: python benchmark_admin_listings.py [customer_count]
+"""
+
+import os
+import sys
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+# Point the app at a temporary database before it is imported
+DB_PATH = os.path.join(tempfile.mkdtemp(), 'admin_listings_benchmark.db')
+os.environ['DATABASE_URL'] = f'sqlite:///{DB_PATH}'
+os.environ.setdefault('JWT_SECRET_KEY', 'benchmark-secret-key-benchmark-secret-key')
+os.environ['START_BACKGROUND_WORKERS'] = 'false'
+
+# Add the current directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from flask_jwt_extended import create_access_token
+from sqlalchemy import event
+
+from app import app
+from extensions import db
+from models import User, Order, UserRole, OrderStatus, PaymentStatus
+from utils.customer_metrics import rebuild_customer_metrics
+
+PAGE_SIZES = (5, 20, 100)
+ORDERS_PER_CUSTOMER = 5
+LISTINGS = (
+    ('customers', '/customers/admin/customers?per_page={per_page}'),
+    ('users', '/user-management/admin/users?per_page={per_page}'),
+    ('users (cursor)', '/user-management/admin/users?per_page={per_page}&cursor='),
+)
+
+
+def seed(rng, customer_count):
+    """Insert customers (half never logged in) with a few orders each, plus one admin."""
+    now = datetime.now()
+    db.session.execute(User.__table__.insert(), [{
+        'username': f'customer{i}',
+        'email': f'customer{i}@example.com',
+        'password_hash': 'x',
+        'role': UserRole.USER,
+        'last_login': None if i % 2 else now,
+    } for i in range(customer_count)])
+    admin = User(username='admin', email='admin@example.com', password_hash='x',
+                 role=UserRole.ADMIN, is_admin=True)
+    db.session.add(admin)
+    db.session.flush()
+    db.session.execute(Order.__table__.insert(), [{
+        'order_date': now - timedelta(days=rng.randint(0, 90)),
+        'total_amount': round(rng.uniform(20, 400), 2),
+        'order_status': rng.choice(list(OrderStatus)),
+        'status': OrderStatus.PENDING,
+        'payment_status': PaymentStatus.PENDING,
+        'shipping_address': f'{rng.randint(1, 999)} Moi Avenue, Nairobi',
+        'user_id': rng.randint(1, customer_count),
+    } for _ in range(customer_count * ORDERS_PER_CUSTOMER)])
+    db.session.commit()
+    rebuild_customer_metrics()
+    return admin.id
+
+
+def measure(client, headers, url):
+    """(statement count, wall ms, row count) for one GET."""
+    statements = {'count': 0}
+
+    def count_statement(*args, **kwargs):
+        statements['count'] += 1
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', count_statement)
+    try:
+        started = time.perf_counter()
+        response = client.get(url, headers=headers)
+        elapsed = (time.perf_counter() - started) * 1000
+    finally:
+        event.remove(engine, 'before_cursor_execute', count_statement)
+    if response.status_code != 200:
+        raise RuntimeError(f'{url} returned {response.status_code}: {response.get_data(as_text=True)[:200]}')
+    body = response.get_json()
+    rows = body.get('customers') or body.get('users') or []
+    return statements['count'], elapsed, len(rows)
+
+
+def run_check(customer_count):
+    rng = random.Random(15)
+
+    with app.app_context():
+        db.create_all()
+        admin_id = seed(rng, customer_count)
+        headers = {'Authorization': f'Bearer {create_access_token(identity=str(admin_id))}'}
+
+    client = app.test_client()
+    print(f"👥 {customer_count} customers, {customer_count * ORDERS_PER_CUSTOMER} orders in {DB_PATH}\n")
+    print(f"{'listing':<16}{'per page':>10}{'rows':>7}{'queries':>9}{'ms':>9}")
+    failures = 0
+    for name, url in LISTINGS:
+        counts = []
+        for per_page in PAGE_SIZES:
+            queries, elapsed, rows = measure(client, headers, url.format(per_page=per_page))
+            counts.append(queries)
+            print(f"{name:<16}{per_page:>10}{rows:>7}{queries:>9}{elapsed:>9.1f}")
+        if len(set(counts)) > 1:
+            failures += 1
+            print(f"   ❌ {name}: query count grows with the page size")
+
+    if failures:
+        print("\n❌ Some listings still issue per-row queries")
+        return 1
+    print("\n✅ Every listing issues a constant number of queries regardless of page size")
+    return 0
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    sys.exit(run_check(count))
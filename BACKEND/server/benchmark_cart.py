@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+Cart Benchmark
+Fills carts of different sizes in a throwaway SQLite database and compares
+the old GET /cart (a product and a primary-image query per item) with the
+single-query read model, and with GET /cart/summary, which the cart badge
+uses instead of the full cart.
+
+Then changes item quantities with PUT /cart/items/<id>, both the old way
+(reload every item and re-sum the cart) and with the delta update of the
+stored total, and checks the stored totals against a full recomputation.
+Finally adds room sets of several products to an empty cart, one
+POST /cart/items per product versus one PATCH /cart/items batch.
+
+Reports queries and mean latency per request and checks that the old and
+new cart responses are identical.
+
+Usage: python benchmark_cart.py [repeats]
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+# Point the app at a temporary database before it is imported
+DB_PATH = os.path.join(tempfile.mkdtemp(), 'cart_benchmark.db')
+os.environ['DATABASE_URL'] = f'sqlite:///{DB_PATH}'
+os.environ.setdefault('JWT_SECRET_KEY', 'benchmark-secret-key-benchmark-secret-key')
+os.environ['START_BACKGROUND_WORKERS'] = 'false'
+
+# Add the current directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from flask import jsonify, request
+from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
+from sqlalchemy import event
+
+from app import app
+from extensions import db
+from models import User, Category, Product, ProductImage, ShoppingCart, CartItem, UserRole
+from utils.cart import format_cents, rebuild_cart_totals
+from utils.image_variants import variant_path, requested_size
+
+CART_SIZES = (1, 5, 20, 50)
+ROOM_SET_SIZES = (3, 10)
+queries = {'count': 0}
+
+
+@jwt_required()
+def old_get_cart():
+    """What GET /cart used to do: walk cart.cart_items, two lookups per item."""
+    user_id = get_jwt_identity()
+    cart = ShoppingCart.query.filter_by(user_id=user_id).first()
+    size, fmt = requested_size(request.args)
+    cart_items = []
+    for item in cart.cart_items:
+        product = Product.query.get(item.product_id)
+        if not product:
+            continue
+        primary_image = ProductImage.query.filter_by(product_id=product.product_id, is_primary=True).first()
+        cart_items.append({
+            'cart_item_id': item.cart_item_id,
+            'product_id': product.product_id,
+            'product_name': product.product_name,
+            'description': product.product_description,
+            'price': format_cents(item.price_cents),
+            'quantity': item.quantity,
+            'image_url': variant_path(primary_image, size, fmt) if primary_image else None,
+            'stock_available': product.stock_quantity,
+            'added_at': item.added_at.isoformat() if item.added_at else None,
+            'max_allowed': min(product.stock_quantity, 10)
+        })
+    return jsonify({
+        'shopping_cart_id': cart.shopping_cart_id,
+        'user_id': cart.user_id,
+        'total_price': format_cents(cart.total_cents),
+        'items_count': cart.shopping_quantity,
+        'created_at': cart.created_at.isoformat() if cart.created_at else None,
+        'updated_at': cart.updated_at.isoformat() if cart.updated_at else None,
+        'items': cart_items
+    }), 200
+
+
+app.add_url_rule('/benchmark/old-cart', 'benchmark_old_cart', old_get_cart)
+
+
+@jwt_required()
+def old_update_cart_item(item_id):
+    """What PUT /cart/items/<id> used to do: set the quantity, then reload and re-sum every item."""
+    user_id = get_jwt_identity()
+    cart = ShoppingCart.query.filter_by(user_id=user_id).first()
+    item = CartItem.query.filter_by(cart_item_id=item_id, shopping_cart_id=cart.shopping_cart_id).first()
+    product = Product.query.get(item.product_id)
+    quantity = request.get_json()['quantity']
+    if product.stock_quantity < quantity:
+        return jsonify({"error": "Not enough stock available"}), 400
+    item.quantity = quantity
+    item.added_at = db.func.current_timestamp()
+    cart_items = CartItem.query.filter_by(shopping_cart_id=cart.shopping_cart_id).all()
+    cart.total_cents = sum(ci.price_cents * ci.quantity for ci in cart_items)
+    cart.shopping_quantity = sum(ci.quantity for ci in cart_items)
+    cart.updated_at = db.func.current_timestamp()
+    db.session.commit()
+    return jsonify({"cart_total": format_cents(cart.total_cents)}), 200
+
+
+app.add_url_rule('/benchmark/old-cart/items/<int:item_id>', 'benchmark_old_update_cart_item',
+                 old_update_cart_item, methods=['PUT'])
+
+
+def seed():
+    """Products with two images each, and one user per cart size with that many items in their cart."""
+    category = Category(category_name='Sofas', name='Sofas', category_description='Sofas')
+    db.session.add(category)
+    db.session.flush()
+    products = max(CART_SIZES)
+    db.session.execute(Product.__table__.insert(), [{
+        'product_name': f'Sofa {i}',
+        'product_description': 'Three-seater',
+        'product_price': 15000 + i,
+        'stock_quantity': 8,
+        'category_id': category.category_id,
+    } for i in range(products)])
+    product_ids = [product_id for (product_id,) in db.session.query(Product.product_id).order_by(Product.product_id)]
+    db.session.execute(ProductImage.__table__.insert(), [{
+        'image_url': f'uploads/sofa_{product_id}_{k}.jpg',
+        'is_primary': k == 0,
+        'product_id': product_id,
+    } for product_id in product_ids for k in range(2)])
+
+    headers, user_ids = {}, {}
+    for size in CART_SIZES:
+        user = User(username=f'shopper{size}', email=f'shopper{size}@example.com', password_hash='x', role=UserRole.USER)
+        db.session.add(user)
+        db.session.flush()
+        cart = ShoppingCart(user_id=user.id, total_cents=sum(1500000 + 100 * i for i in range(size)), shopping_quantity=size)
+        db.session.add(cart)
+        db.session.flush()
+        db.session.execute(CartItem.__table__.insert(), [{
+            'shopping_cart_id': cart.shopping_cart_id,
+            'product_id': product_id,
+            'price_cents': 1500000 + 100 * i,
+            'quantity': 1,
+        } for i, product_id in enumerate(product_ids[:size])])
+        headers[size] = {'Authorization': f'Bearer {create_access_token(identity=str(user.id))}'}
+        user_ids[size] = user.id
+    db.session.commit()
+    return headers, user_ids
+
+
+def measure(client, url, headers, repeats, bodies=None):
+    queries['count'] = 0
+    started = time.perf_counter()
+    for index in range(repeats):
+        if bodies is None:
+            response = client.get(url, headers=headers)
+        else:
+            response = client.put(url, json=bodies[index], headers=headers)
+        if response.status_code != 200:
+            raise RuntimeError(f"{url} answered {response.status_code}: {response.get_json()}")
+    elapsed = (time.perf_counter() - started) * 1000 / repeats
+    return elapsed, queries['count'] / repeats, response.get_json()
+
+
+def run_benchmark(repeats):
+    with app.app_context():
+        db.create_all()
+
+        @event.listens_for(db.engine, 'before_cursor_execute')
+        def count_query(*args):
+            queries['count'] += 1
+
+        headers, user_ids = seed()
+
+    client = app.test_client()
+    print(f"🛒 Cart reads, {repeats} requests each ({DB_PATH})\n")
+    print(f"{'items':>6}  {'endpoint':<16}{'queries':>9}{'mean ms':>9}")
+
+    mismatches = 0
+    for size in CART_SIZES:
+        old_ms, old_queries, old_body = measure(client, '/benchmark/old-cart?size=card', headers[size], repeats)
+        new_ms, new_queries, new_body = measure(client, '/cart?size=card', headers[size], repeats)
+        summary_ms, summary_queries, summary = measure(client, '/cart/summary', headers[size], repeats)
+        mismatches += int(old_body != new_body)
+        mismatches += int((summary['items_count'], summary['total_price']) != (old_body['items_count'], old_body['total_price']))
+        for name, ms, count in (('old /cart', old_ms, old_queries), ('/cart', new_ms, new_queries),
+                                ('/cart/summary', summary_ms, summary_queries)):
+            print(f"{size:>6}  {name:<16}{count:>9.0f}{ms:>9.2f}")
+
+    print(f"\n{'items':>6}  {'endpoint':<16}{'queries':>9}{'mean ms':>9}")
+    rng = random.Random(24)
+    for size in CART_SIZES:
+        with app.app_context():
+            item_ids = [item_id for (item_id,) in db.session.query(CartItem.cart_item_id)
+                        .join(ShoppingCart).filter(ShoppingCart.user_id == user_ids[size])]
+        item_id = rng.choice(item_ids)
+        bodies = [{'quantity': rng.randint(1, 8)} for _ in range(repeats)]
+        old_ms, old_queries, _ = measure(client, f'/benchmark/old-cart/items/{item_id}', headers[size], repeats, bodies)
+        new_ms, new_queries, _ = measure(client, f'/cart/items/{item_id}', headers[size], repeats, bodies)
+        for name, ms, count in (('old PUT item', old_ms, old_queries), ('PUT item', new_ms, new_queries)):
+            print(f"{size:>6}  {name:<16}{count:>9.0f}{ms:>9.2f}")
+
+    print(f"\n{'items':>6}  {'room set added by':<22}{'queries':>9}{'mean ms':>9}")
+    with app.app_context():
+        shopper = User(username='roomset', email='roomset@example.com', password_hash='x', role=UserRole.USER)
+        db.session.add(shopper)
+        db.session.commit()
+        shopper_headers = {'Authorization': f'Bearer {create_access_token(identity=str(shopper.id))}'}
+    for size in ROOM_SET_SIZES:
+        results = {}
+        for name in ('POST per item', 'one PATCH'):
+            queries['count'] = 0
+            elapsed = 0.0
+            for _ in range(repeats):
+                product_ids = rng.sample(range(1, max(CART_SIZES) + 1), size)
+                started = time.perf_counter()
+                if name == 'one PATCH':
+                    responses = [client.patch('/cart/items', headers=shopper_headers, json={
+                        'items': [{'product_id': product_id, 'quantity': 2} for product_id in product_ids]
+                    })]
+                else:
+                    responses = [client.post('/cart/items', json={'product_id': product_id, 'quantity': 2},
+                                             headers=shopper_headers) for product_id in product_ids]
+                elapsed += time.perf_counter() - started
+                counted = queries['count']
+                summary = client.get('/cart/summary', headers=shopper_headers).get_json()
+                client.delete('/cart', headers=shopper_headers)
+                queries['count'] = counted
+                if any(response.status_code not in (200, 201) for response in responses):
+                    raise RuntimeError(f"{name} failed: {responses[-1].get_json()}")
+            results[name] = (summary['items_count'], queries['count'] / repeats, elapsed * 1000 / repeats)
+        mismatches += int(results['POST per item'][0] != results['one PATCH'][0])
+        for name, (_, count, ms) in results.items():
+            print(f"{size:>6}  {name:<22}{count:>9.0f}{ms:>9.2f}")
+
+    # Random adds, updates and removals, then compare the stored totals with a recomputation
+    for size in CART_SIZES:
+        for _ in range(repeats):
+            action = rng.random()
+            if action < 0.4:
+                client.post('/cart/items', json={'product_id': rng.randint(1, max(CART_SIZES)), 'quantity': 1},
+                            headers=headers[size])
+            else:
+                with app.app_context():
+                    item_ids = [item_id for (item_id,) in db.session.query(CartItem.cart_item_id)
+                                .join(ShoppingCart).filter(ShoppingCart.user_id == user_ids[size])]
+                if not item_ids:
+                    continue
+                if action < 0.8:
+                    client.put(f'/cart/items/{rng.choice(item_ids)}', json={'quantity': rng.randint(1, 8)},
+                               headers=headers[size])
+                else:
+                    client.delete(f'/cart/items/{rng.choice(item_ids)}', headers=headers[size])
+    with app.app_context():
+        stored = dict(db.session.query(ShoppingCart.shopping_cart_id, ShoppingCart.total_cents))
+        rebuild_cart_totals()
+        rebuilt = dict(db.session.query(ShoppingCart.shopping_cart_id, ShoppingCart.total_cents))
+    drifted = sum(1 for cart_id in rebuilt if stored[cart_id] != rebuilt[cart_id])
+    print(f"\nAfter {repeats * len(CART_SIZES)} random cart changes: {drifted} carts whose stored total "
+          f"differs from the sum of their items")
+
+    if mismatches or drifted:
+        print("\n❌ The cart does not answer like the old endpoints")
+        return 1
+    print("\n✅ Same cart responses; reads and item changes cost the same whatever the cart size")
+    return 0
+
+
+if __name__ == '__main__':
+    repeat_count = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    sys.exit(run_benchmark(repeat_count))
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Daraja Client Benchmark
+Runs STK pushes against the local fake Daraja server (fake_daraja.py) with
+a simulated network latency and compares the old per-push flow (a new
+requests.get for the OAuth token, then a new requests.post, each on a fresh
+connection) with the shared DarajaClient (cached token, pooled keep-alive
+session).
+
+It also checks the client's token handling: concurrent cold-start pushes
+fetch one token, a token near expiry is renewed ahead of time, and a token
+Daraja rejects is replaced once and the push retried.
+
+Usage: python benchmark_daraja.py [pushes] [latency_ms]
+"""
+
+import os
+import sys
+import time
+import threading
+
+os.environ.setdefault('JWT_SECRET_KEY', 'benchmark-secret-key-benchmark-secret-key')
+os.environ['START_BACKGROUND_WORKERS'] = 'false'
+
+# Add the current directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import requests
+
+from app import app
+from fake_daraja import FakeDaraja
+from utils.daraja_client import DarajaClient, initiate_stk_push, generate_mpesa_password
+
+PHONE = '0712345678'
+
+
+def legacy_stk_push(order_id):
+    """What initiate_stk_push used to do: fetch a token, then push, each on a new connection."""
+    config = app.config
+    token = requests.get(
+        config['DARAJA_AUTH_URL'],
+        auth=(config['MPESA_CONSUMER_KEY'], config['MPESA_CONSUMER_SECRET']),
+        timeout=30
+    ).json()['access_token']
+    timestamp = time.strftime('%Y%m%d%H%M%S')
+    response = requests.post(
+        config['DARAJA_STK_PUSH_URL'],
+        json={
+            'BusinessShortCode': config['MPESA_SHORTCODE'],
+            'Password': generate_mpesa_password(timestamp),
+            'Timestamp': timestamp,
+            'TransactionType': 'CustomerPayBillOnline',
+            'Amount': 100,
+            'PartyA': '254712345678',
+            'PartyB': config['MPESA_SHORTCODE'],
+            'PhoneNumber': '254712345678',
+            'CallBackURL': config['MPESA_CALLBACK_URL'],
+            'AccountReference': str(order_id),
+            'TransactionDesc': 'Benchmark'
+        },
+        headers={'Authorization': f'Bearer {token}'},
+        timeout=30
+    )
+    return response.status_code
+
+
+def client_stk_push(order_id):
+    return initiate_stk_push(PHONE, 100, order_id, 'Benchmark')[1]
+
+
+def measure(server, push, pushes):
+    server.reset_counts()
+    timings = []
+    for order_id in range(1, pushes + 1):
+        started = time.perf_counter()
+        status = push(order_id)
+        timings.append((time.perf_counter() - started) * 1000)
+        if status != 200:
+            raise RuntimeError(f"STK push for order {order_id} failed with {status}")
+    timings.sort()
+    return {
+        'mean': sum(timings) / len(timings),
+        'p50': timings[len(timings) // 2],
+        'p95': timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+        'requests': server.counts['token'] + server.counts['stk_push'],
+        'connections': server.counts['connections'],
+    }
+
+
+def check(name, passed):
+    print(f"  {'✅' if passed else '❌'} {name}")
+    return 0 if passed else 1
+
+
+def run_token_checks(server):
+    failures = 0
+    print("\nToken handling:")
+
+    # Concurrent cold start: one token fetch, everyone else waits for it
+    client = DarajaClient(**client_args(server))
+    server.reset_counts()
+    barrier = threading.Barrier(16)
+    tokens = []
+
+    def cold_start():
+        barrier.wait()
+        tokens.append(client.access_token())
+
+    workers = [threading.Thread(target=cold_start) for _ in range(16)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    failures += check(f"16 concurrent cold-start calls fetched {server.counts['token']} token(s)",
+                      server.counts['token'] == 1 and len(set(tokens)) == 1)
+
+    # Proactive refresh: inside the margin the token is renewed before it expires
+    server.token_lifetime = 2
+    client = DarajaClient(**client_args(server), refresh_margin=1)
+    first = client.access_token()
+    same = client.access_token()
+    time.sleep(1.1)
+    renewed = client.access_token()
+    failures += check("token reused while fresh, renewed inside the refresh margin",
+                      first == same and renewed != first and renewed in server.tokens)
+    server.token_lifetime = 3599
+
+    # Rejected token: renewed once and the push retried
+    client = DarajaClient(**client_args(server))
+    client.access_token()
+    server.revoke_tokens()
+    server.reset_counts()
+    response = client.stk_push({'AccountReference': 'revoked'})
+    failures += check("revoked token replaced and push retried once",
+                      response.status_code == 200 and server.counts['token'] == 1
+                      and server.counts['stk_push'] == 2)
+    return failures
+
+
+def client_args(server):
+    config = server.config()
+    return {
+        'auth_url': config['DARAJA_AUTH_URL'],
+        'stk_push_url': config['DARAJA_STK_PUSH_URL'],
+        'consumer_key': config['MPESA_CONSUMER_KEY'],
+        'consumer_secret': config['MPESA_CONSUMER_SECRET'],
+    }
+
+
+def run_benchmark(pushes, latency_ms):
+    with FakeDaraja(latency=latency_ms / 1000) as server:
+        app.config.update(server.config())
+        app.config.update({
+            'MPESA_SHORTCODE': '174379',
+            'MPESA_PASSKEY': 'fake-passkey',
+            'MPESA_CALLBACK_URL': 'https://example.com/payments/mpesa/callback',
+        })
+        app.extensions.pop('daraja', None)
+
+        print(f"📲 {pushes} STK pushes against {server.base_url} with {latency_ms:g} ms per request\n")
+        print(f"{'flow':<28}{'mean ms':>9}{'p50 ms':>9}{'p95 ms':>9}{'requests':>10}{'connections':>13}")
+        results = {}
+        with app.app_context():
+            for name, push in (('new token + new connection', legacy_stk_push),
+                               ('DarajaClient', client_stk_push)):
+                results[name] = stats = measure(server, push, pushes)
+                print(f"{name:<28}{stats['mean']:>9.1f}{stats['p50']:>9.1f}{stats['p95']:>9.1f}"
+                      f"{stats['requests']:>10}{stats['connections']:>13}")
+
+        legacy, pooled = results['new token + new connection'], results['DarajaClient']
+        print(f"\nSaved {legacy['mean'] - pooled['mean']:.1f} ms per push "
+              f"({legacy['requests'] - pooled['requests']} fewer requests over {pushes} pushes)")
+
+        failures = check("one request per push after the first (token cached)",
+                         pooled['requests'] == pushes + 1)
+        failures += check("connection reused across pushes", pooled['connections'] <= 2)
+        failures += run_token_checks(server)
+
+    if failures:
+        print("\n❌ Daraja client checks failed")
+        return 1
+    print("\n✅ STK pushes cost one round trip on a reused connection")
+    return 0
+
+
+if __name__ == '__main__':
+    push_count = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 20
+    sys.exit(run_benchmark(push_count, latency))
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Export Memory Check
+Generates a large synthetic order history (200k orders by default) in a
+throwaway SQLite database, then streams the sales report export in a fresh
+process and checks that its peak RSS stays within a fixed budget. The old
+build-everything-in-memory approach is measured alongside for comparison.
+
+Usage: python benchmark_exports.py [order_count] [rss_budget_mb]
+Exits non-zero if the streamed export exceeds the budget.
+"""
+
+import os
+import sys
+import random
+import resource
+import subprocess
+import tempfile
+import time
+
+SERVER_DIR = os.path.dirname(os.path.abspath(__file__))
+BATCH_SIZE = 10000
+USER_COUNT = 2000
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB (ru_maxrss is KB on Linux, bytes on macOS)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def load_app(db_path):
+    os.environ['DATABASE_URL'] = f'sqlite:///{db_path}'
+    os.environ.setdefault('JWT_SECRET_KEY', 'benchmark-secret-key-benchmark-secret-key')
+    os.environ['START_BACKGROUND_WORKERS'] = 'false'
+    sys.path.append(SERVER_DIR)
+    from app import app
+    return app
+
+
+def generate_orders(db_path, count):
+    """Insert USER_COUNT users and `count` orders with Core bulk inserts."""
+    app = load_app(db_path)
+    from extensions import db
+    from models import User, Order, UserRole, OrderStatus, PaymentStatus
+
+    rng = random.Random(7)
+    with app.app_context():
+        db.create_all()
+        db.session.execute(User.__table__.insert(), [{
+            'username': f'customer{i}',
+            'email': f'customer{i}@example.com',
+            'password_hash': 'x',
+            'is_admin': i == 0,
+            'role': UserRole.ADMIN if i == 0 else UserRole.USER,
+        } for i in range(USER_COUNT)])
+        for start in range(0, count, BATCH_SIZE):
+            db.session.execute(Order.__table__.insert(), [{
+                'total_amount': round(rng.uniform(20, 4000), 2),
+                'order_status': rng.choice(list(OrderStatus)),
+                'status': OrderStatus.PENDING,
+                'payment_status': PaymentStatus.PENDING,
+                'shipping_address': f'{rng.randint(1, 999)} Moi Avenue, Nairobi',
+                'user_id': rng.randint(2, USER_COUNT),
+            } for _ in range(start, min(start + BATCH_SIZE, count))])
+        db.session.commit()
+
+
+def run_child(db_path, mode):
+    """Measure one export in this (fresh) process and print 'rows peak_mb'."""
+    app = load_app(db_path)
+    from flask_jwt_extended import create_access_token
+
+    with app.app_context():
+        token = create_access_token(identity='1')
+    headers = {'Authorization': f'Bearer {token}'}
+    client = app.test_client()
+
+    rows = 0
+    if mode == 'stream':
+        response = client.get('/reports/admin/reports/export?type=sales&days=36500&stream=1',
+                              headers=headers, buffered=False)
+        for chunk in response.response:
+            rows += chunk.count(b'\n') if isinstance(chunk, bytes) else chunk.count('\n')
+        response.close()
+        rows -= 1  # header line
+    elif mode == 'materialized':
+        # What the export used to do: every row in memory, then one big CSV string
+        import csv
+        import io
+        from extensions import db
+        from models import Order, User
+        with app.app_context():
+            orders = db.session.query(
+                Order.order_id, Order.order_date, Order.total_amount,
+                Order.order_status, User.username, User.email
+            ).join(User).all()
+            output = io.StringIO()
+            writer = csv.writer(output)
+            for order in orders:
+                writer.writerow(list(order))
+            payload = output.getvalue()
+            rows = len(orders)
+            del payload
+    print(rows, round(peak_rss_mb(), 1))
+
+
+def measure(db_path, mode):
+    result = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--child', db_path, mode],
+        capture_output=True, text=True, cwd=SERVER_DIR
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr)
+    rows, peak = result.stdout.strip().splitlines()[-1].split()
+    return int(rows), float(peak)
+
+
+def run_benchmark(count, budget_mb):
+    db_path = os.path.join(tempfile.mkdtemp(), 'export_benchmark.db')
+    print(f"📦 Generating {count} orders in {db_path} ...")
+    started = time.perf_counter()
+    subprocess.run([sys.executable, os.path.abspath(__file__), '--generate', db_path, str(count)],
+                   check=True, cwd=SERVER_DIR)
+    print(f"   done in {time.perf_counter() - started:.1f}s\n")
+
+    _, baseline = measure(db_path, 'baseline')
+    stream_rows, stream_peak = measure(db_path, 'stream')
+    old_rows, old_peak = measure(db_path, 'materialized')
+
+    print(f"{'mode':<16}{'rows':>10}{'peak RSS MB':>14}{'over baseline':>16}")
+    print(f"{'baseline':<16}{'-':>10}{baseline:>14.1f}{'-':>16}")
+    print(f"{'streamed':<16}{stream_rows:>10}{stream_peak:>14.1f}{stream_peak - baseline:>16.1f}")
+    print(f"{'materialized':<16}{old_rows:>10}{old_peak:>14.1f}{old_peak - baseline:>16.1f}")
+
+    if stream_rows != count:
+        print(f"\n❌ Streamed export returned {stream_rows} rows, expected {count}")
+        return 1
+    if stream_peak - baseline > budget_mb:
+        print(f"\n❌ Streamed export used {stream_peak - baseline:.1f} MB over baseline (budget {budget_mb} MB)")
+        return 1
+    print(f"\n✅ Streamed export stayed within {budget_mb} MB of baseline")
+    return 0
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--child':
+        run_child(sys.argv[2], sys.argv[3])
+    elif len(sys.argv) > 1 and sys.argv[1] == '--generate':
+        generate_orders(sys.argv[2], int(sys.argv[3]))
+    else:
+        order_count = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+        budget = float(sys.argv[2]) if len(sys.argv) > 2 else 32
+        sys.exit(run_benchmark(order_count, budget))
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+M-Pesa Callback Benchmark
+Posts a burst of STK callbacks (10% of them Safaricom redeliveries) in a
+throwaway SQLite database and compares the old inline handler (look up the
+payment and transaction, store the PaymentResponse, update payment, order
+and stock hold, commit, then answer) with the inbox (store the raw callback,
+answer, apply later in batches).
+
+Reports how long Safaricom waits for each acknowledgement and how many
+queries it costs, the inbox drain throughput, and checks that both paths end
+with every payment completed, and that the inbox applied each redelivered
+callback only once.
+
+Usage: python benchmark_mpesa_callbacks.py [callbacks]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+# Point the app at a temporary database before it is imported
+DB_PATH = os.path.join(tempfile.mkdtemp(), 'mpesa_callbacks_benchmark.db')
+os.environ['DATABASE_URL'] = f'sqlite:///{DB_PATH}'
+os.environ.setdefault('JWT_SECRET_KEY', 'benchmark-secret-key-benchmark-secret-key')
+os.environ['START_BACKGROUND_WORKERS'] = 'false'
+os.environ['MPESA_CALLBACK_WORKERS'] = '0'  # drained explicitly below
+
+# Add the current directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from flask import request, jsonify
+from sqlalchemy import event
+
+from app import app
+from extensions import db
+from models import User, Order, Payment, PaymentResponse, Transaction, OrderStatus, PaymentStatus, UserRole
+from utils.mpesa_inbox import apply_callback, stk_callback, drain
+
+DUPLICATE_EVERY = 10
+queries = {'count': 0}
+
+
+def inline_callback():
+    """What payment_callback used to do before answering Safaricom."""
+    callback_data = request.get_json()
+    callback = stk_callback(callback_data)
+    payment = Payment.query.filter_by(transaction_id=callback.get('CheckoutRequestID')).first()
+    if not payment:
+        return jsonify({"ResultCode": 1, "ResultDesc": "Payment not found"}), 404
+    transaction = Transaction.query.filter_by(transaction_id=callback.get('MerchantRequestID')).first()
+    apply_callback(payment, transaction, callback_data)
+    db.session.commit()
+    return jsonify({"ResultCode": 0, "ResultDesc": "Callback processed successfully"}), 200
+
+
+app.add_url_rule('/benchmark/inline-callback', 'benchmark_inline_callback', inline_callback, methods=['POST'])
+
+
+def seed(prefix, count, user_id):
+    orders = [{
+        'total_amount': 1500.0,
+        'order_status': OrderStatus.PENDING,
+        'status': OrderStatus.PENDING,
+        'payment_status': PaymentStatus.PENDING,
+        'shipping_address': 'Moi Avenue, Nairobi',
+        'user_id': user_id,
+    } for _ in range(count)]
+    first = (db.session.query(db.func.max(Order.order_id)).scalar() or 0) + 1
+    db.session.execute(Order.__table__.insert(), orders)
+    db.session.execute(Payment.__table__.insert(), [{
+        'payment_amount': '1500',
+        'transaction_id': f'ws_CO_{prefix}{i}',
+        'payment_status': PaymentStatus.PENDING,
+        'order_id': first + i,
+        'payment_method_id': 1,
+        'user_id': user_id,
+    } for i in range(count)])
+    payment_ids = dict(db.session.query(Payment.transaction_id, Payment.payment_id)
+                       .filter(Payment.transaction_id.like(f'ws_CO_{prefix}%')))
+    db.session.execute(Transaction.__table__.insert(), [{
+        'transaction_id': f'{prefix}-merchant-{i}',
+        'amount': 1500.0,
+        'phone_number': '254712345678',
+        'status': 'PENDING',
+        'payment_id': payment_ids[f'ws_CO_{prefix}{i}'],
+        'user_id': user_id,
+    } for i in range(count)])
+    db.session.commit()
+
+
+def callback_body(prefix, i):
+    return {'Body': {'stkCallback': {
+        'MerchantRequestID': f'{prefix}-merchant-{i}',
+        'CheckoutRequestID': f'ws_CO_{prefix}{i}',
+        'ResultCode': 0,
+        'ResultDesc': 'The service request is processed successfully.',
+        'CallbackMetadata': {'Item': [
+            {'Name': 'Amount', 'Value': 1500},
+            {'Name': 'MpesaReceiptNumber', 'Value': f'R{prefix}{i}'},
+            {'Name': 'PhoneNumber', 'Value': 254712345678},
+        ]}
+    }}}
+
+
+def post_burst(client, url, prefix, count):
+    """POST every callback (plus redeliveries); returns per-request latencies (ms) and total queries."""
+    bodies = [callback_body(prefix, i) for i in range(count)]
+    bodies += [callback_body(prefix, i) for i in range(0, count, DUPLICATE_EVERY)]
+    timings = []
+    queries['count'] = 0
+    for body in bodies:
+        started = time.perf_counter()
+        response = client.post(url, json=body)
+        timings.append((time.perf_counter() - started) * 1000)
+        if response.status_code != 200:
+            raise RuntimeError(f"{url} answered {response.status_code}: {response.get_json()}")
+    timings.sort()
+    return timings, queries['count']
+
+
+def outcome(prefix):
+    completed = Payment.query.filter(Payment.transaction_id.like(f'ws_CO_{prefix}%'),
+                                     Payment.payment_status == PaymentStatus.COMPLETED).count()
+    responses = PaymentResponse.query.filter(PaymentResponse.checkout_request_id.like(f'ws_CO_{prefix}%')).count()
+    return completed, responses
+
+
+def run_benchmark(count):
+    with app.app_context():
+        db.create_all()
+
+        @event.listens_for(db.engine, 'before_cursor_execute')
+        def count_query(*args):
+            queries['count'] += 1
+
+        user = User(username='buyer', email='buyer@example.com', password_hash='x', role=UserRole.USER)
+        db.session.add(user)
+        db.session.commit()
+        seed('INLINE', count, user.id)
+        seed('INBOX', count, user.id)
+
+    client = app.test_client()
+    sent = count + len(range(0, count, DUPLICATE_EVERY))
+    print(f"📨 {sent} callbacks ({sent - count} redeliveries) for {count} payments ({DB_PATH})\n")
+    print(f"{'handler':<10}{'ack mean ms':>13}{'ack p95 ms':>12}{'queries/ack':>13}{'completed':>11}{'responses':>11}")
+
+    inline_timings, inline_queries = post_burst(client, '/benchmark/inline-callback', 'INLINE', count)
+    inbox_timings, inbox_queries = post_burst(client, '/payments/callback', 'INBOX', count)
+
+    with app.app_context():
+        queries['count'] = 0
+        started = time.perf_counter()
+        drained = drain()
+        drain_seconds = time.perf_counter() - started
+        drain_queries = queries['count']
+        results = {'INLINE': outcome('INLINE'), 'INBOX': outcome('INBOX')}
+
+    for name, timings, total in (('inline', inline_timings, inline_queries), ('inbox', inbox_timings, inbox_queries)):
+        completed, responses = results[name.upper()]
+        print(f"{name:<10}{sum(timings) / len(timings):>13.2f}{timings[int(len(timings) * 0.95)]:>12.2f}"
+              f"{total / len(timings):>13.1f}{completed:>11}{responses:>11}")
+    print(f"\nInbox drain: {drained} callbacks in {drain_seconds * 1000:.0f} ms "
+          f"({drained / drain_seconds:.0f}/s, {drain_queries / drained:.1f} queries per callback)")
+
+    inline_completed, _ = results['INLINE']
+    inbox_completed, inbox_responses = results['INBOX']
+    if inline_completed != count or inbox_completed != count or inbox_responses != count:
+        print("\n❌ The inbox did not end in the same state as the inline handler")
+        return 1
+    print("\n✅ Same final payment state; redelivered callbacks applied once")
+    return 0
+
+
+if __name__ == '__main__':
+    callback_count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    sys.exit(run_benchmark(callback_count))
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Order Stats Benchmark
+Times the admin order statistics against a growing synthetic order history
+(one year of orders, up to 200k by default) in a throwaway SQLite database.
+The grouped SQL aggregate is compared with the old approach of loading every
+order in the window and summing in Python, and both results are checked to
+match.
+
+Usage: python benchmark_order_stats.py [max_order_count]
+"""
+
+import os
+import sys
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+# Point the app at a temporary database before it is imported
+DB_PATH = os.path.join(tempfile.mkdtemp(), 'order_stats_benchmark.db')
+os.environ['DATABASE_URL'] = f'sqlite:///{DB_PATH}'
+os.environ.setdefault('JWT_SECRET_KEY', 'benchmark-secret-key-benchmark-secret-key')
+os.environ['START_BACKGROUND_WORKERS'] = 'false'
+
+# Add the current directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app import app
+from extensions import db
+from models import User, Order, UserRole, OrderStatus, PaymentStatus
+from routes.order_route import order_stats
+
+STEPS = (0.05, 0.25, 0.5, 1.0)
+WINDOW_DAYS = 365
+REPEAT = 3
+BATCH_SIZE = 10000
+USER_COUNT = 500
+
+
+def generate_orders(rng, count, now):
+    """Insert `count` orders spread over the last WINDOW_DAYS with Core bulk inserts."""
+    statuses = list(OrderStatus)
+    for start in range(0, count, BATCH_SIZE):
+        db.session.execute(Order.__table__.insert(), [{
+            'order_date': now - timedelta(seconds=rng.randint(0, WINDOW_DAYS * 24 * 3600)),
+            'total_amount': round(rng.uniform(20, 4000), 2),
+            'order_status': rng.choice(statuses),
+            'status': OrderStatus.PENDING,
+            'payment_status': PaymentStatus.PENDING,
+            'shipping_address': f'{rng.randint(1, 999)} Moi Avenue, Nairobi',
+            'user_id': rng.randint(1, USER_COUNT),
+        } for _ in range(start, min(start + BATCH_SIZE, count))])
+    db.session.commit()
+
+
+def python_stats(from_date):
+    """What get_order_stats used to do: hydrate every order, then sum in Python."""
+    orders = Order.query.filter(Order.order_date >= from_date).all()
+    status_distribution = {}
+    daily_revenue = {}
+    for order in orders:
+        status = order.order_status.value if order.order_status else 'unknown'
+        status_distribution[status] = status_distribution.get(status, 0) + 1
+        day = order.order_date.strftime('%Y-%m-%d') if order.order_date else 'unknown'
+        daily_revenue[day] = daily_revenue.get(day, 0) + order.total_amount
+    return {
+        'total_orders': len(orders),
+        'total_revenue': sum(order.total_amount for order in orders),
+        'status_distribution': status_distribution,
+        'daily_revenue': daily_revenue
+    }
+
+
+def time_stats(compute, from_date):
+    """Best-of-REPEAT wall time (ms) and the last result."""
+    best = None
+    result = None
+    for _ in range(REPEAT):
+        db.session.expunge_all()
+        started = time.perf_counter()
+        result = compute(from_date)
+        elapsed = (time.perf_counter() - started) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def same_stats(a, b):
+    def close(x, y):
+        return abs(x - y) < 0.01 * max(1, abs(x))
+    return (a['total_orders'] == b['total_orders']
+            and close(a['total_revenue'], b['total_revenue'])
+            and a['status_distribution'] == b['status_distribution']
+            and a['daily_revenue'].keys() == b['daily_revenue'].keys()
+            and all(close(a['daily_revenue'][day], b['daily_revenue'][day]) for day in a['daily_revenue']))
+
+
+def run_benchmark(max_count):
+    rng = random.Random(11)
+    now = datetime.now()
+    from_date = now - timedelta(days=WINDOW_DAYS)
+
+    with app.app_context():
+        db.create_all()
+        db.session.execute(User.__table__.insert(), [{
+            'username': f'customer{i}',
+            'email': f'customer{i}@example.com',
+            'password_hash': 'x',
+            'role': UserRole.USER,
+        } for i in range(USER_COUNT)])
+        db.session.commit()
+
+        print(f"📦 Growing an order history up to {max_count} orders in {DB_PATH}\n")
+        print(f"{'orders':>10}{'python ms':>12}{'SQL ms':>10}{'speedup':>10}{'days':>7}  match")
+        inserted = 0
+        failures = 0
+        for step in STEPS:
+            target = int(max_count * step)
+            generate_orders(rng, target - inserted, now)
+            inserted = target
+
+            python_ms, expected = time_stats(python_stats, from_date)
+            sql_ms, actual = time_stats(order_stats, from_date)
+            match = same_stats(expected, actual)
+            failures += not match
+            print(f"{inserted:>10}{python_ms:>12.1f}{sql_ms:>10.1f}{python_ms / sql_ms:>9.1f}x"
+                  f"{len(actual['daily_revenue']):>7}  {'✅' if match else '❌'}")
+
+    if failures:
+        print("\n❌ SQL aggregate disagreed with the Python computation")
+        return 1
+    print("\n✅ SQL aggregate matches; Python-side work is bounded by days × statuses, not orders")
+    return 0
+
+
+if __name__ == '__main__':
+    order_count = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    sys.exit(run_benchmark(order_count))
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Product Listing Query-Count Check
+Counts the SQL statements behind the public product listings (GET /api/product,
+its cursor variant and GET /api/recent) at growing page sizes in a throwaway
+SQLite database. Images and categories are batch-loaded for the whole page, so
+every listing must issue the same number of statements whatever the page
+size; the script exits non-zero if any listing's count grows with the page.
+
+Usage: python benchmark_product_listing.py [product_count]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+# Point the app at a temporary database before it is imported
+DB_PATH = os.path.join(tempfile.mkdtemp(), 'product_listing_benchmark.db')
+os.environ['DATABASE_URL'] = f'sqlite:///{DB_PATH}'
+os.environ.setdefault('JWT_SECRET_KEY', 'benchmark-secret-key-benchmark-secret-key')
+os.environ['START_BACKGROUND_WORKERS'] = 'false'
+
+# Add the current directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import event
+
+from app import app
+from extensions import db
+from models import Category, Product, ProductImage
+
+PAGE_SIZES = (5, 20, 100)
+CATEGORY_COUNT = 6
+IMAGES_PER_PRODUCT = 3
+LISTINGS = (
+    ('products', '/api/product?per_page={per_page}'),
+    ('products (cursor)', '/api/product?per_page={per_page}&cursor='),
+    ('products (card)', '/api/product?per_page={per_page}&size=card'),
+    ('recent', '/api/recent?limit={per_page}'),
+)
+
+
+def seed(product_count):
+    """Products spread over a few categories, each with a primary and some secondary images."""
+    db.session.execute(Category.__table__.insert(), [{
+        'category_name': f'Category {i}',
+        'name': f'Category {i}',
+        'category_description': 'Benchmark category',
+    } for i in range(CATEGORY_COUNT)])
+    category_ids = [category_id for (category_id,) in db.session.query(Category.category_id)]
+    db.session.execute(Product.__table__.insert(), [{
+        'product_name': f'Product {i}',
+        'product_description': 'Solid wood',
+        'product_price': 1000 + i,
+        'stock_quantity': i % 10,
+        'category_id': category_ids[i % len(category_ids)],
+    } for i in range(product_count)])
+    product_ids = [product_id for (product_id,) in db.session.query(Product.product_id)]
+    db.session.execute(ProductImage.__table__.insert(), [{
+        'image_url': f'uploads/product_{product_id}_{k}.jpg',
+        'is_primary': k == 0,
+        'product_id': product_id,
+    } for product_id in product_ids for k in range(IMAGES_PER_PRODUCT)])
+    db.session.commit()
+
+
+def measure(client, url):
+    """(statement count, wall ms, row count) for one GET."""
+    statements = {'count': 0}
+
+    def count_statement(*args, **kwargs):
+        statements['count'] += 1
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', count_statement)
+    try:
+        started = time.perf_counter()
+        response = client.get(url)
+        elapsed = (time.perf_counter() - started) * 1000
+    finally:
+        event.remove(engine, 'before_cursor_execute', count_statement)
+    if response.status_code != 200:
+        raise RuntimeError(f'{url} returned {response.status_code}: {response.get_data(as_text=True)[:200]}')
+    body = response.get_json()
+    rows = body.get('products', []) if isinstance(body, dict) else body
+    return statements['count'], elapsed, len(rows)
+
+
+def run_check(product_count):
+    with app.app_context():
+        db.create_all()
+        seed(product_count)
+
+    client = app.test_client()
+    print(f"🛋️  {product_count} products, {product_count * IMAGES_PER_PRODUCT} images in {DB_PATH}\n")
+    print(f"{'listing':<20}{'per page':>10}{'rows':>7}{'queries':>9}{'ms':>9}")
+    failures = 0
+    for name, url in LISTINGS:
+        counts = []
+        for per_page in PAGE_SIZES:
+            queries, elapsed, rows = measure(client, url.format(per_page=per_page))
+            counts.append(queries)
+            print(f"{name:<20}{per_page:>10}{rows:>7}{queries:>9}{elapsed:>9.1f}")
+            if rows != min(per_page, product_count):
+                failures += 1
+                print(f"   ❌ {name}: expected {min(per_page, product_count)} rows")
+        if len(set(counts)) > 1:
+            failures += 1
+            print(f"   ❌ {name}: query count grows with the page size")
+
+    if failures:
+        print("\n❌ Some product listings still issue per-product queries")
+        return 1
+    print("\n✅ Every product listing issues a constant number of queries regardless of page size")
+    return 0
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    sys.exit(run_check(count))
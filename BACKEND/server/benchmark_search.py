@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Search Benchmark Script
+Compares the full-text search index against the old leading-wildcard ILIKE
+filter on a synthetic catalog (100k products by default) in a throwaway
+SQLite database.
+
+Usage: python benchmark_search.py [product_count]
+"""
+
+import os
+import sys
+import random
+import tempfile
+import time
+
+# Point the app at a temporary database before it is imported
+DB_PATH = os.path.join(tempfile.mkdtemp(), 'search_benchmark.db')
+os.environ['DATABASE_URL'] = f'sqlite:///{DB_PATH}'
+os.environ['START_BACKGROUND_WORKERS'] = 'false'
+
+# Add the current directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app import app
+from extensions import db
+from models import Product
+from utils.search import rebuild_search_index, product_match_subquery
+
+ADJECTIVES = ['oak', 'walnut', 'velvet', 'leather', 'rattan', 'marble', 'linen', 'teak', 'modern', 'rustic',
+              'vintage', 'nordic', 'industrial', 'classic', 'compact', 'extendable', 'upholstered', 'tufted']
+NOUNS = ['sofa', 'chair', 'table', 'bed', 'wardrobe', 'bookshelf', 'desk', 'stool', 'bench', 'ottoman',
+         'sideboard', 'dresser', 'lamp', 'rug', 'cabinet', 'armchair', 'recliner', 'console']
+SYLLABLES = ['ka', 'lo', 'mi', 'ren', 'tu', 'sa', 'vel', 'dor', 'pi', 'ne', 'bra', 'quo', 'zen', 'fi', 'lum', 'tar']
+
+QUERIES = ['sofa', 'velvet arm', 'teak bench', 'uphol', 'nordic lamp', 'kalo']
+REPEAT = 5
+BATCH_SIZE = 5000
+
+
+def generate_vocabulary(rng, size=5000):
+    """Pseudo-words so descriptions have a realistic spread of rare and common terms."""
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words) + ADJECTIVES + NOUNS
+
+
+def generate_catalog(count):
+    """Insert `count` synthetic products with Core bulk inserts."""
+    rng = random.Random(42)
+    vocabulary = generate_vocabulary(rng)
+    table = Product.__table__
+    for start in range(0, count, BATCH_SIZE):
+        rows = []
+        for i in range(start, min(start + BATCH_SIZE, count)):
+            name = f"{rng.choice(ADJECTIVES).title()} {rng.choice(NOUNS).title()} {i}"
+            description = ' '.join(rng.choice(vocabulary) for _ in range(rng.randint(20, 60)))
+            rows.append({
+                'product_name': name,
+                'product_description': description,
+                'product_price': round(rng.uniform(50, 5000), 2),
+                'stock_quantity': rng.randint(0, 40),
+            })
+        db.session.execute(table.insert(), rows)
+    db.session.commit()
+
+
+def time_query(build_query):
+    """Best-of-REPEAT wall time (ms) and row count for the first page of results."""
+    best = None
+    total = 0
+    for _ in range(REPEAT):
+        started = time.perf_counter()
+        query = build_query()
+        total = query.count()
+        query.limit(50).all()
+        elapsed = (time.perf_counter() - started) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best, total
+
+
+def ilike_query(term):
+    return Product.query.filter(
+        Product.product_name.ilike(f'%{term}%') |
+        Product.product_description.ilike(f'%{term}%')
+    ).order_by(Product.product_name.asc())
+
+
+def fts_query(term):
+    matches = product_match_subquery(term)
+    return Product.query.join(matches, matches.c.match_id == Product.product_id)\
+        .order_by(matches.c.match_rank.asc())
+
+
+def run_benchmark(count):
+    with app.app_context():
+        print(f"📦 Generating {count} products in {DB_PATH} ...")
+        db.create_all()
+        started = time.perf_counter()
+        generate_catalog(count)
+        print(f"   done in {time.perf_counter() - started:.1f}s")
+
+        started = time.perf_counter()
+        rebuild_search_index()
+        print(f"🔎 Built FTS5 index in {time.perf_counter() - started:.1f}s\n")
+
+        print(f"{'query':<24}{'ILIKE ms':>12}{'FTS ms':>12}{'speedup':>10}{'ILIKE rows':>12}{'FTS rows':>10}")
+        for term in QUERIES:
+            ilike_ms, ilike_rows = time_query(lambda: ilike_query(term))
+            fts_ms, fts_rows = time_query(lambda: fts_query(term))
+            print(f"{term:<24}{ilike_ms:>12.1f}{fts_ms:>12.1f}{ilike_ms / fts_ms:>9.1f}x{ilike_rows:>12}{fts_rows:>10}")
+
+        print("\nRow counts differ where ILIKE matches inside words or across word boundaries;"
+              " FTS matches whole words and word prefixes for every term.")
+
+
+if __name__ == '__main__':
+    product_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    run_benchmark(product_count)
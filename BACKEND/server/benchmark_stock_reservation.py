@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Stock Reservation Stress Test
+Hammers a few low-stock products from many threads at once in a throwaway
+SQLite database. Every worker keeps trying to buy random carts (1-2 of the
+hot products, 1-3 units each) until it has made its attempts; each attempt
+commits or rolls back its own transaction.
+
+The conditional-UPDATE reservation engine (utils.inventory.reserve_stock) is
+compared with the old read-validate-decrement approach. A run passes when the
+units granted to successful carts never exceed the stock that was on the
+shelf, i.e. initial - final == granted and no product goes negative.
+
+Usage: python benchmark_stock_reservation.py [threads] [attempts_per_thread]
+"""
+
+import os
+import sys
+import random
+import tempfile
+import threading
+import time
+
+# Point the app at a temporary database before it is imported
+DB_PATH = os.path.join(tempfile.mkdtemp(), 'stock_reservation_benchmark.db')
+os.environ['DATABASE_URL'] = f'sqlite:///{DB_PATH}'
+os.environ.setdefault('JWT_SECRET_KEY', 'benchmark-secret-key-benchmark-secret-key')
+os.environ['START_BACKGROUND_WORKERS'] = 'false'
+
+# Add the current directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app import app
+from extensions import db
+from models import Product, Category
+from utils.inventory import reserve_stock, InsufficientStock
+
+PRODUCT_COUNT = 3
+INITIAL_STOCK = 25
+
+
+def reset_stock():
+    with app.app_context():
+        Product.query.update({Product.stock_quantity: INITIAL_STOCK})
+        db.session.commit()
+
+
+def stock_levels():
+    with app.app_context():
+        return {product.product_id: product.stock_quantity for product in Product.query.all()}
+
+
+def take_atomic(cart):
+    """The reservation engine: one conditional UPDATE for the whole cart."""
+    try:
+        reserve_stock(cart)
+        db.session.commit()
+        return True
+    except InsufficientStock:
+        db.session.rollback()
+        return False
+
+
+def take_read_modify_write(cart):
+    """What checkout used to do: read stock, validate in Python, then write back the decrement."""
+    products = {product_id: db.session.get(Product, product_id) for product_id in cart}
+    if any(products[product_id].stock_quantity < units for product_id, units in cart.items()):
+        db.session.rollback()
+        return False
+    time.sleep(0.001)  # the handler's work between the check and the write (order rows, payment, ...)
+    for product_id, units in cart.items():
+        products[product_id].stock_quantity -= units
+    db.session.commit()
+    return True
+
+
+def run_workers(take, threads, attempts, seed):
+    """Run the workers; returns (granted units per product, successes, errors)."""
+    granted = {}
+    totals = {'ok': 0, 'errors': 0}
+    lock = threading.Lock()
+    start = threading.Barrier(threads)
+
+    def worker(index):
+        rng = random.Random(seed * 1000 + index)
+        with app.app_context():
+            start.wait()
+            for _ in range(attempts):
+                product_ids = rng.sample(range(1, PRODUCT_COUNT + 1), rng.randint(1, 2))
+                cart = {product_id: rng.randint(1, 3) for product_id in product_ids}
+                try:
+                    if take(cart):
+                        with lock:
+                            totals['ok'] += 1
+                            for product_id, units in cart.items():
+                                granted[product_id] = granted.get(product_id, 0) + units
+                except Exception:
+                    db.session.rollback()
+                    with lock:
+                        totals['errors'] += 1
+            db.session.remove()
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return granted, totals['ok'], totals['errors']
+
+
+def run_check(threads, attempts):
+    with app.app_context():
+        db.create_all()
+        category = Category(category_name='Stress', name='Stress', category_description='stress test')
+        db.session.add(category)
+        db.session.flush()
+        for i in range(PRODUCT_COUNT):
+            db.session.add(Product(product_name=f'Hot item {i}', product_description='low stock',
+                                   product_price=100, stock_quantity=INITIAL_STOCK,
+                                   category_id=category.category_id))
+        db.session.commit()
+
+    print(f"🔥 {threads} threads × {attempts} carts against {PRODUCT_COUNT} products "
+          f"with {INITIAL_STOCK} units each ({DB_PATH})\n")
+    print(f"{'approach':<22}{'carts ok':>10}{'errors':>8}{'granted':>9}{'sold':>6}{'oversold':>10}  result")
+
+    failures = 0
+    for name, take, must_pass in (('read-modify-write', take_read_modify_write, False),
+                                  ('conditional UPDATE', take_atomic, True)):
+        reset_stock()
+        granted, ok, errors = run_workers(take, threads, attempts, seed=17)
+        final = stock_levels()
+        sold = sum(INITIAL_STOCK - final[product_id] for product_id in final)
+        total_granted = sum(granted.values())
+        oversold = sum(max(0, granted.get(product_id, 0) - INITIAL_STOCK) for product_id in final)
+        consistent = all(
+            final[product_id] >= 0 and INITIAL_STOCK - final[product_id] == granted.get(product_id, 0)
+            for product_id in final
+        )
+        passed = consistent and oversold == 0
+        if must_pass and not passed:
+            failures += 1
+        print(f"{name:<22}{ok:>10}{errors:>8}{total_granted:>9}{sold:>6}{oversold:>10}  "
+              f"{'✅' if passed else '❌'}")
+
+    if failures:
+        print("\n❌ The reservation engine granted more units than were in stock")
+        return 1
+    print("\n✅ Zero oversell: every unit granted came off the shelf exactly once")
+    return 0
+
+
+if __name__ == '__main__':
+    thread_count = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    attempt_count = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    sys.exit(run_check(thread_count, attempt_count))
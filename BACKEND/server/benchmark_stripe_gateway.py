@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Stripe Gateway Load Test
+Drives /stripe/create-payment-intent and /stripe/refund of a throwaway
+SQLite database against the fake Stripe backend (STRIPE_BACKEND=fake): every
+Stripe call takes STRIPE_FAKE_LATENCY_MS and 10% of them fail like a dropped
+connection, half of those after Stripe applied the call (a lost response).
+Each checkout creates a payment intent, then refunds half of it; one refund
+in ten is sent twice by the client with the same Idempotency-Key.
+
+Reports endpoint throughput and latency at each concurrency level, the
+gateway's latency histograms per Stripe operation (retries included), and
+checks that no retry or resent request created a second payment intent or
+refund.
+
+Usage: python benchmark_stripe_gateway.py [checkouts_per_level] [latency_ms]
+"""
+
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+# Point the app at a temporary database and the fake Stripe backend before it is imported
+DB_PATH = os.path.join(tempfile.mkdtemp(), 'stripe_gateway_benchmark.db')
+os.environ['DATABASE_URL'] = f'sqlite:///{DB_PATH}'
+os.environ.setdefault('JWT_SECRET_KEY', 'benchmark-secret-key-benchmark-secret-key')
+os.environ['START_BACKGROUND_WORKERS'] = 'false'
+os.environ['STRIPE_BACKEND'] = 'fake'
+os.environ['STRIPE_FAKE_LATENCY_MS'] = sys.argv[2] if len(sys.argv) > 2 else '40'
+os.environ['STRIPE_FAKE_FAILURE_RATE'] = '0.1'
+os.environ['STRIPE_MAX_RETRIES'] = '3'
+os.environ['STRIPE_BACKOFF_FACTOR'] = '0.01'
+
+# Add the current directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from flask_jwt_extended import create_access_token
+
+from app import app
+from extensions import db
+from models import User, Order, Payment, OrderStatus, PaymentStatus, UserRole
+from utils.stripe_client import get_stripe_client
+
+logging.getLogger('utils.stripe_client').setLevel(logging.ERROR)  # one warning per retry otherwise
+
+CONCURRENCY_LEVELS = (1, 4, 16)
+RESEND_EVERY = 10
+
+
+def seed(level, count):
+    """One customer per checkout, each with a pending order and payment; returns (order_id, headers) pairs."""
+    db.session.execute(User.__table__.insert(), [{
+        'username': f'buyer{level}_{i}',
+        'email': f'buyer{level}_{i}@example.com',
+        'password_hash': 'x',
+        'role': UserRole.USER,
+    } for i in range(count)])
+    users = [user_id for (user_id,) in db.session.query(User.id).filter(User.username.like(f'buyer{level}_%'))
+             .order_by(User.id)]
+    first = (db.session.query(db.func.max(Order.order_id)).scalar() or 0) + 1
+    db.session.execute(Order.__table__.insert(), [{
+        'order_id': first + i,
+        'total_amount': 2500.0,
+        'order_status': OrderStatus.PENDING,
+        'status': OrderStatus.PENDING,
+        'payment_status': PaymentStatus.PENDING,
+        'shipping_address': 'Kimathi Street, Nairobi',
+        'user_id': user_id,
+    } for i, user_id in enumerate(users)])
+    db.session.execute(Payment.__table__.insert(), [{
+        'payment_amount': '2500',
+        'transaction_id': f'pending-{first + i}',
+        'payment_status': PaymentStatus.PENDING,
+        'order_id': first + i,
+        'payment_method_id': 2,
+        'user_id': user_id,
+    } for i, user_id in enumerate(users)])
+    db.session.commit()
+    return [(first + i, {'Authorization': f'Bearer {create_access_token(identity=str(user_id))}'})
+            for i, user_id in enumerate(users)]
+
+
+def checkout(client, order_id, headers, index, timings, outcomes):
+    started = time.perf_counter()
+    response = client.post('/stripe/create-payment-intent', json={'amount': 2500, 'order_id': order_id},
+                           headers={**headers, 'Idempotency-Key': uuid.uuid4().hex})
+    timings['create-payment-intent'].append((time.perf_counter() - started) * 1000)
+    if response.status_code != 200:
+        outcomes['failed'].append(('create', order_id, response.get_json()))
+        return
+    payment_intent_id = response.get_json()['payment_intent_id']
+
+    refund_key = uuid.uuid4().hex
+    for _ in range(2 if index % RESEND_EVERY == 0 else 1):
+        started = time.perf_counter()
+        response = client.post('/stripe/refund', json={'payment_intent_id': payment_intent_id, 'amount': 1250},
+                               headers={**headers, 'Idempotency-Key': refund_key})
+        timings['refund'].append((time.perf_counter() - started) * 1000)
+        if response.status_code != 200:
+            outcomes['failed'].append(('refund', order_id, response.get_json()))
+            return
+        outcomes['refunds'].append(response.get_json()['refund_id'])
+
+
+def run_level(concurrency, checkouts):
+    timings = {'create-payment-intent': [], 'refund': []}
+    outcomes = {'failed': [], 'refunds': []}
+    shards = [checkouts[i::concurrency] for i in range(concurrency)]
+
+    def work(shard):
+        client = app.test_client()
+        for order_id, headers in shard:
+            checkout(client, order_id, headers, order_id, timings, outcomes)
+
+    threads = [threading.Thread(target=work, args=(shard,)) for shard in shards]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - started, timings, outcomes
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * q), len(ordered) - 1)]
+
+
+def run_benchmark(count):
+    with app.app_context():
+        db.create_all()
+        levels = {level: seed(level, count) for level in CONCURRENCY_LEVELS}
+        gateway = get_stripe_client()
+        fake = gateway.backend
+
+    print(f"🧪 {count} checkouts per level against the fake Stripe backend "
+          f"({os.environ['STRIPE_FAKE_LATENCY_MS']} ms per call, 10% network failures) ({DB_PATH})\n")
+    print(f"{'threads':>7}  {'endpoint':<22}{'requests':>9}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}")
+
+    failed, refund_ids = [], []
+    for concurrency, checkouts in levels.items():
+        elapsed, timings, outcomes = run_level(concurrency, checkouts)
+        failed += outcomes['failed']
+        refund_ids += outcomes['refunds']
+        for endpoint, values in timings.items():
+            print(f"{concurrency:>7}  {endpoint:<22}{len(values):>9}{len(values) / elapsed:>9.0f}"
+                  f"{percentile(values, 0.5):>9.1f}{percentile(values, 0.95):>9.1f}")
+
+    print(f"\n{'operation':<26}{'calls':>7}{'retries':>9}{'errors':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for operation, stats in gateway.metrics().items():
+        print(f"{operation:<26}{stats['count']:>7}{stats['retries']:>9}{stats['errors']:>8}"
+              f"{stats['p50_ms']:>9}{stats['p95_ms']:>9}{stats['p99_ms']:>9}")
+
+    total = count * len(CONCURRENCY_LEVELS)
+    with app.app_context():
+        intents = Payment.query.filter(Payment.transaction_id.like('pi_fake_%')).count()
+    created = len(fake.payment_intents)
+    print(f"\nFake Stripe: {fake.calls} calls, {fake.failures} simulated network failures; "
+          f"{created} payment intents and {len(fake.refunds)} refunds for {total} checkouts "
+          f"({len(refund_ids) - len(set(refund_ids))} resent refunds answered with the original)")
+    for step, order_id, error in failed[:5]:
+        print(f"   gave up on {step} for order {order_id}: {error}")
+
+    duplicates = created - intents + len(fake.refunds) - len(set(refund_ids))
+    if duplicates or intents + len(failed) < total:
+        print("\n❌ A retry or resent request reached Stripe twice")
+        return 1
+    print("\n✅ Retries and resent requests never created a second payment intent or refund")
+    return 0
+
+
+if __name__ == '__main__':
+    checkout_count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    sys.exit(run_benchmark(checkout_count))
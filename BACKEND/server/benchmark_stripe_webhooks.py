@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+Stripe Webhook Benchmark
+Delivers a synthetic Stripe event log (payment failures, retried successes,
+unrelated events) to the webhook of a throwaway SQLite database the way
+Stripe does: signed, shuffled and with 20% redeliveries. The old inline
+handler (one payment lookup and commit per event) is compared with the event
+store (one INSERT per event, applied in batches by the event worker).
+
+Reports acknowledgement latency, queries and transactions per event, and how
+many payments each path leaves in a state other than the one their newest
+event describes. Then the stored events are exported, the payments reset,
+and the export replayed in a different order, duplication and batch size;
+the run passes when the replay reproduces the final state exactly.
+
+Usage: python benchmark_stripe_webhooks.py [payments | captured_events.jsonl]
+
+A log written by `flask export-stripe-events` can be replayed instead of
+the synthetic one; payments for its orders are stubbed in the throwaway
+database.
+"""
+
+import hashlib
+import hmac
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+# Point the app at a temporary database before it is imported
+DB_PATH = os.path.join(tempfile.mkdtemp(), 'stripe_webhooks_benchmark.db')
+os.environ['DATABASE_URL'] = f'sqlite:///{DB_PATH}'
+os.environ.setdefault('JWT_SECRET_KEY', 'benchmark-secret-key-benchmark-secret-key')
+os.environ['START_BACKGROUND_WORKERS'] = 'false'
+os.environ['STRIPE_WEBHOOK_SECRET'] = 'whsec_benchmark'
+os.environ['STRIPE_EVENT_WORKERS'] = '0'  # drained explicitly below
+
+# Add the current directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import stripe
+from flask import request, jsonify
+from sqlalchemy import event
+
+from app import app
+from extensions import db
+from models import User, Order, Payment, StripeEvent, OrderStatus, PaymentStatus, UserRole
+from utils.stripe_events import drain, export_events, EVENT_STATUSES, EVENT_RANKS
+
+SECRET = os.environ['STRIPE_WEBHOOK_SECRET']
+REDELIVERY_RATE = 0.2
+counters = {'queries': 0, 'commits': 0}
+
+
+def inline_webhook():
+    """What stripe_webhook used to do: apply each event as it arrives."""
+    payload = request.get_data(as_text=True)
+    stripe_event = stripe.Webhook.construct_event(payload, request.headers.get('Stripe-Signature'), SECRET)
+    status = EVENT_STATUSES.get(stripe_event['type'])
+    if status is not None:
+        order_id = stripe_event['data']['object'].metadata['order_id']
+        payment = Payment.query.filter_by(order_id=order_id).first()
+        if payment:
+            payment.payment_status = status
+            db.session.commit()
+    return jsonify({"success": True}), 200
+
+
+app.add_url_rule('/benchmark/inline-webhook', 'benchmark_inline_webhook', inline_webhook, methods=['POST'])
+
+
+def sign(payload):
+    timestamp = int(time.time())
+    signature = hmac.new(SECRET.encode(), f'{timestamp}.{payload}'.encode(), hashlib.sha256).hexdigest()
+    return f't={timestamp},v1={signature}'
+
+
+def stripe_event(event_id, event_type, created, order_id):
+    return {
+        'id': event_id,
+        'object': 'event',
+        'type': event_type,
+        'created': created,
+        'data': {'object': {
+            'id': f'pi_{order_id}',
+            'object': 'payment_intent',
+            'metadata': {'order_id': str(order_id)},
+        }},
+    }
+
+
+def synthetic_log(rng, order_ids, prefix):
+    """1-3 events per payment: failures, usually a later (sometimes same-second) success, noise."""
+    log = []
+    start = 1_760_000_000
+    for order_id in order_ids:
+        created = start + rng.randint(0, 3600)
+        for attempt in range(rng.randint(1, 3)):
+            event_type = rng.choice(['payment_intent.payment_failed', 'payment_intent.succeeded'])
+            log.append(stripe_event(f'evt_{prefix}{order_id}_{attempt}', event_type, created, order_id))
+            created += rng.choice([0, 1, 30])
+        if rng.random() < 0.3:
+            log.append(stripe_event(f'evt_{prefix}{order_id}_charge', 'charge.succeeded', created, order_id))
+    return log
+
+
+def expected_states(log):
+    """Final status per order: that of its newest payment event."""
+    newest = {}
+    for item in log:
+        if item['type'] not in EVENT_STATUSES:
+            continue
+        order_id = int(item['data']['object']['metadata']['order_id'])
+        key = (item['created'], EVENT_RANKS[item['type']], item['id'])
+        if order_id not in newest or key > newest[order_id][0]:
+            newest[order_id] = (key, EVENT_STATUSES[item['type']])
+    return {order_id: status for order_id, (key, status) in newest.items()}
+
+
+def seed_payments(order_ids, user_id):
+    first = (db.session.query(db.func.max(Order.order_id)).scalar() or 0) + 1
+    missing = [order_id for order_id in order_ids if order_id >= first]
+    db.session.execute(Order.__table__.insert(), [{
+        'order_id': order_id,
+        'total_amount': 2500.0,
+        'order_status': OrderStatus.PENDING,
+        'status': OrderStatus.PENDING,
+        'payment_status': PaymentStatus.PENDING,
+        'shipping_address': 'Kenyatta Avenue, Nairobi',
+        'user_id': user_id,
+    } for order_id in missing])
+    db.session.execute(Payment.__table__.insert(), [{
+        'payment_amount': '2500',
+        'transaction_id': f'pi_{order_id}',
+        'payment_status': PaymentStatus.PENDING,
+        'order_id': order_id,
+        'payment_method_id': 2,
+        'user_id': user_id,
+    } for order_id in missing])
+    db.session.commit()
+
+
+def deliveries(rng, log):
+    """The log as Stripe might deliver it: shuffled, with redeliveries."""
+    sent = log + [item for item in log if rng.random() < REDELIVERY_RATE]
+    rng.shuffle(sent)
+    return sent
+
+
+def deliver(client, url, items):
+    timings = []
+    counters.update(queries=0, commits=0)
+    for item in items:
+        payload = json.dumps(item)
+        started = time.perf_counter()
+        response = client.post(url, data=payload, content_type='application/json',
+                               headers={'Stripe-Signature': sign(payload)})
+        timings.append((time.perf_counter() - started) * 1000)
+        if response.status_code != 200:
+            raise RuntimeError(f"{url} answered {response.status_code}: {response.get_json()}")
+    return timings, dict(counters)
+
+
+def final_states(order_ids):
+    rows = db.session.query(Payment.order_id, Payment.payment_status).filter(Payment.order_id.in_(order_ids))
+    return dict(rows)
+
+
+def mismatches(states, expected):
+    return sum(1 for order_id, status in expected.items() if states.get(order_id) != status)
+
+
+def load_log(path):
+    with open(path) as stream:
+        return [json.loads(line) for line in stream if line.strip()]
+
+
+def run_benchmark(source):
+    rng = random.Random(21)
+    with app.app_context():
+        db.create_all()
+
+        @event.listens_for(db.engine, 'before_cursor_execute')
+        def count_query(*args):
+            counters['queries'] += 1
+
+        @event.listens_for(db.engine, 'commit')
+        def count_commit(*args):
+            counters['commits'] += 1
+
+        user = User(username='buyer', email='buyer@example.com', password_hash='x', role=UserRole.USER)
+        db.session.add(user)
+        db.session.commit()
+
+        if isinstance(source, str):
+            inbox_log = load_log(source)
+            inline_log = None
+            inbox_orders = sorted({int(item['data']['object']['metadata']['order_id'])
+                                   for item in inbox_log
+                                   if (item['data']['object'].get('metadata') or {}).get('order_id')})
+            seed_payments(inbox_orders, user.id)
+            print(f"🔁 Replaying {len(inbox_log)} captured events for {len(inbox_orders)} payments ({DB_PATH})\n")
+        else:
+            inline_orders = list(range(1, source + 1))
+            inbox_orders = list(range(source + 1, 2 * source + 1))
+            inline_log = synthetic_log(rng, inline_orders, 'inline_')
+            inbox_log = synthetic_log(rng, inbox_orders, 'inbox_')
+            seed_payments(inline_orders + inbox_orders, user.id)
+            print(f"💳 {len(inbox_log)} events for {source} payments, delivered shuffled with "
+                  f"{REDELIVERY_RATE:.0%} redeliveries ({DB_PATH})\n")
+
+    client = app.test_client()
+    print(f"{'handler':<10}{'deliveries':>11}{'ack mean ms':>13}{'queries/event':>15}{'commits/event':>15}{'wrong state':>13}")
+
+    results = []
+    if inline_log is not None:
+        sent = deliveries(rng, inline_log)
+        timings, used = deliver(client, '/benchmark/inline-webhook', sent)
+        with app.app_context():
+            wrong = mismatches(final_states(inline_orders), expected_states(inline_log))
+        results.append(('inline', len(sent), timings, used, wrong))
+
+    sent = deliveries(rng, inbox_log)
+    timings, used = deliver(client, '/stripe/webhook', sent)
+    with app.app_context():
+        counters.update(queries=0, commits=0)
+        applied = drain()
+        worker = dict(counters)
+        used = {name: used[name] + counters[name] for name in used}
+        expected = expected_states(inbox_log)
+        first_run = final_states(inbox_orders)
+        wrong = mismatches(first_run, expected)
+    results.append(('store', len(sent), timings, used, wrong))
+
+    for name, count, timings, used, wrong in results:
+        print(f"{name:<10}{count:>11}{sum(timings) / len(timings):>13.2f}{used['queries'] / count:>15.1f}"
+              f"{used['commits'] / count:>15.2f}{wrong:>13}")
+
+    print(f"\nEvent worker: {applied} stored events applied with {worker['queries']} queries "
+          f"in {worker['commits']} transactions")
+
+    # Replay the exported log against reset payments, in another order and batch size
+    with app.app_context():
+        exported = io.StringIO()
+        export_events(exported)
+        replay_log = [json.loads(line) for line in exported.getvalue().splitlines()]
+        db.session.query(StripeEvent).delete()
+        Payment.query.filter(Payment.order_id.in_(inbox_orders)).update(
+            {Payment.payment_status: PaymentStatus.PENDING}, synchronize_session=False)
+        db.session.commit()
+    app.config['STRIPE_EVENT_BATCH_SIZE'] = 7
+    replay_rng = random.Random(99)
+    sent = deliveries(replay_rng, replay_log)
+    half = len(sent) // 2
+    deliver(client, '/stripe/webhook', sent[:half])
+    with app.app_context():
+        drain()
+    deliver(client, '/stripe/webhook', sent[half:])
+    with app.app_context():
+        drain()
+        replayed = final_states(inbox_orders)
+
+    differences = sum(1 for order_id in inbox_orders if replayed.get(order_id) != first_run.get(order_id))
+    print(f"\nReplayed {len(replay_log)} exported events ({len(sent)} deliveries, batches of 7): "
+          f"{differences} payments differ from the first run")
+
+    if wrong or differences:
+        print("\n❌ The event store did not reproduce the final payment state")
+        return 1
+    print("\n✅ Redeliveries acknowledged without work; replay reproduces the final state exactly")
+    return 0
+
+
+if __name__ == '__main__':
+    argument = sys.argv[1] if len(sys.argv) > 1 else '300'
+    sys.exit(run_benchmark(int(argument) if argument.isdigit() else argument))
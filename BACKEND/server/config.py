@@ -29,6 +29,51 @@ class Config:
     #File Uploads
     UPLOAD_FOLDER = os.path.join(BASE_DIR, 'static/uploads')  # Local storage
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+    IMAGE_VARIANT_WORKERS = int(os.getenv('IMAGE_VARIANT_WORKERS', 2))  # background resize threads
+
+    # Inventory reports
+    LOW_STOCK_THRESHOLD = int(os.getenv('LOW_STOCK_THRESHOLD', 10))  # products at or below this stock count as low
+
+
+    #Response Cache (public catalog endpoints)
+    CACHE_ENABLED = os.getenv('CACHE_ENABLED', 'true').lower() in ['true', 'on', '1']
+    CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'memory')  # 'memory' or 'redis'
+    CACHE_REDIS_URL = os.getenv('CACHE_REDIS_URL', 'redis://localhost:6379/0')
+    CACHE_DEFAULT_TTL = int(os.getenv('CACHE_DEFAULT_TTL', 300))
+    CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', 1024))
+
+
+    #Admin Dashboard
+    DASHBOARD_WORKERS = int(os.getenv('DASHBOARD_WORKERS', 4))  # overview sections queried concurrently
+    DASHBOARD_TIMING_HEADER = os.getenv('DASHBOARD_TIMING_HEADER', 'false').lower() in ['true', 'on', '1']  # Server-Timing per section (always on in debug)
+
+
+    #Inventory
+    STOCK_RESERVATION_MINUTES = int(os.getenv('STOCK_RESERVATION_MINUTES', 15))  # stock held for unpaid M-Pesa orders
+    RESERVATION_SWEEP_WORKERS = int(os.getenv('RESERVATION_SWEEP_WORKERS', 1))  # per process; 0 leaves expired holds to `flask release-expired-reservations`
+    RESERVATION_SWEEP_SECONDS = float(os.getenv('RESERVATION_SWEEP_SECONDS', 60))
+    START_BACKGROUND_WORKERS = os.getenv('START_BACKGROUND_WORKERS', 'true').lower() == 'true'  # false for scripts and request-only processes
+
+
+    #Idempotency-Key (checkout and payment initiation)
+    IDEMPOTENCY_TTL_HOURS = int(os.getenv('IDEMPOTENCY_TTL_HOURS', 24))  # how long retries replay the stored response
+    IDEMPOTENCY_LOCK_SECONDS = int(os.getenv('IDEMPOTENCY_LOCK_SECONDS', 120))  # claim left by a crashed request lapses
+
+
+    #M-Pesa callback inbox
+    MPESA_CALLBACK_WORKERS = int(os.getenv('MPESA_CALLBACK_WORKERS', 2))  # per process; 0 leaves callbacks to `flask process-mpesa-callbacks --watch`
+    MPESA_CALLBACK_BATCH_SIZE = int(os.getenv('MPESA_CALLBACK_BATCH_SIZE', 50))
+    MPESA_CALLBACK_POLL_SECONDS = float(os.getenv('MPESA_CALLBACK_POLL_SECONDS', 2))  # picks up callbacks stored by other processes
+    MPESA_CALLBACK_RETRY_SECONDS = int(os.getenv('MPESA_CALLBACK_RETRY_SECONDS', 10))  # e.g. callback that beat its payment row
+    MPESA_CALLBACK_MAX_ATTEMPTS = int(os.getenv('MPESA_CALLBACK_MAX_ATTEMPTS', 5))
+
+
+    #Payment status events (SSE)
+    PAYMENT_EVENTS_BROKER = os.getenv('PAYMENT_EVENTS_BROKER', 'memory')  # memory (single process) or database (several worker processes)
+    PAYMENT_EVENTS_HEARTBEAT_SECONDS = float(os.getenv('PAYMENT_EVENTS_HEARTBEAT_SECONDS', 15))
+    PAYMENT_EVENTS_TIMEOUT_SECONDS = float(os.getenv('PAYMENT_EVENTS_TIMEOUT_SECONDS', 300))  # streams of abandoned checkouts close after this
+    PAYMENT_EVENTS_POLL_SECONDS = float(os.getenv('PAYMENT_EVENTS_POLL_SECONDS', 1))  # database broker
+    PAYMENT_EVENTS_RETENTION_SECONDS = int(os.getenv('PAYMENT_EVENTS_RETENTION_SECONDS', 600))  # database broker
 
 
     #M-Pesa Configuration
@@ -40,19 +85,45 @@ class Config:
     MPESA_ENVIRONMENT = os.getenv('MPESA_ENVIRONMENT', 'sandbox')
     MPESA_TRANSACTION_TYPE = os.getenv('MPESA_TRANSACTION_TYPE', 'CustomerPayBillOnline')
 
-    # API URLs (auto-configured based on environment)
+    # API URLs (auto-configured based on environment; DARAJA_BASE_URL points them elsewhere, e.g. at fake_daraja.py)
     if MPESA_ENVIRONMENT == 'production':
-        DARAJA_AUTH_URL = 'https://api.safaricom.co.ke/oauth/v1/generate?grant_type=client_credentials'
-        DARAJA_STK_PUSH_URL = 'https://api.safaricom.co.ke/mpesa/stkpush/v1/processrequest'
+        DARAJA_BASE_URL = os.getenv('DARAJA_BASE_URL', 'https://api.safaricom.co.ke')
     else:
-        DARAJA_AUTH_URL = 'https://sandbox.safaricom.co.ke/oauth/v1/generate?grant_type=client_credentials'
-        DARAJA_STK_PUSH_URL = 'https://sandbox.safaricom.co.ke/mpesa/stkpush/v1/processrequest'
+        DARAJA_BASE_URL = os.getenv('DARAJA_BASE_URL', 'https://sandbox.safaricom.co.ke')
+    DARAJA_AUTH_URL = f'{DARAJA_BASE_URL}/oauth/v1/generate?grant_type=client_credentials'
+    DARAJA_STK_PUSH_URL = f'{DARAJA_BASE_URL}/mpesa/stkpush/v1/processrequest'
+
+    # Daraja HTTP client (one pooled keep-alive session and cached OAuth token per app)
+    DARAJA_CONNECT_TIMEOUT = float(os.getenv('DARAJA_CONNECT_TIMEOUT', 5))
+    DARAJA_READ_TIMEOUT = float(os.getenv('DARAJA_READ_TIMEOUT', 30))
+    DARAJA_RETRIES = int(os.getenv('DARAJA_RETRIES', 3))  # STK pushes are only retried when the request never reached Safaricom
+    DARAJA_BACKOFF_FACTOR = float(os.getenv('DARAJA_BACKOFF_FACTOR', 0.5))
+    DARAJA_POOL_SIZE = int(os.getenv('DARAJA_POOL_SIZE', 10))
+    DARAJA_TOKEN_REFRESH_MARGIN = int(os.getenv('DARAJA_TOKEN_REFRESH_MARGIN', 300))  # seconds before expiry the token is renewed
 
 
     # Stripe Configuration
     STRIPE_SECRET_KEY = os.getenv('STRIPE_SECRET_KEY')
     STRIPE_WEBHOOK_SECRET = os.getenv('STRIPE_WEBHOOK_SECRET')
 
+    # Stripe API gateway (see utils/stripe_client.py)
+    STRIPE_BACKEND = os.getenv('STRIPE_BACKEND', 'stripe')  # 'fake' answers in-process, for load tests without network access
+    STRIPE_API_BASE = os.getenv('STRIPE_API_BASE')  # e.g. a stripe-mock server; Stripe's API when unset
+    STRIPE_CONNECT_TIMEOUT = float(os.getenv('STRIPE_CONNECT_TIMEOUT', 5))
+    STRIPE_READ_TIMEOUT = float(os.getenv('STRIPE_READ_TIMEOUT', 30))
+    STRIPE_MAX_RETRIES = int(os.getenv('STRIPE_MAX_RETRIES', 2))  # every attempt of a call reuses its idempotency key
+    STRIPE_BACKOFF_FACTOR = float(os.getenv('STRIPE_BACKOFF_FACTOR', 0.5))
+    STRIPE_POOL_SIZE = int(os.getenv('STRIPE_POOL_SIZE', 10))
+    STRIPE_FAKE_LATENCY_MS = float(os.getenv('STRIPE_FAKE_LATENCY_MS', 0))
+    STRIPE_FAKE_FAILURE_RATE = float(os.getenv('STRIPE_FAKE_FAILURE_RATE', 0))  # share of fake calls that fail as network errors
+
+    # Stripe webhook events (stored per event id, applied in batches)
+    STRIPE_EVENT_WORKERS = int(os.getenv('STRIPE_EVENT_WORKERS', 1))  # per process; 0 leaves events to `flask process-stripe-events --watch`
+    STRIPE_EVENT_BATCH_SIZE = int(os.getenv('STRIPE_EVENT_BATCH_SIZE', 100))
+    STRIPE_EVENT_POLL_SECONDS = float(os.getenv('STRIPE_EVENT_POLL_SECONDS', 2))
+    STRIPE_EVENT_RETRY_SECONDS = int(os.getenv('STRIPE_EVENT_RETRY_SECONDS', 10))  # e.g. event for a payment not saved yet
+    STRIPE_EVENT_MAX_ATTEMPTS = int(os.getenv('STRIPE_EVENT_MAX_ATTEMPTS', 5))
+
     # Backward-compatible alias (some utils referenced MPESA_STK_PUSH_URL)
     MPESA_STK_PUSH_URL = DARAJA_STK_PUSH_URL
 
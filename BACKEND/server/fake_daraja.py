@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Fake Daraja Server
+A local stand-in for Safaricom's Daraja API serving the two endpoints the
+shop calls: the OAuth client-credentials token and the STK push request.
+It checks the Basic/Bearer credentials like Daraja does, can add a fixed
+latency to every request (to mimic the round trip to Safaricom) and counts
+requests and TCP connections so checks can see token reuse and keep-alive.
+
+Run it and point the app at it:
+
+    python fake_daraja.py [port] [latency_ms]
+    DARAJA_BASE_URL=http://127.0.0.1:8089 MPESA_CONSUMER_KEY=fake-key \\
+        MPESA_CONSUMER_SECRET=fake-secret flask run
+
+or use FakeDaraja() from a script (see benchmark_daraja.py).
+"""
+
+import base64
+import json
+import secrets
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CONSUMER_KEY = 'fake-key'
+CONSUMER_SECRET = 'fake-secret'
+TOKEN_PATH = '/oauth/v1/generate'
+STK_PUSH_PATH = '/mpesa/stkpush/v1/processrequest'
+
+
+class FakeDaraja:
+    """
+    Threaded fake Daraja server.
+
+    Args:
+        port (int): Port to listen on (0 picks a free one)
+        latency (float): Seconds added to every request
+        token_lifetime (int): expires_in reported for issued tokens
+    """
+
+    def __init__(self, port=0, latency=0.0, token_lifetime=3599,
+                 consumer_key=CONSUMER_KEY, consumer_secret=CONSUMER_SECRET):
+        self.latency = latency
+        self.token_lifetime = token_lifetime
+        self.consumer_key = consumer_key
+        self.consumer_secret = consumer_secret
+        self.tokens = set()
+        self.counts = {'token': 0, 'stk_push': 0, 'connections': 0}
+        self.stk_pushes = []
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def config(self):
+        """App config entries pointing the Daraja client at this server."""
+        return {
+            'DARAJA_AUTH_URL': f'{self.base_url}{TOKEN_PATH}?grant_type=client_credentials',
+            'DARAJA_STK_PUSH_URL': f'{self.base_url}{STK_PUSH_PATH}',
+            'MPESA_CONSUMER_KEY': self.consumer_key,
+            'MPESA_CONSUMER_SECRET': self.consumer_secret,
+        }
+
+    def revoke_tokens(self):
+        with self._lock:
+            self.tokens.clear()
+
+    def reset_counts(self):
+        with self._lock:
+            self.counts = {name: 0 for name in self.counts}
+            self.stk_pushes = []
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive
+            disable_nagle_algorithm = True  # headers and body go out in separate writes
+
+            def setup(self):
+                super().setup()
+                fake._count('connections')
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status, body, content_type='application/json'):
+                data = body.encode() if isinstance(body, str) else json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if fake.latency:
+                    time.sleep(fake.latency)
+                if self.path.split('?')[0] != TOKEN_PATH:
+                    return self._send(404, {'errorMessage': 'Not found'})
+                fake._count('token')
+                expected = base64.b64encode(f'{fake.consumer_key}:{fake.consumer_secret}'.encode()).decode()
+                if self.headers.get('Authorization') != f'Basic {expected}':
+                    # Daraja answers bad credentials with an empty text/plain 400
+                    return self._send(400, '', content_type='text/plain')
+                token = secrets.token_urlsafe(21)
+                with fake._lock:
+                    fake.tokens.add(token)
+                self._send(200, {'access_token': token, 'expires_in': str(fake.token_lifetime)})
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                if fake.latency:
+                    time.sleep(fake.latency)
+                if self.path != STK_PUSH_PATH:
+                    return self._send(404, {'errorMessage': 'Not found'})
+                fake._count('stk_push')
+                token = (self.headers.get('Authorization') or '').removeprefix('Bearer ')
+                with fake._lock:
+                    valid = token in fake.tokens
+                if not valid:
+                    return self._send(401, {'requestId': secrets.token_hex(4),
+                                            'errorCode': '404.001.03',
+                                            'errorMessage': 'Invalid Access Token'})
+                payload = json.loads(body or b'{}')
+                with fake._lock:
+                    fake.stk_pushes.append(payload)
+                self._send(200, {
+                    'MerchantRequestID': f'fake-{secrets.token_hex(4)}',
+                    'CheckoutRequestID': f'ws_CO_{time.strftime("%d%m%Y%H%M%S")}{secrets.token_hex(4)}',
+                    'ResponseCode': '0',
+                    'ResponseDescription': 'Success. Request accepted for processing',
+                    'CustomerMessage': 'Success. Request accepted for processing'
+                })
+
+        return Handler
+
+
+if __name__ == '__main__':
+    server_port = int(sys.argv[1]) if len(sys.argv) > 1 else 8089
+    latency_ms = float(sys.argv[2]) if len(sys.argv) > 2 else 0
+    server = FakeDaraja(port=server_port, latency=latency_ms / 1000)
+    print(f"Fake Daraja listening on {server.base_url} "
+          f"(consumer key {server.consumer_key!r}, secret {server.consumer_secret!r})")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
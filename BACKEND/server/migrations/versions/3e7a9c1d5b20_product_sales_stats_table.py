@@ -0,0 +1,44 @@
+"""product_sales_stats table for best-seller ranking
+
+Revision ID: 3e7a9c1d5b20
+Revises: c8f4a1b2e3d4
+Create Date: 2026-10-18
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "3e7a9c1d5b20"
+down_revision = "c8f4a1b2e3d4"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "product_sales_stats",
+        sa.Column("product_id", sa.Integer(), nullable=False),
+        sa.Column("units_sold", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("order_count", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("rating_sum", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("rating_count", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("avg_rating", sa.Float(), nullable=False, server_default="0"),
+        sa.Column(
+            "last_updated",
+            sa.DateTime(),
+            server_default=sa.text("(CURRENT_TIMESTAMP)"),
+            nullable=True,
+        ),
+        sa.ForeignKeyConstraint(["product_id"], ["products.product_id"]),
+        sa.PrimaryKeyConstraint("product_id"),
+    )
+    op.create_index(
+        "ix_product_sales_stats_ranking",
+        "product_sales_stats",
+        ["order_count", "avg_rating"],
+    )
+
+
+def downgrade():
+    op.drop_index("ix_product_sales_stats_ranking", table_name="product_sales_stats")
+    op.drop_table("product_sales_stats")
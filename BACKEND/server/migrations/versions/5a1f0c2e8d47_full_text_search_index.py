@@ -0,0 +1,57 @@
+"""full-text search index for products and blog posts
+
+Revision ID: 5a1f0c2e8d47
+Revises: 3e7a9c1d5b20
+Create Date: 2026-10-18
+
+"""
+from alembic import op
+
+revision = "5a1f0c2e8d47"
+down_revision = "3e7a9c1d5b20"
+branch_labels = None
+depends_on = None
+
+
+PRODUCT_DOCUMENT = "coalesce(product_name, '') || ' ' || coalesce(product_description, '')"
+BLOG_DOCUMENT = "coalesce(title, '') || ' ' || coalesce(excerpt, '') || ' ' || coalesce(content, '')"
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == "sqlite":
+        op.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS product_search USING fts5("
+            "product_name, product_description, tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+        )
+        op.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS blog_search USING fts5("
+            "title, excerpt, content, tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+        )
+        op.execute(
+            "INSERT INTO product_search (rowid, product_name, product_description) "
+            "SELECT product_id, product_name, product_description FROM products"
+        )
+        op.execute(
+            "INSERT INTO blog_search (rowid, title, excerpt, content) "
+            "SELECT id, title, excerpt, content FROM blog_posts"
+        )
+    elif dialect == "postgresql":
+        op.execute(
+            f"CREATE INDEX IF NOT EXISTS ix_products_search ON products "
+            f"USING GIN (to_tsvector('english', {PRODUCT_DOCUMENT}))"
+        )
+        op.execute(
+            f"CREATE INDEX IF NOT EXISTS ix_blog_posts_search ON blog_posts "
+            f"USING GIN (to_tsvector('english', {BLOG_DOCUMENT}))"
+        )
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == "sqlite":
+        op.execute("DROP TABLE IF EXISTS blog_search")
+        op.execute("DROP TABLE IF EXISTS product_search")
+    elif dialect == "postgresql":
+        op.execute("DROP INDEX IF EXISTS ix_blog_posts_search")
+        op.execute("DROP INDEX IF EXISTS ix_products_search")
@@ -0,0 +1,33 @@
+"""content_versions table for ETag version stamps
+
+Revision ID: 9b3d6e2f1a84
+Revises: 5a1f0c2e8d47
+Create Date: 2026-10-18
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "9b3d6e2f1a84"
+down_revision = "5a1f0c2e8d47"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "content_versions",
+        sa.Column("scope", sa.String(length=100), nullable=False),
+        sa.Column("version", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column(
+            "updated_at",
+            sa.DateTime(),
+            server_default=sa.text("(CURRENT_TIMESTAMP)"),
+            nullable=True,
+        ),
+        sa.PrimaryKeyConstraint("scope"),
+    )
+
+
+def downgrade():
+    op.drop_table("content_versions")
@@ -0,0 +1,69 @@
+"""mpesa_callbacks inbox and payment_events broker tables
+
+Revision ID: b5e1c8d3f724
+Revises: a8d4f2b6c913
+Create Date: 2026-10-18
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "b5e1c8d3f724"
+down_revision = "a8d4f2b6c913"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "mpesa_callbacks",
+        sa.Column("callback_id", sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column("checkout_request_id", sa.String(length=100), nullable=True),
+        sa.Column("merchant_request_id", sa.String(length=100), nullable=True),
+        sa.Column("result_code", sa.String(length=10), nullable=True),
+        sa.Column("payload", sa.JSON(), nullable=False),
+        sa.Column("status", sa.String(length=20), nullable=False, server_default="received"),
+        sa.Column("attempts", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("error", sa.String(length=255), nullable=True),
+        sa.Column(
+            "received_at",
+            sa.DateTime(),
+            server_default=sa.text("(CURRENT_TIMESTAMP)"),
+            nullable=True,
+        ),
+        sa.Column("claimed_at", sa.DateTime(), nullable=True),
+        sa.Column("processed_at", sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint("callback_id"),
+    )
+    op.create_index(
+        "ix_mpesa_callbacks_status_callback_id",
+        "mpesa_callbacks",
+        ["status", "callback_id"],
+    )
+    op.create_index(
+        "ix_mpesa_callbacks_checkout_request_id",
+        "mpesa_callbacks",
+        ["checkout_request_id"],
+    )
+
+    op.create_table(
+        "payment_events",
+        sa.Column("event_id", sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column("channel", sa.String(length=120), nullable=False),
+        sa.Column("data", sa.Text(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("event_id"),
+    )
+    op.create_index(
+        "ix_payment_events_created_at",
+        "payment_events",
+        ["created_at"],
+    )
+
+
+def downgrade():
+    op.drop_index("ix_payment_events_created_at", table_name="payment_events")
+    op.drop_table("payment_events")
+    op.drop_index("ix_mpesa_callbacks_checkout_request_id", table_name="mpesa_callbacks")
+    op.drop_index("ix_mpesa_callbacks_status_callback_id", table_name="mpesa_callbacks")
+    op.drop_table("mpesa_callbacks")
@@ -0,0 +1,24 @@
+"""variants column on product_images
+
+Revision ID: b7e2c4d9f013
+Revises: 9b3d6e2f1a84
+Create Date: 2026-10-18
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "b7e2c4d9f013"
+down_revision = "9b3d6e2f1a84"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("product_images", schema=None) as batch_op:
+        batch_op.add_column(sa.Column("variants", sa.JSON(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table("product_images", schema=None) as batch_op:
+        batch_op.drop_column("variants")
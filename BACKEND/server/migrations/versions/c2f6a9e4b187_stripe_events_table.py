@@ -0,0 +1,54 @@
+"""stripe_events table deduplicating and queueing Stripe webhook events
+
+Revision ID: c2f6a9e4b187
+Revises: b5e1c8d3f724
+Create Date: 2026-10-18
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "c2f6a9e4b187"
+down_revision = "b5e1c8d3f724"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "stripe_events",
+        sa.Column("event_id", sa.String(length=255), nullable=False),
+        sa.Column("event_type", sa.String(length=100), nullable=False),
+        sa.Column("object_id", sa.String(length=255), nullable=True),
+        sa.Column("order_id", sa.Integer(), nullable=True),
+        sa.Column("created", sa.Integer(), nullable=False),
+        sa.Column("payload", sa.JSON(), nullable=False),
+        sa.Column("status", sa.String(length=20), nullable=False, server_default="received"),
+        sa.Column("attempts", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("error", sa.String(length=255), nullable=True),
+        sa.Column(
+            "received_at",
+            sa.DateTime(),
+            server_default=sa.text("(CURRENT_TIMESTAMP)"),
+            nullable=True,
+        ),
+        sa.Column("claimed_at", sa.DateTime(), nullable=True),
+        sa.Column("processed_at", sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint("event_id"),
+    )
+    op.create_index(
+        "ix_stripe_events_status_created",
+        "stripe_events",
+        ["status", "created"],
+    )
+    op.create_index(
+        "ix_stripe_events_object_id",
+        "stripe_events",
+        ["object_id"],
+    )
+
+
+def downgrade():
+    op.drop_index("ix_stripe_events_object_id", table_name="stripe_events")
+    op.drop_index("ix_stripe_events_status_created", table_name="stripe_events")
+    op.drop_table("stripe_events")
@@ -0,0 +1,34 @@
+"""stored_files table for content-addressed uploads
+
+Revision ID: c4a8e1f7b962
+Revises: b7e2c4d9f013
+Create Date: 2026-10-18
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "c4a8e1f7b962"
+down_revision = "b7e2c4d9f013"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "stored_files",
+        sa.Column("path", sa.String(length=200), nullable=False),
+        sa.Column("size", sa.Integer(), nullable=True),
+        sa.Column("ref_count", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column(
+            "created_at",
+            sa.DateTime(),
+            server_default=sa.text("(CURRENT_TIMESTAMP)"),
+            nullable=True,
+        ),
+        sa.PrimaryKeyConstraint("path"),
+    )
+
+
+def downgrade():
+    op.drop_table("stored_files")
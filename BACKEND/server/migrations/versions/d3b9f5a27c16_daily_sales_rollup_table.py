@@ -0,0 +1,44 @@
+"""daily_sales_rollup table for analytics, dashboard and reports
+
+Revision ID: d3b9f5a27c16
+Revises: c4a8e1f7b962
+Create Date: 2026-10-18
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "d3b9f5a27c16"
+down_revision = "c4a8e1f7b962"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "daily_sales_rollup",
+        sa.Column("sale_date", sa.Date(), nullable=False),
+        sa.Column("category_id", sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column("product_id", sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column("order_status", sa.String(length=20), nullable=False),
+        sa.Column("order_count", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("units_sold", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("revenue", sa.Float(), nullable=False, server_default="0"),
+        sa.Column(
+            "last_updated",
+            sa.DateTime(),
+            server_default=sa.text("(CURRENT_TIMESTAMP)"),
+            nullable=True,
+        ),
+        sa.PrimaryKeyConstraint("sale_date", "category_id", "product_id", "order_status"),
+    )
+    op.create_index(
+        "ix_daily_sales_rollup_product",
+        "daily_sales_rollup",
+        ["product_id", "sale_date"],
+    )
+
+
+def downgrade():
+    op.drop_index("ix_daily_sales_rollup_product", table_name="daily_sales_rollup")
+    op.drop_table("daily_sales_rollup")
@@ -0,0 +1,91 @@
+"""cart item prices and cart totals as integer minor units
+
+Revision ID: d4b8e1f6a359
+Revises: c2f6a9e4b187
+Create Date: 2026-10-18
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "d4b8e1f6a359"
+down_revision = "c2f6a9e4b187"
+branch_labels = None
+depends_on = None
+
+cart_items = sa.table(
+    "cart_items",
+    sa.column("cart_item_id", sa.Integer),
+    sa.column("shopping_cart_id", sa.Integer),
+    sa.column("price", sa.String),
+    sa.column("price_cents", sa.Integer),
+    sa.column("quantity", sa.Integer),
+)
+shopping_carts = sa.table(
+    "shopping_carts",
+    sa.column("shopping_cart_id", sa.Integer),
+    sa.column("shopping_quantity", sa.Integer),
+    sa.column("total_price", sa.String),
+    sa.column("total_cents", sa.Integer),
+)
+
+
+def upgrade():
+    with op.batch_alter_table("cart_items", schema=None) as batch_op:
+        batch_op.add_column(sa.Column("price_cents", sa.Integer(), nullable=True))
+    with op.batch_alter_table("shopping_carts", schema=None) as batch_op:
+        batch_op.add_column(sa.Column("total_cents", sa.Integer(), nullable=False, server_default="0"))
+
+    op.execute(
+        cart_items.update().values(
+            price_cents=sa.cast(sa.func.round(sa.cast(cart_items.c.price, sa.Float) * 100), sa.Integer)
+        )
+    )
+    # Totals are recomputed from the items rather than parsed from the old strings
+    items_of_cart = cart_items.c.shopping_cart_id == shopping_carts.c.shopping_cart_id
+    op.execute(
+        shopping_carts.update().values(
+            total_cents=sa.func.coalesce(
+                sa.select(sa.func.sum(cart_items.c.price_cents * cart_items.c.quantity))
+                .where(items_of_cart).scalar_subquery(),
+                0,
+            ),
+            shopping_quantity=sa.func.coalesce(
+                sa.select(sa.func.sum(cart_items.c.quantity)).where(items_of_cart).scalar_subquery(),
+                0,
+            ),
+        )
+    )
+
+    with op.batch_alter_table("cart_items", schema=None) as batch_op:
+        batch_op.alter_column("price_cents", existing_type=sa.Integer(), nullable=False)
+        batch_op.drop_column("price")
+    with op.batch_alter_table("shopping_carts", schema=None) as batch_op:
+        batch_op.drop_column("total_price")
+
+
+def downgrade():
+    with op.batch_alter_table("cart_items", schema=None) as batch_op:
+        batch_op.add_column(sa.Column("price", sa.String(length=100), nullable=True))
+    with op.batch_alter_table("shopping_carts", schema=None) as batch_op:
+        batch_op.add_column(sa.Column("total_price", sa.String(length=100), nullable=True))
+
+    # Formatted here rather than in SQL, which has no portable "%.2f"
+    connection = op.get_bind()
+    for table, key, cents, text in (
+        (cart_items, cart_items.c.cart_item_id, cart_items.c.price_cents, "price"),
+        (shopping_carts, shopping_carts.c.shopping_cart_id, shopping_carts.c.total_cents, "total_price"),
+    ):
+        rows = connection.execute(sa.select(key, cents)).all()
+        if rows:
+            connection.execute(
+                table.update().where(key == sa.bindparam("row_key")).values({text: sa.bindparam("formatted")}),
+                [{"row_key": row_key, "formatted": f"{(value or 0) / 100:.2f}"} for row_key, value in rows],
+            )
+
+    with op.batch_alter_table("cart_items", schema=None) as batch_op:
+        batch_op.alter_column("price", existing_type=sa.String(length=100), nullable=False)
+        batch_op.drop_column("price_cents")
+    with op.batch_alter_table("shopping_carts", schema=None) as batch_op:
+        batch_op.alter_column("total_price", existing_type=sa.String(length=100), nullable=False)
+        batch_op.drop_column("total_cents")
@@ -0,0 +1,51 @@
+"""customer_metrics table for customer value segmentation
+
+Revision ID: e6a2d8c4b590
+Revises: d3b9f5a27c16
+Create Date: 2026-10-18
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "e6a2d8c4b590"
+down_revision = "d3b9f5a27c16"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "customer_metrics",
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("order_count", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("delivered_count", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("lifetime_value", sa.Float(), nullable=False, server_default="0"),
+        sa.Column("first_order_date", sa.DateTime(), nullable=True),
+        sa.Column("last_order_date", sa.DateTime(), nullable=True),
+        sa.Column("segment", sa.String(length=20), nullable=True),
+        sa.Column(
+            "updated_at",
+            sa.DateTime(),
+            server_default=sa.text("(CURRENT_TIMESTAMP)"),
+            nullable=True,
+        ),
+        sa.ForeignKeyConstraint(["user_id"], ["users.id"]),
+        sa.PrimaryKeyConstraint("user_id"),
+    )
+    op.create_index(
+        "ix_customer_metrics_lifetime_value",
+        "customer_metrics",
+        ["lifetime_value"],
+    )
+    op.create_index(
+        "ix_customer_metrics_last_order_date",
+        "customer_metrics",
+        ["last_order_date"],
+    )
+
+
+def downgrade():
+    op.drop_index("ix_customer_metrics_last_order_date", table_name="customer_metrics")
+    op.drop_index("ix_customer_metrics_lifetime_value", table_name="customer_metrics")
+    op.drop_table("customer_metrics")
@@ -0,0 +1,24 @@
+"""response headers stored with idempotency keys, restored on replay
+
+Revision ID: e7c3a9f1d264
+Revises: d4b8e1f6a359
+Create Date: 2026-10-18
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "e7c3a9f1d264"
+down_revision = "d4b8e1f6a359"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("idempotency_keys", schema=None) as batch_op:
+        batch_op.add_column(sa.Column("response_headers", sa.JSON(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table("idempotency_keys", schema=None) as batch_op:
+        batch_op.drop_column("response_headers")
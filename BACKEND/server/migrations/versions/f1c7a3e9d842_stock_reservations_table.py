@@ -0,0 +1,51 @@
+"""stock_reservations table for stock held by pending payments
+
+Revision ID: f1c7a3e9d842
+Revises: e6a2d8c4b590
+Create Date: 2026-10-18
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "f1c7a3e9d842"
+down_revision = "e6a2d8c4b590"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "stock_reservations",
+        sa.Column("reservation_id", sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column("order_id", sa.Integer(), nullable=False),
+        sa.Column("product_id", sa.Integer(), nullable=False),
+        sa.Column("quantity", sa.Integer(), nullable=False),
+        sa.Column("status", sa.String(length=20), nullable=False, server_default="held"),
+        sa.Column("expires_at", sa.DateTime(), nullable=False),
+        sa.Column(
+            "created_at",
+            sa.DateTime(),
+            server_default=sa.text("(CURRENT_TIMESTAMP)"),
+            nullable=True,
+        ),
+        sa.ForeignKeyConstraint(["order_id"], ["orders.order_id"]),
+        sa.ForeignKeyConstraint(["product_id"], ["products.product_id"]),
+        sa.PrimaryKeyConstraint("reservation_id"),
+    )
+    op.create_index(
+        "ix_stock_reservations_status_expires_at",
+        "stock_reservations",
+        ["status", "expires_at"],
+    )
+    op.create_index(
+        "ix_stock_reservations_order_id",
+        "stock_reservations",
+        ["order_id"],
+    )
+
+
+def downgrade():
+    op.drop_index("ix_stock_reservations_order_id", table_name="stock_reservations")
+    op.drop_index("ix_stock_reservations_status_expires_at", table_name="stock_reservations")
+    op.drop_table("stock_reservations")
@@ -0,0 +1,37 @@
+"""product_sales_stats rows go with their product
+
+Revision ID: f2a8c6d1e375
+Revises: e7c3a9f1d264
+Create Date: 2026-10-18
+
+"""
+from alembic import op
+
+revision = "f2a8c6d1e375"
+down_revision = "e7c3a9f1d264"
+branch_labels = None
+depends_on = None
+
+# The original constraint was created unnamed; SQLite batch mode names it on reflection
+NAMING_CONVENTION = {"fk": "fk_%(table_name)s_%(column_0_name)s_%(referred_table_name)s"}
+SQLITE_FK_NAME = "fk_product_sales_stats_product_id_products"
+POSTGRES_FK_NAME = "product_sales_stats_product_id_fkey"
+
+
+def _replace_foreign_key(ondelete):
+    sqlite = op.get_bind().dialect.name == "sqlite"
+    with op.batch_alter_table("product_sales_stats", schema=None,
+                              naming_convention=NAMING_CONVENTION if sqlite else None) as batch_op:
+        batch_op.drop_constraint(SQLITE_FK_NAME if sqlite else POSTGRES_FK_NAME, type_="foreignkey")
+        batch_op.create_foreign_key(
+            SQLITE_FK_NAME if sqlite else POSTGRES_FK_NAME,
+            "products", ["product_id"], ["product_id"], ondelete=ondelete
+        )
+
+
+def upgrade():
+    _replace_foreign_key("CASCADE")
+
+
+def downgrade():
+    _replace_foreign_key(None)
@@ -103,6 +103,27 @@ class User(db.Model):
         return f'<User {self.username}>'
 
 
+class CustomerMetrics(db.Model):
+    """Per-customer order totals and value segment, kept up to date as orders are written"""
+    __tablename__ = 'customer_metrics'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    order_count = db.Column(db.Integer, default=0, nullable=False)
+    delivered_count = db.Column(db.Integer, default=0, nullable=False)
+    lifetime_value = db.Column(db.Float, default=0.0, nullable=False)  # total of delivered orders
+    first_order_date = db.Column(db.DateTime)
+    last_order_date = db.Column(db.DateTime)
+    segment = db.Column(db.String(20))
+    updated_at = db.Column(db.DateTime, server_default=db.func.current_timestamp())
+
+    user = db.relationship('User')
+
+    __table_args__ = (
+        db.Index('ix_customer_metrics_lifetime_value', 'lifetime_value'),
+        db.Index('ix_customer_metrics_last_order_date', 'last_order_date'),
+    )
+
+
 class Settings(db.Model):
     __tablename__ = 'settings'
 
@@ -206,6 +227,25 @@ class Product(db.Model):
     )
 
 
+class ProductSalesStats(db.Model):
+    """Precomputed per-product sales and rating totals used for the best-seller ranking"""
+    __tablename__ = 'product_sales_stats'
+
+    product_id = db.Column(db.Integer, db.ForeignKey('products.product_id', ondelete='CASCADE'), primary_key=True)
+    units_sold = db.Column(db.Integer, default=0, nullable=False)
+    order_count = db.Column(db.Integer, default=0, nullable=False)
+    rating_sum = db.Column(db.Integer, default=0, nullable=False)
+    rating_count = db.Column(db.Integer, default=0, nullable=False)
+    avg_rating = db.Column(db.Float, default=0.0, nullable=False)
+    last_updated = db.Column(db.DateTime, server_default=db.func.current_timestamp())
+
+    product = db.relationship('Product')
+
+    __table_args__ = (
+        db.Index('ix_product_sales_stats_ranking', 'order_count', 'avg_rating'),
+    )
+
+
 #####################################################################################################################################################################################
 
 class Order(db.Model):
@@ -261,6 +301,55 @@ class OrderItem(db.Model):
     
 
 
+class StockReservation(db.Model):
+    """
+    Stock held for an order awaiting payment (M-Pesa STK push).
+
+    The units are already taken off products.stock_quantity; a held
+    reservation that expires before the payment completes is released back
+    into stock (see utils.inventory).
+    """
+    __tablename__ = 'stock_reservations'
+
+    reservation_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    order_id = db.Column(db.Integer, db.ForeignKey('orders.order_id'), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.product_id'), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(20), default='held', nullable=False)  # held, committed, released
+    expires_at = db.Column(db.DateTime, nullable=False)
+    created_at = db.Column(db.DateTime, server_default=db.func.current_timestamp())
+
+    __table_args__ = (
+        db.Index('ix_stock_reservations_status_expires_at', 'status', 'expires_at'),
+        db.Index('ix_stock_reservations_order_id', 'order_id'),
+    )
+
+
+class DailySalesRollup(db.Model):
+    """
+    Pre-aggregated sales per day, category, product and order status.
+
+    Rows with product_id 0 hold whole-order totals (order count and
+    total_amount), spread over shards kept in category_id; the other rows
+    hold order-item totals for one product (category_id 0 when the product
+    has no category).
+    """
+    __tablename__ = 'daily_sales_rollup'
+
+    sale_date = db.Column(db.Date, primary_key=True)
+    category_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    product_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    order_status = db.Column(db.String(20), primary_key=True)
+    order_count = db.Column(db.Integer, default=0, nullable=False)
+    units_sold = db.Column(db.Integer, default=0, nullable=False)
+    revenue = db.Column(db.Float, default=0.0, nullable=False)
+    last_updated = db.Column(db.DateTime, server_default=db.func.current_timestamp())
+
+    __table_args__ = (
+        db.Index('ix_daily_sales_rollup_product', 'product_id', 'sale_date'),
+    )
+
+
 ################################################################################################################################################################################################
 
 
@@ -364,7 +453,8 @@ class ShoppingCart(db.Model):
 
     shopping_cart_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     shopping_quantity = db.Column(db.Integer, default=1)
-    total_price = db.Column(db.String(100), nullable=False)
+    # Sum of price_cents * quantity over the cart's items, kept up to date by delta updates (utils/cart.py)
+    total_cents = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     created_at = db.Column(db.DateTime, server_default=db.func.current_timestamp())
     updated_at = db.Column(db.DateTime, server_default=db.func.current_timestamp(), onupdate=db.func.current_timestamp())
 
@@ -382,7 +472,7 @@ class ShoppingCart(db.Model):
 class CartItem(db.Model):
     __tablename__ = 'cart_items'
     cart_item_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    price = db.Column(db.String(100), nullable=False)
+    price_cents = db.Column(db.Integer, nullable=False)  # Unit price in minor units, fixed when the item is added
     quantity = db.Column(db.Integer, default=1)
     added_at = db.Column(db.DateTime, server_default=db.func.current_timestamp())
 
@@ -475,6 +565,8 @@ class ProductImage(db.Model):
     image_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     image_url = db.Column(db.String(200), nullable=False)
     is_primary = db.Column(db.Boolean, default=False)
+    # Resized copies keyed by size, e.g. {"card": {"width": 480, "webp": "uploads/variants/...", "jpeg": "..."}}
+    variants = db.Column(db.JSON)
     created_at = db.Column(db.DateTime, server_default=db.func.current_timestamp())
     updated_at = db.Column(db.DateTime, server_default=db.func.current_timestamp(), onupdate=db.func.current_timestamp())
 
@@ -721,4 +813,114 @@ class Supplier(db.Model):
     products = db.relationship('Product', back_populates='supplier', lazy='dynamic')
 
     def __repr__(self):
-        return f'<Supplier {self.name}>'
\ No newline at end of file
+        return f'<Supplier {self.name}>'
+
+###############################################################################################################################################################################################################
+class ContentVersion(db.Model):
+    """Version counters for cacheable content scopes (products, product:<id>, category:<id>, blog, ...), used for ETags"""
+    __tablename__ = 'content_versions'
+
+    scope = db.Column(db.String(100), primary_key=True)
+    version = db.Column(db.Integer, default=0, nullable=False)
+    updated_at = db.Column(db.DateTime, server_default=db.func.current_timestamp(), onupdate=db.func.current_timestamp())
+
+
+###############################################################################################################################################################################################################
+class StoredFile(db.Model):
+    """Content-addressed upload blob and the number of image rows that reference it"""
+    __tablename__ = 'stored_files'
+
+    path = db.Column(db.String(200), primary_key=True)  # e.g. uploads/ab/cd/<sha256>.jpg
+    size = db.Column(db.Integer)
+    ref_count = db.Column(db.Integer, default=0, nullable=False)
+    created_at = db.Column(db.DateTime, server_default=db.func.current_timestamp())
+
+
+###############################################################################################################################################################################################################
+class IdempotencyKey(db.Model):
+    """Stored outcome of a request sent with an Idempotency-Key header, replayed when the client retries"""
+    __tablename__ = 'idempotency_keys'
+
+    scope = db.Column(db.String(50), primary_key=True)  # endpoint, e.g. 'checkout'
+    subject = db.Column(db.String(100), primary_key=True)  # JWT identity of the caller
+    key = db.Column(db.String(255), primary_key=True)
+    request_hash = db.Column(db.String(64), nullable=False)  # sha256 of the request body
+    status = db.Column(db.String(20), default='processing', nullable=False)  # processing, completed
+    response_status = db.Column(db.Integer)
+    response_body = db.Column(db.Text)
+    response_headers = db.Column(db.JSON)  # [[name, value], ...] of the headers replayed with the body
+    created_at = db.Column(db.DateTime, server_default=db.func.current_timestamp())
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_idempotency_keys_expires_at', 'expires_at'),
+    )
+
+
+###############################################################################################################################################################################################################
+class MpesaCallback(db.Model):
+    """
+    Raw STK push callback from Safaricom, stored as received and acknowledged
+    at once; inbox workers apply it to its payment later (see utils.mpesa_inbox).
+    """
+    __tablename__ = 'mpesa_callbacks'
+
+    callback_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    checkout_request_id = db.Column(db.String(100))
+    merchant_request_id = db.Column(db.String(100))
+    result_code = db.Column(db.String(10))
+    payload = db.Column(db.JSON, nullable=False)
+    status = db.Column(db.String(20), default='received', nullable=False)  # received, processing, processed, duplicate, failed
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    error = db.Column(db.String(255))
+    received_at = db.Column(db.DateTime, server_default=db.func.current_timestamp())
+    claimed_at = db.Column(db.DateTime)
+    processed_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_mpesa_callbacks_status_callback_id', 'status', 'callback_id'),
+        db.Index('ix_mpesa_callbacks_checkout_request_id', 'checkout_request_id'),
+    )
+
+
+###############################################################################################################################################################################################################
+class PaymentEvent(db.Model):
+    """Payment status change relayed between app processes by the database event broker (see utils.payment_events)"""
+    __tablename__ = 'payment_events'
+
+    event_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    channel = db.Column(db.String(120), nullable=False)  # payment:<transaction_id>
+    data = db.Column(db.Text, nullable=False)  # JSON message
+    created_at = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_payment_events_created_at', 'created_at'),
+    )
+
+
+###############################################################################################################################################################################################################
+class StripeEvent(db.Model):
+    """
+    Stripe webhook event, stored once per Stripe event id (redeliveries are
+    acknowledged without storing) and applied by the event workers (see
+    utils.stripe_events).
+    """
+    __tablename__ = 'stripe_events'
+
+    event_id = db.Column(db.String(255), primary_key=True)  # evt_...
+    event_type = db.Column(db.String(100), nullable=False)  # e.g. payment_intent.succeeded
+    object_id = db.Column(db.String(255))  # pi_... the event is about
+    order_id = db.Column(db.Integer)  # from the payment intent's metadata
+    created = db.Column(db.Integer, nullable=False)  # Stripe's event timestamp (epoch seconds)
+    payload = db.Column(db.JSON, nullable=False)
+    status = db.Column(db.String(20), default='received', nullable=False)  # received, processing, processed, superseded, ignored, failed
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    error = db.Column(db.String(255))
+    received_at = db.Column(db.DateTime, server_default=db.func.current_timestamp())
+    claimed_at = db.Column(db.DateTime)
+    processed_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_stripe_events_status_created', 'status', 'created'),
+        db.Index('ix_stripe_events_object_id', 'object_id'),
+    )
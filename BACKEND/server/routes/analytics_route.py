@@ -6,13 +6,17 @@ Provides comprehensive analytics data for charts and graphs
 
 from flask import Blueprint, jsonify, request
 from flask_jwt_extended import jwt_required, get_jwt_identity, verify_jwt_in_request
-from models import db, Order, OrderItem, Product, User, Payment, Category
+from models import db, Order, OrderItem, Product, User, Payment, Category, OrderStatus
+from utils.sales_rollup import period_totals_split, daily_totals, status_totals, category_totals, product_totals
+from utils.customer_metrics import segment_counts
 from sqlalchemy import func, desc, and_, extract
 from datetime import datetime, timedelta
 import calendar
 
 analytics_bp = Blueprint('analytics', __name__)
 
+DELIVERED = [OrderStatus.DELIVERED]
+
 def _extract_user_id(identity):
     """Extract user ID from JWT identity"""
     if identity is None:
@@ -54,16 +58,9 @@ def get_dashboard_analytics():
         start_date = end_date - timedelta(days=days)
         
         # Basic counts
-        total_orders = Order.query.filter(
-            Order.order_date >= start_date
-        ).count()
-        
-        total_revenue = db.session.query(
-            func.sum(Order.total_amount)
-        ).filter(
-            Order.order_date >= start_date,
-            Order.order_status == 'delivered'
-        ).scalar() or 0
+        everything, delivered = period_totals_split(start_date, statuses=DELIVERED)
+        total_orders = everything.orders
+        total_revenue = delivered.revenue
         
         total_customers = User.query.filter(
             User.is_admin == False
@@ -72,110 +69,36 @@ def get_dashboard_analytics():
         total_products = Product.query.count()
         
         # Sales trend data
-        sales_trend = db.session.query(
-            func.date(Order.order_date).label('date'),
-            func.count(Order.order_id).label('orders'),
-            func.sum(Order.total_amount).label('revenue')
-        ).filter(
-            Order.order_date >= start_date
-        ).group_by(
-            func.date(Order.order_date)
-        ).order_by(
-            func.date(Order.order_date)
-        ).all()
-        
         sales_data = []
-        for item in sales_trend:
-            # Handle both string and datetime objects
-            if hasattr(item.date, 'strftime'):
-                date_str = item.date.strftime('%Y-%m-%d')
-            else:
-                date_str = str(item.date)
-            
+        for item in daily_totals(start_date):
             sales_data.append({
-                'date': date_str,
+                'date': _format_date(item.date),
                 'orders': item.orders,
                 'revenue': float(item.revenue or 0)
             })
         
         # Top selling products
-        top_products = db.session.query(
-            Product.product_id,
-            Product.product_name,
-            Product.product_price,
-            func.sum(OrderItem.quantity).label('total_sold'),
-            func.sum(OrderItem.quantity * func.cast(OrderItem.price, db.Float)).label('total_revenue')
-        ).select_from(Product).join(OrderItem, Product.product_id == OrderItem.product_id).join(Order, OrderItem.order_id == Order.order_id).filter(
-            Order.order_date >= start_date,
-            Order.order_status == 'delivered'
-        ).group_by(Product.product_id).order_by(
-            desc(func.sum(OrderItem.quantity))
-        ).limit(10).all()
-        
         top_products_data = []
-        for product in top_products:
+        for product in product_totals(start_date, statuses=DELIVERED, limit=10):
             top_products_data.append({
                 'id': product.product_id,
                 'name': product.product_name,
                 'price': float(product.product_price),
-                'total_sold': int(product.total_sold),
-                'total_revenue': float(product.total_revenue or 0)
+                'total_sold': int(product.units),
+                'total_revenue': float(product.revenue or 0)
             })
         
         # Category performance
-        category_performance = db.session.query(
-            Category.category_name,
-            func.count(Order.order_id).label('orders'),
-            func.sum(Order.total_amount).label('revenue')
-        ).select_from(Category).join(Product, Category.category_id == Product.category_id).join(OrderItem, Product.product_id == OrderItem.product_id).join(Order, OrderItem.order_id == Order.order_id).filter(
-            Order.order_date >= start_date,
-            Order.order_status == 'delivered'
-        ).group_by(Category.category_id).order_by(
-            desc(func.sum(Order.total_amount))
-        ).all()
-        
         category_data = []
-        for category in category_performance:
+        for category in category_totals(start_date, statuses=DELIVERED):
             category_data.append({
                 'name': category.category_name,
                 'orders': category.orders,
                 'revenue': float(category.revenue or 0)
             })
         
-        # Customer segments - simplified approach without complex case statements
-        high_value_customers = db.session.query(
-            func.count(User.id).label('count')
-        ).join(Order).filter(
-            Order.order_date >= start_date,
-            Order.order_status == 'delivered'
-        ).group_by(User.id).having(
-            func.sum(Order.total_amount) >= 1000
-        ).count()
-        
-        medium_value_customers = db.session.query(
-            func.count(User.id).label('count')
-        ).join(Order).filter(
-            Order.order_date >= start_date,
-            Order.order_status == 'delivered'
-        ).group_by(User.id).having(
-            func.sum(Order.total_amount) >= 500,
-            func.sum(Order.total_amount) < 1000
-        ).count()
-        
-        low_value_customers = db.session.query(
-            func.count(User.id).label('count')
-        ).join(Order).filter(
-            Order.order_date >= start_date,
-            Order.order_status == 'delivered'
-        ).group_by(User.id).having(
-            func.sum(Order.total_amount) < 500
-        ).count()
-        
-        segment_data = [
-            {'segment': 'High Value', 'count': high_value_customers},
-            {'segment': 'Medium Value', 'count': medium_value_customers},
-            {'segment': 'Low Value', 'count': low_value_customers}
-        ]
+        # Customer segments by lifetime value, among customers who ordered in the period
+        segment_data = segment_counts(active_since=start_date)
         
         return jsonify({
             'success': True,
@@ -213,47 +136,26 @@ def get_sales_analytics():
         end_date = datetime.now()
         start_date = end_date - timedelta(days=days)
         
+        delivered_daily = daily_totals(start_date, statuses=DELIVERED)
+        
         # Monthly sales breakdown
-        monthly_sales = db.session.query(
-            extract('year', Order.order_date).label('year'),
-            extract('month', Order.order_date).label('month'),
-            func.sum(Order.total_amount).label('revenue'),
-            func.count(Order.order_id).label('orders')
-        ).filter(
-            Order.order_date >= start_date,
-            Order.order_status == 'delivered'
-        ).group_by(
-            extract('year', Order.order_date),
-            extract('month', Order.order_date)
-        ).order_by(
-            extract('year', Order.order_date),
-            extract('month', Order.order_date)
-        ).all()
+        monthly = {}
+        for item in delivered_daily:
+            month = monthly.setdefault((item.date.year, item.date.month), {'revenue': 0.0, 'orders': 0})
+            month['revenue'] += float(item.revenue or 0)
+            month['orders'] += item.orders
         
         monthly_data = []
-        for item in monthly_sales:
-            month_name = calendar.month_name[int(item.month)]
+        for (year, month), totals in sorted(monthly.items()):
             monthly_data.append({
-                'month': month_name,
-                'revenue': float(item.revenue or 0),
-                'orders': item.orders
+                'month': calendar.month_name[month],
+                'revenue': totals['revenue'],
+                'orders': totals['orders']
             })
         
         # Daily sales for the last 30 days
-        daily_sales = db.session.query(
-            func.date(Order.order_date).label('date'),
-            func.sum(Order.total_amount).label('revenue'),
-            func.count(Order.order_id).label('orders')
-        ).filter(
-            Order.order_date >= start_date
-        ).group_by(
-            func.date(Order.order_date)
-        ).order_by(
-            func.date(Order.order_date)
-        ).all()
-        
         daily_data = []
-        for item in daily_sales:
+        for item in daily_totals(start_date):
             daily_data.append({
                 'date': _format_date(item.date),
                 'revenue': float(item.revenue or 0),
@@ -261,40 +163,20 @@ def get_sales_analytics():
             })
         
         # Sales by status
-        status_sales = db.session.query(
-            Order.order_status,
-            func.count(Order.order_id).label('count'),
-            func.sum(Order.total_amount).label('revenue')
-        ).filter(
-            Order.order_date >= start_date
-        ).group_by(Order.order_status).all()
-        
         status_data = []
-        for item in status_sales:
+        for status, count, revenue in status_totals(start_date):
             status_data.append({
-                'status': str(item.order_status),
-                'count': item.count,
-                'revenue': float(item.revenue or 0)
+                'status': str(status),
+                'count': count,
+                'revenue': float(revenue or 0)
             })
         
         # Average order value trend
-        aov_trend = db.session.query(
-            func.date(Order.order_date).label('date'),
-            func.avg(Order.total_amount).label('avg_order_value')
-        ).filter(
-            Order.order_date >= start_date,
-            Order.order_status == 'delivered'
-        ).group_by(
-            func.date(Order.order_date)
-        ).order_by(
-            func.date(Order.order_date)
-        ).all()
-        
         aov_data = []
-        for item in aov_trend:
+        for item in delivered_daily:
             aov_data.append({
                 'date': _format_date(item.date),
-                'avg_order_value': float(item.avg_order_value or 0)
+                'avg_order_value': float(item.revenue or 0) / item.orders if item.orders else 0
             })
         
         return jsonify({
@@ -355,7 +237,7 @@ def get_customer_analytics():
             func.avg(Order.total_amount).label('avg_order_value')
         ).join(Order).filter(
             Order.order_date >= start_date,
-            Order.order_status == 'delivered'
+            Order.order_status == OrderStatus.DELIVERED
         ).group_by(User.id).order_by(
             desc(func.sum(Order.total_amount))
         ).limit(20).all()
@@ -375,7 +257,7 @@ def get_customer_analytics():
             func.count(User.id).label('repeat_customers')
         ).select_from(User).join(Order).filter(
             Order.order_date >= start_date,
-            Order.order_status == 'delivered'
+            Order.order_status == OrderStatus.DELIVERED
         ).group_by(User.id).having(
             func.count(Order.order_id) > 1
         ).count()
@@ -384,7 +266,7 @@ def get_customer_analytics():
             func.count(User.id)
         ).select_from(User).join(Order).filter(
             Order.order_date >= start_date,
-            Order.order_status == 'delivered'
+            Order.order_status == OrderStatus.DELIVERED
         ).count()
         
         repeat_rate = (repeat_customers / total_customers * 100) if total_customers > 0 else 0
@@ -418,74 +300,38 @@ def get_product_analytics():
         start_date = end_date - timedelta(days=days)
         
         # Product performance by category
-        category_performance = db.session.query(
-            Category.category_name,
-            func.count(Product.product_id).label('product_count'),
-            func.sum(OrderItem.quantity).label('units_sold'),
-            func.sum(OrderItem.quantity * func.cast(OrderItem.price, db.Float)).label('revenue')
-        ).select_from(Category).join(Product, Category.category_id == Product.category_id).join(OrderItem, Product.product_id == OrderItem.product_id).join(Order, OrderItem.order_id == Order.order_id).filter(
-            Order.order_date >= start_date,
-            Order.order_status == 'delivered'
-        ).group_by(Category.category_id).order_by(
-            desc(func.sum(OrderItem.quantity * func.cast(OrderItem.price, db.Float)))
-        ).all()
-        
         category_data = []
-        for category in category_performance:
+        for category in category_totals(start_date, statuses=DELIVERED):
             category_data.append({
-                'name': category.name,
+                'name': category.category_name,
                 'product_count': category.product_count,
-                'units_sold': int(category.units_sold or 0),
+                'units_sold': int(category.units or 0),
                 'revenue': float(category.revenue or 0)
             })
         
         # Top performing products
-        top_products = db.session.query(
-            Product.product_id,
-            Product.product_name,
-            Product.product_price,
-            Product.category_id,
-            func.sum(OrderItem.quantity).label('units_sold'),
-            func.sum(OrderItem.quantity * func.cast(OrderItem.price, db.Float)).label('revenue')
-        ).select_from(Product).join(OrderItem, Product.product_id == OrderItem.product_id).join(Order, OrderItem.order_id == Order.order_id).filter(
-            Order.order_date >= start_date,
-            Order.order_status == 'delivered'
-        ).group_by(Product.product_id).order_by(
-            desc(func.sum(OrderItem.quantity * func.cast(OrderItem.price, db.Float)))
-        ).limit(15).all()
-        
         product_data = []
-        for product in top_products:
+        for product in product_totals(start_date, statuses=DELIVERED, order_by='revenue', limit=15):
             product_data.append({
                 'id': product.product_id,
                 'name': product.product_name,
                 'price': float(product.product_price),
                 'category_id': product.category_id,
-                'units_sold': int(product.units_sold or 0),
+                'units_sold': int(product.units or 0),
                 'revenue': float(product.revenue or 0)
             })
         
         # Inventory turnover
-        inventory_turnover = db.session.query(
-            Product.product_id,
-            Product.product_name,
-            Product.stock_quantity,
-            func.sum(OrderItem.quantity).label('sold_quantity')
-        ).select_from(Product).join(OrderItem, Product.product_id == OrderItem.product_id).join(Order, OrderItem.order_id == Order.order_id).filter(
-            Order.order_date >= start_date,
-            Order.order_status == 'delivered'
-        ).group_by(Product.product_id).order_by(
-            desc(func.sum(OrderItem.quantity))
-        ).limit(20).all()
-        
         turnover_data = []
-        for product in inventory_turnover:
-            turnover_ratio = (product.sold_quantity / product.stock_quantity * 100) if product.stock_quantity > 0 else 0
+        for product in product_totals(start_date, statuses=DELIVERED, limit=20):
+            sold_quantity = int(product.units or 0)
+            stock_quantity = product.stock_quantity or 0
+            turnover_ratio = (sold_quantity / stock_quantity * 100) if stock_quantity > 0 else 0
             turnover_data.append({
                 'id': product.product_id,
                 'name': product.product_name,
                 'stock_quantity': product.stock_quantity,
-                'sold_quantity': int(product.sold_quantity or 0),
+                'sold_quantity': sold_quantity,
                 'turnover_ratio': round(turnover_ratio, 2)
             })
         
@@ -518,17 +364,7 @@ def get_financial_analytics():
         start_date = end_date - timedelta(days=days)
         
         # Revenue growth
-        revenue_growth = db.session.query(
-            func.date(Order.order_date).label('date'),
-            func.sum(Order.total_amount).label('revenue')
-        ).filter(
-            Order.order_date >= start_date,
-            Order.order_status == 'delivered'
-        ).group_by(
-            func.date(Order.order_date)
-        ).order_by(
-            func.date(Order.order_date)
-        ).all()
+        revenue_growth = daily_totals(start_date, statuses=DELIVERED)
         
         growth_data = []
         for item in revenue_growth:
@@ -564,7 +400,7 @@ def get_financial_analytics():
             func.sum(Payment.payment_amount).label('total_amount')
         ).join(Order).filter(
             Order.order_date >= start_date,
-            Order.order_status == 'delivered'
+            Order.order_status == OrderStatus.DELIVERED
         ).group_by(Payment.payment_status).all()
         
         payment_data = []
@@ -611,21 +447,10 @@ def get_real_time_analytics():
     try:
         # Today's stats
         today = datetime.now().date()
-        today_start = datetime.combine(today, datetime.min.time())
-        today_end = datetime.combine(today, datetime.max.time())
         
-        today_orders = Order.query.filter(
-            Order.order_date >= today_start,
-            Order.order_date <= today_end
-        ).count()
-        
-        today_revenue = db.session.query(
-            func.sum(Order.total_amount)
-        ).filter(
-            Order.order_date >= today_start,
-            Order.order_date <= today_end,
-            Order.order_status == 'delivered'
-        ).scalar() or 0
+        everything, delivered = period_totals_split(today, statuses=DELIVERED)
+        today_orders = everything.orders
+        today_revenue = delivered.revenue
         
         today_customers = User.query.filter(
             User.is_admin == False
@@ -633,20 +458,13 @@ def get_real_time_analytics():
         
         # Current month stats
         current_month = datetime.now().replace(day=1)
-        month_orders = Order.query.filter(
-            Order.order_date >= current_month
-        ).count()
-        
-        month_revenue = db.session.query(
-            func.sum(Order.total_amount)
-        ).filter(
-            Order.order_date >= current_month,
-            Order.order_status == 'delivered'
-        ).scalar() or 0
+        everything, delivered = period_totals_split(current_month, statuses=DELIVERED)
+        month_orders = everything.orders
+        month_revenue = delivered.revenue
         
         # Pending orders
         pending_orders = Order.query.filter(
-            Order.order_status == 'pending'
+            Order.order_status == OrderStatus.PENDING
         ).count()
         
         # Low stock products
@@ -1,8 +1,12 @@
 from flask import Blueprint, jsonify, request, url_for, current_app
 from models import BlogPost, BlogImage, db
 from sqlalchemy import desc, func
-from werkzeug.utils import secure_filename
-import os
+from utils.search import blog_match_subquery, blog_snippets
+from utils.pagination import keyset_paginate, order_by_keyset, InvalidCursor
+from utils.cache import cache
+from utils.etag import conditional
+from utils.storage import store_upload
+from utils.images import delete_image_file
 import re
 from datetime import datetime, timedelta
 
@@ -11,23 +15,13 @@ blog_bp = Blueprint('blogs', __name__)
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.',1)[1].lower() in current_app.config['ALLOWED_EXTENSIONS']
 
-def generate_unique_filename(filename, post_id):
-    """Generate a unique filename using the post ID."""
-    basename = secure_filename(filename.rsplit('.',1)[0])
-    extension = filename.rsplit('.',1)[1].lower()
-    return f"blog_{post_id}_{basename}.{extension}"
-
 def save_blog_media(file, post_id, file_type='post_image'):
-    """Save the uploaded image and return the relative path"""
+    """Save the uploaded image (content-addressed, deduplicated) and return the relative path"""
     if not file or not allowed_file(file.filename):
         return None
-    
-    filename = generate_unique_filename(file.filename, post_id)
-    file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
 
     try:
-        file.save(file_path)
-        return f"uploads/{filename}"
+        return store_upload(file)
     except Exception as e:
         current_app.logger.error(f"Error saving blog image: {str(e)}")
         return None
@@ -40,6 +34,7 @@ def create_slug(title):
 
 # Get all blog posts with pagination
 @blog_bp.route('/posts', methods=['GET'])
+@conditional(scopes=['blog'])
 def get_blog_posts():
     """Get all published blog posts with pagination"""
     try:
@@ -55,7 +50,12 @@ def get_blog_posts():
         if category:
             query = query.filter(BlogPost.category == category)
         
-        if search:
+        matches = blog_match_subquery(search) if search else None
+        if matches is not None:
+            # Full-text index match, best ranked first
+            query = query.join(matches, matches.c.match_id == BlogPost.id)\
+                .order_by(matches.c.match_rank.asc())
+        elif search:
             search_term = f"%{search}%"
             query = query.filter(
                 (BlogPost.title.ilike(search_term)) |
@@ -67,6 +67,7 @@ def get_blog_posts():
         posts = query.order_by(desc(BlogPost.date_posted)).paginate(
             page=page, per_page=per_page, error_out=False
         )
+        snippets = blog_snippets(search, [post.id for post in posts.items]) if search else {}
         
         result = []
         for post in posts.items:
@@ -90,6 +91,8 @@ def get_blog_posts():
                 'date_posted': post.date_posted.isoformat() if post.date_posted else None,
                 'read_time': len(post.content.split()) // 200 + 1  # Rough estimate
             }
+            if search:
+                post_data['search_snippet'] = snippets.get(post.id)
             result.append(post_data)
         
         return jsonify({
@@ -109,6 +112,7 @@ def get_blog_posts():
 
 # Get featured blog posts
 @blog_bp.route('/posts/featured', methods=['GET'])
+@cache.cached(tags=['blog'])
 def get_featured_posts():
     """Get featured blog posts"""
     try:
@@ -190,6 +194,7 @@ def get_blog_post(slug):
 
 # Get blog categories
 @blog_bp.route('/categories', methods=['GET'])
+@cache.cached(tags=['blog'])
 def get_blog_categories():
     """Get all blog categories with post counts"""
     try:
@@ -359,11 +364,8 @@ def delete_blog_post(post_id):
         # Delete associated images
         images = BlogImage.query.filter_by(blog_post_id=post_id).all()
         for img in images:
-            try:
-                if os.path.exists(os.path.join(current_app.config['UPLOAD_FOLDER'], img.image_url.replace('uploads/', ''))):
-                    os.remove(os.path.join(current_app.config['UPLOAD_FOLDER'], img.image_url.replace('uploads/', '')))
-            except Exception as e:
-                current_app.logger.error(f"Failed to delete image {img.image_url}: {str(e)}")
+            if not delete_image_file(img.image_url):
+                current_app.logger.error(f"Failed to delete image {img.image_url}")
         
         db.session.delete(post)
         db.session.commit()
@@ -432,18 +434,35 @@ def admin_get_all_blogs():
         else:
             order_col = BlogPost.date_posted
         
-        if sort_order == 'asc':
-            query = query.order_by(order_col.asc())
-        else:
-            query = query.order_by(order_col.desc())
+        descending = sort_order != 'asc'
         
-        # Paginate
-        posts = query.paginate(
-            page=page, per_page=per_page, error_out=False
-        )
+        if 'cursor' in request.args:
+            # Keyset pagination (opt-in): no OFFSET, total count optional
+            keyset_page = keyset_paginate(
+                query, order_col, BlogPost.id, descending,
+                cursor=request.args.get('cursor', ''),
+                per_page=per_page,
+                count=request.args.get('count', 'exact')
+            )
+            items = keyset_page.items
+            pagination_data = keyset_page.pagination()
+        else:
+            # Paginate
+            posts = order_by_keyset(query, order_col, BlogPost.id, descending).paginate(
+                page=page, per_page=per_page, error_out=False
+            )
+            items = posts.items
+            pagination_data = {
+                'page': page,
+                'per_page': per_page,
+                'total': posts.total,
+                'pages': posts.pages,
+                'has_next': posts.has_next,
+                'has_prev': posts.has_prev
+            }
         
         result = []
-        for post in posts.items:
+        for post in items:
             # Get primary image
             primary_image = BlogImage.query.filter_by(
                 blog_post_id=post.id, 
@@ -471,16 +490,11 @@ def admin_get_all_blogs():
         return jsonify({
             'success': True,
             'blogs': result,
-            'pagination': {
-                'page': page,
-                'per_page': per_page,
-                'total': posts.total,
-                'pages': posts.pages,
-                'has_next': posts.has_next,
-                'has_prev': posts.has_prev
-            }
+            'pagination': pagination_data
         }), 200
         
+    except InvalidCursor as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
         return jsonify({
             'success': False,
@@ -676,11 +690,8 @@ def admin_delete_blog(post_id):
         # Delete associated images
         images = BlogImage.query.filter_by(blog_post_id=post_id).all()
         for img in images:
-            try:
-                if os.path.exists(os.path.join(current_app.config['UPLOAD_FOLDER'], img.image_url.replace('uploads/', ''))):
-                    os.remove(os.path.join(current_app.config['UPLOAD_FOLDER'], img.image_url.replace('uploads/', '')))
-            except Exception as e:
-                current_app.logger.error(f"Failed to delete image {img.image_url}: {str(e)}")
+            if not delete_image_file(img.image_url):
+                current_app.logger.error(f"Failed to delete image {img.image_url}")
         
         db.session.delete(post)
         db.session.commit()
@@ -719,11 +730,8 @@ def admin_bulk_delete_blogs():
                 # Delete associated images
                 images = BlogImage.query.filter_by(blog_post_id=blog_id).all()
                 for img in images:
-                    try:
-                        if os.path.exists(os.path.join(current_app.config['UPLOAD_FOLDER'], img.image_url.replace('uploads/', ''))):
-                            os.remove(os.path.join(current_app.config['UPLOAD_FOLDER'], img.image_url.replace('uploads/', '')))
-                    except Exception as e:
-                        current_app.logger.error(f"Failed to delete image {img.image_url}: {str(e)}")
+                    if not delete_image_file(img.image_url):
+                        current_app.logger.error(f"Failed to delete image {img.image_url}")
                 
                 db.session.delete(post)
                 deleted_count += 1
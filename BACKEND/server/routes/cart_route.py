@@ -1,24 +1,16 @@
 from flask import Blueprint, request, jsonify
 from extensions import db
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from models import ShoppingCart, CartItem, Product, ProductImage
+from models import ShoppingCart, CartItem, Product
+from utils.image_variants import requested_size
+from utils.cart import (load_cart, cart_summary, lock_cart, adjust_cart_totals, to_cents, format_cents,
+                        parse_cart_changes, apply_cart_changes, CartChangeError)
+from utils.idempotency import idempotent
 
 
 #Blueprint Configuration
 cart_bp = Blueprint('cart', __name__)
 
-#########################################################################################################
-
-def update_cart_total(cart):
-    """Helper function to update cart total price"""
-    cart_items = CartItem.query.filter_by(shopping_cart_id=cart.shopping_cart_id).all()
-    total = sum(float(item.price) * item.quantity for item in cart_items)
-    cart.total_price = f"{total:.2f}"
-    cart.shopping_quantity = sum(item.quantity for item in cart_items)
-    cart.updated_at = db.func.current_timestamp()
-
-    db.session.commit()
-
 ####################################################################################################################
 
 
@@ -30,7 +22,8 @@ def get_cart():
     """Get the shopping cart for current user"""
     identity = get_jwt_identity()
     user_id = identity.get('id') if isinstance(identity, dict) else identity
-    cart = ShoppingCart.query.filter_by(user_id=user_id).first()
+    size, fmt = requested_size(request.args)
+    cart = load_cart(user_id, size, fmt)
 
     if not cart:
         response = jsonify({
@@ -46,46 +39,25 @@ def get_cart():
         response.headers.add('Access-Control-Allow-Origin', '*')
         return response, 200
     
-    cart_items = []
-    for item in cart.cart_items:
-        product = Product.query.get(item.product_id)
-        if not product:
-            continue
-            
-        primary_image = ProductImage.query.filter_by(
-            product_id=product.product_id,
-            is_primary=True
-        ).first()
-        
-        image_url = primary_image.image_url if primary_image else None
-        
-        cart_items.append({
-            'cart_item_id': item.cart_item_id,
-            'product_id': product.product_id,
-            'product_name': product.product_name,
-            'description': product.product_description,
-            'price': item.price,
-            'quantity': item.quantity,
-            'image_url': image_url,
-            'stock_available': product.stock_quantity,
-            'added_at': item.added_at.isoformat() if item.added_at else None,
-            'max_allowed': min(product.stock_quantity, 10)  # Example limit
-        })
-    
-    response = jsonify({
-        'shopping_cart_id': cart.shopping_cart_id,
-        'user_id': cart.user_id,
-        'total_price': cart.total_price,
-        'items_count': cart.shopping_quantity,
-        'created_at': cart.created_at.isoformat() if cart.created_at else None,
-        'updated_at': cart.updated_at.isoformat() if cart.updated_at else None,
-        'items': cart_items
-    })
+    response = jsonify(cart)
     response.headers.add('Access-Control-Allow-Origin', '*')
     return response, 200
     
 ####################################################################################################################################################
 
+@cart_bp.route('/summary', methods=['GET'])
+@jwt_required()
+def get_cart_summary():
+    """Item count and total of the current user's cart (for the cart badge), without the items"""
+    identity = get_jwt_identity()
+    user_id = identity.get('id') if isinstance(identity, dict) else identity
+
+    response = jsonify(cart_summary(user_id))
+    response.headers.add('Access-Control-Allow-Origin', '*')
+    return response, 200
+
+####################################################################################################################################################
+
 @cart_bp.route('/items', methods=['POST'])
 @jwt_required()
 def add_to_cart():
@@ -127,12 +99,12 @@ def add_to_cart():
             response.headers.add('Access-Control-Allow-Origin', '*')
             return response, 400
         
-        # Get or create cart
-        cart = ShoppingCart.query.filter_by(user_id=user_id).first()
+        # Get (and lock) or create cart
+        cart = lock_cart(user_id)
         if not cart:
             cart = ShoppingCart(
                 user_id=user_id,
-                total_price="0.00",
+                total_cents=0,
                 shopping_quantity=0
             )
             db.session.add(cart)
@@ -155,21 +127,24 @@ def add_to_cart():
                 response.headers.add('Access-Control-Allow-Origin', '*')
                 return response, 400
             existing_item.quantity = new_quantity
+            price_cents = existing_item.price_cents
         else:
+            price_cents = to_cents(product.product_price)
             new_item = CartItem(
                 shopping_cart_id=cart.shopping_cart_id,
                 product_id=product_id,
-                price=f"{product.product_price:.2f}",
+                price_cents=price_cents,
                 quantity=quantity
             )
             db.session.add(new_item)
         
-        update_cart_total(cart)
+        items_count, total_cents = adjust_cart_totals(cart, quantity, quantity * price_cents)
+        db.session.commit()
         
         response = jsonify({
             "message": "Item added to cart successfully",
-            "cart_total": cart.total_price,
-            "items_count": cart.shopping_quantity
+            "cart_total": format_cents(total_cents),
+            "items_count": items_count
         })
         response.headers.add('Access-Control-Allow-Origin', '*')
         return response, 201
@@ -182,6 +157,48 @@ def add_to_cart():
 
 ########################################################################################################################
 
+@cart_bp.route('/items', methods=['PATCH'])
+@jwt_required()
+@idempotent('cart_items_batch')
+def update_cart_items():
+    """
+    Add, set or remove several cart items in one transaction
+
+    Body: {"items": [{"product_id": 1, "quantity": 2, "mode": "add" | "set" | "remove"}, ...]}.
+    Either every change is applied or none is; with "merge": true, missing
+    products are skipped and quantities capped at the stock left instead.
+    """
+    identity = get_jwt_identity()
+    user_id = identity.get('id') if isinstance(identity, dict) else identity
+    data = request.get_json(silent=True) or {}
+
+    try:
+        changes = parse_cart_changes(data.get('items'))
+    except ValueError as e:
+        response = jsonify({"error": str(e)})
+        response.headers.add('Access-Control-Allow-Origin', '*')
+        return response, 400
+
+    try:
+        result = apply_cart_changes(user_id, changes, merge=bool(data.get('merge')))
+        db.session.commit()
+    except CartChangeError as e:
+        db.session.rollback()
+        response = jsonify({"error": str(e), "items": e.items})
+        response.headers.add('Access-Control-Allow-Origin', '*')
+        return response, 400
+    except Exception as e:
+        db.session.rollback()
+        response = jsonify({"error": "Internal server error"})
+        response.headers.add('Access-Control-Allow-Origin', '*')
+        return response, 500
+
+    response = jsonify({"message": "Cart updated successfully", **result})
+    response.headers.add('Access-Control-Allow-Origin', '*')
+    return response, 200
+
+########################################################################################################################
+
 @cart_bp.route('/items/<int:item_id>', methods=['PUT'])
 @jwt_required()
 def update_cart_item(item_id):
@@ -201,7 +218,7 @@ def update_cart_item(item_id):
     if quantity <= 0:
         return jsonify({"error": "Quantity must be at least 1"}), 400
     
-    cart = ShoppingCart.query.filter_by(user_id=user_id).first()
+    cart = lock_cart(user_id)
     if not cart:
         return jsonify({"error": "Shopping cart not found"}), 404
     
@@ -223,16 +240,18 @@ def update_cart_item(item_id):
             "stock_available": product.stock_quantity
         }), 400
     
+    quantity_delta = quantity - item.quantity
     item.quantity = quantity
     item.added_at = db.func.current_timestamp()
-    update_cart_total(cart)
+    price_cents = item.price_cents
+    _, total_cents = adjust_cart_totals(cart, quantity_delta, quantity_delta * price_cents)
     db.session.commit()
     
     return jsonify({
         "message": "Cart item updated successfully",
         "new_quantity": quantity,
-        "item_total": f"{float(item.price) * quantity:.2f}",
-        "cart_total": cart.total_price
+        "item_total": format_cents(price_cents * quantity),
+        "cart_total": format_cents(total_cents)
     }), 200
 
 ############################################################################################################################
@@ -246,7 +265,7 @@ def remove_from_cart(item_id):
     identity = get_jwt_identity()
     user_id = identity.get('id') if isinstance(identity, dict) else identity
 
-    cart = ShoppingCart.query.filter_by(user_id=user_id).first()
+    cart = lock_cart(user_id)
     if not cart:
         return jsonify({"error": "Shopping cart not found"}), 404
 
@@ -258,15 +277,15 @@ def remove_from_cart(item_id):
     if not item:
         return jsonify({"error": "Item not found in cart"}), 404
 
+    items_count, total_cents = adjust_cart_totals(cart, -item.quantity, -item.quantity * item.price_cents)
     db.session.delete(item)
-    update_cart_total(cart)
 
     db.session.commit()
 
     return jsonify({
         "message": "Item removed from cart successfully",
-        "cart_total": cart.total_price,
-        "items_count": cart.shopping_quantity
+        "cart_total": format_cents(total_cents),
+        "items_count": items_count
     }), 200
 
 #######################################################################################################################################
@@ -278,18 +297,19 @@ def clear_cart():
     identity = get_jwt_identity()
     user_id = identity.get('id') if isinstance(identity, dict) else identity
     
-    cart = ShoppingCart.query.filter_by(user_id=user_id).first()
+    cart = lock_cart(user_id)
     if not cart:
         return jsonify({"error": "Shopping cart not found"}), 404
     
     # More efficient than individual deletes
+    items_removed = cart.shopping_quantity
     CartItem.query.filter_by(shopping_cart_id=cart.shopping_cart_id).delete()
-    cart.total_price = "0.00"
+    cart.total_cents = 0
     cart.shopping_quantity = 0
     cart.updated_at = db.func.current_timestamp()
     db.session.commit()
     
     return jsonify({
         "message": "Cart cleared successfully",
-        "items_removed": cart.shopping_quantity
+        "items_removed": items_removed
     }), 200
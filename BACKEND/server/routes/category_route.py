@@ -4,11 +4,20 @@ from extensions import db
 from flask_jwt_extended import jwt_required
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy import func, case
+from sqlalchemy.orm import aliased
+from collections import defaultdict
 from datetime import datetime
+from utils.cache import cache
+from utils.serializers import load_product_relations, primary_image_of, image_url
+from utils.etag import conditional
 
 # Blueprint Configuration
 category_bp = Blueprint('categories', __name__)
 
+NAV_PREVIEW_PRODUCTS = 4
+MAX_NAV_PREVIEW_PRODUCTS = 12
+MAX_PRODUCTS_PER_PAGE = 50
+
 #####################################################################################################################################################################
 
 # --------------------------
@@ -123,29 +132,130 @@ def delete_category(category_id):
 ########################################################################################################################################
 # Get all categories
 @category_bp.route('', methods=['GET'])
+@cache.cached(tags=['categories', 'products'])
 def get_all_categories():
-    """Get all categories for navigation menu"""
+    """
+    Get all categories for the navigation menu.
+
+    By default each category carries its product count and a few preview
+    products (`preview`, default 4). `expand=products` returns one page of
+    each category's products instead (`page`/`per_page`).
+    """
+    expand = request.args.get('expand') == 'products'
     categories = Category.query.order_by(Category.category_name).all()
+    category_ids = [category.category_id for category in categories]
+
+    if expand:
+        page = max(1, request.args.get('page', 1, type=int))
+        per_page = min(max(1, request.args.get('per_page', 12, type=int)), MAX_PRODUCTS_PER_PAGE)
+        ranked = _ranked_products(
+            category_ids, limit=per_page, offset=(page - 1) * per_page,
+            order_by=(Product.product_name.asc(), Product.product_id.asc())
+        )
+    else:
+        preview = min(max(0, request.args.get('preview', NAV_PREVIEW_PRODUCTS, type=int)), MAX_NAV_PREVIEW_PRODUCTS)
+        ranked = _ranked_products(
+            category_ids, limit=preview,
+            order_by=(Product.created_at.desc(), Product.product_id.desc())
+        )
 
-    return jsonify([{
-        'category_id': category.category_id,
-        'category_name': category.category_name,
-        'category_description': category.category_description,
-        'products': [{
-            'product_id': product.product_id,
-            'product_name': product.product_name,
-            'product_description': product.product_description,
-            'product_price': float(product.product_price),
-            'stock_quantity': product.stock_quantity,
-            'images': [img.image_url for img in product.images] if product.images else []
-        } for product in category.products]
-    } for category in categories]), 200
+    products_by_category, totals = ranked
+    images_by_product, _ = load_product_relations(
+        [product for products in products_by_category.values() for product in products]
+    )
+
+    result = []
+    for category in categories:
+        products = products_by_category.get(category.category_id, [])
+        total = totals.get(category.category_id, 0)
+        entry = {
+            'category_id': category.category_id,
+            'category_name': category.category_name,
+            'category_description': category.category_description,
+            'product_count': total
+        }
+        if expand:
+            entry['products'] = [{
+                'product_id': product.product_id,
+                'product_name': product.product_name,
+                'product_description': product.product_description,
+                'product_price': float(product.product_price),
+                'stock_quantity': product.stock_quantity,
+                'images': [img.image_url for img in images_by_product.get(product.product_id, [])]
+            } for product in products]
+            entry['products_pagination'] = {
+                'total': total,
+                'pages': -(-total // per_page),
+                'current_page': page,
+                'per_page': per_page
+            }
+        else:
+            entry['preview_products'] = []
+            for product in products:
+                primary = primary_image_of(images_by_product.get(product.product_id, []), fallback=True)
+                entry['preview_products'].append({
+                    'product_id': product.product_id,
+                    'product_name': product.product_name,
+                    'product_price': float(product.product_price),
+                    'primary_image': image_url(primary) if primary else None
+                })
+        result.append(entry)
+
+    return jsonify(result), 200
+
+
+def _ranked_products(category_ids, limit, order_by, offset=0):
+    """
+    Fetch a window of each category's products plus per-category product counts.
+
+    Products are numbered within their category by a window function, so one
+    query returns the requested slice of every category along with its total.
+
+    Returns:
+        tuple: (category_id -> [Product], category_id -> product count)
+    """
+    if not category_ids:
+        return {}, {}
+
+    if limit == 0:
+        counts = db.session.query(Product.category_id, func.count(Product.product_id))\
+            .filter(Product.category_id.in_(category_ids))\
+            .group_by(Product.category_id)\
+            .all()
+        return {}, dict(counts)
+
+    numbered = db.session.query(
+        Product,
+        func.row_number().over(partition_by=Product.category_id, order_by=order_by).label('position'),
+        func.count(Product.product_id).over(partition_by=Product.category_id).label('category_total')
+    ).filter(Product.category_id.in_(category_ids)).subquery()
+
+    product = aliased(Product, numbered)
+    rows = db.session.query(product, numbered.c.category_total)\
+        .filter(numbered.c.position > offset, numbered.c.position <= offset + limit)\
+        .order_by(numbered.c.category_id, numbered.c.position)\
+        .all()
+
+    products_by_category = defaultdict(list)
+    totals = {}
+    for item, total in rows:
+        products_by_category[item.category_id].append(item)
+        totals[item.category_id] = total
+
+    # Categories whose products all fall before this page still need their count
+    missing = [category_id for category_id in category_ids if category_id not in totals]
+    if missing and offset:
+        _, missing_totals = _ranked_products(missing, 0, order_by)
+        totals.update(missing_totals)
+
+    return products_by_category, totals
 
 
 ###################################################################################################################################################################
 
 # Get a specific category by ID
 @category_bp.route('/<int:category_id>', methods=['GET'])
+@conditional(scopes=lambda category_id: [f'category:{category_id}', 'products'])
 def get_category_details(category_id):
     """Get category details with paginated products"""
 
@@ -2,9 +2,10 @@ from flask import Blueprint, request, jsonify
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_jwt_extended import jwt_required, get_jwt_identity, create_access_token, create_refresh_token
 from extensions import db
-from models import User, Order, OrderItem, Product, PaymentMethod
+from models import User, Order, OrderItem, Product, PaymentMethod, CustomerMetrics
 from datetime import datetime, timedelta
 from sqlalchemy.exc import SQLAlchemyError
+from utils.customer_metrics import order_totals
 
 customers_bp = Blueprint('customers', __name__)
 
@@ -51,8 +52,10 @@ def get_customers():
         search = request.args.get('search', '')
         status_filter = request.args.get('status', '')
         
-        # Build query - only get non-admin users
-        query = User.query.filter(User.is_admin == False)
+        # Build query - only get non-admin users, with their precomputed order metrics
+        query = db.session.query(User, CustomerMetrics)\
+            .outerjoin(CustomerMetrics, CustomerMetrics.user_id == User.id)\
+            .filter(User.is_admin == False)
         
         # Add search filter if provided
         if search:
@@ -64,61 +67,38 @@ def get_customers():
             )
         
         # Add status filter if provided
+        thirty_days_ago = datetime.now() - timedelta(days=30)
         if status_filter == 'active':
             # Users with recent activity (orders in last 30 days)
-            thirty_days_ago = datetime.now() - timedelta(days=30)
-            active_user_ids = db.session.query(Order.user_id).filter(
-                Order.order_date >= thirty_days_ago
-            ).distinct().subquery()
-            query = query.filter(User.id.in_(active_user_ids))
+            query = query.filter(CustomerMetrics.last_order_date >= thirty_days_ago)
         elif status_filter == 'inactive':
             # Users with no orders or old orders
-            thirty_days_ago = datetime.now() - timedelta(days=30)
-            active_user_ids = db.session.query(Order.user_id).filter(
-                Order.order_date >= thirty_days_ago
-            ).distinct().subquery()
-            query = query.filter(~User.id.in_(active_user_ids))
+            query = query.filter(db.or_(
+                CustomerMetrics.last_order_date.is_(None),
+                CustomerMetrics.last_order_date < thirty_days_ago
+            ))
         
         # Paginate results
-        pagination = query.paginate(
+        pagination = query.order_by(User.id).paginate(
             page=page, 
             per_page=per_page, 
             error_out=False
         )
         
         customers = []
-        for user in pagination.items:
-            try:
-                # Get customer statistics
-                order_count = Order.query.filter_by(user_id=user.id).count()
-                
-                # Get total spent safely
-                total_spent_result = db.session.query(db.func.sum(Order.total_amount)).filter(
-                    Order.user_id == user.id,
-                    Order.order_status == 'delivered'
-                ).scalar()
-                total_spent = float(total_spent_result) if total_spent_result else 0.0
-                
-                # Get last order safely
-                last_order = Order.query.filter_by(user_id=user.id).order_by(
-                    Order.order_date.desc()
-                ).first()
-                
-                customer_data = {
-                    'id': user.id,
-                    'username': user.username,
-                    'email': user.email,
-                    'created_at': None,  # User model doesn't have created_at
-                    'order_count': order_count,
-                    'total_spent': total_spent,
-                    'last_order_date': last_order.order_date.isoformat() if last_order and last_order.order_date else None,
-                    'status': 'active' if order_count > 0 else 'inactive'
-                }
-                customers.append(customer_data)
-            except Exception as user_error:
-                print(f"Error processing user {user.id}: {user_error}")
-                # Continue with other users
-                continue
+        for user, metrics in pagination.items:
+            order_count = metrics.order_count if metrics else 0
+            customers.append({
+                'id': user.id,
+                'username': user.username,
+                'email': user.email,
+                'created_at': user.created_at.isoformat() if user.created_at else None,
+                'order_count': order_count,
+                'total_spent': metrics.lifetime_value if metrics else 0.0,
+                'last_order_date': metrics.last_order_date.isoformat() if metrics and metrics.last_order_date else None,
+                'segment': metrics.segment if metrics else None,
+                'status': 'active' if order_count > 0 else 'inactive'
+            })
         
         return jsonify({
             'customers': customers,
@@ -392,8 +372,9 @@ def bulk_customer_action():
         
         if action == 'delete':
             # Check if any customers have orders
+            totals = order_totals(customer.id for customer in customers)
             for customer in customers:
-                order_count = Order.query.filter_by(user_id=customer.id).count()
+                order_count = totals.get(customer.id, (0, 0.0))[0]
                 if order_count > 0:
                     return jsonify({
                         'error': f'Customer {customer.username} has {order_count} orders and cannot be deleted'
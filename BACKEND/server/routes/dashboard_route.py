@@ -4,15 +4,22 @@ Dashboard Overview routes for admin dashboard
 Provides comprehensive dashboard data for the main overview page
 """
 
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, jsonify, request, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity, verify_jwt_in_request
-from models import db, Order, OrderItem, Product, User, Payment, Category
-from sqlalchemy import func, desc, and_, extract
+from models import db, Order, OrderItem, Product, User, Payment, Category, OrderStatus
+from utils.sales_rollup import period_totals_split, period_comparison, daily_totals, category_totals, product_totals
+from sqlalchemy import func, desc, and_, extract, case
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 import calendar
+import time
 
 dashboard_bp = Blueprint('dashboard', __name__)
 
+DELIVERED = [OrderStatus.DELIVERED]
+
+_executor = None
+
 def _extract_user_id(identity):
     """Extract user ID from JWT identity"""
     if identity is None:
@@ -59,48 +66,45 @@ def get_dashboard_overview():
         period_days = (end_date - start_date).days
         prev_start_date = start_date - timedelta(days=period_days)
         
-        # 1. Stats Grid Data
-        current_stats = get_current_stats(start_date, end_date)
-        previous_stats = get_current_stats(prev_start_date, start_date)
+        # Independent sections run concurrently, each with its own session
+        started = time.perf_counter()
+        results, timings = run_sections({
+            'stats': (get_period_stats, (start_date, end_date, prev_start_date)),
+            'sales': (get_sales_data, (start_date, end_date)),
+            'categories': (get_category_distribution, (start_date, end_date)),
+            'hourly': (get_hourly_sales_pattern, (start_date, end_date)),
+            'recent': (get_recent_orders, (5,)),
+            'products': (get_top_products, (start_date, end_date, 5)),
+            'alerts': (get_system_alerts, ())
+        })
+        timings['total'] = (time.perf_counter() - started) * 1000
         
         # Calculate percentage changes
+        current_stats, previous_stats = results['stats']
         stats = calculate_stats_with_changes(current_stats, previous_stats)
         
-        # 2. Sales Data for Charts
-        sales_data = get_sales_data(start_date, end_date)
-        
-        # 3. Category Distribution
-        category_data = get_category_distribution(start_date, end_date)
-        
-        # 4. Hourly Sales Pattern
-        hourly_data = get_hourly_sales_pattern(start_date, end_date)
-        
-        # 5. Recent Orders
-        recent_orders = get_recent_orders(limit=5)
-        
-        # 6. Top Products
-        top_products = get_top_products(start_date, end_date, limit=5)
-        
-        # 7. Regional Performance (simplified - using order locations)
+        # Regional Performance (simplified - using order locations)
         regional_data = get_regional_performance(start_date, end_date)
         
-        # 8. System Alerts
-        alerts = get_system_alerts()
-        
-        return jsonify({
+        response = jsonify({
             'success': True,
             'data': {
                 'stats': stats,
-                'salesData': sales_data,
-                'categoryData': category_data,
-                'hourlyData': hourly_data,
-                'recentOrders': recent_orders,
-                'topProducts': top_products,
+                'salesData': results['sales'],
+                'categoryData': results['categories'],
+                'hourlyData': results['hourly'],
+                'recentOrders': results['recent'],
+                'topProducts': results['products'],
                 'regionalData': regional_data,
-                'alerts': alerts,
+                'alerts': results['alerts'],
                 'lastUpdate': datetime.now().isoformat()
             }
         })
+        if current_app.debug or current_app.config.get('DASHBOARD_TIMING_HEADER'):
+            response.headers['Server-Timing'] = ', '.join(
+                f"{name};dur={elapsed:.1f}" for name, elapsed in timings.items()
+            )
+        return response
         
     except Exception as e:
         print(f"Error in dashboard overview: {str(e)}")
@@ -109,22 +113,85 @@ def get_dashboard_overview():
             'error': 'Failed to fetch dashboard overview'
         }), 500
 
+def _get_executor(app):
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=app.config.get('DASHBOARD_WORKERS', 4),
+            thread_name_prefix='dashboard'
+        )
+    return _executor
+
+def _run_section(app, function, args):
+    """Run one overview section in its own app context (and so its own session)"""
+    with app.app_context():
+        started = time.perf_counter()
+        try:
+            return function(*args), (time.perf_counter() - started) * 1000
+        finally:
+            db.session.remove()
+
+def run_sections(sections):
+    """
+    Run independent dashboard sections concurrently on the bounded dashboard pool.
+    
+    Args:
+        sections (dict): name -> (function, args)
+    
+    Returns:
+        tuple: (name -> result, name -> milliseconds); the first section error is re-raised
+    """
+    app = current_app._get_current_object()
+    executor = _get_executor(app)
+    futures = {
+        name: executor.submit(_run_section, app, function, args)
+        for name, (function, args) in sections.items()
+    }
+    results, timings = {}, {}
+    for name, future in futures.items():
+        results[name], timings[name] = future.result()
+    return results, timings
+
+def get_period_stats(start_date, end_date, prev_start_date):
+    """Current and previous period statistics over whole days, each source read once for both periods"""
+    # One (first day, last day) pair per period, shared by the rollup totals and the customer count
+    current = (start_date.date(), end_date.date())
+    previous = (prev_start_date.date(), start_date.date() - timedelta(days=1))
+    totals = period_comparison(current, previous, revenue_statuses=DELIVERED)
+    
+    # Active Customers (distinct per period, so counted from orders)
+    periods = [
+        (datetime.combine(first_day, datetime.min.time()), datetime.combine(last_day + timedelta(days=1), datetime.min.time()))
+        for first_day, last_day in (current, previous)
+    ]
+    active_customers = db.session.query(*[
+        func.count(func.distinct(case(
+            (and_(Order.order_date >= period_start, Order.order_date < period_end), Order.user_id)
+        )))
+        for period_start, period_end in periods
+    ]).filter(
+        Order.order_date >= periods[1][0],
+        Order.order_date < periods[0][1]
+    ).one()
+    
+    stats = []
+    for period, customers in zip(('current', 'previous'), active_customers):
+        total_orders = totals[period]['orders']
+        total_revenue = totals[period]['revenue']
+        stats.append({
+            'total_revenue': total_revenue,
+            'total_orders': total_orders,
+            'active_customers': customers or 0,
+            'avg_order_value': total_revenue / total_orders if total_orders > 0 else 0.0
+        })
+    return stats
+
 def get_current_stats(start_date, end_date):
     """Get current period statistics"""
-    # Total Revenue
-    total_revenue = db.session.query(
-        func.sum(Order.total_amount)
-    ).filter(
-        Order.order_date >= start_date,
-        Order.order_date <= end_date,
-        Order.order_status == 'delivered'
-    ).scalar() or 0
-    
-    # Total Orders
-    total_orders = Order.query.filter(
-        Order.order_date >= start_date,
-        Order.order_date <= end_date
-    ).count()
+    # Total Revenue and Orders (whole days, from the daily sales rollup)
+    everything, delivered = period_totals_split(start_date, end_date, statuses=DELIVERED)
+    total_revenue = delivered.revenue
+    total_orders = everything.orders
     
     # Active Customers
     active_customers = db.session.query(
@@ -216,31 +283,31 @@ def calculate_stats_with_changes(current, previous):
 def get_sales_data(start_date, end_date):
     """Get sales data for charts"""
     # Get daily sales data
-    daily_sales = db.session.query(
-        func.date(Order.order_date).label('date'),
-        func.sum(Order.total_amount).label('revenue'),
-        func.count(Order.order_id).label('orders'),
-        func.count(func.distinct(Order.user_id)).label('customers')
+    daily_sales = daily_totals(start_date, end_date)
+    
+    # Distinct customers per day can't be summed from the rollup
+    daily_customers = dict(db.session.query(
+        func.date(Order.order_date),
+        func.count(func.distinct(Order.user_id))
     ).filter(
         Order.order_date >= start_date,
         Order.order_date <= end_date
     ).group_by(
         func.date(Order.order_date)
-    ).order_by(
-        func.date(Order.order_date)
-    ).all()
+    ).all())
     
     # Calculate profit (assuming 30% profit margin for demo)
     sales_data = []
     for item in daily_sales:
         revenue = float(item.revenue or 0)
         profit = revenue * 0.3  # 30% profit margin
+        customers = daily_customers.get(item.date, daily_customers.get(item.date.isoformat(), 0))
         
         sales_data.append({
             'date': item.date.strftime('%b %d') if hasattr(item.date, 'strftime') else str(item.date),
             'revenue': revenue,
             'orders': item.orders,
-            'customers': item.customers,
+            'customers': customers,
             'profit': profit
         })
     
@@ -248,27 +315,15 @@ def get_sales_data(start_date, end_date):
 
 def get_category_distribution(start_date, end_date):
     """Get sales distribution by category"""
-    category_sales = db.session.query(
-        Category.category_name,
-        func.count(Order.order_id).label('order_count'),
-        func.sum(Order.total_amount).label('total_revenue')
-    ).select_from(Category).join(Product, Category.category_id == Product.category_id).join(
-        OrderItem, Product.product_id == OrderItem.product_id
-    ).join(Order, OrderItem.order_id == Order.order_id).filter(
-        Order.order_date >= start_date,
-        Order.order_date <= end_date,
-        Order.order_status == 'delivered'
-    ).group_by(Category.category_id).order_by(
-        desc(func.sum(Order.total_amount))
-    ).all()
+    category_sales = category_totals(start_date, end_date, statuses=DELIVERED)
     
     # Calculate percentages and assign colors
-    total_revenue = sum(float(item.total_revenue or 0) for item in category_sales)
+    total_revenue = sum(float(item.revenue or 0) for item in category_sales)
     colors = ["#8884d8", "#82ca9d", "#ffc658", "#ff7300", "#00ff88"]
     
     category_data = []
     for i, item in enumerate(category_sales):
-        revenue = float(item.total_revenue or 0)
+        revenue = float(item.revenue or 0)
         percentage = (revenue / total_revenue * 100) if total_revenue > 0 else 0
         
         category_data.append({
@@ -362,19 +417,7 @@ def get_recent_orders(limit=5):
 
 def get_top_products(start_date, end_date, limit=5):
     """Get top performing products"""
-    top_products = db.session.query(
-        Product.product_name,
-        func.sum(OrderItem.quantity).label('sales'),
-        func.sum(OrderItem.quantity * func.cast(OrderItem.price, db.Float)).label('revenue')
-    ).select_from(Product).join(OrderItem, Product.product_id == OrderItem.product_id).join(
-        Order, OrderItem.order_id == Order.order_id
-    ).filter(
-        Order.order_date >= start_date,
-        Order.order_date <= end_date,
-        Order.order_status == 'delivered'
-    ).group_by(Product.product_id).order_by(
-        desc(func.sum(OrderItem.quantity))
-    ).limit(limit).all()
+    top_products = product_totals(start_date, end_date, statuses=DELIVERED, limit=limit)
     
     products_data = []
     for product in top_products:
@@ -385,7 +428,7 @@ def get_top_products(start_date, end_date, limit=5):
         
         products_data.append({
             'name': product.product_name,
-            'sales': int(product.sales or 0),
+            'sales': int(product.units or 0),
             'revenue': float(product.revenue or 0),
             'trend': round(trend, 1),
             'rating': round(rating, 1)
@@ -6,6 +6,10 @@ from models import (ShoppingCart, CartItem, Order, OrderItem, Product,
                    User, OrderStatus, ShippingStatus, DiscountType, 
                    ProductImage, Payment, PaymentStatus, RefundStatus, Refund, Coupon)
 from sqlalchemy.exc import SQLAlchemyError
+from utils.pagination import keyset_paginate, order_by_keyset, InvalidCursor
+from utils.idempotency import idempotent, new_transaction_id
+from utils.inventory import (InsufficientStock, item_quantities, reserve_stock, release_stock,
+                             hold_reservations)
 
 order_bp = Blueprint('order', __name__)
 
@@ -104,6 +108,7 @@ def apply_coupon(coupon_code, order_amount):
 
 @order_bp.route('/checkout', methods=['POST'])
 @jwt_required()
+@idempotent('checkout')
 def checkout():
     """Enhanced checkout process with coupon support"""
     identity = get_jwt_identity()
@@ -126,33 +131,9 @@ def checkout():
     if not cart or not cart.cart_items:
         return jsonify({"error": "Your cart is empty"}), 400
     
-    # Validate cart items
-    unavailable_items = []
-    for item in cart.cart_items:
-        product = Product.query.get(item.product_id)
-        available_qty = int(product.stock_quantity or 0) if product else 0
-        if not product or available_qty < item.quantity:
-            unavailable_items.append({
-                "product_id": item.product_id,
-                "requested": item.quantity,
-                "available": available_qty
-            })
-    
-    if unavailable_items:
-        return jsonify({
-            "error": "Some items are no longer available",
-            "unavailable_items": unavailable_items
-        }), 400
-    
     try:
-        # Calculate subtotal (fallback if cart.total_price is missing or zero)
-        try:
-            subtotal_val = float(cart.total_price or 0)
-        except Exception:
-            subtotal_val = 0.0
-        if subtotal_val <= 0:
-            subtotal_val = sum(float(ci.price) * ci.quantity for ci in cart.cart_items)
-        subtotal = float(f"{subtotal_val:.2f}")
+        # Subtotal kept on the cart in cents as items change (utils/cart.py)
+        subtotal = cart.total_cents / 100
         shipping_cost = calculate_shipping_cost(cart.cart_items, data['shipping_address'])
         discount = 0.0
         coupon_code = data.get('coupon_code')
@@ -167,6 +148,17 @@ def checkout():
         # Calculate total
         total_amount = subtotal + float(shipping_cost) - discount
         
+        # Take this cart's units in one conditional UPDATE (nothing is taken if any item is short)
+        quantities = item_quantities(cart.cart_items)
+        try:
+            reserve_stock(quantities)
+        except InsufficientStock as e:
+            db.session.rollback()
+            return jsonify({
+                "error": "Some items are no longer available",
+                "unavailable_items": e.items
+            }), 400
+        
         # Create order
         new_order = Order(
             user_id=user_id,
@@ -179,13 +171,11 @@ def checkout():
         
         # Create order items
         for cart_item in cart.cart_items:
-            product = Product.query.get(cart_item.product_id)
-            
             order_item = OrderItem(
                 order_id=new_order.order_id,
-                product_id=product.product_id,
+                product_id=cart_item.product_id,
                 quantity=cart_item.quantity,
-                price=cart_item.price,
+                price=cart_item.price_cents / 100,
                 shipping_cost=shipping_cost,
                 tax="0.00",
                 discount=str(discount),
@@ -193,9 +183,6 @@ def checkout():
                 shipping_status=ShippingStatus.PENDING
             )
             db.session.add(order_item)
-            
-            # Update inventory
-            product.stock_quantity -= cart_item.quantity
         
         # Process payment
         # Create payment to match current Payment model schema
@@ -204,6 +191,7 @@ def checkout():
         # Set payment status based on payment method
         if payment_method == 'mpesa':
             payment_status = PaymentStatus.PENDING  # Will be updated when payment is confirmed
+            hold_reservations(new_order.order_id, quantities)  # Released back into stock if never paid
         else:
             payment_status = PaymentStatus.COMPLETED  # For bank transfer, mark as completed
             
@@ -211,7 +199,7 @@ def checkout():
             order_id=new_order.order_id,
             user_id=user_id,
             payment_amount=f"{total_amount:.2f}",
-            transaction_id=f"txn_{datetime.now().strftime('%Y%m%d%H%M%S')}",
+            transaction_id=new_transaction_id(),
             payment_status=payment_status,
             payment_method_id=1,  # Default to 1 for now
             payment_date=db.func.current_timestamp()
@@ -220,7 +208,7 @@ def checkout():
         
         # Clear cart
         CartItem.query.filter_by(shopping_cart_id=cart.shopping_cart_id).delete()
-        cart.total_price = "0.00"
+        cart.total_cents = 0
         cart.shopping_quantity = 0
         
         # Mark coupon as used if applicable
@@ -346,11 +334,7 @@ def process_return(return_id):
             
             # Restock items if applicable
             if data.get('restock', True):
-                for item in order.order_items:
-                    if item.refund_requested:
-                        product = Product.query.get(item.product_id)
-                        if product:
-                            product.stock_quantity += item.quantity
+                release_stock(item_quantities(item for item in order.order_items if item.refund_requested))
             
             # Update order status
             order.order_status = OrderStatus.RETURNED
@@ -503,18 +487,35 @@ def get_all_orders():
             except ValueError:
                 pass
         
-        # Order by most recent first
-        query = query.order_by(Order.order_date.desc())
-        
-        # Paginate results
-        pagination = query.paginate(
-            page=page, 
-            per_page=per_page, 
-            error_out=False
-        )
+        if 'cursor' in request.args:
+            # Keyset pagination (opt-in), most recent first
+            keyset_page = keyset_paginate(
+                query, Order.order_date, Order.order_id, descending=True,
+                cursor=request.args.get('cursor', ''),
+                per_page=per_page,
+                count=request.args.get('count', 'exact')
+            )
+            items = keyset_page.items
+            pagination_data = keyset_page.pagination()
+        else:
+            # Order by most recent first, then paginate results
+            pagination = order_by_keyset(query, Order.order_date, Order.order_id, descending=True).paginate(
+                page=page, 
+                per_page=per_page, 
+                error_out=False
+            )
+            items = pagination.items
+            pagination_data = {
+                'page': page,
+                'per_page': per_page,
+                'total': pagination.total,
+                'pages': pagination.pages,
+                'has_next': pagination.has_next,
+                'has_prev': pagination.has_prev
+            }
         
         orders = []
-        for order in pagination.items:
+        for order in items:
             order_data = {
                 'order_id': order.order_id,
                 'order_date': order.order_date.isoformat() if order.order_date else None,
@@ -534,19 +535,55 @@ def get_all_orders():
         
         return jsonify({
             'orders': orders,
-            'pagination': {
-                'page': page,
-                'per_page': per_page,
-                'total': pagination.total,
-                'pages': pagination.pages,
-                'has_next': pagination.has_next,
-                'has_prev': pagination.has_prev
-            }
+            'pagination': pagination_data
         }), 200
         
+    except InvalidCursor as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": "Failed to fetch orders", "details": str(e)}), 500
 
+def order_stats(from_date):
+    """
+    Order totals since `from_date`, aggregated in SQL.
+
+    A single GROUP BY (day, status) scan returns at most one row per day and
+    status, so the work done in Python stays flat however many orders there are.
+
+    Returns:
+        dict: total_orders, total_revenue, status_distribution (status -> count), daily_revenue (YYYY-MM-DD -> revenue)
+    """
+    day = db.func.date(Order.order_date)
+    rows = db.session.query(
+        day,
+        Order.order_status,
+        db.func.count(Order.order_id),
+        db.func.coalesce(db.func.sum(Order.total_amount), 0)
+    ).filter(Order.order_date >= from_date).group_by(day, Order.order_status).order_by(day).all()
+
+    total_orders = 0
+    total_revenue = 0.0
+    status_distribution = {}
+    daily_revenue = {}
+    for date_value, status, count, revenue in rows:
+        revenue = float(revenue)
+        total_orders += count
+        total_revenue += revenue
+
+        status_key = status.value if status else 'unknown'
+        status_distribution[status_key] = status_distribution.get(status_key, 0) + count
+
+        # SQLite returns 'YYYY-MM-DD' text, PostgreSQL a date
+        date_key = date_value.isoformat() if hasattr(date_value, 'isoformat') else (date_value or 'unknown')
+        daily_revenue[date_key] = daily_revenue.get(date_key, 0) + revenue
+
+    return {
+        'total_orders': total_orders,
+        'total_revenue': total_revenue,
+        'status_distribution': status_distribution,
+        'daily_revenue': daily_revenue
+    }
+
 @order_bp.route('/admin/stats', methods=['GET'])
 @jwt_required()
 def get_order_stats():
@@ -559,27 +596,14 @@ def get_order_stats():
         days = request.args.get('days', 30, type=int)
         from_date = datetime.now() - timedelta(days=days)
         
-        # Get orders in date range
-        orders = Order.query.filter(Order.order_date >= from_date).all()
-        
-        # Calculate statistics
-        total_orders = len(orders)
-        total_revenue = sum(order.total_amount for order in orders)
-        pending_orders = len([o for o in orders if o.order_status == OrderStatus.PENDING])
-        completed_orders = len([o for o in orders if o.order_status == OrderStatus.DELIVERED])
-        cancelled_orders = len([o for o in orders if o.order_status == OrderStatus.CANCELLED])
-        
-        # Get status distribution
-        status_counts = {}
-        for order in orders:
-            status = order.order_status.value if order.order_status else 'unknown'
-            status_counts[status] = status_counts.get(status, 0) + 1
-        
-        # Get daily revenue for chart
-        daily_revenue = {}
-        for order in orders:
-            date_str = order.order_date.strftime('%Y-%m-%d') if order.order_date else 'unknown'
-            daily_revenue[date_str] = daily_revenue.get(date_str, 0) + order.total_amount
+        stats = order_stats(from_date)
+        total_orders = stats['total_orders']
+        total_revenue = stats['total_revenue']
+        status_counts = stats['status_distribution']
+        daily_revenue = stats['daily_revenue']
+        pending_orders = status_counts.get(OrderStatus.PENDING.value, 0)
+        completed_orders = status_counts.get(OrderStatus.DELIVERED.value, 0)
+        cancelled_orders = status_counts.get(OrderStatus.CANCELLED.value, 0)
         
         return jsonify({
             'total_orders': total_orders,
@@ -1,12 +1,14 @@
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, request, jsonify, current_app, Response
 from extensions import db
-from datetime import datetime
 from flask_jwt_extended import jwt_required, get_jwt_identity
-import json
 import logging
 
-from models import Order, PaymentStatus, Payment, PaymentResponse, Transaction
+from models import Order, OrderStatus, PaymentStatus, Payment, Transaction
+from utils.idempotency import idempotent, new_transaction_id
 from utils.daraja_client import initiate_stk_push, get_mpesa_access_token
+from utils.mpesa_inbox import stk_callback, record_callback
+from utils import payment_events
+from utils.payment_events import payment_state
 
 # Blueprint Configuration
 payment_bp = Blueprint('payment', __name__)
@@ -24,43 +26,25 @@ def _extract_user_id(identity):
 @jwt_required()
 def mpesa_status(checkout_request_id):
     """
-    Get payment status by checkout request ID.
-    Used by frontend to poll for payment completion.
+    Get payment status by checkout request ID, as applied from the M-Pesa callback.
+    Clients waiting for the result should prefer the /status/<id>/events stream.
     """
     try:
-        # Handle mock checkout IDs for testing
-        if checkout_request_id.startswith('ws_CO_'):
-            return jsonify({
-                "status": "COMPLETED",
-                "payment_id": None,
-                "mock": True,
-                "message": "Mock payment completed"
-            }), 200
-        
         # Find payment by checkout request ID
         payment = Payment.query.filter_by(transaction_id=checkout_request_id).first()
         if not payment:
+            # Mock checkout IDs (credentials not configured) have no payment record
+            if checkout_request_id.startswith('ws_CO_'):
+                return jsonify({
+                    "status": "COMPLETED",
+                    "payment_id": None,
+                    "mock": True,
+                    "message": "Mock payment completed"
+                }), 200
             logger.warning(f"Payment not found for checkout_request_id: {checkout_request_id}")
             return jsonify({"status": "NOT_FOUND", "message": "Payment not found"}), 404
 
-        # Map payment status to string
-        status_map = {
-            PaymentStatus.PENDING: "PENDING",
-            PaymentStatus.COMPLETED: "COMPLETED", 
-            PaymentStatus.SUCCESS: "COMPLETED",
-            PaymentStatus.FAILED: "FAILED",
-            PaymentStatus.EXPIRED: "FAILED"
-        }
-        
-        status = status_map.get(payment.payment_status, "PENDING")
-        
-        return jsonify({
-            "status": status,
-            "payment_id": payment.payment_id,
-            "order_id": payment.order_id,
-            "amount": payment.payment_amount,
-            "payment_date": payment.payment_date.isoformat() if payment.payment_date else None
-        }), 200
+        return jsonify(payment_state(payment)), 200
         
     except Exception as e:
         logger.error(f"Error checking payment status: {str(e)}")
@@ -68,8 +52,49 @@ def mpesa_status(checkout_request_id):
 
 
 
+@payment_bp.route('/status/<string:transaction_id>/events', methods=['GET'])
+@jwt_required(locations=['headers', 'query_string'])
+def payment_status_events(transaction_id):
+    """
+    Stream a payment's status as Server-Sent Events until it completes or fails.
+
+    Works for M-Pesa checkout request IDs and Stripe payment intent IDs.
+    EventSource can't send headers, so the JWT may be passed as ?jwt=<token>.
+
+    Events:
+        status: {"status": "PENDING" | "COMPLETED" | "FAILED", "payment_id", "order_id", ...}
+        timeout: sent when no result arrived within PAYMENT_EVENTS_TIMEOUT_SECONDS
+    """
+    user_id = _extract_user_id(get_jwt_identity())
+
+    # Subscribe before reading the current state so no change falls in between
+    subscription = payment_events.subscribe(transaction_id)
+    try:
+        payment = Payment.query.filter_by(transaction_id=transaction_id).first()
+        if not payment or str(payment.user_id) != str(user_id):
+            subscription.close()
+            return jsonify({"status": "NOT_FOUND", "message": "Payment not found"}), 404
+        initial = payment_state(payment)
+    except Exception as e:
+        subscription.close()
+        logger.error(f"Error opening payment status stream: {str(e)}")
+        return jsonify({"error": "Internal server error"}), 500
+
+    stream = payment_events.event_stream(
+        subscription,
+        initial,
+        heartbeat=current_app.config.get('PAYMENT_EVENTS_HEARTBEAT_SECONDS', payment_events.DEFAULT_HEARTBEAT_SECONDS),
+        timeout=current_app.config.get('PAYMENT_EVENTS_TIMEOUT_SECONDS', payment_events.DEFAULT_TIMEOUT_SECONDS)
+    )
+    return Response(stream, mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # don't let nginx buffer the stream
+    })
+
+
 @payment_bp.route('/mpesa/stkpush', methods=['POST'])
 @jwt_required()
+@idempotent('mpesa_stkpush')
 def mpesa_stk_push():
     """
     Initiate M-Pesa STK Push payment using official Safaricom Daraja API.
@@ -120,6 +145,10 @@ def mpesa_stk_push():
         logger.error(f"Order {data['order_id']} not found for user {user_id}")
         return jsonify({"error": "Order not found"}), 404
     
+    # Orders whose stock hold expired unpaid were cancelled and their stock released
+    if order.order_status == OrderStatus.CANCELLED:
+        return jsonify({"error": "Order has been cancelled"}), 400
+    
     # Check if order already has a completed payment
     if order.payment and order.payment.payment_status not in [PaymentStatus.PENDING, PaymentStatus.FAILED]:
         return jsonify({
@@ -134,8 +163,8 @@ def mpesa_stk_push():
     if not consumer_key or not consumer_secret or consumer_key == 'your-consumer-key-here':
         # Return mock response for testing without real credentials
         logger.warning("M-Pesa credentials not configured, returning mock response")
-        mock_checkout_id = f"ws_CO_{datetime.now().strftime('%Y%m%d%H%M%S')}"
-        mock_merchant_id = f"m-pesa-{datetime.now().strftime('%Y%m%d%H%M%S')}"
+        mock_checkout_id = new_transaction_id('ws_CO')
+        mock_merchant_id = new_transaction_id('m-pesa')
         
         return jsonify({
             "message": "STK Push initiated successfully (MOCK - credentials not configured)",
@@ -305,107 +334,32 @@ def payment_callback():
     """
     Handle M-Pesa STK Push callback from Safaricom.
     This endpoint receives asynchronous notifications about payment status.
+
+    The callback is stored as received and acknowledged at once; inbox
+    workers apply it to the payment (see utils.mpesa_inbox).
     """
     try:
-        callback_data = request.get_json()
-        logger.info(f"Received M-Pesa callback: {json.dumps(callback_data, indent=2)}")
-        
+        callback_data = request.get_json(silent=True)
+
         # Validate callback structure
-        if not callback_data or 'Body' not in callback_data or 'stkCallback' not in callback_data['Body']:
+        callback = stk_callback(callback_data)
+        if callback is None:
             logger.error("Invalid callback structure received")
             return jsonify({"ResultCode": 1, "ResultDesc": "Invalid callback structure"}), 400
 
-        stk_callback = callback_data['Body']['stkCallback']
-        result_code = stk_callback.get('ResultCode')
-        result_desc = stk_callback.get('ResultDesc')
-        merchant_request_id = stk_callback.get('MerchantRequestID')
-        checkout_request_id = stk_callback.get('CheckoutRequestID')
-
-        logger.info(f"Processing callback: ResultCode={result_code}, CheckoutRequestID={checkout_request_id}")
-
-        # Find the related payment
-        payment = Payment.query.filter_by(transaction_id=checkout_request_id).first()
-        if not payment:
-            logger.error(f"Payment not found for checkout_request_id: {checkout_request_id}")
-            return jsonify({"ResultCode": 1, "ResultDesc": "Payment not found"}), 404
+        callback_id = record_callback(callback_data)
+        logger.info(f"Queued M-Pesa callback {callback_id}: ResultCode={callback.get('ResultCode')}, "
+                    f"CheckoutRequestID={callback.get('CheckoutRequestID')}")
 
-        # Save the raw callback response
-        payment_response = PaymentResponse(
-            response_code=str(result_code),
-            response_description=result_desc,
-            merchant_request_id=merchant_request_id,
-            checkout_request_id=checkout_request_id,
-            result_code=str(result_code),
-            result_description=result_desc,
-            raw_callback=callback_data,
-            payment_id=payment.payment_id
-        )
-        db.session.add(payment_response)
-
-        # Process payment result
-        if str(result_code) == '0':
-            # Payment successful
-            callback_metadata = stk_callback.get('CallbackMetadata', {}).get('Item', [])
-            payment_details = {
-                'amount': None,
-                'mpesa_receipt': None,
-                'phone_number': None,
-                'transaction_date': None
-            }
-
-            # Extract payment details from callback metadata
-            for item in callback_metadata:
-                name = item.get('Name')
-                value = item.get('Value')
-                if name == 'Amount':
-                    payment_details['amount'] = value
-                elif name == 'MpesaReceiptNumber':
-                    payment_details['mpesa_receipt'] = value
-                elif name == 'PhoneNumber':
-                    payment_details['phone_number'] = value
-                elif name == 'TransactionDate':
-                    payment_details['transaction_date'] = value
-
-            logger.info(f"Payment successful. Details: {payment_details}")
-
-            # Update payment status
-            payment.payment_status = PaymentStatus.COMPLETED
-            payment.payment_date = datetime.now()
-
-            # Update transaction record
-            transaction = Transaction.query.filter_by(transaction_id=merchant_request_id).first()
-            if transaction:
-                transaction.status = 'COMPLETED'
-                transaction.mpesa_receipt_number = payment_details['mpesa_receipt']
-                if payment_details['amount']:
-                    transaction.amount = payment_details['amount']
-                    
-            # Update order status to processing
-            if payment.order:
-                payment.order.order_status = 'processing'
-                
-        else:
-            # Payment failed
-            logger.warning(f"Payment failed: {result_desc}")
-            payment.payment_status = PaymentStatus.FAILED
-            
-            # Update transaction record
-            transaction = Transaction.query.filter_by(transaction_id=merchant_request_id).first()
-            if transaction:
-                transaction.status = 'FAILED'
-
-        db.session.commit()
-        logger.info(f"Callback processed successfully for payment {payment.payment_id}")
-        
         return jsonify({
             "ResultCode": 0,
-            "ResultDesc": "Callback processed successfully"
+            "ResultDesc": "Callback received successfully"
         }), 200
 
     except Exception as e:
         db.session.rollback()
-        logger.error(f"Error processing callback: {str(e)}", exc_info=True)
+        logger.error(f"Error storing callback: {str(e)}", exc_info=True)
         return jsonify({
             "ResultCode": 1,
             "ResultDesc": f"Error processing callback: {str(e)}"
-        }), 500
\ No newline at end of file
+        }), 500
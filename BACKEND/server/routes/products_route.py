@@ -1,6 +1,15 @@
 from flask import Blueprint, request, jsonify,url_for, current_app
 from utils.images import save_product_image, delete_image_file
-from models import Product, ProductImage, OrderItem, Review, Category
+from utils.storage import is_content_addressed
+from utils.serializers import serialize_products
+from utils.image_variants import requested_size
+from utils.export import stream_query, wants_stream, stream_format, download_response, envelope_response
+from utils.sales_stats import top_sellers
+from utils.search import product_match_subquery, product_snippets
+from utils.pagination import keyset_paginate, order_by_keyset, InvalidCursor
+from utils.cache import cache
+from utils.etag import conditional
+from models import Product, ProductImage, Category
 from flask_jwt_extended import jwt_required
 import os
 from sqlalchemy import func, desc
@@ -15,46 +24,20 @@ MAX_IMAGES_PER_PRODUCT = 10
 
 # Get best sellers (products with most orders and highest ratings) - Using different path to avoid conflicts
 @product_bp.route('/bestsellers', methods=['GET'])
+@cache.cached(tags=['products', 'bestsellers'])
 def get_best_sellers():
     """Retrieve best selling products based on order frequency and ratings."""
     try:
-        # Get products with their order counts and average ratings
-        best_sellers = db.session.query(
-            Product,
-            func.count(OrderItem.order_item_id).label('order_count'),
-            func.avg(Review.rating).label('avg_rating')
-        ).outerjoin(OrderItem, Product.product_id == OrderItem.product_id)\
-         .outerjoin(Review, Product.product_id == Review.product_id)\
-         .group_by(Product.product_id)\
-         .order_by(desc('order_count'), desc('avg_rating'))\
-         .limit(8)\
-         .all()
-        
-        result = []
-        for product, order_count, avg_rating in best_sellers:
-            # Get primary image for the product
-            primary_image = ProductImage.query.filter_by(
-                product_id=product.product_id, 
-                is_primary=True
-            ).first()
-            
-            product_data = {
-                'product_id': product.product_id,
-                'product_name': product.product_name,
-                'product_description': product.product_description,
-                'product_price': product.product_price,
-                'stock_quantity': product.stock_quantity,
-                'category_id': product.category_id,
-                'order_count': order_count or 0,
-                'avg_rating': float(avg_rating) if avg_rating else 0.0,
-                'primary_image': url_for('static', filename=primary_image.image_url, _external=True) if primary_image else None,
-                'all_images': [{
-                    'image_id': img.image_id,
-                    'image_url': url_for('static', filename=img.image_url, _external=True),
-                    'is_primary': img.is_primary
-                } for img in product.images]
-            }
-            result.append(product_data)
+        size, fmt = requested_size(request.args)
+        # Single top-N read from the precomputed ranking table
+        best_sellers = top_sellers(limit=8)
+        
+        products = [product for product, _ in best_sellers]
+        result = serialize_products(products, images_key='all_images', size=size, fmt=fmt)
+        for product_data, (_, stats) in zip(result, best_sellers):
+            product_data['order_count'] = stats.order_count if stats else 0
+            product_data['units_sold'] = stats.units_sold if stats else 0
+            product_data['avg_rating'] = float(stats.avg_rating) if stats else 0.0
         
         return jsonify(result), 200
         
@@ -63,38 +46,17 @@ def get_best_sellers():
 
 # Get recent products (newest first)
 @product_bp.route('/recent', methods=['GET'])
+@cache.cached(tags=['products'])
 def get_recent_products():
     """Retrieve the most recently added products."""
     try:
         limit = request.args.get('limit', 5, type=int)
+        size, fmt = requested_size(request.args)
         
         # Get products ordered by creation date (newest first)
         recent_products = Product.query.order_by(desc(Product.created_at)).limit(limit).all()
         
-        result = []
-        for product in recent_products:
-            # Get primary image for the product
-            primary_image = ProductImage.query.filter_by(
-                product_id=product.product_id, 
-                is_primary=True
-            ).first()
-            
-            product_data = {
-                'product_id': product.product_id,
-                'product_name': product.product_name,
-                'product_description': product.product_description,
-                'product_price': product.product_price,
-                'stock_quantity': product.stock_quantity,
-                'category_id': product.category_id,
-                'created_at': product.created_at.isoformat() if product.created_at else None,
-                'primary_image': url_for('static', filename=primary_image.image_url, _external=True) if primary_image else None,
-                'all_images': [{
-                    'image_id': img.image_id,
-                    'image_url': url_for('static', filename=img.image_url, _external=True),
-                    'is_primary': img.is_primary
-                } for img in product.images]
-            }
-            result.append(product_data)
+        result = serialize_products(recent_products, images_key='all_images', size=size, fmt=fmt)
         
         return jsonify(result), 200
         
@@ -107,34 +69,12 @@ def get_recent_products_alt():
     """Retrieve the most recently added products (alternative route)."""
     try:
         limit = request.args.get('limit', 5, type=int)
+        size, fmt = requested_size(request.args)
         
         # Get products ordered by creation date (newest first)
         recent_products = Product.query.order_by(desc(Product.created_at)).limit(limit).all()
         
-        result = []
-        for product in recent_products:
-            # Get primary image for the product
-            primary_image = ProductImage.query.filter_by(
-                product_id=product.product_id, 
-                is_primary=True
-            ).first()
-            
-            product_data = {
-                'product_id': product.product_id,
-                'product_name': product.product_name,
-                'product_description': product.product_description,
-                'product_price': product.product_price,
-                'stock_quantity': product.stock_quantity,
-                'category_id': product.category_id,
-                'created_at': product.created_at.isoformat() if product.created_at else None,
-                'primary_image': url_for('static', filename=primary_image.image_url, _external=True) if primary_image else None,
-                'all_images': [{
-                    'image_id': img.image_id,
-                    'image_url': url_for('static', filename=img.image_url, _external=True),
-                    'is_primary': img.is_primary
-                } for img in product.images]
-            }
-            result.append(product_data)
+        result = serialize_products(recent_products, images_key='all_images', size=size, fmt=fmt)
         
         return jsonify(result), 200
         
@@ -191,6 +131,7 @@ def create_product():
 
 # Get all products
 @product_bp.route('/product', methods=['GET', 'OPTIONS'])
+@conditional(scopes=['products', 'categories'])
 def get_products():
     """Retrieve all products along with their images."""
     if request.method == 'OPTIONS':
@@ -207,21 +148,28 @@ def get_products():
         category_id = request.args.get('category_id', type=int)
         search = request.args.get('search', '').strip()
         status = request.args.get('status', '').strip()
-        sort_by = request.args.get('sort_by', 'product_name')
+        sort_by = request.args.get('sort_by', 'relevance' if search else 'product_name')
         sort_order = request.args.get('sort_order', 'asc')
+        size, fmt = requested_size(request.args)
         
         # Build query
         query = Product.query
+        matches = None
         
         # Apply filters
         if category_id:
             query = query.filter(Product.category_id == category_id)
         
         if search:
-            query = query.filter(
-                Product.product_name.ilike(f'%{search}%') |
-                Product.product_description.ilike(f'%{search}%')
-            )
+            # Full-text index match (FTS5 / tsvector), ranked and prefix-matched
+            matches = product_match_subquery(search)
+            if matches is not None:
+                query = query.join(matches, matches.c.match_id == Product.product_id)
+            else:
+                query = query.filter(
+                    Product.product_name.ilike(f'%{search}%') |
+                    Product.product_description.ilike(f'%{search}%')
+                )
         
         if status:
             if status == 'out_of_stock':
@@ -232,71 +180,35 @@ def get_products():
                 query = query.filter(Product.stock_quantity > 5)
         
         # Apply sorting
-        if sort_by == 'product_price':
-            if sort_order == 'desc':
-                query = query.order_by(Product.product_price.desc())
-            else:
-                query = query.order_by(Product.product_price.asc())
-        elif sort_by == 'stock_quantity':
-            if sort_order == 'desc':
-                query = query.order_by(Product.stock_quantity.desc())
-            else:
-                query = query.order_by(Product.stock_quantity.asc())
-        elif sort_by == 'created_at':
-            if sort_order == 'desc':
-                query = query.order_by(Product.created_at.desc())
-            else:
-                query = query.order_by(Product.created_at.asc())
-        else:  # default sort by name
-            if sort_order == 'desc':
-                query = query.order_by(Product.product_name.desc())
-            else:
-                query = query.order_by(Product.product_name.asc())
-        
-        # Apply pagination
-        paginated_products = query.paginate(
-            page=page, 
-            per_page=per_page, 
-            error_out=False
-        )
-        
-        # Format response
-        products_data = []
-        for product in paginated_products.items:
-            # Get primary image
-            primary_image = ProductImage.query.filter_by(
-                product_id=product.product_id, 
-                is_primary=True
-            ).first()
-            
-            # Get category name
-            category_name = None
-            if product.category_id:
-                category = Category.query.get(product.category_id)
-                category_name = category.category_name if category else None
-            
-            product_data = {
-                'product_id': product.product_id,
-                'product_name': product.product_name,
-                'product_description': product.product_description,
-                'product_price': float(product.product_price),
-                'stock_quantity': product.stock_quantity,
-                'category_id': product.category_id,
-                'category_name': category_name,
-                'created_at': product.created_at.isoformat() if product.created_at else None,
-                'updated_at': product.updated_at.isoformat() if product.updated_at else None,
-                'primary_image': url_for('static', filename=primary_image.image_url, _external=True) if primary_image else None,
-                'images': [{
-                    'image_id': img.image_id, 
-                    'image_url': url_for('static', filename=img.image_url, _external=True), 
-                    'is_primary': img.is_primary
-                } for img in product.images]
-            }
-            products_data.append(product_data)
-        
-        response = jsonify({
-            'products': products_data,
-            'pagination': {
+        if sort_by == 'relevance' and matches is not None:
+            sort_column, descending = matches.c.match_rank, False
+        else:
+            sort_column = {
+                'product_price': Product.product_price,
+                'stock_quantity': Product.stock_quantity,
+                'created_at': Product.created_at,
+            }.get(sort_by, Product.product_name)  # default sort by name
+            descending = sort_order == 'desc'
+        
+        if 'cursor' in request.args:
+            # Keyset pagination (opt-in): no OFFSET, total count optional
+            keyset_page = keyset_paginate(
+                query, sort_column, Product.product_id, descending,
+                cursor=request.args.get('cursor', ''),
+                per_page=per_page,
+                count=request.args.get('count', 'exact')
+            )
+            items = keyset_page.items
+            pagination = keyset_page.pagination()
+        else:
+            # Apply pagination
+            paginated_products = order_by_keyset(query, sort_column, Product.product_id, descending).paginate(
+                page=page, 
+                per_page=per_page, 
+                error_out=False
+            )
+            items = paginated_products.items
+            pagination = {
                 'total': paginated_products.total,
                 'pages': paginated_products.pages,
                 'current_page': paginated_products.page,
@@ -304,12 +216,25 @@ def get_products():
                 'has_next': paginated_products.has_next,
                 'has_prev': paginated_products.has_prev
             }
+        
+        # Format response (images and categories are batch-loaded for the whole page)
+        products_data = serialize_products(items, size=size, fmt=fmt)
+        if search:
+            snippets = product_snippets(search, [p['product_id'] for p in products_data])
+            for product_data in products_data:
+                product_data['search_snippet'] = snippets.get(product_data['product_id'])
+        
+        response = jsonify({
+            'products': products_data,
+            'pagination': pagination
         })
         response.headers.add('Access-Control-Allow-Origin', '*')
         response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization')
         response.headers.add('Access-Control-Allow-Methods', 'GET,OPTIONS')
         return response, 200
         
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': f'Error fetching products: {str(e)}'}), 500
 
@@ -330,6 +255,7 @@ def get_related_products_simple(product_id):
     
     try:
         print(f"🔍 Processing GET request for product_id: {product_id} (simple route)")
+        size, fmt = requested_size(request.args)
         # Get the current product to find its category
         current_product = Product.query.get(product_id)
         if not current_product:
@@ -350,37 +276,7 @@ def get_related_products_simple(product_id):
             related_products.extend(additional_products)
         
         # Format response
-        products_data = []
-        for product in related_products:
-            # Get primary image
-            primary_image = ProductImage.query.filter_by(
-                product_id=product.product_id, 
-                is_primary=True
-            ).first()
-            
-            # Get category name
-            category_name = None
-            if product.category_id:
-                category = Category.query.get(product.category_id)
-                category_name = category.category_name if category else None
-            
-            product_data = {
-                'product_id': product.product_id,
-                'product_name': product.product_name,
-                'product_description': product.product_description,
-                'product_price': float(product.product_price),
-                'stock_quantity': product.stock_quantity,
-                'category_id': product.category_id,
-                'category_name': category_name,
-                'created_at': product.created_at.isoformat() if product.created_at else None,
-                'primary_image': url_for('static', filename=primary_image.image_url, _external=True) if primary_image else None,
-                'images': [{
-                    'image_id': img.image_id, 
-                    'image_url': url_for('static', filename=img.image_url, _external=True), 
-                    'is_primary': img.is_primary
-                } for img in product.images]
-            }
-            products_data.append(product_data)
+        products_data = serialize_products(related_products, size=size, fmt=fmt)
         
         response = jsonify({
             'related_products': products_data,
@@ -414,6 +310,7 @@ def get_related_products(product_id):
     
     try:
         print(f"🔍 Processing GET request for product_id: {product_id}")
+        size, fmt = requested_size(request.args)
         # Get the current product to find its category
         current_product = Product.query.get(product_id)
         if not current_product:
@@ -434,37 +331,7 @@ def get_related_products(product_id):
             related_products.extend(additional_products)
         
         # Format response
-        products_data = []
-        for product in related_products:
-            # Get primary image
-            primary_image = ProductImage.query.filter_by(
-                product_id=product.product_id, 
-                is_primary=True
-            ).first()
-            
-            # Get category name
-            category_name = None
-            if product.category_id:
-                category = Category.query.get(product.category_id)
-                category_name = category.category_name if category else None
-            
-            product_data = {
-                'product_id': product.product_id,
-                'product_name': product.product_name,
-                'product_description': product.product_description,
-                'product_price': float(product.product_price),
-                'stock_quantity': product.stock_quantity,
-                'category_id': product.category_id,
-                'category_name': category_name,
-                'created_at': product.created_at.isoformat() if product.created_at else None,
-                'primary_image': url_for('static', filename=primary_image.image_url, _external=True) if primary_image else None,
-                'images': [{
-                    'image_id': img.image_id, 
-                    'image_url': url_for('static', filename=img.image_url, _external=True), 
-                    'is_primary': img.is_primary
-                } for img in product.images]
-            }
-            products_data.append(product_data)
+        products_data = serialize_products(related_products, size=size, fmt=fmt)
         
         response = jsonify({
             'related_products': products_data,
@@ -483,6 +350,8 @@ def get_related_products(product_id):
 
 # Get a specific product by ID
 @product_bp.route('/<int:product_id>', methods=['GET'])
+@conditional(scopes=lambda product_id: [f'product:{product_id}'])
+@cache.cached(tags=lambda product_id: [f'product:{product_id}'])
 def get_product(product_id):
     """Retrieve a specific product by ID and its images."""
     
@@ -512,6 +381,7 @@ def get_product(product_id):
 def get_products_by_category(category_slug):
     """Retrieve products by category name/slug."""
     try:
+        size, fmt = requested_size(request.args)
         # Map category slugs to category names
         category_mapping = {
             'sofas': 'Sofas & Couches',
@@ -540,32 +410,7 @@ def get_products_by_category(category_slug):
         products = Product.query.filter_by(category_id=category.category_id).all()
         
         # Format response
-        products_data = []
-        for product in products:
-            # Get primary image
-            primary_image = ProductImage.query.filter_by(
-                product_id=product.product_id, 
-                is_primary=True
-            ).first()
-            
-            product_data = {
-                'product_id': product.product_id,
-                'product_name': product.product_name,
-                'product_description': product.product_description,
-                'product_price': float(product.product_price),
-                'stock_quantity': product.stock_quantity,
-                'category_id': product.category_id,
-                'category_name': category.category_name,
-                'created_at': product.created_at.isoformat() if product.created_at else None,
-                'updated_at': product.updated_at.isoformat() if product.updated_at else None,
-                'primary_image': url_for('static', filename=primary_image.image_url, _external=True) if primary_image else None,
-                'images': [{
-                    'image_id': img.image_id, 
-                    'image_url': url_for('static', filename=img.image_url, _external=True), 
-                    'is_primary': img.is_primary
-                } for img in product.images]
-            }
-            products_data.append(product_data)
+        products_data = serialize_products(products, size=size, fmt=fmt)
         
         response = jsonify({
             'products': products_data,
@@ -630,6 +475,27 @@ def update_product(product_id):
     db.session.commit()
     return jsonify({'message': 'Product updated successfully'}), 200
 
+def _delete_images(images):
+    """
+    Delete image rows through the session, so the storage hooks drop their
+    blob references and remove unreferenced blobs once the delete commits.
+
+    Returns:
+        list: Paths of legacy (not content-addressed) files to remove after the commit
+    """
+    for img in images:
+        db.session.delete(img)
+    return [img.image_url for img in images if not is_content_addressed(img.image_url)]
+
+
+def _delete_legacy_files(image_urls):
+    for image_url in image_urls:
+        try:
+            delete_image_file(image_url)
+        except Exception as e:
+            current_app.logger.error(f"Failed to delete image {image_url}: {str(e)}")
+
+
 # Delete a product and its images
 @product_bp.route('/<int:product_id>', methods=['DELETE'])
 @jwt_required()
@@ -637,19 +503,12 @@ def delete_product(product_id):
     """Delete a product and all its images."""
     product = Product.query.get_or_404(product_id)
 
-    # Delete associated images from database
+    # Delete associated images through the session so shared blobs are released on commit
     images = ProductImage.query.filter_by(product_id=product_id).all()
-    for img in images:
-        
-        try:
-            delete_image_file(img.image_url)
-        except Exception as e:
-            current_app.logger.error(f"Failed to delete image {img.image_url}: {str(e)}")
-
-    # Delete db records
-    ProductImage.query.filter_by(product_id=product_id).delete()
+    legacy_files = _delete_images(images)
     db.session.delete(product)
     db.session.commit()
+    _delete_legacy_files(legacy_files)
 
     return jsonify({
         'message': 'Product and all associated images deleted',
@@ -841,25 +700,20 @@ def bulk_delete_products():
         
         # Delete products and their images
         deleted_count = 0
+        legacy_files = []
         for product_id in product_ids:
             product = Product.query.get(product_id)
             if product:
-                # Delete associated images
+                # Delete associated images (shared blobs are released on commit)
                 images = ProductImage.query.filter_by(product_id=product_id).all()
-                for img in images:
-                    try:
-                        delete_image_file(img.image_url)
-                    except Exception as e:
-                        current_app.logger.error(f"Failed to delete image {img.image_url}: {str(e)}")
-                
-                # Delete image records
-                ProductImage.query.filter_by(product_id=product_id).delete()
+                legacy_files.extend(_delete_images(images))
                 
                 # Delete product
                 db.session.delete(product)
                 deleted_count += 1
         
         db.session.commit()
+        _delete_legacy_files(legacy_files)
         
         response = jsonify({
             'message': f'Successfully deleted {deleted_count} products',
@@ -886,30 +740,24 @@ def export_products():
         return response, 200
     """Export products to CSV (admin only)"""
     try:
-        products = Product.query.all()
-        
-        csv_data = []
-        for product in products:
-            category_name = None
-            if product.category_id:
-                category = Category.query.get(product.category_id)
-                category_name = category.category_name if category else None
-            
-            csv_data.append({
-                'ID': product.product_id,
-                'Name': product.product_name,
-                'Description': product.product_description,
-                'Price': product.product_price,
-                'Stock': product.stock_quantity,
-                'Category': category_name,
-                'Created': product.created_at.isoformat() if product.created_at else '',
-                'Updated': product.updated_at.isoformat() if product.updated_at else ''
-            })
-        
-        response = jsonify({
-            'csv_data': csv_data,
-            'filename': f'products_export_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
-        })
+        # Category names come from a join and rows are streamed in batches
+        rows = stream_query(db.session.query(
+            Product.product_id,
+            Product.product_name,
+            Product.product_description,
+            Product.product_price,
+            Product.stock_quantity,
+            Category.category_name,
+            Product.created_at,
+            Product.updated_at
+        ).outerjoin(Category, Category.category_id == Product.category_id).order_by(Product.product_id))
+
+        header = ['ID', 'Name', 'Description', 'Price', 'Stock', 'Category', 'Created', 'Updated']
+        basename = f'products_export_{datetime.now().strftime("%Y%m%d_%H%M%S")}'
+        if wants_stream(request):
+            response = download_response(basename, header, rows, stream_format(request))
+        else:
+            response = envelope_response({'filename': f'{basename}.csv'}, 'csv_data', header, rows, embed='objects')
         response.headers.add('Access-Control-Allow-Origin', '*')
         response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization')
         response.headers.add('Access-Control-Allow-Methods', 'GET,OPTIONS')
@@ -1,15 +1,19 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from sqlalchemy import func, desc, asc, extract, case, and_
 from datetime import datetime, timedelta
-import csv
-import io
 import json
 
 from models import db, User, Order, OrderItem, Product, Category, Payment, PaymentMethod, OrderStatus, PaymentStatus, ShippingStatus, UserRole
+from utils.export import stream_query, wants_stream, download_response, envelope_response
+from utils.sales_rollup import period_totals_split, daily_totals, category_totals, product_totals, product_daily_units
+from utils.customer_metrics import segment_counts, repeat_customer_count, top_customers as top_customers_by_value
 
 reports_bp = Blueprint('reports', __name__)
 
+# Orders counted as sales in reports
+SALE_STATUSES = [OrderStatus.SHIPPED, OrderStatus.DELIVERED]
+
 def _extract_user_id():
     """Extract user ID from JWT token"""
     try:
@@ -54,68 +58,20 @@ def get_sales_report():
         days = request.args.get('days', 30, type=int)
         start_date, end_date = _get_date_range(days)
 
-        # Sales metrics
-        total_sales = db.session.query(func.sum(Order.total_amount)).filter(
-            and_(
-                Order.order_date >= start_date,
-                Order.order_date <= end_date,
-                Order.order_status.in_([OrderStatus.COMPLETED, OrderStatus.SHIPPED])
-            )
-        ).scalar() or 0
-
-        total_orders = db.session.query(func.count(Order.order_id)).filter(
-            and_(
-                Order.order_date >= start_date,
-                Order.order_date <= end_date
-            )
-        ).scalar() or 0
-
-        completed_orders = db.session.query(func.count(Order.order_id)).filter(
-            and_(
-                Order.order_date >= start_date,
-                Order.order_date <= end_date,
-                Order.order_status.in_([OrderStatus.COMPLETED, OrderStatus.SHIPPED])
-            )
-        ).scalar() or 0
+        # Sales metrics (whole days, from the daily sales rollup)
+        everything, sales = period_totals_split(start_date, end_date, statuses=SALE_STATUSES)
+        total_sales = sales.revenue
+        completed_orders = sales.orders
+        total_orders = everything.orders
 
         # Daily sales trend
-        daily_sales = db.session.query(
-            func.date(Order.order_date).label('date'),
-            func.sum(Order.total_amount).label('total'),
-            func.count(Order.order_id).label('orders')
-        ).filter(
-            and_(
-                Order.order_date >= start_date,
-                Order.order_date <= end_date,
-                Order.order_status.in_([OrderStatus.COMPLETED, OrderStatus.SHIPPED])
-            )
-        ).group_by(func.date(Order.order_date)).order_by(func.date(Order.order_date)).all()
+        daily_sales = daily_totals(start_date, end_date, statuses=SALE_STATUSES)
 
         # Sales by category
-        category_sales = db.session.query(
-            Category.category_name,
-            func.sum(OrderItem.price * OrderItem.quantity).label('total'),
-            func.count(OrderItem.order_item_id).label('items')
-        ).join(Product).join(OrderItem).join(Order).filter(
-            and_(
-                Order.order_date >= start_date,
-                Order.order_date <= end_date,
-                Order.order_status.in_([OrderStatus.COMPLETED, OrderStatus.SHIPPED])
-            )
-        ).group_by(Category.category_name).order_by(desc(func.sum(OrderItem.price * OrderItem.quantity))).all()
+        category_sales = category_totals(start_date, end_date, statuses=SALE_STATUSES)
 
         # Top selling products
-        top_products = db.session.query(
-            Product.product_name,
-            func.sum(OrderItem.quantity).label('total_quantity'),
-            func.sum(OrderItem.price * OrderItem.quantity).label('total_revenue')
-        ).join(OrderItem).join(Order).filter(
-            and_(
-                Order.order_date >= start_date,
-                Order.order_date <= end_date,
-                Order.order_status.in_([OrderStatus.COMPLETED, OrderStatus.SHIPPED])
-            )
-        ).group_by(Product.product_name).order_by(desc(func.sum(OrderItem.quantity))).limit(10).all()
+        top_products = product_totals(start_date, end_date, statuses=SALE_STATUSES, limit=10)
 
         return jsonify({
             'success': True,
@@ -135,7 +91,7 @@ def get_sales_report():
                 'daily_trend': [
                     {
                         'date': daily.date.isoformat(),
-                        'total': float(daily.total),
+                        'total': float(daily.revenue),
                         'orders': daily.orders
                     }
                     for daily in daily_sales
@@ -143,16 +99,16 @@ def get_sales_report():
                 'category_sales': [
                     {
                         'category': cat.category_name,
-                        'total': float(cat.total),
-                        'items': cat.items
+                        'total': float(cat.revenue),
+                        'items': cat.units
                     }
                     for cat in category_sales
                 ],
                 'top_products': [
                     {
                         'product': prod.product_name,
-                        'quantity': prod.total_quantity,
-                        'revenue': float(prod.total_revenue)
+                        'quantity': prod.units,
+                        'revenue': float(prod.revenue)
                     }
                     for prod in top_products
                 ]
@@ -172,13 +128,14 @@ def get_inventory_report():
             return jsonify({'error': 'Unauthorized access'}), 401
 
         # Current inventory status
+        low_stock_threshold = current_app.config['LOW_STOCK_THRESHOLD']
         total_products = Product.query.count()
-        low_stock_products = Product.query.filter(Product.stock_quantity <= Product.reorder_level).count()
+        low_stock_products = Product.query.filter(Product.stock_quantity <= low_stock_threshold).count()
         out_of_stock_products = Product.query.filter(Product.stock_quantity == 0).count()
 
         # Stock value
         total_stock_value = db.session.query(
-            func.sum(Product.stock_quantity * Product.price)
+            func.sum(Product.stock_quantity * Product.product_price)
         ).scalar() or 0
 
         # Products by category
@@ -186,30 +143,21 @@ def get_inventory_report():
             Category.category_name,
             func.count(Product.product_id).label('product_count'),
             func.sum(Product.stock_quantity).label('total_stock'),
-            func.sum(Product.stock_quantity * Product.price).label('stock_value')
+            func.sum(Product.stock_quantity * Product.product_price).label('stock_value')
         ).join(Product).group_by(Category.category_name).all()
 
         # Low stock products
         low_stock_list = db.session.query(
             Product.product_name,
             Product.stock_quantity,
-            Product.reorder_level,
-            Product.price,
+            Product.product_price,
             Category.category_name
         ).join(Category).filter(
-            Product.stock_quantity <= Product.reorder_level
+            Product.stock_quantity <= low_stock_threshold
         ).order_by(Product.stock_quantity).limit(20).all()
 
         # Stock movement (recent orders)
-        recent_stock_movement = db.session.query(
-            Product.product_name,
-            func.sum(OrderItem.quantity).label('units_sold'),
-            func.date(Order.order_date).label('date')
-        ).join(OrderItem).join(Order).filter(
-            Order.order_date >= datetime.utcnow() - timedelta(days=30)
-        ).group_by(Product.product_name, func.date(Order.order_date)).order_by(
-            desc(func.date(Order.order_date))
-        ).limit(50).all()
+        recent_stock_movement = product_daily_units(datetime.utcnow() - timedelta(days=30))
 
         return jsonify({
             'success': True,
@@ -225,7 +173,7 @@ def get_inventory_report():
                         'category': cat.category_name,
                         'product_count': cat.product_count,
                         'total_stock': cat.total_stock,
-                        'stock_value': float(cat.stock_value)
+                        'stock_value': float(cat.stock_value or 0)
                     }
                     for cat in category_inventory
                 ],
@@ -233,8 +181,8 @@ def get_inventory_report():
                     {
                         'product': prod.product_name,
                         'current_stock': prod.stock_quantity,
-                        'reorder_level': prod.reorder_level,
-                        'price': float(prod.price),
+                        'reorder_level': low_stock_threshold,
+                        'price': float(prod.product_price),
                         'category': prod.category_name
                     }
                     for prod in low_stock_list
@@ -242,7 +190,7 @@ def get_inventory_report():
                 'stock_movement': [
                     {
                         'product': mov.product_name,
-                        'units_sold': mov.units_sold,
+                        'units_sold': mov.units,
                         'date': mov.date.isoformat()
                     }
                     for mov in recent_stock_movement
@@ -266,62 +214,19 @@ def get_customer_report():
         start_date, end_date = _get_date_range(days)
 
         # Customer metrics
-        total_customers = User.query.filter(User.role == UserRole.CUSTOMER).count()
+        total_customers = User.query.filter(User.role == UserRole.USER).count()
         new_customers = User.query.filter(
             and_(
-                User.role == UserRole.CUSTOMER,
+                User.role == UserRole.USER,
                 User.created_at >= start_date
             )
         ).count()
 
-        # Customer segments
-        customer_segments = db.session.query(
-            case(
-                (func.sum(Order.total_amount) >= 1000, 'High Value'),
-                (func.sum(Order.total_amount) >= 500, 'Medium Value'),
-                else_='Low Value'
-            ).label('segment'),
-            func.count(User.id).label('count')
-        ).join(Order).filter(
-            and_(
-                User.role == UserRole.CUSTOMER,
-                Order.order_date >= start_date,
-                Order.order_date <= end_date
-            )
-        ).group_by(
-            case(
-                (func.sum(Order.total_amount) >= 1000, 'High Value'),
-                (func.sum(Order.total_amount) >= 500, 'Medium Value'),
-                else_='Low Value'
-            )
-        ).all()
-
-        # Top customers
-        top_customers = db.session.query(
-            User.username,
-            User.first_name,
-            User.last_name,
-            func.count(Order.order_id).label('order_count'),
-            func.sum(Order.total_amount).label('total_spent'),
-            func.avg(Order.total_amount).label('avg_order_value')
-        ).join(Order).filter(
-            and_(
-                User.role == UserRole.CUSTOMER,
-                Order.order_date >= start_date,
-                Order.order_date <= end_date
-            )
-        ).group_by(User.id).order_by(desc(func.sum(Order.total_amount))).limit(10).all()
-
-        # Customer retention
-        repeat_customers = db.session.query(
-            func.count(User.id)
-        ).select_from(User).join(Order).filter(
-            and_(
-                User.role == UserRole.CUSTOMER,
-                Order.order_date >= start_date,
-                Order.order_date <= end_date
-            )
-        ).group_by(User.id).having(func.count(Order.order_id) > 1).count()
+        # Customer segments, top customers and retention from customer_metrics
+        # (lifetime figures, for customers who ordered in the period)
+        customer_segments = segment_counts(active_since=start_date)
+        top_customers = top_customers_by_value(limit=10, active_since=start_date)
+        repeat_customers = repeat_customer_count(active_since=start_date)
 
         return jsonify({
             'success': True,
@@ -339,8 +244,8 @@ def get_customer_report():
                 },
                 'customer_segments': [
                     {
-                        'segment': seg.segment,
-                        'count': seg.count
+                        'segment': seg['segment'],
+                        'count': seg['count']
                     }
                     for seg in customer_segments
                 ],
@@ -348,11 +253,11 @@ def get_customer_report():
                     {
                         'username': cust.username,
                         'name': f"{cust.first_name} {cust.last_name}",
-                        'order_count': cust.order_count,
-                        'total_spent': float(cust.total_spent),
-                        'avg_order_value': float(cust.avg_order_value)
+                        'order_count': metrics.order_count,
+                        'total_spent': metrics.lifetime_value,
+                        'avg_order_value': metrics.lifetime_value / metrics.delivered_count if metrics.delivered_count else 0.0
                     }
-                    for cust in top_customers
+                    for cust, metrics in top_customers
                 ]
             }
         })
@@ -484,14 +389,15 @@ def export_report():
         format_type = request.args.get('format', 'csv')
         days = request.args.get('days', 30, type=int)
         
-        if format_type != 'csv':
-            return jsonify({'error': 'Only CSV export is supported'}), 400
+        if format_type not in ('csv', 'ndjson'):
+            return jsonify({'error': 'Only CSV and NDJSON export are supported'}), 400
 
         start_date, end_date = _get_date_range(days)
         
         if report_type == 'sales':
             # Export sales data
-            orders = db.session.query(
+            header = ['Order ID', 'Date', 'Total Amount', 'Status', 'Customer', 'Email']
+            rows = db.session.query(
                 Order.order_id,
                 Order.order_date,
                 Order.total_amount,
@@ -503,78 +409,38 @@ def export_report():
                     Order.order_date >= start_date,
                     Order.order_date <= end_date
                 )
-            ).all()
-
-            output = io.StringIO()
-            writer = csv.writer(output)
-            
-            writer.writerow(['Order ID', 'Date', 'Total Amount', 'Status', 'Customer', 'Email'])
-            for order in orders:
-                writer.writerow([
-                    order.order_id,
-                    order.order_date.isoformat(),
-                    order.total_amount,
-                    order.order_status.value if order.order_status else '',
-                    order.username,
-                    order.email
-                ])
+            ).order_by(Order.order_id)
 
         elif report_type == 'inventory':
             # Export inventory data
-            products = db.session.query(
+            header = ['Product', 'Stock', 'Price', 'Category']
+            rows = db.session.query(
                 Product.product_name,
                 Product.stock_quantity,
-                Product.price,
-                Category.category_name,
-                Product.reorder_level
-            ).join(Category).all()
-
-            output = io.StringIO()
-            writer = csv.writer(output)
-            
-            writer.writerow(['Product', 'Stock', 'Price', 'Category', 'Reorder Level'])
-            for product in products:
-                writer.writerow([
-                    product.product_name,
-                    product.stock_quantity,
-                    product.price,
-                    product.category_name,
-                    product.reorder_level
-                ])
+                Product.product_price,
+                Category.category_name
+            ).outerjoin(Category, Category.category_id == Product.category_id).order_by(Product.product_id)
 
         elif report_type == 'customers':
             # Export customer data
-            customers = db.session.query(
+            header = ['Username', 'Email', 'First Name', 'Last Name', 'Created At']
+            rows = db.session.query(
                 User.username,
                 User.email,
                 User.first_name,
                 User.last_name,
                 User.created_at
-            ).filter(User.role == UserRole.CUSTOMER).all()
-
-            output = io.StringIO()
-            writer = csv.writer(output)
-            
-            writer.writerow(['Username', 'Email', 'First Name', 'Last Name', 'Created At'])
-            for customer in customers:
-                writer.writerow([
-                    customer.username,
-                    customer.email,
-                    customer.first_name,
-                    customer.last_name,
-                    customer.created_at.isoformat() if customer.created_at else ''
-                ])
+            ).filter(User.role == UserRole.USER).order_by(User.id)
 
         else:
             return jsonify({'error': 'Invalid report type'}), 400
 
-        output.seek(0)
-        
-        return jsonify({
-            'success': True,
-            'data': output.getvalue(),
-            'filename': f'{report_type}_report_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
-        })
+        # Rows are streamed from a server-side cursor straight into the response
+        rows = stream_query(rows)
+        basename = f'{report_type}_report_{datetime.now().strftime("%Y%m%d_%H%M%S")}'
+        if wants_stream(request) or format_type == 'ndjson':
+            return download_response(basename, header, rows, format_type)
+        return envelope_response({'success': True, 'filename': f'{basename}.csv'}, 'data', header, rows)
 
     except Exception as e:
         print(f"Error in export_report: {str(e)}")
@@ -591,30 +457,21 @@ def get_reports_dashboard():
         days = request.args.get('days', 30, type=int)
         start_date, end_date = _get_date_range(days)
 
-        # Quick stats
-        total_revenue = db.session.query(func.sum(Order.total_amount)).filter(
-            and_(
-                Order.order_date >= start_date,
-                Order.order_date <= end_date,
-                Order.order_status.in_([OrderStatus.COMPLETED, OrderStatus.SHIPPED])
-            )
-        ).scalar() or 0
-
-        total_orders = db.session.query(func.count(Order.order_id)).filter(
-            and_(
-                Order.order_date >= start_date,
-                Order.order_date <= end_date
-            )
-        ).scalar() or 0
+        # Quick stats (whole days, from the daily sales rollup)
+        everything, sales = period_totals_split(start_date, end_date, statuses=SALE_STATUSES)
+        total_revenue = sales.revenue
+        total_orders = everything.orders
 
         total_customers = db.session.query(func.count(User.id)).filter(
             and_(
-                User.role == UserRole.CUSTOMER,
+                User.role == UserRole.USER,
                 User.created_at >= start_date
             )
         ).scalar() or 0
 
-        low_stock_products = Product.query.filter(Product.stock_quantity <= Product.reorder_level).count()
+        low_stock_products = Product.query.filter(
+            Product.stock_quantity <= current_app.config['LOW_STOCK_THRESHOLD']
+        ).count()
 
         return jsonify({
             'success': True,
@@ -1,11 +1,13 @@
 from flask import Blueprint, jsonify, request
 from models import SocialMediaPost, SocialMediaStats, db
 from sqlalchemy import desc
+from utils.cache import cache
 import os
 
 social_media_bp = Blueprint('social_media', __name__)
 
 @social_media_bp.route('/posts', methods=['GET'])
+@cache.cached(tags=['social'])
 def get_social_media_posts():
     """Get all active social media posts"""
     try:
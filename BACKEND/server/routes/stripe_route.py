@@ -1,10 +1,13 @@
 from flask import Blueprint, request, jsonify, current_app
 from extensions import db
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from models import Order, Payment, PaymentStatus, User
-from utils.stripe_client import stripe_client
+from models import Order, Payment, PaymentStatus, OrderStatus, User
+from utils.stripe_client import get_stripe_client
+from utils.idempotency import idempotent, IDEMPOTENCY_HEADER
+from utils.payment_events import publish_payment_status
+from utils.stripe_events import record_event
 import stripe
-import os
+import json
 
 stripe_bp = Blueprint('stripe', __name__)
 
@@ -17,6 +20,7 @@ def _extract_user_id(identity):
 
 @stripe_bp.route('/create-payment-intent', methods=['POST'])
 @jwt_required()
+@idempotent('stripe_payment_intent')
 def create_payment_intent():
     """
     Create a Stripe payment intent for bank transfer
@@ -50,10 +54,13 @@ def create_payment_intent():
         }
         
         # Create payment intent
-        result = stripe_client.create_bank_transfer_payment_intent(
+        # Stripe deduplicates on its side too, should our stored response be lost
+        idempotency_key = request.headers.get(IDEMPOTENCY_HEADER, '').strip()
+        result = get_stripe_client().create_bank_transfer_payment_intent(
             amount=amount,
             currency='kes',
-            metadata=metadata
+            metadata=metadata,
+            idempotency_key=f"{user_id}:{idempotency_key}" if idempotency_key else None
         )
         
         if result['success']:
@@ -97,7 +104,7 @@ def confirm_payment():
         payment_intent_id = data['payment_intent_id']
         
         # Retrieve payment intent from Stripe
-        result = stripe_client.retrieve_payment_intent(payment_intent_id)
+        result = get_stripe_client().retrieve_payment_intent(payment_intent_id)
         
         if not result['success']:
             return jsonify({"error": result['error']}), 400
@@ -105,92 +112,69 @@ def confirm_payment():
         payment_intent = result['payment_intent']
         
         # Verify the payment intent belongs to the user
-        if payment_intent.metadata.get('user_id') != str(user_id):
+        if payment_intent['metadata'].get('user_id') != str(user_id):
             return jsonify({"error": "Payment intent does not belong to user"}), 403
         
         # Update payment status based on Stripe status
-        order_id = payment_intent.metadata.get('order_id')
+        order_id = payment_intent['metadata'].get('order_id')
         payment = Payment.query.filter_by(order_id=order_id).first()
         
         if payment:
-            if payment_intent.status == 'succeeded':
+            if payment_intent['status'] == 'succeeded':
                 payment.payment_status = PaymentStatus.COMPLETED
-                # Update order status if needed
+                # A paid order moves on to processing
                 order = Order.query.get(order_id)
-                if order:
-                    order.order_status = 'confirmed'  # You might want to use an enum here
-            elif payment_intent.status == 'requires_payment_method':
+                if order and order.order_status == OrderStatus.PENDING:
+                    order.order_status = OrderStatus.PROCESSING
+            elif payment_intent['status'] in ('requires_payment_method', 'canceled'):
                 payment.payment_status = PaymentStatus.FAILED
-            elif payment_intent.status == 'canceled':
-                payment.payment_status = PaymentStatus.CANCELLED
             
             db.session.commit()
+            publish_payment_status(payment)
         
         return jsonify({
             'success': True,
             'payment_intent_id': payment_intent_id,
-            'status': payment_intent.status,
-            'amount': payment_intent.amount / 100  # Convert from cents
+            'status': payment_intent['status'],
+            'amount': payment_intent['amount'] / 100  # Convert from cents
         }), 200
         
     except Exception as e:
+        db.session.rollback()
         return jsonify({"error": f"Payment confirmation failed: {str(e)}"}), 500
 
 @stripe_bp.route('/webhook', methods=['POST'])
 def stripe_webhook():
     """
     Handle Stripe webhooks for payment status updates
+
+    Events are stored once per Stripe event id and applied by the event
+    workers (see utils.stripe_events); redeliveries are acknowledged as duplicates.
     """
     payload = request.get_data(as_text=True)
     sig_header = request.headers.get('Stripe-Signature')
     
     try:
         # Verify webhook signature
-        event = stripe.Webhook.construct_event(
-            payload, sig_header, os.getenv('STRIPE_WEBHOOK_SECRET')
+        stripe.WebhookSignature.verify_header(
+            payload, sig_header, current_app.config.get('STRIPE_WEBHOOK_SECRET'), tolerance=stripe.Webhook.DEFAULT_TOLERANCE
         )
+        event = json.loads(payload)
+        if not isinstance(event, dict) or 'id' not in event:
+            raise ValueError('Not a Stripe event')
     except ValueError as e:
         return jsonify({"error": "Invalid payload"}), 400
     except stripe.error.SignatureVerificationError as e:
         return jsonify({"error": "Invalid signature"}), 400
     
-    # Handle the event
-    if event['type'] == 'payment_intent.succeeded':
-        payment_intent = event['data']['object']
-        handle_payment_success(payment_intent)
-    elif event['type'] == 'payment_intent.payment_failed':
-        payment_intent = event['data']['object']
-        handle_payment_failure(payment_intent)
-    
-    return jsonify({"success": True}), 200
-
-def handle_payment_success(payment_intent):
-    """
-    Handle successful payment
-    """
     try:
-        order_id = payment_intent.metadata.get('order_id')
-        if order_id:
-            payment = Payment.query.filter_by(order_id=order_id).first()
-            if payment:
-                payment.payment_status = PaymentStatus.COMPLETED
-                db.session.commit()
+        stored = record_event(event)
     except Exception as e:
-        current_app.logger.error(f"Error handling payment success: {str(e)}")
+        db.session.rollback()
+        current_app.logger.error(f"Error storing Stripe event {event.get('id')}: {str(e)}")
+        return jsonify({"error": "Failed to store event"}), 500
 
-def handle_payment_failure(payment_intent):
-    """
-    Handle failed payment
-    """
-    try:
-        order_id = payment_intent.metadata.get('order_id')
-        if order_id:
-            payment = Payment.query.filter_by(order_id=order_id).first()
-            if payment:
-                payment.payment_status = PaymentStatus.FAILED
-                db.session.commit()
-    except Exception as e:
-        current_app.logger.error(f"Error handling payment failure: {str(e)}")
+    return jsonify({"success": True, "duplicate": not stored}), 200
 
 @stripe_bp.route('/refund', methods=['POST'])
 @jwt_required()
@@ -214,14 +198,16 @@ def create_refund():
         
         # Verify the payment belongs to the user
         payment = Payment.query.filter_by(transaction_id=payment_intent_id).first()
-        if not payment or payment.user_id != user_id:
+        if not payment or str(payment.user_id) != str(user_id):
             return jsonify({"error": "Payment not found or unauthorized"}), 404
         
-        # Create refund
-        result = stripe_client.create_refund(
+        # Create refund (retries reuse the key, so a refund is never issued twice)
+        idempotency_key = request.headers.get(IDEMPOTENCY_HEADER, '').strip()
+        result = get_stripe_client().create_refund(
             payment_intent_id=payment_intent_id,
             amount=amount,
-            reason=reason
+            reason=reason,
+            idempotency_key=f"{user_id}:refund:{idempotency_key}" if idempotency_key else None
         )
         
         if result['success']:
@@ -236,3 +222,20 @@ def create_refund():
             
     except Exception as e:
         return jsonify({"error": f"Refund creation failed: {str(e)}"}), 500
+
+@stripe_bp.route('/metrics', methods=['GET'])
+@jwt_required()
+def stripe_metrics():
+    """
+    Latency histograms of the Stripe API calls made by this process (admin only)
+    """
+    user = User.query.get(_extract_user_id(get_jwt_identity()))
+    if not user or not user.is_admin:
+        return jsonify({"error": "Admin access required"}), 403
+
+    client = get_stripe_client()
+    return jsonify({
+        'backend': current_app.config.get('STRIPE_BACKEND', 'stripe'),
+        'max_retries': client.max_retries,
+        'operations': client.metrics()
+    }), 200
@@ -6,6 +6,8 @@ import csv
 import io
 
 from models import db, User, Supplier, Product, Order, OrderItem, UserRole
+from utils.pagination import keyset_paginate, order_by_keyset, InvalidCursor
+from utils.supplier_metrics import METRICS, supplier_metrics, supplier_metrics_subquery
 
 suppliers_bp = Blueprint('suppliers', __name__)
 
@@ -101,6 +103,29 @@ def is_admin():
         print(f"Error checking admin status: {e}")
         return False
 
+def _supplier_data(supplier, metrics):
+    """Supplier JSON with its performance metrics (see utils.supplier_metrics)"""
+    last_order = metrics['last_order'] or supplier.last_order_date
+    return {
+        'id': supplier.supplier_id,
+        'name': supplier.name,
+        'category': supplier.category,
+        'contact_person': supplier.contact_person,
+        'email': supplier.email,
+        'phone': supplier.phone,
+        'address': supplier.address,
+        'website': supplier.website,
+        'rating': float(supplier.rating) if supplier.rating else 0.0,
+        'products': metrics['products'],
+        'orders': metrics['orders'],
+        'total_spent': metrics['total_spent'],
+        'status': supplier.status,
+        'last_order': last_order.isoformat() if last_order else None,
+        'notes': supplier.notes,
+        'created_at': supplier.created_at.isoformat() if supplier.created_at else None,
+        'updated_at': supplier.updated_at.isoformat() if supplier.updated_at else None
+    }
+
 @suppliers_bp.route('/admin/suppliers', methods=['GET'])
 @jwt_required()
 def get_suppliers():
@@ -138,58 +163,37 @@ def get_suppliers():
         if status:
             query = query.filter(Supplier.status == status)
 
-        # Apply sorting
-        if hasattr(Supplier, sort_by):
+        # Apply sorting (metrics are sorted in SQL by joining their grouped subquery)
+        if sort_by in METRICS:
+            metrics = supplier_metrics_subquery()
+            query = query.join(metrics, metrics.c.supplier_id == Supplier.supplier_id)
+            sort_column = metrics.c[sort_by]
+            descending = sort_order == 'desc'
+        elif sort_by in Supplier.__table__.columns:
             sort_column = getattr(Supplier, sort_by)
-            if sort_order == 'desc':
-                query = query.order_by(desc(sort_column))
-            else:
-                query = query.order_by(asc(sort_column))
+            descending = sort_order == 'desc'
         else:
-            query = query.order_by(Supplier.name)
-
-        # Get paginated results
-        pagination = query.paginate(
-            page=page, 
-            per_page=per_page, 
-            error_out=False
-        )
-
-        suppliers = []
-        for supplier in pagination.items:
-            # Get supplier statistics
-            products_count = Product.query.filter_by(supplier_id=supplier.supplier_id).count()
-            orders_count = db.session.query(Order).join(OrderItem).join(Product).filter(
-                Product.supplier_id == supplier.supplier_id
-            ).distinct(Order.order_id).count()
-            
-            total_spent = db.session.query(func.sum(OrderItem.price * OrderItem.quantity)).join(
-                Product
-            ).filter(Product.supplier_id == supplier.supplier_id).scalar() or 0
-
-            suppliers.append({
-                'id': supplier.supplier_id,
-                'name': supplier.name,
-                'category': supplier.category,
-                'contact_person': supplier.contact_person,
-                'email': supplier.email,
-                'phone': supplier.phone,
-                'address': supplier.address,
-                'website': supplier.website,
-                'rating': float(supplier.rating) if supplier.rating else 0.0,
-                'products': products_count,
-                'orders': orders_count,
-                'total_spent': float(total_spent),
-                'status': supplier.status,
-                'last_order': supplier.last_order_date.isoformat() if supplier.last_order_date else None,
-                'notes': supplier.notes,
-                'created_at': supplier.created_at.isoformat() if supplier.created_at else None,
-                'updated_at': supplier.updated_at.isoformat() if supplier.updated_at else None
-            })
-
-        return jsonify({
-            'suppliers': suppliers,
-            'pagination': {
+            sort_column, descending = Supplier.name, False
+
+        if 'cursor' in request.args:
+            # Keyset pagination (opt-in): no OFFSET, total count optional
+            keyset_page = keyset_paginate(
+                query, sort_column, Supplier.supplier_id, descending,
+                cursor=request.args.get('cursor', ''),
+                per_page=per_page,
+                count=request.args.get('count', 'exact')
+            )
+            items = keyset_page.items
+            pagination_data = keyset_page.pagination()
+        else:
+            # Get paginated results
+            pagination = order_by_keyset(query, sort_column, Supplier.supplier_id, descending).paginate(
+                page=page, 
+                per_page=per_page, 
+                error_out=False
+            )
+            items = pagination.items
+            pagination_data = {
                 'page': page,
                 'per_page': per_page,
                 'total': pagination.total,
@@ -197,8 +201,18 @@ def get_suppliers():
                 'has_next': pagination.has_next,
                 'has_prev': pagination.has_prev
             }
+
+        # Metrics for the whole page in one grouped query
+        page_metrics = supplier_metrics(supplier.supplier_id for supplier in items)
+        suppliers = [_supplier_data(supplier, page_metrics[supplier.supplier_id]) for supplier in items]
+
+        return jsonify({
+            'suppliers': suppliers,
+            'pagination': pagination_data
         })
 
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         print(f"Error in get_suppliers: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
@@ -215,35 +229,7 @@ def get_supplier(supplier_id):
         if not supplier:
             return jsonify({'error': 'Supplier not found'}), 404
 
-        # Get supplier statistics
-        products_count = Product.query.filter_by(supplier_id=supplier.supplier_id).count()
-        orders_count = db.session.query(Order).join(OrderItem).join(Product).filter(
-            Product.supplier_id == supplier.supplier_id
-        ).distinct(Order.order_id).count()
-        
-        total_spent = db.session.query(func.sum(OrderItem.price * OrderItem.quantity)).join(
-            Product
-        ).filter(Product.supplier_id == supplier.supplier_id).scalar() or 0
-
-        supplier_data = {
-            'id': supplier.supplier_id,
-            'name': supplier.name,
-            'category': supplier.category,
-            'contact_person': supplier.contact_person,
-            'email': supplier.email,
-            'phone': supplier.phone,
-            'address': supplier.address,
-            'website': supplier.website,
-            'rating': float(supplier.rating) if supplier.rating else 0.0,
-            'products': products_count,
-            'orders': orders_count,
-            'total_spent': float(total_spent),
-            'status': supplier.status,
-            'last_order': supplier.last_order_date.isoformat() if supplier.last_order_date else None,
-            'notes': supplier.notes,
-            'created_at': supplier.created_at.isoformat() if supplier.created_at else None,
-            'updated_at': supplier.updated_at.isoformat() if supplier.updated_at else None
-        }
+        supplier_data = _supplier_data(supplier, supplier_metrics([supplier.supplier_id])[supplier.supplier_id])
 
         return jsonify(supplier_data)
 
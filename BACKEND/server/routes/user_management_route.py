@@ -2,10 +2,11 @@ from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
 from sqlalchemy import func, desc, asc
 from datetime import datetime, timedelta
-import csv
-import io
 
 from models import db, User, Order, OrderItem, Product, UserRole
+from utils.customer_metrics import order_totals
+from utils.pagination import keyset_paginate, order_by_keyset, InvalidCursor
+from utils.export import stream_query, wants_stream, stream_format, download_response, envelope_response
 
 user_management_bp = Blueprint('user_management', __name__)
 
@@ -159,42 +160,46 @@ def get_users():
                 query = query.filter(User.is_active == False)
         
         # Apply sorting
-        if hasattr(User, sort_by):
+        if sort_by in User.__table__.columns:
             sort_column = getattr(User, sort_by)
-            if sort_order == 'asc':
-                query = query.order_by(asc(sort_column))
-            else:
-                query = query.order_by(desc(sort_column))
+            descending = sort_order != 'asc'
         else:
-            query = query.order_by(desc(User.created_at))
-        
-        # Get paginated results
-        pagination = query.paginate(
-            page=page, 
-            per_page=per_page, 
-            error_out=False
-        )
-        
-        users = pagination.items
-        # Backfill last_login with current DB time for NULLs
-        from datetime import datetime
-        touched = False
-        for u in users:
-            if u.last_login is None:
-                u.last_login = datetime.utcnow()
-                touched = True
-        if touched:
-            try:
-                db.session.commit()
-            except Exception:
-                db.session.rollback()
+            sort_column, descending = User.created_at, True
+        
+        if 'cursor' in request.args:
+            # Keyset pagination (opt-in): no OFFSET, total count optional
+            keyset_page = keyset_paginate(
+                query, sort_column, User.id, descending,
+                cursor=request.args.get('cursor', ''),
+                per_page=per_page,
+                count=request.args.get('count', 'exact')
+            )
+            users = keyset_page.items
+            pagination_data = keyset_page.pagination()
+        else:
+            # Get paginated results
+            pagination = order_by_keyset(query, sort_column, User.id, descending).paginate(
+                page=page, 
+                per_page=per_page, 
+                error_out=False
+            )
+            users = pagination.items
+            pagination_data = {
+                'page': page,
+                'per_page': per_page,
+                'total': pagination.total,
+                'pages': pagination.pages,
+                'has_next': pagination.has_next,
+                'has_prev': pagination.has_prev
+            }
+        # Order statistics for the whole page in one grouped query
+        totals = order_totals(user.id for user in users)
         
         # Format user data
+        now = datetime.utcnow()
         users_data = []
         for user in users:
-            # Get user statistics
-            total_orders = Order.query.filter_by(user_id=user.id).count()
-            total_spent = db.session.query(func.coalesce(func.sum(Order.total_amount), 0)).filter_by(user_id=user.id).scalar() or 0
+            total_orders, total_spent = totals.get(user.id, (0, 0.0))
             
             user_data = {
                 'id': user.id,
@@ -205,27 +210,33 @@ def get_users():
                 'role': str(user.role),
                 'is_active': user.is_active,
                 'created_at': user.created_at.isoformat() if user.created_at else None,
-                'last_login': (user.last_login or datetime.utcnow()).isoformat(),
+                'last_login': (user.last_login or now).isoformat(),
                 # 'last_logout': user.last_logout.isoformat() if user.last_logout else None,  # Temporarily commented until migration is run
                 'total_orders': total_orders,
-                'total_spent': float(total_spent),
+                'total_spent': total_spent,
                 'phone': getattr(user, 'phone', None),
                 'address': getattr(user, 'address', None)
             }
             users_data.append(user_data)
         
+        # Backfill last_login with current DB time for NULLs in one UPDATE, after the
+        # page is serialized so the commit doesn't expire and reload every user
+        missing_login = [user.id for user in users if user.last_login is None]
+        if missing_login:
+            try:
+                User.query.filter(User.id.in_(missing_login), User.last_login.is_(None))\
+                    .update({User.last_login: now}, synchronize_session=False)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+        
         return jsonify({
             'users': users_data,
-            'pagination': {
-                'page': page,
-                'per_page': per_page,
-                'total': pagination.total,
-                'pages': pagination.pages,
-                'has_next': pagination.has_next,
-                'has_prev': pagination.has_prev
-            }
+            'pagination': pagination_data
         }), 200
         
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         print(f"Error getting users: {e}")
         return jsonify({'error': 'Internal server error'}), 500
@@ -538,41 +549,37 @@ def export_users():
         if not is_admin():
             return jsonify({'error': 'Admin access required'}), 403
         
-        # Get all users
-        users = User.query.all()
-        
-        # Create CSV
-        output = io.StringIO()
-        writer = csv.writer(output)
-        
-        # Write header
-        writer.writerow([
-            'ID', 'Username', 'Email', 'First Name', 'Last Name', 
+        header = [
+            'ID', 'Username', 'Email', 'First Name', 'Last Name',
             'Role', 'Status', 'Created At', 'Last Login', 'Phone', 'Address'  # Last Logout temporarily removed until migration is run
-        ])
-        
-        # Write data
-        for user in users:
-            writer.writerow([
-                user.id,
-                user.username,
-                user.email,
-                user.first_name or '',
-                user.last_name or '',
-                str(user.role),
-                'Active' if user.is_active else 'Inactive',
-                user.created_at.isoformat() if user.created_at else '',
-                user.last_login.isoformat() if user.last_login else '',
-        # user.last_logout.isoformat() if user.last_logout else '',  # Temporarily commented until migration is run
-                user.phone or '',
-                user.address or ''
-            ])
-        
-        output.seek(0)
-        
-        return jsonify({
-            'csv_data': output.getvalue()
-        }), 200
+        ]
+
+        # Users are streamed in batches from a server-side cursor
+        def rows():
+            users = db.session.query(
+                User.id, User.username, User.email, User.first_name, User.last_name, User.role,
+                User.is_active, User.created_at, User.last_login, User.phone, User.address
+                # User.last_logout,  # Temporarily commented until migration is run
+            ).order_by(User.id)
+            for user in stream_query(users):
+                yield [
+                    user.id,
+                    user.username,
+                    user.email,
+                    user.first_name,
+                    user.last_name,
+                    str(user.role),
+                    'Active' if user.is_active else 'Inactive',
+                    user.created_at,
+                    user.last_login,
+                    user.phone,
+                    user.address
+                ]
+
+        if wants_stream(request):
+            basename = f'users_export_{datetime.now().strftime("%Y%m%d_%H%M%S")}'
+            return download_response(basename, header, rows(), stream_format(request))
+        return envelope_response({}, 'csv_data', header, rows())
         
     except Exception as e:
         print(f"Error exporting users: {e}")
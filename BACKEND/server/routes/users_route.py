@@ -4,6 +4,7 @@ from flask_jwt_extended import  jwt_required, get_jwt_identity, create_access_to
 from datetime import datetime
 from extensions import db
 from models import User
+from utils.cart import merge_guest_cart
 
 # Blueprint Configuration
 users_bp = Blueprint('auth', __name__)
@@ -184,7 +185,7 @@ def login():
     access_token = create_access_token(identity=identity_payload, additional_claims=additional_claims)
     refresh_token = create_refresh_token(identity=identity_payload, additional_claims=additional_claims)
 
-    return jsonify({
+    response = {
         "access_token": access_token,
         "refresh_token": refresh_token,
         "message": "Login successful",
@@ -195,7 +196,13 @@ def login():
             "is_admin": is_admin_flag,
             "role": user_role
         }
-    }), 200   
+    }
+
+    # Items added while signed out ([{product_id, quantity}]) join the user's cart
+    if data.get('guest_cart'):
+        response["cart"] = merge_guest_cart(user.id, data['guest_cart'])
+
+    return jsonify(response), 200   
 
 
 
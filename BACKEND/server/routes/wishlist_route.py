@@ -1,9 +1,12 @@
 from flask import Blueprint, jsonify, request
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
 
 from extensions import db
-from models import WishlistItem, Product, ProductImage
+from models import WishlistItem, Product
+from utils.serializers import load_product_relations, primary_image_of
+from utils.image_variants import variant_path, requested_size, DEFAULT_FORMAT
 
 wishlist_bp = Blueprint("wishlist", __name__)
 
@@ -16,12 +19,8 @@ def _user_id(identity):
     return identity
 
 
-def _product_to_dict(product):
-    primary = (
-        ProductImage.query.filter_by(product_id=product.product_id, is_primary=True).first()
-        or ProductImage.query.filter_by(product_id=product.product_id).first()
-    )
-    images = ProductImage.query.filter_by(product_id=product.product_id).all()
+def _product_to_dict(product, images, size=None, fmt=DEFAULT_FORMAT):
+    primary = primary_image_of(images, fallback=True)
     return {
         "id": product.product_id,
         "product_id": product.product_id,
@@ -30,24 +29,32 @@ def _product_to_dict(product):
         "product_price": product.product_price,
         "stock_quantity": product.stock_quantity,
         "category_id": product.category_id,
-        "image_url": primary.image_url if primary else None,
+        "image_url": variant_path(primary, size, fmt) if primary else None,
         "images": [
-            {"image_url": img.image_url, "is_primary": img.is_primary} for img in images
+            {"image_url": variant_path(img, size, fmt), "is_primary": img.is_primary} for img in images
         ],
     }
 
 
+def _products_to_dicts(products):
+    size, fmt = requested_size(request.args)
+    images_by_product, _ = load_product_relations(products)
+    return [_product_to_dict(p, images_by_product.get(p.product_id, []), size, fmt) for p in products]
+
+
 @wishlist_bp.route("", methods=["GET"])
 @jwt_required()
 def list_wishlist():
     uid = _user_id(get_jwt_identity())
     if not uid:
         return jsonify({"error": "Invalid user"}), 401
-    rows = WishlistItem.query.filter_by(user_id=uid).order_by(WishlistItem.created_at.desc()).all()
-    products = []
-    for row in rows:
-        if row.product:
-            products.append(_product_to_dict(row.product))
+    rows = (
+        WishlistItem.query.filter_by(user_id=uid)
+        .options(joinedload(WishlistItem.product))
+        .order_by(WishlistItem.created_at.desc())
+        .all()
+    )
+    products = _products_to_dicts([row.product for row in rows if row.product])
     return jsonify({"items": products}), 200
 
 
@@ -66,15 +73,15 @@ def add_wishlist_item():
         return jsonify({"error": "Product not found"}), 404
     existing = WishlistItem.query.filter_by(user_id=uid, product_id=product_id).first()
     if existing:
-        return jsonify({"message": "Already in wishlist", "item": _product_to_dict(product)}), 200
+        return jsonify({"message": "Already in wishlist", "item": _products_to_dicts([product])[0]}), 200
     row = WishlistItem(user_id=uid, product_id=product_id)
     db.session.add(row)
     try:
         db.session.commit()
     except IntegrityError:
         db.session.rollback()
-        return jsonify({"message": "Already in wishlist", "item": _product_to_dict(product)}), 200
-    return jsonify({"message": "Added", "item": _product_to_dict(product)}), 201
+        return jsonify({"message": "Already in wishlist", "item": _products_to_dicts([product])[0]}), 200
+    return jsonify({"message": "Added", "item": _products_to_dicts([product])[0]}), 201
 
 
 @wishlist_bp.route("/<int:product_id>", methods=["DELETE"])
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Stripe Payment Confirmation Test
+Creates payment intents for pending orders of a throwaway SQLite database
+against the fake Stripe backend (STRIPE_BACKEND=fake), moves them to
+succeeded, canceled or left unpaid, and posts each one to
+/stripe/confirm-payment. Checks the payment and order status every outcome
+leaves behind, that another customer's intent is refused, and that the
+session still serves requests afterwards. Exits non-zero on any failed check.
+
+Usage: python test_stripe_confirm.py
+"""
+
+import logging
+import os
+import sys
+import tempfile
+
+# Point the app at a temporary database and the fake Stripe backend before it is imported
+DB_PATH = os.path.join(tempfile.mkdtemp(), 'stripe_confirm_test.db')
+os.environ['DATABASE_URL'] = f'sqlite:///{DB_PATH}'
+os.environ.setdefault('JWT_SECRET_KEY', 'benchmark-secret-key-benchmark-secret-key')
+os.environ['START_BACKGROUND_WORKERS'] = 'false'
+os.environ['STRIPE_BACKEND'] = 'fake'
+os.environ['STRIPE_FAKE_LATENCY_MS'] = '0'
+os.environ['STRIPE_FAKE_FAILURE_RATE'] = '0'
+
+# Add the current directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from flask_jwt_extended import create_access_token
+
+from app import app
+from extensions import db
+from models import User, Order, Payment, OrderStatus, PaymentStatus, UserRole
+from utils.stripe_client import get_stripe_client
+
+logging.getLogger('utils.stripe_client').setLevel(logging.ERROR)
+
+# Stripe status the intent is moved to -> (payment status, order status) expected after confirmation
+OUTCOMES = {
+    'succeeded': (PaymentStatus.COMPLETED, OrderStatus.PROCESSING),
+    'canceled': (PaymentStatus.FAILED, OrderStatus.PENDING),
+    'requires_payment_method': (PaymentStatus.FAILED, OrderStatus.PENDING),
+}
+
+
+def seed():
+    """Two customers; the first has one pending order and payment per outcome."""
+    users = []
+    for name in ('buyer', 'other'):
+        user = User(username=name, email=f'{name}@example.com', password_hash='x', role=UserRole.USER)
+        db.session.add(user)
+        db.session.flush()
+        users.append(user.id)
+    order_ids = []
+    for index in range(len(OUTCOMES)):
+        order = Order(total_amount=2500.0, order_status=OrderStatus.PENDING, status=OrderStatus.PENDING,
+                      payment_status=PaymentStatus.PENDING, shipping_address='Kimathi Street, Nairobi',
+                      user_id=users[0])
+        db.session.add(order)
+        db.session.flush()
+        db.session.add(Payment(payment_amount='2500', transaction_id=f'pending-{order.order_id}',
+                               payment_status=PaymentStatus.PENDING, order_id=order.order_id,
+                               payment_method_id=2, user_id=users[0]))
+        order_ids.append(order.order_id)
+    db.session.commit()
+    return [{'Authorization': f'Bearer {create_access_token(identity=str(user_id))}'} for user_id in users], order_ids
+
+
+def statuses(order_id):
+    with app.app_context():
+        payment = Payment.query.filter_by(order_id=order_id).first()
+        return payment.payment_status, db.session.get(Order, order_id).order_status
+
+
+def run_test():
+    with app.app_context():
+        db.create_all()
+        (headers, other_headers), order_ids = seed()
+        backend = get_stripe_client(app).backend
+
+    client = app.test_client()
+    failures = []
+
+    def check(condition, message):
+        print(f"   {'✅' if condition else '❌'} {message}")
+        if not condition:
+            failures.append(message)
+
+    for (stripe_status, expected), order_id in zip(OUTCOMES.items(), order_ids):
+        response = client.post('/stripe/create-payment-intent', json={'amount': 2500, 'order_id': order_id},
+                               headers=headers)
+        if response.status_code != 200:
+            raise RuntimeError(f"create-payment-intent returned {response.status_code}: {response.get_json()}")
+        payment_intent_id = response.get_json()['payment_intent_id']
+        backend.payment_intents[payment_intent_id]['status'] = stripe_status
+
+        if stripe_status == 'succeeded':
+            response = client.post('/stripe/confirm-payment', json={'payment_intent_id': payment_intent_id},
+                                   headers=other_headers)
+            check(response.status_code == 403, "another customer's intent is refused")
+
+        response = client.post('/stripe/confirm-payment', json={'payment_intent_id': payment_intent_id},
+                               headers=headers)
+        body = response.get_json()
+        check(response.status_code == 200 and body['status'] == stripe_status,
+              f"{stripe_status}: confirm-payment answers 200 ({response.status_code}: {body})")
+        payment_status, order_status = statuses(order_id)
+        check((payment_status, order_status) == expected,
+              f"{stripe_status}: payment {payment_status.name}, order {order_status.name}")
+
+    response = client.post('/stripe/confirm-payment', json={'payment_intent_id': 'pi_missing'}, headers=headers)
+    check(response.status_code == 400, "an unknown intent is reported as a client error")
+    response = client.get('/cart/summary', headers=headers)
+    check(response.status_code == 200, "later requests are served normally")
+
+    if failures:
+        print(f"\n❌ {len(failures)} payment confirmation checks failed")
+        return 1
+    print("\n✅ Every Stripe outcome is recorded by /stripe/confirm-payment")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(run_test())
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Upload Storage Reference-Count Test
+Uploads the same image for two products in a throwaway SQLite database and
+upload folder, then deletes the products one by one (DELETE /api/<id>, then
+DELETE /api/admin/bulk-delete). The shared blob's stored_files.ref_count must
+go down with each delete, and the blob and its variants must be removed from
+disk once nothing references them. Exits non-zero on any failed check.
+
+Usage: python test_upload_storage.py
+"""
+
+import io
+import os
+import sys
+import tempfile
+
+# Point the app at a temporary database before it is imported
+TEMP_DIR = tempfile.mkdtemp()
+DB_PATH = os.path.join(TEMP_DIR, 'upload_storage_test.db')
+os.environ['DATABASE_URL'] = f'sqlite:///{DB_PATH}'
+os.environ.setdefault('JWT_SECRET_KEY', 'benchmark-secret-key-benchmark-secret-key')
+os.environ['START_BACKGROUND_WORKERS'] = 'false'
+
+# Add the current directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from flask_jwt_extended import create_access_token
+
+from app import app
+from extensions import db
+from models import User, Category, Product, StoredFile, UserRole
+from utils import image_variants
+from utils.storage import absolute_path
+
+UPLOAD_FOLDER = os.path.join(TEMP_DIR, 'uploads')
+
+
+def image_bytes():
+    """A small JPEG (Pillow is optional: any bytes do when no variants are generated)."""
+    pillow = image_variants._pillow()
+    if pillow is None:
+        return b'\xff\xd8\xff\xe0 not really a jpeg'
+    Image, _ = pillow
+    buffer = io.BytesIO()
+    Image.new('RGB', (640, 480), (120, 80, 40)).save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+def wait_for_variants():
+    """Block until the single variant worker has finished every queued image."""
+    if image_variants._executor is not None:
+        image_variants._executor.submit(lambda: None).result(timeout=60)
+
+
+def ref_count(path):
+    with app.app_context():
+        stored = db.session.get(StoredFile, path)
+        return stored.ref_count if stored else None
+
+
+def variant_files():
+    variants_dir = os.path.join(UPLOAD_FOLDER, image_variants.VARIANTS_DIR)
+    return sorted(os.listdir(variants_dir)) if os.path.isdir(variants_dir) else []
+
+
+def run_test():
+    os.makedirs(UPLOAD_FOLDER)
+    app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+    app.config['IMAGE_VARIANT_WORKERS'] = 1
+
+    with app.app_context():
+        db.create_all()
+        category = Category(category_name='Sofas', name='Sofas', category_description='Sofas')
+        admin = User(username='admin', email='admin@example.com', password_hash='x',
+                     role=UserRole.ADMIN, is_admin=True)
+        db.session.add_all([category, admin])
+        db.session.commit()
+        category_id = category.category_id
+        headers = {'Authorization': f'Bearer {create_access_token(identity=str(admin.id))}'}
+
+    client = app.test_client()
+    content = image_bytes()
+    product_ids = []
+    for name in ('Sofa A', 'Sofa B'):
+        response = client.post('/api/product', headers=headers, content_type='multipart/form-data', data={
+            'product_name': name,
+            'product_description': 'Three-seater',
+            'product_price': '15000',
+            'stock_quantity': '3',
+            'category_id': str(category_id),
+            'images': (io.BytesIO(content), 'sofa.jpg'),
+        })
+        if response.status_code != 201:
+            raise RuntimeError(f"Creating {name} returned {response.status_code}: {response.get_json()}")
+        product_ids.append(response.get_json()['product_id'])
+    wait_for_variants()
+
+    with app.app_context():
+        paths = {image.image_url for product_id in product_ids for image in db.session.get(Product, product_id).images}
+    failures = []
+
+    def check(condition, message):
+        print(f"   {'✅' if condition else '❌'} {message}")
+        if not condition:
+            failures.append(message)
+
+    check(len(paths) == 1, "both products point at one stored blob")
+    path = paths.pop()
+    blob = absolute_path(path, UPLOAD_FOLDER)
+    variants = variant_files()
+    check(ref_count(path) == 2, "the blob is referenced twice")
+
+    response = client.delete(f'/api/{product_ids[0]}', headers=headers)
+    check(response.status_code == 200, "DELETE /api/<id> succeeds")
+    check(ref_count(path) == 1, "deleting the first product drops the count to 1")
+    check(os.path.exists(blob), "the blob stays on disk while still referenced")
+    check(variant_files() == variants, "its variants stay on disk while still referenced")
+
+    response = client.delete('/api/admin/bulk-delete', headers=headers, json={'product_ids': [product_ids[1]]})
+    check(response.status_code == 200, "DELETE /api/admin/bulk-delete succeeds")
+    check(ref_count(path) is None, "deleting the last product removes the stored_files row")
+    check(not os.path.exists(blob), "the unreferenced blob is removed from disk")
+    check(variant_files() == [], "its variants are removed from disk")
+
+    if failures:
+        print(f"\n❌ {len(failures)} upload storage checks failed")
+        return 1
+    print("\n✅ Deleting products releases their shared uploads")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(run_test())
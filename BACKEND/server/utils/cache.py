@@ -0,0 +1,332 @@
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import request, current_app, make_response
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+# Response cache for anonymous catalog endpoints.
+#
+# Views decorated with @cache.cached(tags=...) store their 200 responses under
+# the request URL. Each entry is tagged with the entities it was built from
+# (product:<id>, category:<id>, products, blog, ...). When a session commits,
+# the tags of every row it inserted, updated or deleted are invalidated, so
+# only the affected entries are dropped.
+
+ALL_TAGS = '*'
+
+# Tables whose rows end up in cached responses
+CATALOG_TABLES = ('products', 'product_images', 'categories', 'blog_posts', 'blog_images',
+                  'social_media_posts', 'social_media_stats')
+
+# Columns whose changes never show up in cached responses
+IGNORED_COLUMNS = {
+    'blog_posts': {'view_count', 'updated_at'},
+    'products': {'updated_at'},
+}
+
+
+def tags_for(obj):
+    """Cache tags affected by a change to `obj` (keyed on table name to avoid importing models)."""
+    table = getattr(obj, '__tablename__', None)
+    if table == 'products':
+        tags = ['products', f'product:{obj.product_id}']
+        # A product moved between categories affects both of them
+        history = inspect(obj).attrs.category_id.history
+        for category_id in {obj.category_id, *history.deleted}:
+            if category_id:
+                tags.append(f'category:{category_id}')
+        return tags
+    if table == 'product_images':
+        return ['products', f'product:{obj.product_id}']
+    if table == 'categories':
+        return ['categories', f'category:{obj.category_id}']
+    if table in ('blog_posts', 'blog_images'):
+        return ['blog']
+    if table in ('social_media_posts', 'social_media_stats'):
+        return ['social']
+    if table in ('order_items', 'reviews'):
+        return ['bestsellers']
+    return []
+
+
+def flush_tags(session):
+    """Tags of the rows inserted, updated or deleted by the flush in progress."""
+    tags = set()
+    for obj in session.new:
+        tags.update(tags_for(obj))
+    for obj in session.deleted:
+        tags.update(tags_for(obj))
+    for obj in session.dirty:
+        if session.is_modified(obj) and _changed_columns_matter(obj):
+            tags.update(tags_for(obj))
+    return tags
+
+
+def bulk_write_table(orm_execute_state):
+    """
+    Catalog table targeted by a Query.update()/delete(), or None.
+
+    Bulk statements bypass the unit of work, so the affected rows (and their tags) are unknown.
+    """
+    if not (orm_execute_state.is_update or orm_execute_state.is_delete):
+        return None
+    mapper = orm_execute_state.bind_arguments.get('mapper')
+    table = mapper.local_table.name if mapper is not None else None
+    return table if table in CATALOG_TABLES else None
+
+
+class MemoryBackend:
+    """In-process LRU with per-entry TTL and a tag -> keys index."""
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, tags, value = entry
+            if expires_at < time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, tags, ttl):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + ttl, tags, value)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate(self, tags):
+        with self._lock:
+            if ALL_TAGS in tags:
+                removed = len(self._entries)
+                self._entries.clear()
+                self._tags.clear()
+                return removed
+            removed = 0
+            for tag in tags:
+                for key in self._tags.pop(tag, set()):
+                    if key in self._entries:
+                        self._remove(key)
+                        removed += 1
+            return removed
+
+    def _remove(self, key):
+        _, tags, _ = self._entries.pop(key)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def size(self):
+        return len(self._entries)
+
+
+class RedisBackend:
+    """Redis-compatible backend; entries are JSON strings, tags are sets of keys."""
+
+    def __init__(self, url, prefix='vitrax:cache:'):
+        import redis  # optional dependency
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self.evictions = 0
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        return json.loads(raw) if raw else None
+
+    def set(self, key, value, tags, ttl):
+        pipe = self.client.pipeline()
+        pipe.setex(self.prefix + key, ttl, json.dumps(value))
+        for tag in tags:
+            pipe.sadd(f'{self.prefix}tag:{tag}', key)
+            pipe.expire(f'{self.prefix}tag:{tag}', ttl)
+        pipe.execute()
+
+    def invalidate(self, tags):
+        if ALL_TAGS in tags:
+            keys = list(self.client.scan_iter(match=self.prefix + '*'))
+            if keys:
+                self.client.delete(*keys)
+            return len(keys)
+        removed = 0
+        for tag in tags:
+            tag_key = f'{self.prefix}tag:{tag}'
+            keys = self.client.smembers(tag_key)
+            if keys:
+                removed += self.client.delete(*[self.prefix + k.decode() for k in keys])
+            self.client.delete(tag_key)
+        return removed
+
+    def size(self):
+        return None
+
+
+class ResponseCache:
+    """Tag-invalidated response cache, initialised like the other extensions via init_app."""
+
+    def __init__(self):
+        self.backend = None
+        self.enabled = False
+        self.default_ttl = 300
+        self._stats = {'hits': 0, 'misses': 0, 'stores': 0, 'invalidations': 0, 'invalidated_entries': 0}
+        self._stats_lock = threading.Lock()
+
+    def init_app(self, app):
+        self.enabled = app.config.get('CACHE_ENABLED', True)
+        self.default_ttl = app.config.get('CACHE_DEFAULT_TTL', 300)
+        backend = app.config.get('CACHE_BACKEND', 'memory')
+        if backend == 'redis':
+            try:
+                self.backend = RedisBackend(app.config.get('CACHE_REDIS_URL', 'redis://localhost:6379/0'))
+            except ImportError:
+                logger.warning("CACHE_BACKEND=redis but the redis package is not installed; using memory cache")
+        if self.backend is None:
+            self.backend = MemoryBackend(app.config.get('CACHE_MAX_ENTRIES', 1024))
+        app.extensions['response_cache'] = self
+
+    def _count(self, name, amount=1):
+        with self._stats_lock:
+            self._stats[name] += amount
+
+    def stats(self):
+        """Hit/miss counters for this process."""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+        stats['backend'] = type(self.backend).__name__ if self.backend else None
+        stats['entries'] = self.backend.size() if self.backend else 0
+        stats['evictions'] = getattr(self.backend, 'evictions', 0)
+        return stats
+
+    def invalidate(self, tags):
+        """Drop every entry carrying any of `tags`."""
+        if not self.backend or not tags:
+            return
+        try:
+            removed = self.backend.invalidate(set(tags))
+            self._count('invalidations')
+            self._count('invalidated_entries', removed or 0)
+        except Exception as e:
+            logger.error(f"Cache invalidation failed for {tags}: {str(e)}")
+
+    def _key(self):
+        args = '&'.join(f'{k}={v}' for k, v in sorted(request.args.items(multi=True)))
+        return f'{request.host_url}{request.path}?{args}'
+
+    def cached(self, tags, ttl=None):
+        """
+        Cache a GET view's successful responses.
+
+        Args:
+            tags (list | callable): Tags for the entry, or a function of the view kwargs returning them
+            ttl (int): Seconds to keep the entry (defaults to CACHE_DEFAULT_TTL)
+        """
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if not self.enabled or self.backend is None or request.method != 'GET':
+                    return view(*args, **kwargs)
+
+                key = self._key()
+                try:
+                    entry = self.backend.get(key)
+                except Exception as e:
+                    logger.error(f"Cache read failed: {str(e)}")
+                    entry = None
+
+                if entry is not None:
+                    self._count('hits')
+                    response = current_app.response_class(
+                        entry['body'], status=entry['status'], headers=entry['headers']
+                    )
+                    response.headers['X-Cache'] = 'HIT'
+                    return response
+
+                self._count('misses')
+                response = make_response(view(*args, **kwargs))
+                if response.status_code == 200 and not response.direct_passthrough:
+                    entry_tags = tags(**kwargs) if callable(tags) else list(tags)
+                    headers = [(k, v) for k, v in response.headers.items()
+                               if k not in ('Content-Length', 'Set-Cookie')]
+                    try:
+                        self.backend.set(key, {
+                            'body': response.get_data(as_text=True),
+                            'status': response.status_code,
+                            'headers': headers,
+                        }, entry_tags, ttl or self.default_ttl)
+                        self._count('stores')
+                    except Exception as e:
+                        logger.error(f"Cache write failed: {str(e)}")
+                response.headers['X-Cache'] = 'MISS'
+                return response
+            return wrapper
+        return decorator
+
+
+cache = ResponseCache()
+
+
+###########################################################################################################################################
+# Invalidation hooks: collect tags while flushing, apply them once the transaction commits
+
+def _changed_columns_matter(obj):
+    ignored = IGNORED_COLUMNS.get(getattr(obj, '__tablename__', None))
+    if not ignored:
+        return True
+    state = inspect(obj)
+    return any(
+        attr.key not in ignored and attr.history.has_changes()
+        for attr in state.attrs
+    )
+
+
+def add_tags(session, tags):
+    """Invalidate `tags` once the session's transaction commits (rows written with Core statements)."""
+    session.info.setdefault('cache_tags', set()).update(tags)
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_cache_tags(session, flush_context):
+    session.info.setdefault('cache_tags', set()).update(flush_tags(session))
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _collect_bulk_cache_tags(orm_execute_state):
+    if bulk_write_table(orm_execute_state):
+        orm_execute_state.session.info.setdefault('cache_tags', set()).add(ALL_TAGS)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_committed(session):
+    tags = session.info.pop('cache_tags', None)
+    if tags:
+        cache.invalidate(tags)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_rolled_back(session, previous_transaction):
+    session.info.pop('cache_tags', None)
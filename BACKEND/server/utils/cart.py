@@ -0,0 +1,379 @@
+import logging
+from decimal import Decimal, ROUND_HALF_UP
+
+from sqlalchemy import select, insert, update, func, and_
+
+from extensions import db
+from models import ShoppingCart, CartItem, Product, ProductImage
+from utils.image_variants import variant_path, DEFAULT_FORMAT
+
+logger = logging.getLogger(__name__)
+
+# Cart read model.
+#
+# The cart badge and mini-cart load the cart on every page. GET /cart used
+# to walk cart.cart_items and look up each item's product and primary image
+# separately (2N+2 queries); it is now built from one statement joining the
+# cart, its items, their products and primary images. GET /cart/summary
+# reads the count and total stored on the shopping_carts row alone.
+#
+# Amounts are integer minor units (cents): cart_items.price_cents is the unit
+# price when the item was added, shopping_carts.total_cents the sum over the
+# items. Instead of reloading and re-summing every item after each change, a
+# mutation locks the cart row (lock_cart), changes the item and adds the
+# difference to the cart's count and total with one UPDATE
+# (adjust_cart_totals). `flask rebuild-cart-totals` recomputes them all.
+#
+# PATCH /cart/items applies a list of {product_id, quantity, mode} changes
+# (a room set, say) with apply_cart_changes: one query loads the products
+# with their cart items to check stock, then all changes are applied with a
+# single totals update in one transaction, or none if any fails. Merging a
+# guest cart into the user's cart at login takes the same path, clamping
+# quantities to the stock left instead of failing. A merge raises each
+# product to the larger of the two carts' quantities rather than adding them,
+# so a login retried with the same guest cart leaves the cart as it was.
+
+CHANGE_MODES = ('add', 'set', 'remove')
+MERGE_MODE = 'max'  # guest cart merges only: raise the quantity to at least the given one
+MAX_BATCH_ITEMS = 100
+
+
+class CartChangeError(Exception):
+    """Raised when some changes of a batch can't be applied; none of them is."""
+
+    def __init__(self, items):
+        super().__init__('Some cart changes could not be applied')
+        self.items = items  # [{'index', 'product_id', 'error', ...}]
+
+
+def to_cents(amount):
+    """Minor units of a price (float, string or Decimal), rounded half up."""
+    return int((Decimal(str(amount)) * 100).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+
+
+def format_cents(cents):
+    """'1234.50' for 123450, the string shape prices have in cart responses."""
+    return f"{Decimal(int(cents or 0)) / 100:.2f}"
+
+
+def _user_cart_id(user_id):
+    # A user's cart is their first one, as ShoppingCart.query.filter_by(user_id=...).first() finds it
+    return (
+        select(func.min(ShoppingCart.shopping_cart_id))
+        .where(ShoppingCart.user_id == user_id)
+        .scalar_subquery()
+    )
+
+
+def _item_to_dict(item, product, primary_image, size, fmt):
+    return {
+        'cart_item_id': item.cart_item_id,
+        'product_id': product.product_id,
+        'product_name': product.product_name,
+        'description': product.product_description,
+        'price': format_cents(item.price_cents),
+        'quantity': item.quantity,
+        'image_url': variant_path(primary_image, size, fmt) if primary_image else None,
+        'stock_available': product.stock_quantity,
+        'added_at': item.added_at.isoformat() if item.added_at else None,
+        'max_allowed': min(product.stock_quantity, 10)  # Example limit
+    }
+
+
+def load_cart(user_id, size=None, fmt=DEFAULT_FORMAT):
+    """
+    A user's cart with its items in one query.
+
+    Items whose product no longer exists are left out; a product with
+    several primary images shows the oldest.
+
+    Args:
+        user_id (int): Cart owner
+        size (str): Image variant to link ('thumbnail', 'card', 'detail'); None for originals
+        fmt (str): Variant format, 'webp' or 'jpeg'
+
+    Returns:
+        dict: Cart in the GET /cart shape, or None if the user has no cart
+    """
+    rows = (
+        db.session.query(ShoppingCart, CartItem, Product, ProductImage)
+        .outerjoin(CartItem, CartItem.shopping_cart_id == ShoppingCart.shopping_cart_id)
+        .outerjoin(Product, Product.product_id == CartItem.product_id)
+        .outerjoin(ProductImage, and_(
+            ProductImage.product_id == Product.product_id,
+            ProductImage.is_primary.is_(True)
+        ))
+        .filter(ShoppingCart.shopping_cart_id == _user_cart_id(user_id))
+        .order_by(CartItem.cart_item_id, ProductImage.image_id)
+        .all()
+    )
+    if not rows:
+        return None
+
+    cart = rows[0][0]
+    items, seen = [], set()
+    for _, item, product, primary_image in rows:
+        if item is None or product is None or item.cart_item_id in seen:
+            continue
+        seen.add(item.cart_item_id)
+        items.append(_item_to_dict(item, product, primary_image, size, fmt))
+
+    return {
+        'shopping_cart_id': cart.shopping_cart_id,
+        'user_id': cart.user_id,
+        'total_price': format_cents(cart.total_cents),
+        'items_count': cart.shopping_quantity,
+        'created_at': cart.created_at.isoformat() if cart.created_at else None,
+        'updated_at': cart.updated_at.isoformat() if cart.updated_at else None,
+        'items': items
+    }
+
+
+def cart_summary(user_id):
+    """Item count and total of a user's cart, read from the shopping_carts row without touching its items."""
+    row = db.session.execute(
+        select(
+            ShoppingCart.shopping_cart_id,
+            ShoppingCart.shopping_quantity,
+            ShoppingCart.total_cents,
+            ShoppingCart.updated_at
+        ).where(ShoppingCart.shopping_cart_id == _user_cart_id(user_id))
+    ).first()
+    if row is None:
+        return {
+            'shopping_cart_id': None,
+            'items_count': 0,
+            'total_price': "0.00",
+            'updated_at': None
+        }
+    return {
+        'shopping_cart_id': row.shopping_cart_id,
+        'items_count': row.shopping_quantity or 0,
+        'total_price': format_cents(row.total_cents),
+        'updated_at': row.updated_at.isoformat() if row.updated_at else None
+    }
+
+
+def lock_cart(user_id):
+    """
+    A user's cart, locked until the transaction ends (FOR UPDATE on PostgreSQL),
+    so concurrent changes to it apply their deltas one after the other.
+    """
+    return (
+        ShoppingCart.query.filter(ShoppingCart.shopping_cart_id == _user_cart_id(user_id))
+        .with_for_update()
+        .first()
+    )
+
+
+def adjust_cart_totals(cart, quantity_delta, cents_delta):
+    """
+    Add an item change to the cart's stored count and total, in the caller's transaction.
+
+    Args:
+        cart (ShoppingCart): Cart the change was made to
+        quantity_delta (int): Change in the number of units
+        cents_delta (int): Change in value, price_cents * units
+
+    Returns:
+        tuple: The cart's new (shopping_quantity, total_cents)
+    """
+    row = db.session.execute(
+        update(ShoppingCart)
+        .where(ShoppingCart.shopping_cart_id == cart.shopping_cart_id)
+        .values(
+            shopping_quantity=func.coalesce(ShoppingCart.shopping_quantity, 0) + quantity_delta,
+            total_cents=ShoppingCart.total_cents + cents_delta,
+            updated_at=func.current_timestamp()
+        )
+        .returning(ShoppingCart.shopping_quantity, ShoppingCart.total_cents)
+    ).one()
+    return row.shopping_quantity, row.total_cents
+
+
+def rebuild_cart_totals():
+    """Recompute every cart's count and total from its items; returns the number of carts."""
+    items_of_cart = CartItem.shopping_cart_id == ShoppingCart.shopping_cart_id
+    result = db.session.execute(
+        update(ShoppingCart).values(
+            shopping_quantity=func.coalesce(
+                select(func.sum(CartItem.quantity)).where(items_of_cart).scalar_subquery(), 0
+            ),
+            total_cents=func.coalesce(
+                select(func.sum(CartItem.price_cents * CartItem.quantity)).where(items_of_cart).scalar_subquery(), 0
+            )
+        ).execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+def parse_cart_changes(items, mode=None):
+    """
+    Validate the entries of a cart batch.
+
+    Args:
+        items (list): {product_id, quantity, mode} dicts; mode is 'add' (default), 'set' or 'remove'
+        mode (str): Mode every entry gets, ignoring theirs (e.g. 'add' for guest carts)
+
+    Returns:
+        list: (product_id, quantity, mode) tuples in request order
+
+    Raises:
+        ValueError: With a message naming the first invalid entry
+    """
+    if not isinstance(items, list) or not items:
+        raise ValueError("items must be a non-empty list")
+    if len(items) > MAX_BATCH_ITEMS:
+        raise ValueError(f"At most {MAX_BATCH_ITEMS} items can be changed at once")
+
+    changes = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or 'product_id' not in item:
+            raise ValueError(f"items[{index}]: product_id is required")
+        item_mode = mode or item.get('mode', 'add')
+        if item_mode not in CHANGE_MODES:
+            raise ValueError(f"items[{index}]: mode must be one of {', '.join(CHANGE_MODES)}")
+        try:
+            product_id = int(item['product_id'])
+            quantity = int(item.get('quantity', 0 if item_mode == 'remove' else 1))
+        except (ValueError, TypeError):
+            raise ValueError(f"items[{index}]: invalid product_id or quantity")
+        if item_mode == 'add' and quantity <= 0:
+            raise ValueError(f"items[{index}]: quantity must be at least 1")
+        if item_mode == 'set' and quantity < 0:
+            raise ValueError(f"items[{index}]: quantity can't be negative")
+        changes.append((product_id, quantity, item_mode))
+    return changes
+
+
+def apply_cart_changes(user_id, changes, merge=False):
+    """
+    Apply a batch of item changes to a user's cart in the caller's transaction.
+
+    Changes apply in order, so several entries for one product add up. Stock
+    is checked against the quantity each product ends with.
+
+    Args:
+        user_id (int): Cart owner (the cart is created if missing)
+        changes (list): (product_id, quantity, mode) tuples from parse_cart_changes(), or with MERGE_MODE
+        merge (bool): Skip missing products and cap quantities at the stock
+            left instead of rejecting the batch (guest cart merges)
+
+    Returns:
+        dict: cart_total, items_count, the resulting items and the skipped or capped entries
+
+    Raises:
+        CartChangeError: Some change can't be applied (only when not merging); nothing was changed
+    """
+    cart = lock_cart(user_id)
+    if not cart:
+        cart = ShoppingCart(user_id=user_id, total_cents=0, shopping_quantity=0)
+        db.session.add(cart)
+        db.session.flush()
+
+    # Products and the cart's items for them, in one query
+    product_ids = list(dict.fromkeys(product_id for product_id, _, _ in changes))
+    found = {}
+    for product, item in (
+        db.session.query(Product, CartItem)
+        .outerjoin(CartItem, and_(
+            CartItem.product_id == Product.product_id,
+            CartItem.shopping_cart_id == cart.shopping_cart_id
+        ))
+        .filter(Product.product_id.in_(product_ids))
+        .order_by(Product.product_id, CartItem.cart_item_id)
+    ):
+        found.setdefault(product.product_id, (product, item))
+
+    quantities = {product_id: (item.quantity if item else 0) for product_id, (product, item) in found.items()}
+    errors, skipped = [], []
+    for index, (product_id, quantity, mode) in enumerate(changes):
+        if product_id not in found:
+            (skipped if merge else errors).append({'index': index, 'product_id': product_id, 'error': "Product not found"})
+            continue
+        current = quantities[product_id]
+        if mode == MERGE_MODE and quantity <= current:
+            continue
+        wanted = current + quantity if mode == 'add' else quantity if mode in ('set', MERGE_MODE) else 0
+        stock = found[product_id][0].stock_quantity
+        if wanted > stock:
+            problem = {'index': index, 'product_id': product_id, 'error': "Not enough stock available",
+                       'requested': wanted, 'stock_available': stock}
+            if not merge:
+                errors.append(problem)
+                continue
+            wanted = max(current, stock)  # never take away what the user's cart already held
+            skipped.append(dict(problem, quantity=wanted))
+        quantities[product_id] = wanted
+    if errors:
+        raise CartChangeError(errors)
+
+    quantity_delta = cents_delta = 0
+    item_ids, new_items = {}, []
+    for product_id, wanted in quantities.items():
+        product, item = found[product_id]
+        current = item.quantity if item else 0
+        if item is not None:
+            item_ids[product_id] = item.cart_item_id
+        if wanted == current:
+            continue
+        price_cents = item.price_cents if item else to_cents(product.product_price)
+        if item is None:
+            new_items.append({
+                'shopping_cart_id': cart.shopping_cart_id,
+                'product_id': product_id,
+                'price_cents': price_cents,
+                'quantity': wanted
+            })
+        elif wanted == 0:
+            db.session.delete(item)
+        else:
+            item.quantity = wanted
+        quantity_delta += wanted - current
+        cents_delta += (wanted - current) * price_cents
+
+    # New items in one multi-row INSERT (the ORM would insert them one by one to fetch their ids)
+    if new_items:
+        items_table = CartItem.__table__
+        for row in db.session.execute(
+            insert(items_table).values(new_items).returning(items_table.c.product_id, items_table.c.cart_item_id)
+        ):
+            item_ids[row.product_id] = row.cart_item_id
+
+    items_count, total_cents = adjust_cart_totals(cart, quantity_delta, cents_delta)
+    return {
+        'shopping_cart_id': cart.shopping_cart_id,
+        'cart_total': format_cents(total_cents),
+        'items_count': items_count,
+        'items': [{
+            'product_id': product_id,
+            'cart_item_id': item_ids.get(product_id) if quantities[product_id] else None,
+            'quantity': quantities[product_id]
+        } for product_id in product_ids if product_id in found],
+        'skipped': skipped
+    }
+
+
+def merge_guest_cart(user_id, items):
+    """
+    Merge the items of a guest (signed-out) cart into a user's cart and commit; never raises.
+
+    Each product ends with the larger of its quantity in the two carts (capped
+    at the stock left), so merging the same guest cart twice changes nothing.
+
+    Returns:
+        dict: apply_cart_changes() result, or None if nothing could be merged
+    """
+    try:
+        guest = {}
+        for product_id, quantity, _ in parse_cart_changes(items, mode='add'):
+            guest[product_id] = guest.get(product_id, 0) + quantity
+        changes = [(product_id, quantity, MERGE_MODE) for product_id, quantity in guest.items()]
+        result = apply_cart_changes(user_id, changes, merge=True)
+        db.session.commit()
+        return result
+    except Exception as e:
+        db.session.rollback()
+        logger.warning(f"Could not merge guest cart of user {user_id}: {str(e)}")
+        return None
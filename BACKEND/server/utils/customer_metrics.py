@@ -0,0 +1,193 @@
+from sqlalchemy import event, func, case, select, inspect, delete
+from sqlalchemy.orm import Session
+
+from extensions import db
+from models import CustomerMetrics, Order, OrderStatus, User
+from utils.upsert import insert_missing
+
+# Customer metrics.
+#
+# customer_metrics holds one row per customer with orders: order count,
+# delivered order count, lifetime value (total of delivered orders), first
+# and last order dates and a value segment. The rows of the customers
+# touched by a flush are recomputed from their orders in the same
+# transaction, so segmentation, top-customer and customer-list endpoints
+# read one row per customer instead of grouping orders on every request.
+# `flask rebuild-customer-metrics` recomputes every customer in one pass.
+
+HIGH_VALUE = 1000
+MEDIUM_VALUE = 500
+SEGMENTS = ('High Value', 'Medium Value', 'Low Value')
+BATCH_SIZE = 1000
+
+metrics_table = CustomerMetrics.__table__
+orders_table = Order.__table__
+
+# Order columns whose change can move a customer's metrics
+TRACKED_COLUMNS = ('user_id', 'order_status', 'total_amount', 'order_date')
+
+
+def segment_for(lifetime_value):
+    """Value segment name for a lifetime value."""
+    if lifetime_value >= HIGH_VALUE:
+        return 'High Value'
+    if lifetime_value >= MEDIUM_VALUE:
+        return 'Medium Value'
+    return 'Low Value'
+
+
+def _aggregate(user_ids=None):
+    """One GROUP BY user_id pass over orders (optionally limited to some customers)."""
+    delivered = orders_table.c.order_status == OrderStatus.DELIVERED
+    query = select(
+        orders_table.c.user_id,
+        func.count(orders_table.c.order_id),
+        func.coalesce(func.sum(case((delivered, 1), else_=0)), 0),
+        func.coalesce(func.sum(case((delivered, orders_table.c.total_amount), else_=0)), 0),
+        func.min(orders_table.c.order_date),
+        func.max(orders_table.c.order_date)
+    ).where(orders_table.c.user_id.isnot(None))
+    if user_ids is not None:
+        query = query.where(orders_table.c.user_id.in_(user_ids))
+    return query.group_by(orders_table.c.user_id)
+
+
+def _metrics_row(user_id, order_count, delivered_count, lifetime_value, first_order_date, last_order_date):
+    return {
+        'user_id': user_id,
+        'order_count': order_count,
+        'delivered_count': int(delivered_count),
+        'lifetime_value': float(lifetime_value),
+        'first_order_date': first_order_date,
+        'last_order_date': last_order_date,
+        'segment': segment_for(float(lifetime_value))
+    }
+
+
+def refresh_customers(connection, user_ids):
+    """
+    Recompute the metrics rows of some customers in the caller's transaction.
+
+    Customers left without orders lose their row.
+
+    Args:
+        connection: Connection bound to the current transaction
+        user_ids (iterable): Customer ids
+    """
+    user_ids = sorted(set(user_ids))
+    if not user_ids:
+        return
+
+    rows = [_metrics_row(*row) for row in connection.execute(_aggregate(user_ids))]
+    insert_missing(connection, metrics_table, 'user_id', [{'user_id': row['user_id']} for row in rows])
+    for row in rows:
+        connection.execute(
+            metrics_table.update().where(metrics_table.c.user_id == row['user_id'])
+            .values(updated_at=func.current_timestamp(), **row)
+        )
+
+    without_orders = set(user_ids) - {row['user_id'] for row in rows}
+    if without_orders:
+        connection.execute(delete(metrics_table).where(metrics_table.c.user_id.in_(without_orders)))
+
+
+def _affected_customers(session):
+    user_ids = set()
+    for obj in session.new:
+        if isinstance(obj, Order):
+            user_ids.add(obj.user_id)
+    for obj in session.deleted:
+        if isinstance(obj, Order):
+            history = inspect(obj).attrs.user_id.history
+            user_ids.update(history.deleted or [obj.user_id])
+    for obj in session.dirty:
+        if isinstance(obj, Order):
+            attrs = inspect(obj).attrs
+            if any(attrs[column].history.has_changes() for column in TRACKED_COLUMNS):
+                user_ids.add(obj.user_id)
+                user_ids.update(attrs.user_id.history.deleted)
+    user_ids.discard(None)
+    return user_ids
+
+
+@event.listens_for(Session, 'after_flush')
+def _update_customer_metrics(session, flush_context):
+    """Keep customer_metrics in step with the orders written in this flush."""
+    user_ids = _affected_customers(session)
+    if user_ids:
+        refresh_customers(session.connection(), user_ids)
+
+
+def rebuild_customer_metrics():
+    """
+    Recompute customer_metrics for every customer in one pass over orders.
+
+    Returns:
+        int: Number of metrics rows written
+    """
+    rows = [_metrics_row(*row) for row in db.session.execute(_aggregate())]
+    db.session.execute(metrics_table.delete())
+    for start in range(0, len(rows), BATCH_SIZE):
+        db.session.execute(metrics_table.insert(), rows[start:start + BATCH_SIZE])
+    db.session.commit()
+    return len(rows)
+
+
+###########################################################################################################################################
+# Readers
+
+def customer_metrics_query(*entities, active_since=None):
+    """Query over non-admin customers joined to their metrics, optionally only those who ordered since a date."""
+    query = db.session.query(*entities)\
+        .select_from(CustomerMetrics)\
+        .join(User, User.id == CustomerMetrics.user_id)\
+        .filter(User.is_admin == False)
+    if active_since is not None:
+        query = query.filter(CustomerMetrics.last_order_date >= active_since)
+    return query
+
+
+def segment_counts(active_since=None):
+    """[{'segment', 'count'}] for every segment, highest value first."""
+    counts = dict(customer_metrics_query(
+        CustomerMetrics.segment, func.count(CustomerMetrics.user_id), active_since=active_since
+    ).group_by(CustomerMetrics.segment).all())
+    return [{'segment': segment, 'count': counts.get(segment, 0)} for segment in SEGMENTS]
+
+
+def repeat_customer_count(active_since=None):
+    """Customers with more than one order."""
+    return customer_metrics_query(
+        func.count(CustomerMetrics.user_id), active_since=active_since
+    ).filter(CustomerMetrics.order_count > 1).scalar()
+
+
+def top_customers(limit=10, active_since=None):
+    """(User, CustomerMetrics) pairs with the highest lifetime value."""
+    return customer_metrics_query(User, CustomerMetrics, active_since=active_since)\
+        .order_by(CustomerMetrics.lifetime_value.desc(), CustomerMetrics.user_id)\
+        .limit(limit)\
+        .all()
+
+
+def order_totals(user_ids):
+    """
+    Order count and order total (all statuses) per customer in one grouped query.
+
+    Args:
+        user_ids (iterable): Customer ids, e.g. one page of a listing
+
+    Returns:
+        dict: {user_id: (order_count, total_amount)} for customers with orders
+    """
+    user_ids = list(user_ids)
+    if not user_ids:
+        return {}
+    rows = db.session.execute(
+        select(
+            orders_table.c.user_id,
+            func.count(orders_table.c.order_id),
+            func.coalesce(func.sum(orders_table.c.total_amount), 0)
+        ).where(orders_table.c.user_id.in_(user_ids)).group_by(orders_table.c.user_id)
+    )
+    return {user_id: (order_count, float(total_amount)) for user_id, order_count, total_amount in rows}
@@ -1,71 +1,227 @@
 import base64
+import threading
+import time
 import requests
 from datetime import datetime
 from flask import current_app
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Daraja API client.
+#
+# Every STK push used to fetch a new OAuth token with a bare requests.get and
+# then post the push with a bare requests.post: two round trips, each over a
+# new TCP+TLS connection, although a token stays valid for an hour. The app
+# now keeps one DarajaClient (app.extensions['daraja']) holding a pooled
+# keep-alive requests.Session and the current token. The token is renewed
+# DARAJA_TOKEN_REFRESH_MARGIN seconds before it expires: one thread fetches
+# the new token while the others keep using the old one, so only a cold
+# start (or an expired token) waits for the OAuth call.
+#
+# Token fetches are retried with backoff on connection errors and 429/5xx.
+# STK pushes are not idempotent, so they are only retried when the
+# connection failed before the request was sent.
 
+TOKEN_LIFETIME_SECONDS = 3599  # Daraja's expires_in, used if a response omits it
+RETRY_STATUSES = (429, 500, 502, 503, 504)
 
 
-def get_mpesa_access_token():
+class DarajaError(Exception):
+    """Raised when Daraja does not issue an access token."""
 
-    """Generates an access token required for authenticating M-Pesa API calls."""
 
-    url = current_app.config.get('DARAJA_AUTH_URL')
-    consumer_key = current_app.config.get('MPESA_CONSUMER_KEY')
-    consumer_secret = current_app.config.get('MPESA_CONSUMER_SECRET')
+class DarajaClient:
+    """
+    Daraja API client shared by all requests (and threads) of an app.
 
-    # Validate configuration early to avoid 400 from M-Pesa due to empty creds
-    if not consumer_key or not consumer_secret:
-        raise Exception("Missing MPESA credentials. Please set MPESA_CONSUMER_KEY and MPESA_CONSUMER_SECRET in your .env file.")
+    Args:
+        auth_url (str): OAuth client-credentials endpoint
+        stk_push_url (str): STK push endpoint
+        consumer_key (str): Daraja app consumer key
+        consumer_secret (str): Daraja app consumer secret
+        connect_timeout (float): Seconds to wait for a connection
+        read_timeout (float): Seconds to wait for a response
+        retries (int): Retries for failed connections (and for token fetches, 429/5xx)
+        backoff_factor (float): Retry backoff, backoff_factor * 2 ** (retry - 1) seconds
+        pool_size (int): Keep-alive connections kept per host
+        refresh_margin (int): Seconds before expiry the token is renewed
+    """
 
-    logger.info(f"Getting M-Pesa access token from: {url}")
-    logger.info(f"Consumer key: {consumer_key[:10]}...")  # Log first 10 chars for security
+    def __init__(self, auth_url, stk_push_url, consumer_key, consumer_secret, connect_timeout=5,
+                 read_timeout=30, retries=3, backoff_factor=0.5, pool_size=10, refresh_margin=300):
+        self.auth_url = auth_url
+        self.stk_push_url = stk_push_url
+        self.consumer_key = consumer_key
+        self.consumer_secret = consumer_secret
+        self.timeout = (connect_timeout, read_timeout)
+        self.refresh_margin = refresh_margin
+        self.session = self._build_session(retries, backoff_factor, pool_size)
+        self._token = (None, 0.0)  # (access token, time.monotonic() it expires at), replaced as a whole
+        self._refresh_lock = threading.Lock()
 
-    credentials = f"{consumer_key}:{consumer_secret}"
-    encoded_credentials = base64.b64encode(credentials.encode()).decode()
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            auth_url=config.get('DARAJA_AUTH_URL'),
+            stk_push_url=config.get('DARAJA_STK_PUSH_URL', config.get('MPESA_STK_PUSH_URL')),
+            consumer_key=config.get('MPESA_CONSUMER_KEY'),
+            consumer_secret=config.get('MPESA_CONSUMER_SECRET'),
+            connect_timeout=config.get('DARAJA_CONNECT_TIMEOUT', 5),
+            read_timeout=config.get('DARAJA_READ_TIMEOUT', 30),
+            retries=config.get('DARAJA_RETRIES', 3),
+            backoff_factor=config.get('DARAJA_BACKOFF_FACTOR', 0.5),
+            pool_size=config.get('DARAJA_POOL_SIZE', 10),
+            refresh_margin=config.get('DARAJA_TOKEN_REFRESH_MARGIN', 300)
+        )
 
-    headers = {
-        "Authorization": f"Basic {encoded_credentials}",
-        "Accept": "application/json"
-    }
-    
-    try:
+    @staticmethod
+    def _build_session(retries, backoff_factor, pool_size):
+        # Read and status retries only apply to GET (the token fetch); connect
+        # retries apply to every method since nothing reached the server
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=frozenset(['GET']),
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers.update({"Accept": "application/json"})
+        return session
+
+    def _cached_token(self, margin):
+        token, expires_at = self._token
+        if token is not None and time.monotonic() < expires_at - margin:
+            return token
+        return None
+
+    def access_token(self):
+        """Current OAuth access token, fetched only when missing or about to expire."""
+        token = self._cached_token(self.refresh_margin)
+        if token is not None:
+            return token
+
+        # Due for renewal: a thread that can still use the old token doesn't
+        # wait for another thread's refresh
+        current = self._cached_token(0)
+        if not self._refresh_lock.acquire(blocking=current is None):
+            return current
+        try:
+            token = self._cached_token(self.refresh_margin)  # renewed while we waited
+            if token is not None:
+                return token
+            return self._fetch_token()
+        finally:
+            self._refresh_lock.release()
+
+    def invalidate_token(self):
+        """Drop the cached token (Daraja rejected it) so the next call fetches a new one."""
+        self._token = (None, 0.0)
+
+    def _fetch_token(self):
+        if not self.consumer_key or not self.consumer_secret:
+            raise DarajaError("Missing MPESA credentials. Please set MPESA_CONSUMER_KEY and MPESA_CONSUMER_SECRET in your .env file.")
+
+        requested_at = time.monotonic()
+        try:
+            response = self.session.get(self.auth_url, auth=(self.consumer_key, self.consumer_secret), timeout=self.timeout)
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Network error fetching M-pesa access token: {str(e)}")
+            raise DarajaError(f"Network error: {str(e)}")
 
-        response = requests.get(url, headers=headers, timeout=30)
-        logger.info(f"M-Pesa auth response status: {response.status_code}")
-        logger.info(f"M-Pesa auth response headers: {dict(response.headers)}")
-        
         # Check if response is JSON
         content_type = response.headers.get('content-type', '')
         if 'application/json' not in content_type:
             # Safaricom returns 400 text/plain for invalid credentials
             if response.status_code == 400:
-                raise Exception("Invalid MPESA_CONSUMER_KEY or MPESA_CONSUMER_SECRET. Please check your .env file and ensure you have valid sandbox credentials from https://developer.safaricom.co.ke/")
+                raise DarajaError("Invalid MPESA_CONSUMER_KEY or MPESA_CONSUMER_SECRET. Please check your .env file and ensure you have valid sandbox credentials from https://developer.safaricom.co.ke/")
             logger.error(f"Expected JSON response but got: {content_type}")
             logger.error(f"Response text: {response.text[:500]}")  # Log first 500 chars
-            raise Exception(f"M-Pesa API returned non-JSON response. Status: {response.status_code}")
-        
+            raise DarajaError(f"M-Pesa API returned non-JSON response. Status: {response.status_code}")
+
         try:
             response_data = response.json()
-            logger.info(f"M-Pesa auth response: {response_data}")
         except Exception as json_error:
             logger.error(f"Failed to parse JSON response: {response.text[:500]}")
-            raise Exception(f"Invalid JSON response from M-Pesa API: {str(json_error)}")
+            raise DarajaError(f"Invalid JSON response from M-Pesa API: {str(json_error)}")
 
-        if "access_token" in response_data:
-            logger.info("M-Pesa access token obtained successfully")
-            return response_data["access_token"]
-        else:
-            error_msg = response_data.get('error_description', 'Unknown error')
+        token = response_data.get("access_token")
+        if not token:
+            error_msg = response_data.get('error_description', response_data.get('errorMessage', 'Unknown error'))
             logger.error(f"Error obtaining access token: {error_msg}")
-            raise Exception(f"Error obtaining access token: {error_msg}")
+            raise DarajaError(f"Error obtaining access token: {error_msg}")
 
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Network error fetching M-pesa access token: {str(e)}")
-        raise Exception(f"Network error: {str(e)}")
+        try:
+            lifetime = int(response_data.get("expires_in", TOKEN_LIFETIME_SECONDS))
+        except (TypeError, ValueError):
+            lifetime = TOKEN_LIFETIME_SECONDS
+        # Measured from when the request went out, so the cached expiry is never late
+        self._token = (token, requested_at + lifetime)
+        logger.info(f"M-Pesa access token obtained, valid for {lifetime}s")
+        return token
+
+    def post(self, url, payload):
+        """POST a JSON payload with the bearer token, renewing the token once if Daraja rejects it."""
+        for attempt in range(2):
+            token = self.access_token()
+            response = self.session.post(
+                url,
+                json=payload,
+                headers={"Authorization": f"Bearer {token}"},
+                timeout=self.timeout
+            )
+            if response.status_code != 401 or attempt:
+                return response
+            # Revoked before its expiry (e.g. credentials rotated)
+            logger.warning("Daraja rejected the cached access token; fetching a new one")
+            if self._token[0] == token:
+                self.invalidate_token()
+        return response
+
+    def stk_push(self, payload):
+        return self.post(self.stk_push_url, payload)
+
+    def close(self):
+        self.session.close()
+
+
+_client_lock = threading.Lock()
+
+
+def get_daraja_client(app=None):
+    """The app's shared DarajaClient, created from its config on first use."""
+    app = app or current_app._get_current_object()
+    client = app.extensions.get('daraja')
+    if client is None:
+        with _client_lock:
+            client = app.extensions.get('daraja')
+            if client is None:
+                client = app.extensions['daraja'] = DarajaClient.from_config(app.config)
+    return client
+
+
+def get_mpesa_access_token():
+
+    """Returns the access token required for authenticating M-Pesa API calls (cached until shortly before expiry)."""
+
+    consumer_key = current_app.config.get('MPESA_CONSUMER_KEY')
+    consumer_secret = current_app.config.get('MPESA_CONSUMER_SECRET')
+
+    # Validate configuration early to avoid 400 from M-Pesa due to empty creds
+    if not consumer_key or not consumer_secret:
+        raise Exception("Missing MPESA credentials. Please set MPESA_CONSUMER_KEY and MPESA_CONSUMER_SECRET in your .env file.")
+
+    try:
+        return get_daraja_client().access_token()
     except Exception as e:
         logger.error(f"Error fetching M-pesa access token: {str(e)}")
         raise Exception(f"Error fetching M-pesa access token: {str(e)}")
@@ -150,11 +306,6 @@ def initiate_stk_push(phone_number, amount, order_id, description='Furniture Pay
         timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
         password = generate_mpesa_password(timestamp)
 
-        headers = {
-            "Authorization": f"Bearer {access_token}",
-            "Content-Type": "application/json"
-        }
-
         payload = {
             "BusinessShortCode": current_app.config['MPESA_SHORTCODE'],
             "Password": password,
@@ -169,20 +320,14 @@ def initiate_stk_push(phone_number, amount, order_id, description='Furniture Pay
             "TransactionDesc": description[:13]  # Max 13 chars
         }
     
-        # Make API request to Safaricom
-        stk_push_url = current_app.config.get('DARAJA_STK_PUSH_URL', current_app.config.get('MPESA_STK_PUSH_URL'))
-        logger.info(f"Making STK push request to: {stk_push_url}")
-        logger.info(f"STK push payload: {payload}")
-        
-        response = requests.post(
-            stk_push_url,
-            json=payload,
-            headers=headers,
-            timeout=30
-        )
+        # Make API request to Safaricom over the client's pooled connection
+        client = get_daraja_client()
+        logger.info(f"Making STK push request to: {client.stk_push_url}")
+        logger.debug(f"STK push payload: {dict(payload, Password='***')}")
+
+        response = client.stk_push(payload)
         logger.info(f"STK push response status: {response.status_code}")
-        logger.info(f"STK push response headers: {dict(response.headers)}")
-        
+
         # Check if response is JSON
         content_type = response.headers.get('content-type', '')
         if 'application/json' not in content_type:
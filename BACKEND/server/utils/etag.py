@@ -0,0 +1,161 @@
+import hashlib
+import logging
+from functools import wraps
+
+from flask import request, make_response, current_app
+from sqlalchemy import event, select, update, func
+from sqlalchemy.orm import Session
+
+from extensions import db
+from models import ContentVersion
+from utils.cache import flush_tags, bulk_write_table, add_tags, ALL_TAGS
+from utils.upsert import insert_missing
+
+logger = logging.getLogger(__name__)
+
+# Conditional GET for catalog and blog JSON.
+#
+# Every scope a response depends on (products, product:<id>, categories,
+# category:<id>, blog) has a row in content_versions that is bumped whenever
+# its rows change. A response's ETag hashes the request URL with the current
+# versions of its scopes, so checking If-None-Match costs one primary-key
+# lookup and runs before the view does any querying or serialization.
+#
+# The scopes a transaction changes are collected in session.info and bumped
+# once it commits, in a short transaction of their own. Bumping inside the
+# writer's transaction would hold the row locks of 'products' and the
+# category scopes until it ends, so every checkout decrementing stock would
+# queue behind every other on those few rows. A GET racing the bump can
+# still answer 304 for the moment between the commit and the bump, as it
+# can for the response cache, which is also invalidated after commit.
+
+VERSIONED_SCOPES = ('products', 'categories', 'blog')
+VERSIONED_PREFIXES = ('product:', 'category:')
+
+versions_table = ContentVersion.__table__
+
+
+def _is_versioned(tag):
+    return tag in VERSIONED_SCOPES or tag.startswith(VERSIONED_PREFIXES)
+
+
+def _insert_missing(connection, scopes):
+    insert_missing(connection, versions_table, 'scope', [{'scope': scope, 'version': 0} for scope in scopes])
+
+
+def bump_versions(connection, scopes):
+    """Increment the version of each scope in the caller's transaction."""
+    scopes = sorted(set(scopes))  # fixed order so concurrent writers lock rows the same way
+    if not scopes:
+        return
+    _insert_missing(connection, scopes)
+    connection.execute(
+        update(versions_table)
+        .where(versions_table.c.scope.in_(scopes))
+        .values(version=versions_table.c.version + 1, updated_at=func.current_timestamp())
+    )
+
+
+def _bump_all_versions(connection):
+    _insert_missing(connection, VERSIONED_SCOPES)
+    connection.execute(
+        update(versions_table).values(version=versions_table.c.version + 1, updated_at=func.current_timestamp())
+    )
+
+
+def _add_scopes(session, scopes):
+    """Bump the versions of `scopes` once the session's transaction commits."""
+    session.info.setdefault('version_scopes', set()).update(scopes)
+
+
+def touch(session, tags):
+    """
+    Record a change made with Core statements, which the flush hooks never see:
+    bump the versions of its scopes and invalidate its cache tags on commit.
+    """
+    add_tags(session, tags)
+    _add_scopes(session, [tag for tag in tags if _is_versioned(tag)])
+
+
+def current_versions(session, scopes):
+    """Map scope -> version (0 for scopes that have never changed)."""
+    rows = session.execute(
+        select(versions_table.c.scope, versions_table.c.version).where(versions_table.c.scope.in_(scopes))
+    )
+    versions = dict.fromkeys(scopes, 0)
+    versions.update({scope: version for scope, version in rows})
+    return versions
+
+
+def compute_etag(scopes):
+    """Strong ETag for the current request given the scopes its response is built from."""
+    versions = current_versions(db.session, scopes)
+    args = '&'.join(f'{k}={v}' for k, v in sorted(request.args.items(multi=True)))
+    stamp = ';'.join(f'{scope}={versions[scope]}' for scope in sorted(versions))
+    raw = f'{request.host_url}{request.path}?{args}|{stamp}'
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def conditional(scopes):
+    """
+    Answer GETs with 304 Not Modified when If-None-Match still matches.
+
+    Args:
+        scopes (list | callable): Version scopes of the response, or a function of the view kwargs returning them
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != 'GET':
+                return view(*args, **kwargs)
+
+            etag = compute_etag(scopes(**kwargs) if callable(scopes) else list(scopes))
+            if request.if_none_match.contains_weak(etag):
+                response = current_app.response_class(status=304)
+                response.set_etag(etag)
+                response.headers['Cache-Control'] = 'no-cache'
+                return response
+
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200:
+                response.set_etag(etag)
+                response.headers['Cache-Control'] = 'no-cache'
+            return response
+        return wrapper
+    return decorator
+
+
+###########################################################################################################################################
+# Version maintenance
+
+@event.listens_for(Session, 'after_flush')
+def _collect_flushed_versions(session, flush_context):
+    _add_scopes(session, [tag for tag in flush_tags(session) if _is_versioned(tag)])
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _collect_bulk_versions(orm_execute_state):
+    # Rows touched by Query.update()/delete() are unknown, so every version moves
+    if bulk_write_table(orm_execute_state):
+        _add_scopes(orm_execute_state.session, [ALL_TAGS])
+
+
+@event.listens_for(Session, 'after_commit')
+def _bump_committed_versions(session):
+    scopes = session.info.pop('version_scopes', None)
+    if not scopes:
+        return
+    try:
+        with session.get_bind().begin() as connection:
+            if ALL_TAGS in scopes:
+                _bump_all_versions(connection)
+            else:
+                bump_versions(connection, scopes)
+    except Exception as e:
+        # The data is committed either way; the next change to these scopes moves their ETags again
+        logger.error(f"Content version bump failed for {sorted(scopes)}: {str(e)}")
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_rolled_back_versions(session, previous_transaction):
+    session.info.pop('version_scopes', None)
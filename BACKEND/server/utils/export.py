@@ -0,0 +1,136 @@
+import csv
+import io
+import json
+from datetime import datetime, date
+from decimal import Decimal
+from enum import Enum
+
+from flask import Response, stream_with_context
+
+# Streaming exports.
+#
+# Export rows are read through a server-side cursor in batches (yield_per)
+# and written out by generators, so memory stays bounded however many rows
+# there are. `stream=1` (or an Accept header asking for text/csv or
+# application/x-ndjson) returns a raw chunked download; otherwise the
+# endpoint's existing JSON envelope is produced, itself streamed piece by
+# piece.
+
+YIELD_PER = 1000
+ROWS_PER_CHUNK = 500
+FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+}
+
+
+def stream_query(query, yield_per=YIELD_PER):
+    """Iterate a query's rows in batches through a server-side cursor."""
+    return query.execution_options(stream_results=True, yield_per=yield_per)
+
+
+def _plain(value, empty=''):
+    if value is None:
+        return empty
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+def csv_chunks(header, rows, include_header=True):
+    """CSV text in chunks of ROWS_PER_CHUNK rows."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if include_header:
+        writer.writerow(header)
+    for count, row in enumerate(rows, start=1):
+        writer.writerow([_plain(value) for value in row])
+        if count % ROWS_PER_CHUNK == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def ndjson_chunks(header, rows):
+    """One JSON object per line, keyed by `header`, in chunks of ROWS_PER_CHUNK rows."""
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(dict(zip(header, (_plain(value, None) for value in row))), default=str))
+        if len(lines) == ROWS_PER_CHUNK:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+def json_envelope_chunks(envelope, key, header, rows, embed='csv'):
+    """
+    The legacy `{..., key: <data>}` JSON response, generated incrementally.
+
+    Args:
+        envelope (dict): Other top-level fields of the response
+        key (str): Field holding the export
+        header (list): Column names
+        rows: Iterable of row tuples
+        embed (str): 'csv' embeds the CSV text as one JSON string; 'objects' embeds a list of row objects
+    """
+    head = json.dumps(envelope)[:-1]
+    yield f'{head}{", " if envelope else ""}"{key}": '
+    if embed == 'csv':
+        yield '"'
+        for chunk in csv_chunks(header, rows):
+            yield json.dumps(chunk)[1:-1]
+        yield '"}'
+        return
+
+    yield '['
+    first = True
+    batch = []
+    for row in rows:
+        item = json.dumps(dict(zip(header, (_plain(value, None) for value in row))), default=str)
+        batch.append(item if first else ',' + item)
+        first = False
+        if len(batch) == ROWS_PER_CHUNK:
+            yield ''.join(batch)
+            batch = []
+    yield ''.join(batch) + ']}'
+
+
+def wants_stream(request):
+    """True when the client asked for a raw download instead of the JSON envelope."""
+    if request.args.get('stream', '').lower() in ('1', 'true', 'yes'):
+        return True
+    best = request.accept_mimetypes.best_match(['application/json', 'text/csv', 'application/x-ndjson'])
+    return best in ('text/csv', 'application/x-ndjson')
+
+
+def stream_format(request):
+    """'csv' or 'ndjson' for a raw download (query string first, then Accept)."""
+    fmt = request.args.get('format', '').lower()
+    if fmt in FORMATS:
+        return fmt
+    if request.accept_mimetypes.best_match(['text/csv', 'application/x-ndjson']) == 'application/x-ndjson':
+        return 'ndjson'
+    return 'csv'
+
+
+def download_response(basename, header, rows, fmt='csv'):
+    """Chunked download of `rows` as CSV or NDJSON."""
+    mimetype, extension = FORMATS[fmt]
+    chunks = csv_chunks(header, rows) if fmt == 'csv' else ndjson_chunks(header, rows)
+    response = Response(stream_with_context(chunks), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{basename}.{extension}"'
+    response.headers['X-Accel-Buffering'] = 'no'  # let nginx pass chunks straight through
+    return response
+
+
+def envelope_response(envelope, key, header, rows, embed='csv', status=200):
+    """Streamed JSON envelope response (same body the endpoint used to build in memory)."""
+    chunks = json_envelope_chunks(envelope, key, header, rows, embed)
+    return Response(stream_with_context(chunks), status=status, mimetype='application/json')
@@ -0,0 +1,213 @@
+import hashlib
+import logging
+import secrets
+from datetime import datetime, timedelta
+from functools import wraps
+
+from flask import request, jsonify, make_response, current_app
+from flask_jwt_extended import get_jwt_identity
+from sqlalchemy import event, select, insert, update, delete
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from extensions import db
+from models import IdempotencyKey
+
+logger = logging.getLogger(__name__)
+
+# Idempotent POSTs.
+#
+# Clients on flaky mobile networks retry checkout and payment requests, and a
+# retry of a request that did go through would place a second order or push a
+# second STK prompt. Requests sent with an Idempotency-Key header are recorded
+# per (endpoint, caller, key): the first one claims the key and runs, and its
+# response (status, body and the STORED_HEADERS such as Content-Type and
+# Location) is stored for IDEMPOTENCY_TTL_HOURS. Retries with the same key and
+# body get the stored response back after one primary-key lookup; a retry
+# while the first request is still running gets 409, and reusing a key for a
+# different body gets 422. Server errors (5xx) and exceptions release the key
+# so the retry runs again, unless the view had already committed.
+#
+# The response is stored after the view returns, in a transaction of its own.
+# So that a crash or a failed store in between can't let a retry run the view
+# twice, every commit the view makes also extends its claim to the full TTL in
+# the same transaction: once the view's writes are committed the key stays
+# taken (retries get 409) even if the response is never stored. A claim whose
+# view never committed lapses after IDEMPOTENCY_LOCK_SECONDS.
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+MAX_KEY_LENGTH = 255
+STORED_HEADERS = ('Content-Type', 'Content-Language', 'Location', 'ETag', 'Last-Modified', 'Cache-Control', 'Link')
+PROCESSING = 'processing'
+COMPLETED = 'completed'
+DEFAULT_TTL_HOURS = 24
+DEFAULT_LOCK_SECONDS = 120
+
+keys_table = IdempotencyKey.__table__
+
+# session.info entries while a claimed view runs
+CLAIM_INFO = 'idempotency_claim'
+COMMITTED_INFO = 'idempotency_committed'
+
+
+def new_transaction_id(prefix='txn'):
+    """Collision-free payment reference: <prefix>_<UTC timestamp>_<16 random hex digits>."""
+    return f"{prefix}_{datetime.utcnow().strftime('%Y%m%d%H%M%S')}_{secrets.token_hex(8)}"
+
+
+def _subject():
+    identity = get_jwt_identity()
+    if isinstance(identity, dict):
+        identity = identity.get('id') or identity.get('user_id') or identity.get('sub')
+    return str(identity)
+
+
+def _where_key(scope, subject, key):
+    return (keys_table.c.scope == scope) & (keys_table.c.subject == subject) & (keys_table.c.key == key)
+
+
+def _claim(scope, subject, key, request_hash, now):
+    """
+    Record the key as in progress in its own transaction.
+
+    Returns:
+        (bool, row): (True, None) when this request claimed the key, else (False, existing row or None)
+    """
+    lock_seconds = current_app.config.get('IDEMPOTENCY_LOCK_SECONDS', DEFAULT_LOCK_SECONDS)
+    where = _where_key(scope, subject, key)
+    try:
+        # An expired record (stored response past its TTL, or a lapsed claim) frees the key
+        db.session.execute(delete(keys_table).where(where, keys_table.c.expires_at <= now))
+        db.session.execute(insert(keys_table).values(
+            scope=scope,
+            subject=subject,
+            key=key,
+            request_hash=request_hash,
+            status=PROCESSING,
+            expires_at=now + timedelta(seconds=lock_seconds)
+        ))
+        db.session.commit()
+        return True, None
+    except IntegrityError:
+        db.session.rollback()
+        return False, db.session.execute(select(keys_table).where(where)).first()
+
+
+def _store(scope, subject, key, response):
+    ttl_hours = current_app.config.get('IDEMPOTENCY_TTL_HOURS', DEFAULT_TTL_HOURS)
+    db.session.execute(
+        update(keys_table).where(_where_key(scope, subject, key)).values(
+            status=COMPLETED,
+            response_status=response.status_code,
+            response_body=response.get_data(as_text=True),
+            response_headers=[[name, value] for name, value in response.headers.items()
+                              if name.lower() in {stored.lower() for stored in STORED_HEADERS}],
+            expires_at=datetime.utcnow() + timedelta(hours=ttl_hours)
+        )
+    )
+    db.session.commit()
+
+
+def _track_claim(scope, subject, key):
+    db.session.info[CLAIM_INFO] = (scope, subject, key)
+
+
+def _untrack_claim():
+    """Stop extending the claim on commit; returns True if the view committed while it ran."""
+    db.session.info.pop(CLAIM_INFO, None)
+    return db.session.info.pop(COMMITTED_INFO, False)
+
+
+@event.listens_for(Session, 'before_commit')
+def _hold_claim(session):
+    claim = session.info.get(CLAIM_INFO)
+    if claim is None:
+        return
+    ttl_hours = current_app.config.get('IDEMPOTENCY_TTL_HOURS', DEFAULT_TTL_HOURS)
+    session.execute(
+        update(keys_table).where(_where_key(*claim), keys_table.c.status == PROCESSING)
+        .values(expires_at=datetime.utcnow() + timedelta(hours=ttl_hours))
+    )
+    session.info[COMMITTED_INFO] = True
+
+
+def _release(scope, subject, key):
+    db.session.execute(delete(keys_table).where(_where_key(scope, subject, key)))
+    db.session.commit()
+
+
+def _replay(row):
+    response = current_app.response_class(row.response_body, status=row.response_status, mimetype='application/json')
+    if row.response_headers:
+        # The stored Content-Type (and any other stored header) replaces the default
+        for name in {name for name, _ in row.response_headers}:
+            del response.headers[name]
+        for name, value in row.response_headers:
+            response.headers.add(name, value)
+    response.headers[REPLAYED_HEADER] = 'true'
+    return response
+
+
+def idempotent(scope):
+    """
+    Make a JWT-protected POST view replay its stored response for retried Idempotency-Keys.
+
+    Requests without the header run as before. Apply below @jwt_required().
+
+    Args:
+        scope (str): Endpoint name keys are recorded under (keys are per endpoint and caller)
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            key = request.headers.get(IDEMPOTENCY_HEADER, '').strip()
+            if not key:
+                return view(*args, **kwargs)
+            if len(key) > MAX_KEY_LENGTH:
+                return jsonify({"error": f"{IDEMPOTENCY_HEADER} must be at most {MAX_KEY_LENGTH} characters"}), 400
+
+            subject = _subject()
+            request_hash = hashlib.sha256(request.get_data()).hexdigest()
+            claimed, row = _claim(scope, subject, key, request_hash, datetime.utcnow())
+            if not claimed:
+                if row is not None and row.request_hash != request_hash:
+                    return jsonify({"error": f"{IDEMPOTENCY_HEADER} was already used for a different request"}), 422
+                if row is not None and row.status == COMPLETED:
+                    return _replay(row)
+                return jsonify({"error": f"A request with this {IDEMPOTENCY_HEADER} is still being processed"}), 409
+
+            _track_claim(scope, subject, key)
+            try:
+                response = make_response(view(*args, **kwargs))
+            except Exception:
+                committed = _untrack_claim()
+                db.session.rollback()
+                if not committed:
+                    _release(scope, subject, key)
+                raise
+            committed = _untrack_claim()
+
+            # Whatever the view left uncommitted is discarded, as at teardown
+            db.session.rollback()
+            try:
+                if response.status_code >= 500 or response.direct_passthrough:
+                    # Nothing to replay; a view that committed keeps the key held until it expires
+                    if not committed:
+                        _release(scope, subject, key)
+                else:
+                    _store(scope, subject, key, response)
+            except Exception as e:
+                # The claim stays, so retries get 409 instead of running the view again
+                db.session.rollback()
+                logger.error(f"Failed to record {IDEMPOTENCY_HEADER} {key} for {scope}: {str(e)}")
+            return response
+        return wrapper
+    return decorator
+
+
+def purge_expired_keys(now=None):
+    """Delete stored responses and lapsed claims past their expiry; returns the number deleted."""
+    result = db.session.execute(delete(keys_table).where(keys_table.c.expires_at <= (now or datetime.utcnow())))
+    db.session.commit()
+    return result.rowcount
@@ -0,0 +1,245 @@
+import os
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from flask import current_app, has_app_context
+from sqlalchemy import event, inspect, select, update
+from sqlalchemy.orm import Session
+
+from extensions import db
+from models import Product, ProductImage
+from utils.etag import touch
+from utils.storage import absolute_path, is_content_addressed, release
+
+logger = logging.getLogger(__name__)
+
+# Resized product image variants.
+#
+# After a ProductImage is committed, a worker pool resizes the original into
+# fixed-width variants (thumbnail, card, detail), each as WebP and JPEG, under
+# static/uploads/variants, and records them in ProductImage.variants:
+#
+#     {"card": {"width": 480, "height": 320,
+#               "webp": "uploads/variants/<sha256>_card.webp",
+#               "jpeg": "uploads/variants/<sha256>_card.jpg"}, ...}
+#
+# Listings pick a variant with ?size=thumbnail|card|detail and fall back to the
+# original until the variants exist. Pillow is optional: without it no
+# variants are generated and originals are served as before.
+
+VARIANT_WIDTHS = {
+    'thumbnail': 160,
+    'card': 480,
+    'detail': 1200,
+}
+FORMATS = {
+    'webp': ('WEBP', '.webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', '.jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+DEFAULT_FORMAT = 'webp'
+VARIANTS_DIR = 'variants'
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _pillow():
+    try:
+        from PIL import Image, ImageOps
+        return Image, ImageOps
+    except ImportError:
+        return None
+
+
+def variant_path(img, size=None, fmt=DEFAULT_FORMAT):
+    """
+    Relative static path of an image, or of its `size` variant when one has been generated.
+
+    Args:
+        img (ProductImage): Image row
+        size (str): 'thumbnail', 'card' or 'detail' (None for the original)
+        fmt (str): 'webp' or 'jpeg'
+    """
+    variant = (img.variants or {}).get(size) if size else None
+    if variant:
+        return variant.get(fmt) or variant.get(DEFAULT_FORMAT) or img.image_url
+    return img.image_url
+
+
+def requested_size(args):
+    """Validated (size, format) pair from the request's query string."""
+    size = args.get('size')
+    fmt = args.get('format', DEFAULT_FORMAT)
+    return (size if size in VARIANT_WIDTHS else None), (fmt if fmt in FORMATS else DEFAULT_FORMAT)
+
+
+def _variant_name(image_url, size, extension):
+    stem = os.path.splitext(os.path.basename(image_url))[0]
+    return f"{stem}_{size}{extension}"
+
+
+def generate_variants(image_url, upload_folder):
+    """
+    Write every size/format variant of an uploaded image.
+
+    Args:
+        image_url (str): Relative path of the original (e.g. 'uploads/ab/cd/<sha256>.jpg')
+        upload_folder (str): Absolute path of static/uploads
+
+    Returns:
+        dict: Variant map for ProductImage.variants, or None if Pillow is unavailable
+    """
+    pillow = _pillow()
+    if pillow is None:
+        return None
+    Image, ImageOps = pillow
+
+    source = absolute_path(image_url, upload_folder)
+    target_dir = Path(upload_folder) / VARIANTS_DIR
+    target_dir.mkdir(parents=True, exist_ok=True)
+
+    variants = {}
+    with Image.open(source) as original:
+        image = ImageOps.exif_transpose(original)
+        has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+        image = image.convert('RGBA' if has_alpha else 'RGB')
+
+        for size, max_width in VARIANT_WIDTHS.items():
+            # Never upscale; a small original is simply re-encoded
+            width = min(max_width, image.width)
+            height = max(1, round(image.height * width / image.width))
+            variant = {'width': width, 'height': height}
+
+            # Identical content uploaded before already has its variants on disk
+            names = {fmt: _variant_name(image_url, size, extension) for fmt, (_, extension, _) in FORMATS.items()}
+            if is_content_addressed(image_url) and all((target_dir / name).exists() for name in names.values()):
+                variants[size] = {**variant, **{fmt: f"uploads/{VARIANTS_DIR}/{name}" for fmt, name in names.items()}}
+                continue
+
+            resized = image.resize((width, height), Image.LANCZOS) if width < image.width else image
+            for fmt, (pil_format, extension, options) in FORMATS.items():
+                output = resized
+                if pil_format == 'JPEG' and has_alpha:
+                    output = Image.new('RGB', resized.size, (255, 255, 255))
+                    output.paste(resized, mask=resized.split()[-1])
+                name = names[fmt]
+                output.save(target_dir / name, pil_format, **options)
+                variant[fmt] = f"uploads/{VARIANTS_DIR}/{name}"
+            variants[size] = variant
+
+    return variants
+
+
+def delete_variant_files(image_url, upload_folder):
+    """Remove every generated variant of an image (missing files are ignored)."""
+    target_dir = Path(upload_folder) / VARIANTS_DIR
+    for size in VARIANT_WIDTHS:
+        for _, extension, _ in FORMATS.values():
+            path = target_dir / _variant_name(image_url, size, extension)
+            if path.exists():
+                path.unlink()
+
+
+def _discard_variants(image_url, upload_folder):
+    """Remove variants written for an image row that no longer exists (blobs once db.session commits)."""
+    if is_content_addressed(image_url):
+        # Shared with any other row still holding the blob: only go if unreferenced
+        release(image_url)
+    else:
+        delete_variant_files(image_url, upload_folder)
+
+
+def process_image(image_id):
+    """
+    Generate and record the variants of one ProductImage (runs inside an app context).
+
+    Returns:
+        dict: Variant map ({} if the image was deleted or replaced meanwhile), or None without Pillow
+    """
+    image = db.session.get(ProductImage, image_id)
+    if image is None:
+        return {}
+    image_url, product_id = image.image_url, image.product_id
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    variants = generate_variants(image_url, upload_folder)
+    if variants is None:
+        return None
+
+    # The row may have been deleted (or given a new file) while we were resizing
+    images_table = ProductImage.__table__
+    result = db.session.execute(
+        update(images_table)
+        .where(images_table.c.image_id == image_id, images_table.c.image_url == image_url)
+        .values(variants=variants)
+    )
+    if result.rowcount == 0:
+        _discard_variants(image_url, upload_folder)
+        db.session.commit()
+        return {}
+    # A Core update: move the product's ETags and cached listings by hand
+    category_id = db.session.scalar(select(Product.category_id).where(Product.product_id == product_id))
+    tags = {'products', f'product:{product_id}'}
+    if category_id:
+        tags.add(f'category:{category_id}')
+    touch(db.session, tags)
+    db.session.commit()
+    return variants
+
+
+def _run(app, image_id):
+    with app.app_context():
+        try:
+            process_image(image_id)
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error generating variants for image {image_id}: {str(e)}")
+        finally:
+            db.session.remove()
+
+
+def _get_executor(app):
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=app.config.get('IMAGE_VARIANT_WORKERS', 2),
+                thread_name_prefix='image-variants'
+            )
+        return _executor
+
+
+def schedule_variants(image_ids):
+    """Queue variant generation for committed images on the worker pool."""
+    if not image_ids or not has_app_context() or _pillow() is None:
+        return []
+    app = current_app._get_current_object()
+    executor = _get_executor(app)
+    return [executor.submit(_run, app, image_id) for image_id in image_ids]
+
+
+###########################################################################################################################################
+# Queue new and replaced images once their transaction commits
+
+@event.listens_for(Session, 'after_flush')
+def _collect_new_images(session, flush_context):
+    pending = session.info.setdefault('pending_variants', set())
+    for obj in session.new:
+        if isinstance(obj, ProductImage):
+            pending.add(obj.image_id)
+    for obj in session.dirty:
+        if isinstance(obj, ProductImage) and inspect(obj).attrs.image_url.history.has_changes():
+            pending.add(obj.image_id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _queue_committed_images(session):
+    pending = session.info.pop('pending_variants', None)
+    if pending:
+        schedule_variants(sorted(pending))
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_rolled_back_images(session, previous_transaction):
+    session.info.pop('pending_variants', None)
@@ -6,28 +6,18 @@ def allowed_file(filename):
     return '.' in filename and filename.rsplit('.',1)[1].lower() in current_app.config['ALLOWED_EXTENSIONS']
 
 
-def generate_unique_filename(filename, product_id):
-    """Generate a unique filename using the product ID."""
-    basename = secure_filename(filename.rsplit('.',1)[0])
-    extension = filename.rsplit('.',1)[1].lower()
-    return f"product_{product_id}_{basename}.{extension}"
-
 ###########################################################################################################################################
 # Blog media 
 
 
 
 def save_product_image(file, product_id):
-    """Save the uploaded image and return the relative path."""
+    """Save the uploaded image (content-addressed, deduplicated) and return the relative path."""
     if not file or not allowed_file(file.filename):
         return None
 
-    filename = generate_unique_filename(file.filename, product_id)
-    file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
-
     try:
-        file.save(file_path)
-        return f"uploads/{filename}"
+        return store_upload(file)
     except Exception as e:
         current_app.logger.error(f"Error saving product image: {str(e)}")
         return None
@@ -36,6 +26,8 @@ import os
 from werkzeug.utils import secure_filename
 from flask import current_app
 from pathlib import Path
+from utils.image_variants import delete_variant_files
+from utils.storage import store_upload, is_content_addressed, release
 
 def delete_image_file(image_url):
     """
@@ -51,6 +43,10 @@ def delete_image_file(image_url):
         if not image_url:
             current_app.logger.warning("Empty image URL provided for deletion")
             return False
+
+        # Shared blobs are only unlinked once nothing references them
+        if is_content_addressed(image_url):
+            return release(image_url)
             
         # Extract filename securely
         filename = secure_filename(os.path.basename(image_url))
@@ -73,6 +69,9 @@ def delete_image_file(image_url):
             current_app.logger.error(f"Attempted to delete file outside upload directory: {file_path}")
             return False
             
+        # Generated size variants go with the original
+        delete_variant_files(filename, upload_folder)
+
         # Delete the file
         if file_path.exists():
             file_path.unlink()
@@ -0,0 +1,270 @@
+import logging
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import select, update, case
+
+from extensions import db
+from models import Product, StockReservation, Order, OrderStatus, Payment, PaymentStatus
+from utils.etag import touch
+from utils.payment_events import publish_payment_status
+from utils.workers import InboxWorkers
+
+logger = logging.getLogger(__name__)
+
+# Inventory reservation.
+#
+# Checkout takes a cart's stock with one conditional UPDATE:
+#
+#   UPDATE products SET stock_quantity = stock_quantity - CASE product_id WHEN ... END
+#   WHERE product_id IN (...) AND stock_quantity >= CASE product_id WHEN ... END
+#
+# so a product is only decremented if enough units are left when its row is
+# written; reading stock in Python and writing it back later lets concurrent
+# checkouts of the last units both succeed. Carts are all-or-nothing: the
+# UPDATE returns the rows it matched and any partial take is put back before
+# InsufficientStock is raised. On PostgreSQL the rows are first locked with
+# SELECT ... FOR UPDATE in product_id order, so concurrent carts sharing
+# products queue on the same rows instead of deadlocking (SQLite serializes
+# writers and ignores FOR UPDATE).
+#
+# Orders paid by M-Pesa hold their units in stock_reservations until the STK
+# callback confirms the payment. Holds still unpaid after
+# STOCK_RESERVATION_MINUTES are released back into stock and their orders
+# cancelled by release_expired_reservations(), which a background sweeper
+# runs every RESERVATION_SWEEP_SECONDS in each serving process (and
+# `flask release-expired-reservations` on demand). A payment confirmed after
+# its hold was released and the units sold out leaves the order cancelled. Checkout never sweeps, so
+# it does not commit other customers' orders inside its own request.
+# Concurrent sweeps are safe: a hold only changes state once.
+
+HELD = 'held'
+COMMITTED = 'committed'
+RELEASED = 'released'
+DEFAULT_RESERVATION_MINUTES = 15
+DEFAULT_SWEEP_SECONDS = 60
+PAID_STATUSES = (PaymentStatus.COMPLETED, PaymentStatus.SUCCESS, PaymentStatus.CAPTURED)
+
+products_table = Product.__table__
+reservations_table = StockReservation.__table__
+
+
+class InsufficientStock(Exception):
+    """Raised when some product of a cart has fewer units left than requested."""
+
+    def __init__(self, items):
+        super().__init__('Some items are no longer available')
+        self.items = items  # [{'product_id', 'requested', 'available'}]
+
+
+def item_quantities(items):
+    """{product_id: units} summed over cart or order items."""
+    quantities = {}
+    for item in items:
+        quantities[item.product_id] = quantities.get(item.product_id, 0) + int(item.quantity or 0)
+    return quantities
+
+
+def _units(quantities):
+    """CASE product_id WHEN <id> THEN <units> ... END"""
+    return case(quantities, value=products_table.c.product_id, else_=0)
+
+
+def _touch_products(session, product_ids):
+    """Invalidate cached catalog responses showing these products' stock."""
+    rows = session.execute(
+        select(products_table.c.product_id, products_table.c.category_id)
+        .where(products_table.c.product_id.in_(product_ids))
+    )
+    tags = {'products'}
+    for product_id, category_id in rows:
+        tags.add(f'product:{product_id}')
+        if category_id:
+            tags.add(f'category:{category_id}')
+    touch(session, tags)
+
+
+def _shortages(quantities, stock):
+    return [
+        {'product_id': product_id, 'requested': units, 'available': stock.get(product_id, 0)}
+        for product_id, units in sorted(quantities.items())
+        if stock.get(product_id, 0) < units
+    ]
+
+
+def _current_stock(session, product_ids, lock=False):
+    query = select(products_table.c.product_id, products_table.c.stock_quantity)\
+        .where(products_table.c.product_id.in_(product_ids))\
+        .order_by(products_table.c.product_id)
+    if lock:
+        query = query.with_for_update()
+    return {product_id: int(stock or 0) for product_id, stock in session.execute(query)}
+
+
+def reserve_stock(quantities, session=None):
+    """
+    Take units off stock for every product of a cart, or for none of them.
+
+    Args:
+        quantities (dict): {product_id: units}
+        session: Session whose transaction the update joins (default: db.session)
+
+    Raises:
+        InsufficientStock: A product is missing or has fewer units left than requested
+    """
+    session = session or db.session
+    quantities = {product_id: units for product_id, units in quantities.items() if units > 0}
+    if not quantities:
+        return
+    product_ids = sorted(quantities)
+
+    short = _shortages(quantities, _current_stock(session, product_ids, lock=True))
+    if short:
+        raise InsufficientStock(short)
+
+    taken = session.execute(
+        update(products_table)
+        .where(products_table.c.product_id.in_(product_ids),
+               products_table.c.stock_quantity >= _units(quantities))
+        .values(stock_quantity=products_table.c.stock_quantity - _units(quantities))
+        .returning(products_table.c.product_id)
+    ).scalars().all()
+
+    if len(taken) < len(product_ids):
+        # Another cart took the units between the read and the update (no row locks here)
+        if taken:
+            release_stock({product_id: quantities[product_id] for product_id in taken}, session)
+        stock = _current_stock(session, product_ids)
+        raise InsufficientStock(_shortages(quantities, stock) or [
+            {'product_id': product_id, 'requested': quantities[product_id], 'available': stock.get(product_id, 0)}
+            for product_id in product_ids if product_id not in taken
+        ])
+
+    _touch_products(session, product_ids)
+
+
+def release_stock(quantities, session=None):
+    """Put units back into stock (expired holds, restocked returns) in one UPDATE."""
+    session = session or db.session
+    quantities = {product_id: units for product_id, units in quantities.items() if units > 0}
+    if not quantities:
+        return
+    session.execute(
+        update(products_table)
+        .where(products_table.c.product_id.in_(sorted(quantities)))
+        .values(stock_quantity=products_table.c.stock_quantity + _units(quantities))
+    )
+    _touch_products(session, sorted(quantities))
+
+
+###########################################################################################################################################
+# Holds for pending payments
+
+def hold_reservations(order_id, quantities, minutes=None):
+    """
+    Record the units reserved for an order awaiting payment.
+
+    Args:
+        order_id (int): Order the stock was reserved for (already taken off stock)
+        quantities (dict): {product_id: units}
+        minutes (int): Hold duration (defaults to STOCK_RESERVATION_MINUTES)
+    """
+    if minutes is None:
+        minutes = current_app.config.get('STOCK_RESERVATION_MINUTES', DEFAULT_RESERVATION_MINUTES)
+    expires_at = datetime.utcnow() + timedelta(minutes=minutes)
+    for product_id, units in sorted(quantities.items()):
+        db.session.add(StockReservation(
+            order_id=order_id,
+            product_id=product_id,
+            quantity=units,
+            status=HELD,
+            expires_at=expires_at
+        ))
+
+
+def _set_status(order_id, from_status, to_status):
+    """Move an order's reservations between states; returns the (product_id, quantity) rows moved."""
+    return db.session.execute(
+        update(reservations_table)
+        .where(reservations_table.c.order_id == order_id, reservations_table.c.status == from_status)
+        .values(status=to_status)
+        .returning(reservations_table.c.product_id, reservations_table.c.quantity)
+    ).all()
+
+
+def confirm_reservations(order_id):
+    """
+    Turn an order's held units into a sale once its payment succeeds.
+
+    A payment confirmed after its hold expired takes the units again if they
+    are still in stock.
+
+    Returns:
+        bool: False if the order was paid but its units are no longer in stock
+    """
+    if _set_status(order_id, HELD, COMMITTED):
+        return True
+
+    released = _set_status(order_id, RELEASED, COMMITTED)
+    if not released:
+        return True
+    quantities = {}
+    for product_id, units in released:
+        quantities[product_id] = quantities.get(product_id, 0) + units
+    try:
+        reserve_stock(quantities)
+    except InsufficientStock as e:
+        logger.warning(f"Order {order_id} was paid after its stock hold expired; short items: {e.items}")
+        _set_status(order_id, COMMITTED, RELEASED)
+        return False
+    return True
+
+
+def release_expired_reservations(now=None):
+    """
+    Release holds whose payment never completed, cancelling their orders.
+
+    Each order is released in its own transaction. Holds whose payment did
+    complete (callback missed) are committed instead.
+
+    Returns:
+        int: Number of orders whose stock went back on sale
+    """
+    now = now or datetime.utcnow()
+    order_ids = db.session.execute(
+        select(reservations_table.c.order_id)
+        .where(reservations_table.c.status == HELD, reservations_table.c.expires_at <= now)
+        .distinct()
+    ).scalars().all()
+
+    released = 0
+    for order_id in order_ids:
+        try:
+            payment = Payment.query.filter_by(order_id=order_id).first()
+            if payment is not None and payment.payment_status in PAID_STATUSES:
+                _set_status(order_id, HELD, COMMITTED)
+            else:
+                rows = _set_status(order_id, HELD, RELEASED)
+                if rows:
+                    quantities = {}
+                    for product_id, units in rows:
+                        quantities[product_id] = quantities.get(product_id, 0) + units
+                    release_stock(quantities)
+                    order = db.session.get(Order, order_id)
+                    if order is not None and order.order_status == OrderStatus.PENDING:
+                        order.order_status = OrderStatus.CANCELLED
+                    if payment is not None:
+                        payment.payment_status = PaymentStatus.EXPIRED
+                    released += 1
+            db.session.commit()
+            if payment is not None and payment.payment_status == PaymentStatus.EXPIRED:
+                publish_payment_status(payment)
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Failed to release stock held for order {order_id}: {str(e)}")
+    return released
+
+
+sweeper = InboxWorkers('reservation-sweeper', release_expired_reservations,
+                       'RESERVATION_SWEEP_WORKERS', 'RESERVATION_SWEEP_SECONDS',
+                       default_workers=1, default_poll_seconds=DEFAULT_SWEEP_SECONDS)
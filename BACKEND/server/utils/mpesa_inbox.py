@@ -0,0 +1,256 @@
+import logging
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import select, insert, update
+from sqlalchemy.orm import joinedload
+
+from extensions import db
+from models import MpesaCallback, Payment, PaymentResponse, Transaction, Refund, OrderStatus, PaymentStatus, RefundStatus
+from utils.inventory import confirm_reservations
+from utils.payment_events import payment_state, publish_payment_state
+from utils.workers import InboxWorkers, claim_rows, RECEIVED
+
+logger = logging.getLogger(__name__)
+
+# M-Pesa callback inbox.
+#
+# Safaricom expects STK callbacks to be acknowledged quickly and retries the
+# ones that time out. The callback route used to look up the payment and its
+# transaction, store the PaymentResponse and commit before answering, so
+# callback bursts held request workers for the whole of it. Now the route
+# stores the raw callback in mpesa_callbacks (one INSERT) and answers at once;
+# inbox workers apply callbacks in batches of MPESA_CALLBACK_BATCH_SIZE:
+#
+#   * a batch is claimed with one conditional UPDATE, so several workers (and
+#     several app processes) never apply the same callback
+#   * payments and transactions of the whole batch are loaded with one query
+#     each, and the batch is committed once
+#   * only the first callback for a CheckoutRequestID is applied; Safaricom's
+#     redeliveries are marked duplicate
+#   * a callback that arrives before its payment row is committed, or fails,
+#     is retried every MPESA_CALLBACK_RETRY_SECONDS, up to
+#     MPESA_CALLBACK_MAX_ATTEMPTS times; a failing batch is
+#     re-run one callback per transaction so one bad callback can't block the
+#     rest
+#
+# MPESA_CALLBACK_WORKERS threads per serving process are started with it and
+# poll every MPESA_CALLBACK_POLL_SECONDS for callbacks stored by other
+# processes or left pending by a restart. With MPESA_CALLBACK_WORKERS = 0 run
+# `flask process-mpesa-callbacks --watch` instead.
+
+PROCESSED = 'processed'
+DUPLICATE = 'duplicate'
+FAILED = 'failed'
+DEFAULT_BATCH_SIZE = 50
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_POLL_SECONDS = 2
+DEFAULT_RETRY_SECONDS = 10
+
+callbacks_table = MpesaCallback.__table__
+
+
+def stk_callback(callback_data):
+    """The stkCallback object of a callback body, or None if the body isn't an STK callback."""
+    if not isinstance(callback_data, dict):
+        return None
+    body = callback_data.get('Body')
+    if not isinstance(body, dict) or not isinstance(body.get('stkCallback'), dict):
+        return None
+    return body['stkCallback']
+
+
+def record_callback(callback_data):
+    """Store a raw STK callback for the inbox workers and wake them; returns its callback_id."""
+    callback = stk_callback(callback_data)
+    callback_id = db.session.execute(
+        insert(callbacks_table).values(
+            checkout_request_id=callback.get('CheckoutRequestID'),
+            merchant_request_id=callback.get('MerchantRequestID'),
+            result_code=str(callback.get('ResultCode')),
+            payload=callback_data,
+            status=RECEIVED
+        ).returning(callbacks_table.c.callback_id)
+    ).scalar()
+    db.session.commit()
+    wake()
+    return callback_id
+
+
+def _claim(limit, now):
+    rows = claim_rows(
+        callbacks_table,
+        callbacks_table.c.callback_id,
+        [callbacks_table.c.callback_id],
+        [callbacks_table.c.callback_id, callbacks_table.c.checkout_request_id,
+         callbacks_table.c.merchant_request_id, callbacks_table.c.payload, callbacks_table.c.attempts],
+        limit,
+        now,
+        current_app.config.get('MPESA_CALLBACK_RETRY_SECONDS', DEFAULT_RETRY_SECONDS)
+    )
+    return sorted(rows, key=lambda row: row.callback_id)
+
+
+def _set_status(callback_ids, status, error=None):
+    if not callback_ids:
+        return
+    values = {'status': status, 'error': error}
+    if status != RECEIVED:
+        values['processed_at'] = datetime.utcnow()
+    db.session.execute(
+        update(callbacks_table).where(callbacks_table.c.callback_id.in_(callback_ids)).values(**values)
+    )
+
+
+def _retry_or_fail(row, error):
+    max_attempts = current_app.config.get('MPESA_CALLBACK_MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS)
+    status = FAILED if row.attempts >= max_attempts else RECEIVED
+    if status == FAILED:
+        logger.error(f"Giving up on M-Pesa callback {row.callback_id} ({row.checkout_request_id}): {error}")
+    _set_status([row.callback_id], status, error[:255])
+
+
+def _request_refund(payment, receipt_number):
+    """Queue a refund for a payment whose order can't be fulfilled (shows up with the customers' refund requests)."""
+    db.session.add(Refund(
+        order_id=payment.order_id,
+        user_id=payment.user_id,
+        reason='Paid after the stock hold expired and the items sold out',
+        status=RefundStatus.REQUESTED,
+        admin_notes=f'M-Pesa receipt {receipt_number}' if receipt_number else None
+    ))
+
+
+def apply_callback(payment, transaction, callback_data):
+    """Record one STK callback against its payment, transaction, order and stock hold."""
+    callback = stk_callback(callback_data)
+    result_code = callback.get('ResultCode')
+    result_desc = callback.get('ResultDesc')
+
+    # Save the raw callback response
+    db.session.add(PaymentResponse(
+        response_code=str(result_code),
+        response_description=result_desc,
+        merchant_request_id=callback.get('MerchantRequestID'),
+        checkout_request_id=callback.get('CheckoutRequestID'),
+        result_code=str(result_code),
+        result_description=result_desc,
+        raw_callback=callback_data,
+        payment_id=payment.payment_id
+    ))
+
+    if str(result_code) == '0':
+        # Payment successful: extract payment details from callback metadata
+        payment_details = {}
+        for item in callback.get('CallbackMetadata', {}).get('Item', []):
+            payment_details[item.get('Name')] = item.get('Value')
+        logger.info(f"Payment successful. Details: {payment_details}")
+
+        payment.payment_status = PaymentStatus.COMPLETED
+        payment.payment_date = datetime.now()
+
+        if transaction:
+            transaction.status = 'COMPLETED'
+            transaction.mpesa_receipt_number = payment_details.get('MpesaReceiptNumber')
+            if payment_details.get('Amount'):
+                transaction.amount = payment_details['Amount']
+
+        # The order's held stock is now sold; if the hold expired and the units are gone, the
+        # order stays cancelled (as the sweeper left it) and the payment is queued for a refund
+        if confirm_reservations(payment.order_id):
+            if payment.order:
+                payment.order.order_status = OrderStatus.PROCESSING
+        else:
+            logger.warning(f"Order {payment.order_id} paid after its stock hold expired and items sold out; refund requested")
+            _request_refund(payment, payment_details.get('MpesaReceiptNumber'))
+    else:
+        logger.warning(f"Payment failed: {result_desc}")
+        payment.payment_status = PaymentStatus.FAILED
+        if transaction:
+            transaction.status = 'FAILED'
+
+
+def _apply(rows):
+    """Apply claimed callbacks in the session's transaction; returns the new states of the payments they changed."""
+    checkout_ids = {row.checkout_request_id for row in rows if row.checkout_request_id}
+    merchant_ids = {row.merchant_request_id for row in rows if row.merchant_request_id}
+
+    applied = set(db.session.execute(
+        select(callbacks_table.c.checkout_request_id)
+        .where(callbacks_table.c.checkout_request_id.in_(checkout_ids), callbacks_table.c.status == PROCESSED)
+    ).scalars())
+    payments = {
+        payment.transaction_id: payment
+        for payment in Payment.query.options(joinedload(Payment.order)).filter(Payment.transaction_id.in_(checkout_ids))
+    }
+    transactions = {
+        transaction.transaction_id: transaction
+        for transaction in Transaction.query.filter(Transaction.transaction_id.in_(merchant_ids))
+    } if merchant_ids else {}
+
+    processed, duplicates, changed = [], [], []
+    for row in rows:
+        if row.checkout_request_id in applied:
+            duplicates.append(row.callback_id)
+            continue
+        payment = payments.get(row.checkout_request_id)
+        if payment is None:
+            _retry_or_fail(row, 'Payment not found')
+            continue
+        apply_callback(payment, transactions.get(row.merchant_request_id), row.payload)
+        applied.add(row.checkout_request_id)
+        processed.append(row.callback_id)
+        changed.append(payment)
+
+    _set_status(processed, PROCESSED)
+    _set_status(duplicates, DUPLICATE)
+    # Taken before commit expires the payments, so publishing doesn't reload them
+    return [payment_state(payment) for payment in changed]
+
+
+def process_batch(limit=None):
+    """
+    Claim and apply the oldest waiting callbacks.
+
+    Returns:
+        int: Number of callbacks claimed (0 when the inbox is empty)
+    """
+    limit = limit or current_app.config.get('MPESA_CALLBACK_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+    rows = _claim(limit, datetime.utcnow())
+    if not rows:
+        return 0
+
+    try:
+        changed = _apply(rows)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.warning(f"M-Pesa callback batch of {len(rows)} failed ({str(e)}); applying one by one")
+        changed = []
+        for row in rows:
+            try:
+                changed += _apply([row])
+                db.session.commit()
+            except Exception as row_error:
+                db.session.rollback()
+                _retry_or_fail(row, str(row_error))
+                db.session.commit()
+
+    for state in changed:
+        publish_payment_state(state)
+    return len(rows)
+
+
+def drain():
+    """Process batches until the inbox is empty; returns the number of callbacks claimed."""
+    total = 0
+    while True:
+        claimed = process_batch()
+        if not claimed:
+            return total
+        total += claimed
+
+
+workers = InboxWorkers('mpesa-inbox', drain, 'MPESA_CALLBACK_WORKERS', 'MPESA_CALLBACK_POLL_SECONDS',
+                       default_workers=2, default_poll_seconds=DEFAULT_POLL_SECONDS)
+wake = workers.wake
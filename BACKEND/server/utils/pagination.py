@@ -0,0 +1,251 @@
+import base64
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, date
+from decimal import Decimal
+from enum import Enum
+
+from sqlalchemy import literal, tuple_, type_coerce, DateTime, String
+
+# Keyset (cursor) pagination for admin/catalog listings.
+#
+# Listings stay on page/per_page by default. Passing `cursor=` (empty for the
+# first page) switches to keyset mode: rows are ordered by (sort column,
+# primary key) and each page continues strictly after the last row of the
+# previous one, so deep pages cost the same as the first. The cursor is an
+# opaque base64 token carrying that last (sort value, primary key) pair.
+#
+# Pages seek with a row-value comparison, (sort, pk) > (:value, :pk), that an
+# index on (sort column, primary key) can serve. Rows whose nullable sort
+# column is NULL are never mixed into that range: they come after every
+# non-NULL row as a tail walked by primary key alone (sort IS NULL AND
+# pk > :pk), which the cursor enters with a NULL sort value.
+
+COUNT_MODES = ('exact', 'cached', 'none')
+COUNT_CACHE_TTL = 60  # seconds
+COUNT_CACHE_SIZE = 256  # distinct filtered queries whose counts are kept
+
+_count_cache = OrderedDict()
+_count_cache_lock = threading.Lock()
+
+
+class InvalidCursor(ValueError):
+    """Raised when a cursor can't be decoded or belongs to a different sort."""
+
+
+def _column_of(sort_column):
+    return getattr(sort_column, 'expression', sort_column)
+
+
+def _is_nullable(sort_column):
+    return getattr(_column_of(sort_column), 'nullable', True)
+
+
+def _sort_key(sort_column):
+    return getattr(sort_column, 'key', None) or str(_column_of(sort_column))
+
+
+def _compares_raw_text(query, sort_column):
+    """
+    SQLite keeps DateTime values as text in whatever format they were written
+    (CURRENT_TIMESTAMP defaults have no microseconds, Python values do), so
+    cursors there carry and compare the stored text rather than a datetime.
+    """
+    return isinstance(getattr(_column_of(sort_column), 'type', None), DateTime) \
+        and query.session.get_bind().dialect.name == 'sqlite'
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return ['dt', value.isoformat()]
+    if isinstance(value, date):
+        return ['d', value.isoformat()]
+    if isinstance(value, Enum):
+        return ['e', value.name]
+    if isinstance(value, Decimal):
+        return ['n', str(value)]
+    return ['v', value]
+
+
+def _decode_value(encoded, sort_column):
+    kind, value = encoded
+    if kind == 'dt':
+        return datetime.fromisoformat(value)
+    if kind == 'd':
+        return date.fromisoformat(value)
+    if kind == 'e':
+        enum_class = getattr(_column_of(sort_column).type, 'enum_class', None)
+        if enum_class is None:
+            raise InvalidCursor('Cursor does not match this listing')
+        return enum_class[value]
+    if kind == 'n':
+        return Decimal(value)
+    return value
+
+
+def encode_cursor(sort_column, descending, sort_value, pk_value):
+    """Build the opaque cursor pointing just after (sort_value, pk_value)."""
+    payload = {
+        'k': _sort_key(sort_column),
+        'd': bool(descending),
+        'v': _encode_value(sort_value),
+        'id': pk_value,
+    }
+    raw = json.dumps(payload, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor, sort_column, descending):
+    """Return the (sort_value, pk_value) pair stored in a cursor for this sort."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if payload['k'] != _sort_key(sort_column) or payload['d'] != bool(descending):
+            raise InvalidCursor('Cursor does not match the requested sort order')
+        return _decode_value(payload['v'], sort_column), payload['id']
+    except InvalidCursor:
+        raise
+    except (ValueError, KeyError, TypeError, json.JSONDecodeError) as e:
+        raise InvalidCursor(f'Invalid cursor: {str(e)}')
+
+
+def _direction(descending):
+    return (lambda c: c.desc()) if descending else (lambda c: c.asc())
+
+
+def order_by_keyset(query, sort_column, pk_column, descending=False):
+    """
+    Order a query by (sort column, primary key) for page/per_page listings.
+
+    The primary key tie-breaker keeps page boundaries stable. NULL sort values
+    go where the database's index puts them, except on PostgreSQL where
+    NULLS LAST (its index order when ascending) matches cursor mode.
+    """
+    direction = _direction(descending)
+    sort_order = direction(sort_column)
+    if _is_nullable(sort_column) and query.session.get_bind().dialect.name == 'postgresql':
+        sort_order = sort_order.nulls_last()
+    return query.order_by(sort_order, direction(pk_column))
+
+
+def _after(sort_column, pk_column, descending, sort_value, pk_value, raw_text=False):
+    """Filter selecting non-NULL rows strictly after (sort_value, pk_value) in keyset order."""
+    # Bound with the columns' types (enums, dates), which a tuple would not infer
+    sort_value = literal(sort_value, String() if raw_text else sort_column.type)
+    row, bound = tuple_(sort_column, pk_column), tuple_(sort_value, literal(pk_value, pk_column.type))
+    return row < bound if descending else row > bound
+
+
+def _count(query, mode):
+    if mode == 'none':
+        return None
+
+    count_query = query.order_by(None)
+    if mode == 'exact':
+        return count_query.count()
+
+    compiled = count_query.statement.compile()
+    key = (str(compiled), repr(sorted(compiled.params.items())))
+    now = time.monotonic()
+    with _count_cache_lock:
+        cached = _count_cache.get(key)
+        if cached and now - cached[0] < COUNT_CACHE_TTL:
+            _count_cache.move_to_end(key)
+            return cached[1]
+    total = count_query.count()
+    with _count_cache_lock:
+        # Least recently used counts go first, so arbitrary search terms can't grow it without bound
+        _count_cache[key] = (now, total)
+        _count_cache.move_to_end(key)
+        while len(_count_cache) > COUNT_CACHE_SIZE:
+            _count_cache.popitem(last=False)
+    return total
+
+
+class KeysetPage:
+    """One page of a keyset-paginated listing."""
+
+    def __init__(self, items, cursor, next_cursor, per_page, total):
+        self.items = items
+        self.cursor = cursor
+        self.next_cursor = next_cursor
+        self.per_page = per_page
+        self.total = total
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def pagination(self):
+        """Pagination block for the JSON response."""
+        return {
+            'mode': 'cursor',
+            'per_page': self.per_page,
+            'cursor': self.cursor or None,
+            'next_cursor': self.next_cursor,
+            'has_next': self.has_next,
+            'has_prev': bool(self.cursor),
+            'total': self.total
+        }
+
+
+def keyset_paginate(query, sort_column, pk_column, descending=False, cursor='', per_page=20, count='exact'):
+    """
+    Fetch one page of `query` in keyset order.
+
+    Args:
+        query: Unordered, filtered query over a single entity
+        sort_column: Column to sort by
+        pk_column: Primary key column of the entity (tie-breaker)
+        descending (bool): Sort direction
+        cursor (str): Cursor from the previous page, or '' for the first page
+        per_page (int): Page size
+        count (str): 'exact' runs COUNT(*), 'cached' reuses a recent count, 'none' skips it
+
+    Returns:
+        KeysetPage
+    """
+    if count not in COUNT_MODES:
+        count = 'exact'
+    per_page = max(1, per_page)
+    total = _count(query, count)
+
+    raw_text = _compares_raw_text(query, sort_column)
+    nullable = _is_nullable(sort_column)
+    direction = _direction(descending)
+    sort_value = pk_value = None
+    if cursor:
+        sort_value, pk_value = decode_cursor(cursor, sort_column, descending)
+    past = (lambda c, v: c < v) if descending else (lambda c, v: c > v)
+
+    # The sort value is selected alongside each row so that columns from joined
+    # subqueries (e.g. search relevance) can be carried in the cursor too
+    selected_sort = type_coerce(sort_column, String()) if raw_text else sort_column
+    page_query = query.add_columns(selected_sort.label('keyset_sort_value'))
+
+    rows = []
+    if not cursor or sort_value is not None:
+        # Non-NULL rows: a range on (sort column, primary key)
+        value_query = page_query.filter(sort_column.isnot(None)) if nullable else page_query
+        if cursor:
+            value_query = value_query.filter(_after(sort_column, pk_column, descending, sort_value, pk_value, raw_text))
+        rows = value_query.order_by(direction(sort_column), direction(pk_column)).limit(per_page + 1).all()
+    if nullable and len(rows) <= per_page:
+        # NULL tail, after every non-NULL row, by primary key
+        tail_query = page_query.filter(sort_column.is_(None))
+        if cursor and sort_value is None:
+            tail_query = tail_query.filter(past(pk_column, pk_value))
+        rows += tail_query.order_by(direction(pk_column)).limit(per_page + 1 - len(rows)).all()
+    items = [row[0] for row in rows[:per_page]]
+
+    next_cursor = None
+    if len(rows) > per_page:
+        last_item, last_sort_value = rows[per_page - 1]
+        next_cursor = encode_cursor(
+            sort_column, descending, last_sort_value,
+            getattr(last_item, _column_of(pk_column).key)
+        )
+
+    return KeysetPage(items, cursor, next_cursor, per_page, total)
@@ -0,0 +1,273 @@
+import json
+import logging
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app, has_app_context
+from sqlalchemy import select, insert, delete, func
+
+from extensions import db
+from models import PaymentEvent, PaymentStatus
+
+logger = logging.getLogger(__name__)
+
+# Payment status events.
+#
+# While a customer approves the STK prompt the frontend used to poll
+# /payments/mpesa/status/<id>, one authenticated DB lookup per poll per
+# checkout. It now opens an EventSource on /payments/status/<id>/events: the
+# stream sends the current state once, then every state change published for
+# that payment (M-Pesa callbacks, Stripe webhooks, expired stock holds), a
+# comment line every PAYMENT_EVENTS_HEARTBEAT_SECONDS to keep proxies from
+# closing it, and gives up after PAYMENT_EVENTS_TIMEOUT_SECONDS so abandoned
+# checkouts don't hold connections forever.
+#
+# Events go through the app's broker (PAYMENT_EVENTS_BROKER):
+#   memory   - in-process fan-out; enough for a single app process
+#   database - publishers append to payment_events and one poller thread per
+#              process fans new rows out to its subscribers, so a callback
+#              handled by one worker reaches streams held by the others
+# Other backends register in BROKERS under a name of their own.
+
+STATUS_MAP = {
+    PaymentStatus.PENDING: "PENDING",
+    PaymentStatus.COMPLETED: "COMPLETED",
+    PaymentStatus.SUCCESS: "COMPLETED",
+    PaymentStatus.FAILED: "FAILED",
+    PaymentStatus.EXPIRED: "FAILED"
+}
+TERMINAL_STATUSES = ('COMPLETED', 'FAILED')
+DEFAULT_HEARTBEAT_SECONDS = 15
+DEFAULT_TIMEOUT_SECONDS = 300
+DEFAULT_POLL_SECONDS = 1.0
+DEFAULT_RETENTION_SECONDS = 600
+
+events_table = PaymentEvent.__table__
+
+
+def channel_for(transaction_id):
+    return f'payment:{transaction_id}'
+
+
+def payment_state(payment):
+    """Client-facing status of a payment, as returned by mpesa_status and streamed to subscribers."""
+    return {
+        "status": STATUS_MAP.get(payment.payment_status, "PENDING"),
+        "payment_id": payment.payment_id,
+        "order_id": payment.order_id,
+        "transaction_id": payment.transaction_id,
+        "amount": payment.payment_amount,
+        "payment_date": payment.payment_date.isoformat() if payment.payment_date else None
+    }
+
+
+class Subscription:
+    """Queue of the messages published on one channel since subscribing."""
+
+    def __init__(self, broker, channel):
+        self.broker = broker
+        self.channel = channel
+        self.queue = queue.Queue()
+
+    def get(self, timeout=None):
+        """Next message, or None if nothing arrived within `timeout` seconds."""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class MemoryBroker:
+    """Delivers messages to subscribers of the same process."""
+
+    def __init__(self, app=None):
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, channel):
+        subscription = Subscription(self, channel)
+        with self._lock:
+            self._subscribers.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.channel]
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    def publish(self, channel, message):
+        self._deliver(channel, message)
+
+    def _deliver(self, channel, message):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for subscription in subscribers:
+            subscription.queue.put(message)
+
+
+class DatabaseBroker(MemoryBroker):
+    """Relays messages between app processes through the payment_events table."""
+
+    def __init__(self, app):
+        super().__init__(app)
+        self.app = app
+        self.poll_seconds = app.config.get('PAYMENT_EVENTS_POLL_SECONDS', DEFAULT_POLL_SECONDS)
+        self.retention = timedelta(seconds=app.config.get('PAYMENT_EVENTS_RETENTION_SECONDS', DEFAULT_RETENTION_SECONDS))
+        self._last_id = None
+        self._poller = None
+        self._poller_lock = threading.Lock()
+
+    def subscribe(self, channel):
+        self._start_poller()
+        return super().subscribe(channel)
+
+    def publish(self, channel, message):
+        # Own connection and transaction: published whether or not the caller's session commits again
+        with db.engine.begin() as connection:
+            connection.execute(insert(events_table).values(
+                channel=channel,
+                data=json.dumps(message),
+                created_at=datetime.utcnow()
+            ))
+
+    def _start_poller(self):
+        with self._poller_lock:
+            if self._poller is None:
+                with self.app.app_context():
+                    self._last_id = self._max_event_id()
+                self._poller = threading.Thread(target=self._poll_forever, name='payment-events', daemon=True)
+                self._poller.start()
+
+    def _max_event_id(self):
+        with db.engine.connect() as connection:
+            return connection.execute(select(func.max(events_table.c.event_id))).scalar() or 0
+
+    def poll(self):
+        """Fan out the events published since the last poll; returns how many there were."""
+        with db.engine.connect() as connection:
+            rows = connection.execute(
+                select(events_table.c.event_id, events_table.c.channel, events_table.c.data)
+                .where(events_table.c.event_id > self._last_id)
+                .order_by(events_table.c.event_id)
+            ).all()
+        for event_id, channel, data in rows:
+            self._last_id = event_id
+            self._deliver(channel, json.loads(data))
+        return len(rows)
+
+    def purge(self, now=None):
+        with db.engine.begin() as connection:
+            connection.execute(delete(events_table).where(
+                events_table.c.created_at <= (now or datetime.utcnow()) - self.retention
+            ))
+
+    def _poll_forever(self):
+        last_purge = time.monotonic()
+        with self.app.app_context():
+            while True:
+                time.sleep(self.poll_seconds)
+                try:
+                    self.poll()
+                    if time.monotonic() - last_purge >= self.retention.total_seconds():
+                        self.purge()
+                        last_purge = time.monotonic()
+                except Exception as e:
+                    logger.error(f"Payment event poll failed: {str(e)}")
+
+
+BROKERS = {
+    'memory': MemoryBroker,
+    'database': DatabaseBroker,
+}
+
+_broker_lock = threading.Lock()
+
+
+def get_broker(app=None):
+    """The app's event broker, created from PAYMENT_EVENTS_BROKER on first use."""
+    app = app or current_app._get_current_object()
+    broker = app.extensions.get('payment_events')
+    if broker is None:
+        with _broker_lock:
+            broker = app.extensions.get('payment_events')
+            if broker is None:
+                name = app.config.get('PAYMENT_EVENTS_BROKER', 'memory')
+                if name not in BROKERS:
+                    raise ValueError(f"Unknown PAYMENT_EVENTS_BROKER {name!r}; expected one of {sorted(BROKERS)}")
+                broker = app.extensions['payment_events'] = BROKERS[name](app)
+    return broker
+
+
+def subscribe(transaction_id):
+    return get_broker().subscribe(channel_for(transaction_id))
+
+
+def publish_payment_state(state):
+    """Tell subscribers about a committed payment_state(); never raises."""
+    if not has_app_context():
+        return
+    try:
+        get_broker().publish(channel_for(state['transaction_id']), state)
+    except Exception as e:
+        logger.error(f"Failed to publish status of payment {state.get('payment_id')}: {str(e)}")
+
+
+def publish_payment_status(payment):
+    """Tell subscribers about a payment's committed state; never raises."""
+    if payment is not None:
+        publish_payment_state(payment_state(payment))
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def event_stream(subscription, initial, heartbeat=DEFAULT_HEARTBEAT_SECONDS, timeout=DEFAULT_TIMEOUT_SECONDS):
+    """
+    Server-Sent Events for one payment: its current state, then each change until it is final.
+
+    Closes the subscription when the stream ends or the client goes away.
+
+    Args:
+        subscription (Subscription): Taken before `initial` was read, so no change is missed
+        initial (dict): payment_state() when the stream opened
+        heartbeat (float): Seconds between keep-alive comments
+        timeout (float): Seconds after which a still-pending stream is closed
+    """
+    try:
+        yield _sse('status', initial)
+        if initial['status'] in TERMINAL_STATUSES:
+            return
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                yield _sse('timeout', {"status": "PENDING", "message": "No payment result yet; check the order status later"})
+                return
+            message = subscription.get(timeout=min(heartbeat, remaining))
+            if message is None:
+                yield ": heartbeat\n\n"
+                continue
+            yield _sse('status', message)
+            if message['status'] in TERMINAL_STATUSES:
+                return
+    finally:
+        subscription.close()
@@ -0,0 +1,487 @@
+from collections import defaultdict, namedtuple
+from datetime import date, datetime
+
+from sqlalchemy import event, func, select, inspect, type_coerce, String, case, and_, true
+from sqlalchemy.orm import Session
+
+from extensions import db
+from models import DailySalesRollup, Order, OrderItem, OrderStatus, Product, Category
+from utils.upsert import insert_missing
+
+# Daily sales rollup.
+#
+# daily_sales_rollup holds one row per (day, category, product, order status)
+# with order count, units and revenue, so analytics, dashboard and report
+# windows read at most days x products x statuses rows instead of scanning
+# orders and order_items. Two kinds of row share the table:
+#
+#   product_id == ORDER_TOTALS  whole orders: order count, units, sum(total_amount)
+#   product_id == <product>     that product's order items: orders containing
+#                               it, units, sum(price * quantity)
+#
+# Whole-order rows have no category, so their category_id holds a shard,
+# order_id % ORDER_TOTAL_SHARDS: otherwise every checkout of the day would
+# update the same (today, pending) row and concurrent checkouts would queue
+# on its lock. Readers always sum whole-order rows over the shards.
+#
+# The flush hooks below apply per-row deltas in the same transaction as the
+# order writes (new orders and items, status and amount changes). Rows are
+# attributed to the product's category when the sale is recorded;
+# `flask rebuild-sales-rollup` recomputes everything from orders, e.g. after
+# a backfill or recategorising products. Windows are whole days.
+
+ORDER_TOTALS = 0
+ORDER_TOTAL_SHARDS = 16
+UNCATEGORIZED = 0
+BATCH_SIZE = 1000
+
+# Raw stored status, so rows written with a bare string don't fail to load
+stored_status = type_coerce(Order.__table__.c.order_status, String)
+
+rollup_table = DailySalesRollup.__table__
+orders_table = Order.__table__
+items_table = OrderItem.__table__
+products_table = Product.__table__
+
+Totals = namedtuple('Totals', ['orders', 'units', 'revenue'])
+
+
+def _day(value):
+    """Calendar day of a datetime, date or 'YYYY-MM-DD...' string (None stays None)."""
+    if value is None or (isinstance(value, date) and not isinstance(value, datetime)):
+        return value
+    if isinstance(value, datetime):
+        return value.date()
+    return date.fromisoformat(str(value)[:10])
+
+
+def _number(value):
+    """Attribute value as a float; unflushed attributes hold whatever was assigned (e.g. '12.50')."""
+    return float(value) if value not in (None, '') else 0.0
+
+
+def _status_value(status):
+    """OrderStatus value ('delivered') of an enum member, value or name."""
+    if isinstance(status, OrderStatus):
+        return status.value
+    if status in OrderStatus._value2member_map_:
+        return status
+    if status in OrderStatus.__members__:
+        return OrderStatus[status].value
+    return None
+
+
+def apply_deltas(connection, deltas):
+    """
+    Apply increments to daily_sales_rollup in the caller's transaction.
+
+    Args:
+        connection: Connection bound to the current transaction
+        deltas (dict): (sale_date, category_id, product_id, order_status) -> {'orders', 'units', 'revenue'}
+    """
+    if not deltas:
+        return
+
+    key = ('sale_date', 'category_id', 'product_id', 'order_status')
+    insert_missing(connection, rollup_table, key, [dict(zip(key, row_key)) for row_key in deltas])
+
+    t = rollup_table
+    for (sale_date, category_id, product_id, status), delta in sorted(deltas.items()):
+        connection.execute(
+            t.update().where(
+                t.c.sale_date == sale_date,
+                t.c.category_id == category_id,
+                t.c.product_id == product_id,
+                t.c.order_status == status
+            ).values(
+                order_count=t.c.order_count + delta['orders'],
+                units_sold=t.c.units_sold + delta['units'],
+                revenue=t.c.revenue + delta['revenue'],
+                last_updated=func.current_timestamp()
+            )
+        )
+
+
+###########################################################################################################################################
+# Incremental maintenance
+
+def _empty_delta():
+    return {'orders': 0, 'units': 0, 'revenue': 0.0}
+
+
+def _collect_changes(session):
+    """
+    Contributions of this flush as (order_id, product_id, status, orders, units, revenue) tuples.
+
+    A status of None means "the order's status as now stored".
+    """
+    changes = []
+    new_items = set()
+    new_pairs = set()
+    moved_orders = {}
+    deleted_orders = {}
+
+    for obj in session.new:
+        if isinstance(obj, Order):
+            changes.append((obj.order_id, ORDER_TOTALS, None, 1, 0, _number(obj.total_amount)))
+        elif isinstance(obj, OrderItem) and obj.product_id:
+            quantity = int(obj.quantity or 0)
+            new_items.add(obj.order_item_id)
+            if (obj.order_id, obj.product_id) not in new_pairs:
+                new_pairs.add((obj.order_id, obj.product_id))
+                changes.append((obj.order_id, obj.product_id, None, 1, 0, 0))
+            changes.append((obj.order_id, obj.product_id, None, 0, quantity, quantity * _number(obj.price)))
+            changes.append((obj.order_id, ORDER_TOTALS, None, 0, quantity, 0))
+
+    for obj in session.deleted:
+        if isinstance(obj, Order):
+            state = inspect(obj).attrs
+            status = (state.order_status.history.deleted or [obj.order_status])[0]
+            total = (state.total_amount.history.deleted or [obj.total_amount])[0]
+            deleted_orders[obj.order_id] = (obj.order_date, _status_value(status))
+            changes.append((obj.order_id, ORDER_TOTALS, _status_value(status), -1, 0, -_number(total)))
+        elif isinstance(obj, OrderItem) and obj.product_id:
+            quantity = int(obj.quantity or 0)
+            changes.append((obj.order_id, obj.product_id, None, -1, -quantity, -quantity * _number(obj.price)))
+            changes.append((obj.order_id, ORDER_TOTALS, None, 0, -quantity, 0))
+
+    for obj in session.dirty:
+        if isinstance(obj, Order):
+            state = inspect(obj).attrs
+            status_history = state.order_status.history
+            total_history = state.total_amount.history
+            if not (status_history.has_changes() or total_history.has_changes()):
+                continue
+            old_status = _status_value((status_history.deleted or [obj.order_status])[0])
+            old_total = _number((total_history.deleted or [obj.total_amount])[0])
+            changes.append((obj.order_id, ORDER_TOTALS, old_status, -1, 0, -old_total))
+            changes.append((obj.order_id, ORDER_TOTALS, None, 1, 0, _number(obj.total_amount)))
+            if status_history.has_changes() and old_status != _status_value(obj.order_status):
+                moved_orders[obj.order_id] = old_status
+        elif isinstance(obj, OrderItem) and obj.product_id:
+            state = inspect(obj).attrs
+            if not (state.quantity.history.has_changes() or state.price.history.has_changes()):
+                continue
+            old_quantity = int((state.quantity.history.deleted or [obj.quantity])[0] or 0)
+            old_price = _number((state.price.history.deleted or [obj.price])[0])
+            quantity = int(obj.quantity or 0)
+            changes.append((obj.order_id, obj.product_id, None, 0, quantity - old_quantity,
+                            quantity * _number(obj.price) - old_quantity * old_price))
+            changes.append((obj.order_id, ORDER_TOTALS, None, 0, quantity - old_quantity, 0))
+
+    if moved_orders:
+        # Items already recorded under the old status move with their order
+        connection = session.connection()
+        query = select(
+            items_table.c.order_id,
+            items_table.c.product_id,
+            func.sum(items_table.c.quantity),
+            func.sum(items_table.c.quantity * items_table.c.price)
+        ).where(items_table.c.order_id.in_(moved_orders))
+        if new_items:
+            query = query.where(items_table.c.order_item_id.notin_(new_items))
+        for order_id, product_id, units, revenue in connection.execute(
+            query.group_by(items_table.c.order_id, items_table.c.product_id)
+        ):
+            old_status = moved_orders[order_id]
+            units, revenue = units or 0, revenue or 0
+            changes.append((order_id, product_id, old_status, -1, -units, -revenue))
+            changes.append((order_id, product_id, None, 1, units, revenue))
+            changes.append((order_id, ORDER_TOTALS, old_status, 0, -units, 0))
+            changes.append((order_id, ORDER_TOTALS, None, 0, units, 0))
+
+    return changes, deleted_orders
+
+
+def _collect_deltas(session):
+    """Turn the orders and order items written in this flush into rollup deltas."""
+    changes, deleted_orders = _collect_changes(session)
+    if not changes:
+        return {}
+
+    connection = session.connection()
+    order_ids = {change[0] for change in changes}
+    product_ids = {change[1] for change in changes if change[1] != ORDER_TOTALS}
+
+    orders = dict(deleted_orders)
+    for order_id, order_date, status in connection.execute(
+        select(orders_table.c.order_id, orders_table.c.order_date, stored_status)
+        .where(orders_table.c.order_id.in_(order_ids))
+    ):
+        orders[order_id] = (order_date, _status_value(status))
+
+    categories = {}
+    if product_ids:
+        categories = {product_id: category_id for product_id, category_id in connection.execute(
+            select(products_table.c.product_id, products_table.c.category_id)
+            .where(products_table.c.product_id.in_(product_ids))
+        )}
+
+    deltas = defaultdict(_empty_delta)
+    for order_id, product_id, status, orders_delta, units, revenue in changes:
+        if order_id not in orders:
+            continue
+        order_date, current_status = orders[order_id]
+        sale_date = _day(order_date)
+        status = status or current_status
+        if sale_date is None or status is None:
+            continue
+        if product_id == ORDER_TOTALS:
+            category_id = order_id % ORDER_TOTAL_SHARDS
+        else:
+            category_id = categories.get(product_id) or UNCATEGORIZED
+        delta = deltas[(sale_date, category_id, product_id, status)]
+        delta['orders'] += orders_delta
+        delta['units'] += units
+        delta['revenue'] += revenue
+
+    return {
+        key: delta for key, delta in deltas.items()
+        if delta['orders'] or delta['units'] or delta['revenue']
+    }
+
+
+@event.listens_for(Session, 'after_flush')
+def _update_sales_rollup(session, flush_context):
+    """Keep daily_sales_rollup in step with orders and order items as they are flushed."""
+    deltas = _collect_deltas(session)
+    if deltas:
+        apply_deltas(session.connection(), deltas)
+
+
+def rebuild_sales_rollup():
+    """
+    Recompute daily_sales_rollup from scratch from orders and order items.
+
+    Returns:
+        int: Number of rollup rows written
+    """
+    day = func.date(Order.order_date)
+
+    units_sub = db.session.query(
+        OrderItem.order_id.label('order_id'),
+        func.sum(OrderItem.quantity).label('units')
+    ).group_by(OrderItem.order_id).subquery()
+
+    shard = Order.order_id % ORDER_TOTAL_SHARDS
+    order_rows = db.session.query(
+        day,
+        stored_status,
+        shard,
+        func.count(Order.order_id),
+        func.coalesce(func.sum(units_sub.c.units), 0),
+        func.coalesce(func.sum(Order.total_amount), 0)
+    ).select_from(Order)\
+     .outerjoin(units_sub, units_sub.c.order_id == Order.order_id)\
+     .filter(Order.order_date.isnot(None))\
+     .group_by(day, stored_status, shard)
+
+    item_rows = db.session.query(
+        day,
+        stored_status,
+        func.coalesce(Product.category_id, UNCATEGORIZED),
+        OrderItem.product_id,
+        func.count(func.distinct(OrderItem.order_id)),
+        func.coalesce(func.sum(OrderItem.quantity), 0),
+        func.coalesce(func.sum(OrderItem.quantity * OrderItem.price), 0)
+    ).select_from(OrderItem)\
+     .join(Order, Order.order_id == OrderItem.order_id)\
+     .outerjoin(Product, Product.product_id == OrderItem.product_id)\
+     .filter(Order.order_date.isnot(None))\
+     .group_by(day, stored_status, func.coalesce(Product.category_id, UNCATEGORIZED), OrderItem.product_id)
+
+    rows = [(sale_date, shard, ORDER_TOTALS, status, orders, units, revenue)
+            for sale_date, status, shard, orders, units, revenue in order_rows.all()]
+    rows.extend((sale_date, category_id, product_id, status, orders, units, revenue)
+                for sale_date, status, category_id, product_id, orders, units, revenue in item_rows.all())
+
+    # Keyed on the status value; orders stored with an unknown status string can't be attributed
+    records = {}
+    for sale_date, category_id, product_id, status, orders, units, revenue in rows:
+        status = _status_value(status)
+        if status is None:
+            continue
+        key = (_day(sale_date), category_id, product_id, status)
+        record = records.setdefault(key, {
+            'sale_date': key[0],
+            'category_id': category_id,
+            'product_id': product_id,
+            'order_status': status,
+            'order_count': 0,
+            'units_sold': 0,
+            'revenue': 0.0
+        })
+        record['order_count'] += orders
+        record['units_sold'] += int(units)
+        record['revenue'] += float(revenue)
+    records = list(records.values())
+
+    db.session.execute(rollup_table.delete())
+    for start in range(0, len(records), BATCH_SIZE):
+        db.session.execute(rollup_table.insert(), records[start:start + BATCH_SIZE])
+    db.session.commit()
+    return len(records)
+
+
+###########################################################################################################################################
+# Readers
+
+def _in_window(query, start_date, end_date=None, statuses=None):
+    query = query.filter(DailySalesRollup.sale_date >= _day(start_date))
+    if end_date is not None:
+        query = query.filter(DailySalesRollup.sale_date <= _day(end_date))
+    if statuses is not None:
+        query = query.filter(DailySalesRollup.order_status.in_([_status_value(s) for s in statuses]))
+    return query
+
+
+def period_totals(start_date, end_date=None, statuses=None):
+    """(orders, units, revenue) for whole orders in the window."""
+    query = db.session.query(
+        func.coalesce(func.sum(DailySalesRollup.order_count), 0).label('orders'),
+        func.coalesce(func.sum(DailySalesRollup.units_sold), 0).label('units'),
+        func.coalesce(func.sum(DailySalesRollup.revenue), 0).label('revenue')
+    ).filter(DailySalesRollup.product_id == ORDER_TOTALS)
+    return _in_window(query, start_date, end_date, statuses).one()
+
+
+def period_totals_split(start_date, end_date=None, statuses=None):
+    """
+    Whole-order totals in the window for every status and for `statuses` only, in one pass.
+
+    Returns:
+        tuple: (all, selected) Totals of orders, units and revenue
+    """
+    selected = DailySalesRollup.order_status.in_([_status_value(s) for s in statuses or ()])
+    columns = [DailySalesRollup.order_count, DailySalesRollup.units_sold, DailySalesRollup.revenue]
+    query = db.session.query(
+        *[func.coalesce(func.sum(column), 0) for column in columns],
+        *[func.coalesce(func.sum(case((selected, column), else_=0)), 0) for column in columns]
+    ).filter(DailySalesRollup.product_id == ORDER_TOTALS)
+    row = _in_window(query, start_date, end_date).one()
+    return Totals(*row[:3]), Totals(*row[3:])
+
+
+def period_comparison(current, previous, revenue_statuses=None):
+    """
+    Whole-order totals for two windows in one conditional-aggregate pass.
+
+    Args:
+        current (tuple): (start_date, end_date) of the current window
+        previous (tuple): (start_date, end_date) of the comparison window
+        revenue_statuses (list): Statuses whose orders count towards revenue (None for all)
+
+    Returns:
+        dict: {'current': {'orders', 'revenue'}, 'previous': {'orders', 'revenue'}}
+    """
+    windows = {'current': current, 'previous': previous}
+    counts_revenue = true()
+    if revenue_statuses is not None:
+        counts_revenue = DailySalesRollup.order_status.in_([_status_value(s) for s in revenue_statuses])
+
+    columns = []
+    for start_date, end_date in windows.values():
+        in_window = and_(DailySalesRollup.sale_date >= _day(start_date), DailySalesRollup.sale_date <= _day(end_date))
+        columns.append(func.coalesce(func.sum(case((in_window, DailySalesRollup.order_count), else_=0)), 0))
+        columns.append(func.coalesce(func.sum(case((and_(in_window, counts_revenue), DailySalesRollup.revenue), else_=0)), 0))
+
+    row = db.session.query(*columns).filter(
+        DailySalesRollup.product_id == ORDER_TOTALS,
+        DailySalesRollup.sale_date >= _day(min(start for start, _ in windows.values())),
+        DailySalesRollup.sale_date <= _day(max(end for _, end in windows.values()))
+    ).one()
+
+    return {
+        name: {'orders': int(row[2 * i]), 'revenue': float(row[2 * i + 1])}
+        for i, name in enumerate(windows)
+    }
+
+
+def daily_totals(start_date, end_date=None, statuses=None):
+    """Per-day (date, orders, units, revenue) for whole orders, oldest first."""
+    query = db.session.query(
+        DailySalesRollup.sale_date.label('date'),
+        func.sum(DailySalesRollup.order_count).label('orders'),
+        func.sum(DailySalesRollup.units_sold).label('units'),
+        func.sum(DailySalesRollup.revenue).label('revenue')
+    ).filter(DailySalesRollup.product_id == ORDER_TOTALS)
+    return _in_window(query, start_date, end_date, statuses)\
+        .group_by(DailySalesRollup.sale_date)\
+        .order_by(DailySalesRollup.sale_date)\
+        .all()
+
+
+def status_totals(start_date, end_date=None):
+    """Per-status (order_status, orders, revenue) for whole orders; order_status is an OrderStatus."""
+    query = db.session.query(
+        DailySalesRollup.order_status,
+        func.sum(DailySalesRollup.order_count),
+        func.sum(DailySalesRollup.revenue)
+    ).filter(DailySalesRollup.product_id == ORDER_TOTALS)
+    rows = _in_window(query, start_date, end_date).group_by(DailySalesRollup.order_status).all()
+    return [(OrderStatus(status), orders, revenue) for status, orders, revenue in rows]
+
+
+def category_totals(start_date, end_date=None, statuses=None):
+    """
+    Per-category item sales, highest revenue first.
+
+    Rows have category_id, category_name, product_count (distinct products
+    sold), orders, units and revenue; uncategorised sales are left out.
+    """
+    query = db.session.query(
+        Category.category_id,
+        Category.category_name,
+        func.count(func.distinct(DailySalesRollup.product_id)).label('product_count'),
+        func.sum(DailySalesRollup.order_count).label('orders'),
+        func.sum(DailySalesRollup.units_sold).label('units'),
+        func.sum(DailySalesRollup.revenue).label('revenue')
+    ).join(Category, Category.category_id == DailySalesRollup.category_id)\
+     .filter(DailySalesRollup.product_id != ORDER_TOTALS)
+    return _in_window(query, start_date, end_date, statuses)\
+        .group_by(Category.category_id, Category.category_name)\
+        .order_by(func.sum(DailySalesRollup.revenue).desc())\
+        .all()
+
+
+def product_totals(start_date, end_date=None, statuses=None, order_by='units', limit=10):
+    """
+    Best-selling products in the window.
+
+    Rows have product_id, product_name, product_price, category_id,
+    stock_quantity, orders, units and revenue.
+
+    Args:
+        order_by (str): 'units' or 'revenue'
+    """
+    units = func.sum(DailySalesRollup.units_sold)
+    revenue = func.sum(DailySalesRollup.revenue)
+    query = db.session.query(
+        Product.product_id,
+        Product.product_name,
+        Product.product_price,
+        Product.category_id,
+        Product.stock_quantity,
+        func.sum(DailySalesRollup.order_count).label('orders'),
+        units.label('units'),
+        revenue.label('revenue')
+    ).join(Product, Product.product_id == DailySalesRollup.product_id)
+    return _in_window(query, start_date, end_date, statuses)\
+        .group_by(Product.product_id)\
+        .order_by((revenue if order_by == 'revenue' else units).desc())\
+        .limit(limit)\
+        .all()
+
+
+def product_daily_units(start_date, end_date=None, statuses=None, limit=50):
+    """Per product and day (product_name, date, units), most recent first."""
+    query = db.session.query(
+        Product.product_name,
+        DailySalesRollup.sale_date.label('date'),
+        func.sum(DailySalesRollup.units_sold).label('units')
+    ).join(Product, Product.product_id == DailySalesRollup.product_id)
+    return _in_window(query, start_date, end_date, statuses)\
+        .group_by(Product.product_id, Product.product_name, DailySalesRollup.sale_date)\
+        .order_by(DailySalesRollup.sale_date.desc())\
+        .limit(limit)\
+        .all()
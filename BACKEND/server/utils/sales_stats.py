@@ -0,0 +1,202 @@
+from collections import defaultdict
+from sqlalchemy import event, func, case, cast, select, literal, inspect
+from sqlalchemy.orm import Session
+
+from extensions import db
+from models import ProductSalesStats, Product, OrderItem, Review
+from utils.upsert import insert_missing
+
+stats_table = ProductSalesStats.__table__
+
+
+def apply_deltas(connection, deltas):
+    """
+    Apply per-product increments to product_sales_stats in the caller's transaction.
+
+    Args:
+        connection: Connection bound to the current transaction
+        deltas (dict): product_id -> {'units', 'orders', 'rating_sum', 'rating_count'}
+    """
+    if not deltas:
+        return
+
+    # Zeroed rows for products that don't have stats yet
+    insert_missing(connection, stats_table, 'product_id', [{'product_id': product_id} for product_id in deltas])
+
+    t = stats_table
+    for product_id, delta in deltas.items():
+        new_sum = t.c.rating_sum + delta['rating_sum']
+        new_count = t.c.rating_count + delta['rating_count']
+        connection.execute(
+            t.update().where(t.c.product_id == product_id).values(
+                units_sold=t.c.units_sold + delta['units'],
+                order_count=t.c.order_count + delta['orders'],
+                rating_sum=new_sum,
+                rating_count=new_count,
+                avg_rating=case((new_count > 0, cast(new_sum, db.Float) / new_count), else_=0.0),
+                last_updated=func.current_timestamp()
+            )
+        )
+
+
+def _empty_delta():
+    return {'units': 0, 'orders': 0, 'rating_sum': 0, 'rating_count': 0}
+
+
+def _order_count_deltas(connection, added, removed):
+    """
+    Per-product change in distinct orders from the items added and removed in this flush.
+
+    The flush has already been written, so the items left for each (product, order)
+    pair are counted once; the pair held items before the flush if
+    left - added + removed > 0. A second item of an order already counted (or
+    the removal of one of two) therefore leaves order_count alone.
+
+    Args:
+        connection: Connection bound to the flushing transaction
+        added (dict): (product_id, order_id) -> items inserted in this flush
+        removed (dict): (product_id, order_id) -> items deleted in this flush
+
+    Returns:
+        dict: product_id -> change in order_count
+    """
+    pairs = set(added) | set(removed)
+    if not pairs:
+        return {}
+    items = OrderItem.__table__
+    left = dict.fromkeys(pairs, 0)
+    rows = connection.execute(
+        select(items.c.product_id, items.c.order_id, func.count())
+        .where(items.c.product_id.in_({product_id for product_id, _ in pairs}),
+               items.c.order_id.in_({order_id for _, order_id in pairs}))
+        .group_by(items.c.product_id, items.c.order_id)
+    )
+    for product_id, order_id, count in rows:
+        if (product_id, order_id) in left:
+            left[(product_id, order_id)] = count
+
+    changes = defaultdict(int)
+    for (product_id, order_id), count in left.items():
+        before = count - added.get((product_id, order_id), 0) + removed.get((product_id, order_id), 0)
+        changes[product_id] += int(count > 0) - int(before > 0)
+    return changes
+
+
+def _collect_deltas(session):
+    """Turn the order items and reviews written in this flush into per-product deltas."""
+    deltas = defaultdict(_empty_delta)
+    new_orders, removed_orders = defaultdict(int), defaultdict(int)
+
+    for obj in session.new:
+        if isinstance(obj, OrderItem) and obj.product_id:
+            deltas[obj.product_id]['units'] += obj.quantity or 0
+            new_orders[(obj.product_id, obj.order_id)] += 1
+        elif isinstance(obj, Review) and obj.product_id:
+            deltas[obj.product_id]['rating_sum'] += obj.rating or 0
+            deltas[obj.product_id]['rating_count'] += 1
+
+    for obj in session.deleted:
+        if isinstance(obj, OrderItem) and obj.product_id:
+            deltas[obj.product_id]['units'] -= obj.quantity or 0
+            removed_orders[(obj.product_id, obj.order_id)] += 1
+        elif isinstance(obj, Review) and obj.product_id:
+            deltas[obj.product_id]['rating_sum'] -= obj.rating or 0
+            deltas[obj.product_id]['rating_count'] -= 1
+
+    for obj in session.dirty:
+        if isinstance(obj, Review) and obj.product_id:
+            history = inspect(obj).attrs.rating.history
+            if history.deleted and history.added:
+                deltas[obj.product_id]['rating_sum'] += (history.added[0] or 0) - (history.deleted[0] or 0)
+        elif isinstance(obj, OrderItem) and obj.product_id:
+            history = inspect(obj).attrs.quantity.history
+            if history.deleted and history.added:
+                deltas[obj.product_id]['units'] += (history.added[0] or 0) - (history.deleted[0] or 0)
+
+    if new_orders or removed_orders:
+        for product_id, change in _order_count_deltas(session.connection(), new_orders, removed_orders).items():
+            deltas[product_id]['orders'] += change
+
+    return {
+        product_id: delta for product_id, delta in deltas.items()
+        if any(delta.values())
+    }
+
+
+@event.listens_for(Session, 'after_flush')
+def _update_sales_stats(session, flush_context):
+    """Keep product_sales_stats in step with order items and reviews as they are flushed."""
+    deltas = _collect_deltas(session)
+    if deltas:
+        apply_deltas(session.connection(), deltas)
+
+
+def rebuild_sales_stats():
+    """
+    Recompute product_sales_stats from scratch for every product.
+
+    Order and review totals are aggregated in separate subqueries so that
+    neither multiplies the other.
+
+    Returns:
+        int: Number of stats rows written
+    """
+    orders_sub = db.session.query(
+        OrderItem.product_id.label('product_id'),
+        func.sum(OrderItem.quantity).label('units_sold'),
+        func.count(func.distinct(OrderItem.order_id)).label('order_count')
+    ).group_by(OrderItem.product_id).subquery()
+
+    reviews_sub = db.session.query(
+        Review.product_id.label('product_id'),
+        func.sum(Review.rating).label('rating_sum'),
+        func.count(Review.review_id).label('rating_count')
+    ).group_by(Review.product_id).subquery()
+
+    rating_sum = func.coalesce(reviews_sub.c.rating_sum, 0)
+    rating_count = func.coalesce(reviews_sub.c.rating_count, 0)
+
+    rows = select(
+        Product.product_id,
+        func.coalesce(orders_sub.c.units_sold, 0),
+        func.coalesce(orders_sub.c.order_count, 0),
+        rating_sum,
+        rating_count,
+        case((rating_count > 0, cast(rating_sum, db.Float) / rating_count), else_=literal(0.0)),
+        func.current_timestamp()
+    ).select_from(Product)\
+     .outerjoin(orders_sub, orders_sub.c.product_id == Product.product_id)\
+     .outerjoin(reviews_sub, reviews_sub.c.product_id == Product.product_id)
+
+    db.session.execute(stats_table.delete())
+    db.session.execute(stats_table.insert().from_select(
+        ['product_id', 'units_sold', 'order_count', 'rating_sum', 'rating_count', 'avg_rating', 'last_updated'],
+        rows
+    ))
+    db.session.commit()
+    return db.session.query(func.count(ProductSalesStats.product_id)).scalar()
+
+
+def top_sellers(limit=8):
+    """
+    Return the best-selling products as (product, stats) pairs.
+
+    Reads the ranking index on product_sales_stats; products without a stats
+    row yet (e.g. added since the last rebuild) only fill up a short list.
+    """
+    ranked = db.session.query(Product, ProductSalesStats)\
+        .join(ProductSalesStats, ProductSalesStats.product_id == Product.product_id)\
+        .order_by(ProductSalesStats.order_count.desc(), ProductSalesStats.avg_rating.desc())\
+        .limit(limit)\
+        .all()
+
+    if len(ranked) < limit:
+        padding = Product.query\
+            .outerjoin(ProductSalesStats, ProductSalesStats.product_id == Product.product_id)\
+            .filter(ProductSalesStats.product_id.is_(None))\
+            .order_by(Product.product_id)\
+            .limit(limit - len(ranked))\
+            .all()
+        ranked.extend((product, None) for product in padding)
+
+    return ranked
@@ -0,0 +1,262 @@
+import re
+from sqlalchemy import event, text, select, func, literal, inspect, bindparam, Integer, Float
+
+from extensions import db
+from models import Product, BlogPost
+
+# Full-text search for products and blog posts.
+#
+# SQLite uses FTS5 tables (product_search / blog_search) whose rowid is the
+# source row's primary key, kept in sync by the mapper events below.
+# PostgreSQL searches a GIN-indexed to_tsvector() expression over the source
+# columns directly, so it needs no sync. Any other backend, or SQLite before
+# the FTS tables exist, falls back to the old ILIKE filters.
+
+MARK_START = '<mark>'
+MARK_END = '</mark>'
+SNIPPET_WORDS = 16
+TS_CONFIG = 'english'
+
+FTS_TABLES = {
+    'product_search': {
+        'model': Product,
+        'key': 'product_id',
+        'columns': ['product_name', 'product_description'],
+        'weights': (10.0, 1.0),
+    },
+    'blog_search': {
+        'model': BlogPost,
+        'key': 'id',
+        'columns': ['title', 'excerpt', 'content'],
+        'weights': (10.0, 4.0, 1.0),
+    },
+}
+
+_fts_available = {}
+
+
+def _tokens(term):
+    """Split a user search string into word tokens (punctuation is dropped)."""
+    return re.findall(r'\w+', (term or '').lower())
+
+
+def _fts_query(tokens):
+    """FTS5 MATCH expression: every token must match, each as a prefix."""
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+def _tsquery(tokens):
+    """PostgreSQL to_tsquery expression: every token must match, each as a prefix."""
+    return ' & '.join(f'{token}:*' for token in tokens)
+
+
+def search_backend():
+    """Return 'fts5', 'postgres' or 'ilike' for the current database."""
+    engine = db.engine
+    dialect = engine.dialect.name
+    if dialect == 'postgresql':
+        return 'postgres'
+    if dialect != 'sqlite':
+        return 'ilike'
+
+    key = str(engine.url)
+    if key not in _fts_available:
+        with engine.connect() as connection:
+            found = connection.execute(
+                text("SELECT count(*) FROM sqlite_master WHERE name IN ('product_search', 'blog_search')")
+            ).scalar()
+        _fts_available[key] = found == len(FTS_TABLES)
+    return 'fts5' if _fts_available[key] else 'ilike'
+
+
+def _product_document():
+    return func.coalesce(Product.product_name, '') + ' ' + func.coalesce(Product.product_description, '')
+
+
+def _blog_document():
+    return (func.coalesce(BlogPost.title, '') + ' ' + func.coalesce(BlogPost.excerpt, '')
+            + ' ' + func.coalesce(BlogPost.content, ''))
+
+
+def _match_subquery(table, term, document, key_column, ilike_columns):
+    """
+    Build a (match_id, match_rank) subquery of rows matching `term`, best match first when ordered by rank.
+
+    Returns None if the term has no searchable words.
+    """
+    tokens = _tokens(term)
+    if not tokens:
+        return None
+
+    backend = search_backend()
+    if backend == 'fts5':
+        weights = ', '.join(str(w) for w in FTS_TABLES[table]['weights'])
+        return text(
+            f"SELECT rowid AS match_id, bm25({table}, {weights}) AS match_rank "
+            f"FROM {table} WHERE {table} MATCH :fts_query"
+        ).bindparams(fts_query=_fts_query(tokens)).columns(match_id=Integer, match_rank=Float).subquery()
+
+    if backend == 'postgres':
+        vector = func.to_tsvector(TS_CONFIG, document)
+        query = func.to_tsquery(TS_CONFIG, _tsquery(tokens))
+        return select(
+            key_column.label('match_id'),
+            (-func.ts_rank(vector, query)).label('match_rank')
+        ).where(vector.op('@@')(query)).subquery()
+
+    pattern = f'%{term}%'
+    return select(key_column.label('match_id'), literal(0.0).label('match_rank')).where(
+        db.or_(*[column.ilike(pattern) for column in ilike_columns])
+    ).subquery()
+
+
+def product_match_subquery(term):
+    """Products matching `term` as a (match_id, match_rank) subquery; lower rank is a better match."""
+    return _match_subquery(
+        'product_search', term, _product_document(), Product.product_id,
+        [Product.product_name, Product.product_description]
+    )
+
+
+def blog_match_subquery(term):
+    """Blog posts matching `term` as a (match_id, match_rank) subquery; lower rank is a better match."""
+    return _match_subquery(
+        'blog_search', term, _blog_document(), BlogPost.id,
+        [BlogPost.title, BlogPost.excerpt, BlogPost.content]
+    )
+
+
+def _snippets(table, term, ids, pg_column, key_column):
+    """Highlighted snippets for the given row ids (only the page being returned)."""
+    tokens = _tokens(term)
+    if not tokens or not ids:
+        return {}
+
+    backend = search_backend()
+    if backend == 'fts5':
+        rows = db.session.execute(
+            text(
+                f"SELECT rowid, snippet({table}, -1, :start, :end, '…', {SNIPPET_WORDS}) "
+                f"FROM {table} WHERE {table} MATCH :fts_query AND rowid IN :ids"
+            ).bindparams(bindparam('ids', expanding=True)),
+            {'start': MARK_START, 'end': MARK_END, 'fts_query': _fts_query(tokens), 'ids': list(ids)}
+        )
+        return {row[0]: row[1] for row in rows}
+
+    if backend == 'postgres':
+        options = f'StartSel={MARK_START},StopSel={MARK_END},MaxWords={SNIPPET_WORDS},MinWords=5'
+        rows = db.session.execute(
+            select(key_column, func.ts_headline(
+                TS_CONFIG, pg_column, func.to_tsquery(TS_CONFIG, _tsquery(tokens)), options
+            )).where(key_column.in_(ids))
+        )
+        return {row[0]: row[1] for row in rows}
+
+    return {}
+
+
+def product_snippets(term, product_ids):
+    """Map product_id -> highlighted snippet of the best-matching column."""
+    return _snippets('product_search', term, product_ids, _product_document(), Product.product_id)
+
+
+def blog_snippets(term, post_ids):
+    """Map post id -> highlighted snippet of the best-matching column."""
+    return _snippets('blog_search', term, post_ids, _blog_document(), BlogPost.id)
+
+
+###########################################################################################################################################
+# Index maintenance (SQLite FTS5 only)
+
+def create_search_tables(connection):
+    """Create the FTS5 tables if they don't exist yet."""
+    for table, spec in FTS_TABLES.items():
+        connection.execute(text(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {table} USING fts5("
+            f"{', '.join(spec['columns'])}, tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+        ))
+
+
+def rebuild_search_index():
+    """
+    (Re)build the search index from the products and blog_posts tables.
+
+    Returns:
+        dict: Rows indexed per FTS table (empty when the backend needs no index)
+    """
+    if db.engine.dialect.name != 'sqlite':
+        return {}
+
+    counts = {}
+    with db.engine.begin() as connection:
+        create_search_tables(connection)
+        for table, spec in FTS_TABLES.items():
+            source = spec['model'].__tablename__
+            columns = ', '.join(spec['columns'])
+            connection.execute(text(f"DELETE FROM {table}"))
+            connection.execute(text(
+                f"INSERT INTO {table} (rowid, {columns}) SELECT {spec['key']}, {columns} FROM {source}"
+            ))
+            counts[table] = connection.execute(text(f"SELECT count(*) FROM {table}")).scalar()
+    _fts_available.clear()
+    return counts
+
+
+def _fts_enabled(connection):
+    return connection.dialect.name == 'sqlite' and search_backend() == 'fts5'
+
+
+def _index_row(connection, table, target, changed_only):
+    spec = FTS_TABLES[table]
+    if not _fts_enabled(connection):
+        return
+    if changed_only:
+        state = inspect(target)
+        if not any(state.attrs[column].history.has_changes() for column in spec['columns']):
+            return
+
+    key = getattr(target, spec['key'])
+    columns = spec['columns']
+    connection.execute(text(f"DELETE FROM {table} WHERE rowid = :key"), {'key': key})
+    connection.execute(
+        text(f"INSERT INTO {table} (rowid, {', '.join(columns)}) "
+             f"VALUES (:key, {', '.join(':' + c for c in columns)})"),
+        {'key': key, **{c: getattr(target, c) for c in columns}}
+    )
+
+
+def _unindex_row(connection, table, target):
+    if not _fts_enabled(connection):
+        return
+    key = getattr(target, FTS_TABLES[table]['key'])
+    connection.execute(text(f"DELETE FROM {table} WHERE rowid = :key"), {'key': key})
+
+
+@event.listens_for(Product, 'after_insert')
+def _product_inserted(mapper, connection, target):
+    _index_row(connection, 'product_search', target, changed_only=False)
+
+
+@event.listens_for(Product, 'after_update')
+def _product_updated(mapper, connection, target):
+    _index_row(connection, 'product_search', target, changed_only=True)
+
+
+@event.listens_for(Product, 'after_delete')
+def _product_deleted(mapper, connection, target):
+    _unindex_row(connection, 'product_search', target)
+
+
+@event.listens_for(BlogPost, 'after_insert')
+def _blog_inserted(mapper, connection, target):
+    _index_row(connection, 'blog_search', target, changed_only=False)
+
+
+@event.listens_for(BlogPost, 'after_update')
+def _blog_updated(mapper, connection, target):
+    _index_row(connection, 'blog_search', target, changed_only=True)
+
+
+@event.listens_for(BlogPost, 'after_delete')
+def _blog_deleted(mapper, connection, target):
+    _unindex_row(connection, 'blog_search', target)
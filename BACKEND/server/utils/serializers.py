@@ -0,0 +1,96 @@
+from collections import defaultdict
+from flask import url_for
+
+from models import ProductImage, Category
+from utils.image_variants import variant_path, DEFAULT_FORMAT
+
+
+def load_product_relations(products):
+    """
+    Load images and categories for a whole list of products in two IN queries.
+
+    Args:
+        products (list): Product instances (e.g. one page of a listing)
+
+    Returns:
+        tuple: (images_by_product, categories_by_id) where images are ordered by image_id
+    """
+    product_ids = {product.product_id for product in products}
+    category_ids = {product.category_id for product in products if product.category_id}
+
+    images_by_product = defaultdict(list)
+    if product_ids:
+        images = ProductImage.query.filter(
+            ProductImage.product_id.in_(product_ids)
+        ).order_by(ProductImage.image_id).all()
+        for img in images:
+            images_by_product[img.product_id].append(img)
+
+    categories_by_id = {}
+    if category_ids:
+        categories = Category.query.filter(Category.category_id.in_(category_ids)).all()
+        categories_by_id = {category.category_id: category for category in categories}
+
+    return images_by_product, categories_by_id
+
+
+def primary_image_of(images, fallback=False):
+    """Return the primary image from a pre-loaded image list (optionally falling back to the first)."""
+    primary = next((img for img in images if img.is_primary), None)
+    if primary is None and fallback and images:
+        return images[0]
+    return primary
+
+
+def image_url(img, size=None, fmt=DEFAULT_FORMAT):
+    """External URL of a product image, or of its `size` variant once generated."""
+    return url_for('static', filename=variant_path(img, size, fmt), _external=True)
+
+
+def product_to_dict(product, images, category=None, images_key='images', size=None, fmt=DEFAULT_FORMAT):
+    """Serialize a product in the listing shape using pre-loaded images and category."""
+    primary_image = primary_image_of(images)
+    return {
+        'product_id': product.product_id,
+        'product_name': product.product_name,
+        'product_description': product.product_description,
+        'product_price': float(product.product_price),
+        'stock_quantity': product.stock_quantity,
+        'category_id': product.category_id,
+        'category_name': category.category_name if category else None,
+        'created_at': product.created_at.isoformat() if product.created_at else None,
+        'updated_at': product.updated_at.isoformat() if product.updated_at else None,
+        'primary_image': image_url(primary_image, size, fmt) if primary_image else None,
+        images_key: [{
+            'image_id': img.image_id,
+            'image_url': image_url(img, size, fmt),
+            'is_primary': img.is_primary
+        } for img in images]
+    }
+
+
+def serialize_products(products, images_key='images', size=None, fmt=DEFAULT_FORMAT):
+    """
+    Serialize a list of products with a fixed number of queries, whatever its length.
+
+    Args:
+        products (list): Product instances
+        images_key (str): Response key for the image list ('all_images' on the homepage feeds)
+        size (str): Image variant to link ('thumbnail', 'card', 'detail'); None for originals
+        fmt (str): Variant format, 'webp' or 'jpeg'
+
+    Returns:
+        list: Product dicts in the same order as `products`
+    """
+    images_by_product, categories_by_id = load_product_relations(products)
+    return [
+        product_to_dict(
+            product,
+            images_by_product.get(product.product_id, []),
+            categories_by_id.get(product.category_id),
+            images_key=images_key,
+            size=size,
+            fmt=fmt
+        )
+        for product in products
+    ]
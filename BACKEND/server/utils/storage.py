@@ -0,0 +1,251 @@
+import hashlib
+import os
+import re
+import logging
+import tempfile
+from collections import defaultdict
+
+from flask import current_app, has_app_context
+from sqlalchemy import event, inspect, select, update, delete
+from sqlalchemy.orm import Session
+
+from extensions import db
+from models import StoredFile, ProductImage, BlogImage
+from utils.upsert import insert_missing
+
+logger = logging.getLogger(__name__)
+
+# Content-addressed upload storage.
+#
+# Uploads are stored once per distinct content as
+# static/uploads/<aa>/<bb>/<sha256>.<ext>, so a URL never changes content and
+# can be served as immutable. stored_files counts the image rows
+# (product_images, blog_images) that reference each blob; the count is kept by
+# the flush hooks below in the same transaction as the rows, and a blob (with
+# its resized variants) is unlinked once a commit leaves it unreferenced.
+# Older uploads named product_<id>_<name>.<ext> are still read and deleted as
+# plain files.
+#
+# A blob is only unlinked by the transaction that deletes its unreferenced
+# stored_files row (DELETE ... WHERE ref_count <= 0), before that transaction
+# commits, so a writer counting a new reference to it waits on the row. Each
+# upload keeps its own copy of the blob until its session's transaction ends:
+# if the blob was unlinked under a reference that committed, the copy is put
+# back; if the transaction ended without a reference, the blob goes.
+
+CHUNK_SIZE = 64 * 1024
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+HASHED_PATH = re.compile(r'^uploads/([0-9a-f]{2})/([0-9a-f]{2})/([0-9a-f]{64})\.([a-z0-9]+)$')
+HASHED_VARIANT_PATH = re.compile(r'^uploads/variants/([0-9a-f]{64})_(\w+)\.([a-z0-9]+)$')
+
+files_table = StoredFile.__table__
+
+# Image models whose image_url may point at a stored blob
+REFERENCING_MODELS = (ProductImage, BlogImage)
+
+
+def is_content_addressed(image_url):
+    """True for paths produced by store_upload()."""
+    return bool(image_url and HASHED_PATH.match(image_url))
+
+
+def immutable_etag(image_url):
+    """
+    ETag for uploads whose content can never change behind their URL
+    (hashed blobs and their variants), or None for legacy names.
+    """
+    match = HASHED_PATH.match(image_url or '')
+    if match:
+        return match.group(3)
+    match = HASHED_VARIANT_PATH.match(image_url or '')
+    if match:
+        return '-'.join(match.groups())
+    return None
+
+
+def absolute_path(image_url, upload_folder=None):
+    """Filesystem path of an upload given its 'uploads/...' relative path."""
+    upload_folder = upload_folder or current_app.config['UPLOAD_FOLDER']
+    relative = image_url[len('uploads/'):] if image_url.startswith('uploads/') else os.path.basename(image_url)
+    return os.path.join(upload_folder, relative)
+
+
+def store_upload(file):
+    """
+    Store an uploaded file under its content hash.
+
+    Identical content is written once; later uploads reuse the existing blob.
+    The blob is removed again if db.session's transaction ends without a row
+    referencing it.
+
+    Args:
+        file: Werkzeug FileStorage (extension already validated by the caller)
+
+    Returns:
+        str: Relative path such as 'uploads/ab/cd/<sha256>.jpg'
+    """
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    extension = file.filename.rsplit('.', 1)[1].lower()
+
+    digest = hashlib.sha256()
+    fd, temp_path = tempfile.mkstemp(dir=upload_folder, prefix='.upload-')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            for chunk in iter(lambda: file.stream.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+                out.write(chunk)
+
+        hex_digest = digest.hexdigest()
+        relative = f"uploads/{hex_digest[:2]}/{hex_digest[2:4]}/{hex_digest}.{extension}"
+        target = absolute_path(relative, upload_folder)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        try:
+            os.link(temp_path, target)
+        except FileExistsError:
+            pass
+
+        # Begin the transaction now so that _settle_uploads runs however the request ends
+        db.session.connection()
+        uploads = db.session.info.setdefault('stored_uploads', {})
+        if relative in uploads:
+            os.remove(temp_path)
+        else:
+            uploads[relative] = (temp_path, upload_folder)
+        return relative
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def _unlink_blob(path, upload_folder):
+    from utils.image_variants import delete_variant_files
+    file_path = absolute_path(path, upload_folder)
+    if os.path.exists(file_path):
+        os.remove(file_path)
+    delete_variant_files(path, upload_folder)
+
+
+def _remove_if_unreferenced(connection, path, upload_folder):
+    """
+    Delete the stored_files row and the blob of `path` unless some row references it.
+
+    Returns:
+        bool: True if the blob was removed
+    """
+    deleted = connection.execute(
+        delete(files_table).where(files_table.c.path == path, files_table.c.ref_count <= 0)
+    ).rowcount
+    if not deleted and connection.execute(select(files_table.c.path).where(files_table.c.path == path)).first():
+        return False
+    _unlink_blob(path, upload_folder)
+    return True
+
+
+def release(image_url):
+    """
+    Drop a blob from disk once db.session commits, if no row references it then.
+
+    The caller is usually about to delete the last referencing row; nothing is
+    removed if its transaction rolls back.
+
+    Returns:
+        bool: True (the caller's reference has been dealt with)
+    """
+    db.session.info.setdefault('released_blobs', set()).add(image_url)
+    return True
+
+
+###########################################################################################################################################
+# Reference counting
+
+def _reference_deltas(session):
+    deltas = defaultdict(int)
+    for obj in session.new:
+        if isinstance(obj, REFERENCING_MODELS) and is_content_addressed(obj.image_url):
+            deltas[obj.image_url] += 1
+    for obj in session.deleted:
+        if isinstance(obj, REFERENCING_MODELS):
+            history = inspect(obj).attrs.image_url.history
+            path = (history.deleted or [obj.image_url])[0]
+            if is_content_addressed(path):
+                deltas[path] -= 1
+    for obj in session.dirty:
+        if isinstance(obj, REFERENCING_MODELS):
+            history = inspect(obj).attrs.image_url.history
+            if history.has_changes():
+                for path in history.deleted:
+                    if is_content_addressed(path):
+                        deltas[path] -= 1
+                for path in history.added:
+                    if is_content_addressed(path):
+                        deltas[path] += 1
+    return {path: delta for path, delta in deltas.items() if delta}
+
+
+@event.listens_for(Session, 'after_flush')
+def _count_references(session, flush_context):
+    deltas = _reference_deltas(session)
+    if not deltas:
+        return
+
+    connection = session.connection()
+    upload_folder = current_app.config['UPLOAD_FOLDER'] if has_app_context() else None
+    rows = {}
+    for path in deltas:
+        file_path = absolute_path(path, upload_folder) if upload_folder else None
+        size = os.path.getsize(file_path) if file_path and os.path.exists(file_path) else None
+        rows[path] = {'path': path, 'size': size, 'ref_count': 0}
+    insert_missing(connection, files_table, 'path', list(rows.values()))
+
+    for path, delta in sorted(deltas.items()):
+        increment = update(files_table).where(files_table.c.path == path)\
+            .values(ref_count=files_table.c.ref_count + delta)
+        if connection.execute(increment).rowcount == 0:
+            # Deleted as unreferenced by a concurrent commit since insert_missing() ran
+            insert_missing(connection, files_table, 'path', [rows[path]])
+            connection.execute(increment)
+        if delta < 0:
+            session.info.setdefault('released_blobs', set()).add(path)
+
+
+@event.listens_for(Session, 'after_commit')
+def _remove_unreferenced(session):
+    released = session.info.pop('released_blobs', None)
+    if not released or not has_app_context():
+        return
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    for path in sorted(released):
+        try:
+            with session.get_bind().begin() as connection:
+                _remove_if_unreferenced(connection, path, upload_folder)
+        except Exception as e:
+            logger.error(f"Error removing unreferenced upload {path}: {str(e)}")
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_released(session, previous_transaction):
+    session.info.pop('released_blobs', None)
+
+
+@event.listens_for(Session, 'after_transaction_end')
+def _settle_uploads(session, transaction):
+    if transaction.parent is not None:
+        return
+    uploads = session.info.pop('stored_uploads', None)
+    if not uploads:
+        return
+    for path, (temp_path, upload_folder) in sorted(uploads.items()):
+        try:
+            with session.get_bind().begin() as connection:
+                if not _remove_if_unreferenced(connection, path, upload_folder):
+                    # Still referenced: restore the blob if a concurrent release unlinked it
+                    target = absolute_path(path, upload_folder)
+                    if not os.path.exists(target):
+                        os.makedirs(os.path.dirname(target), exist_ok=True)
+                        os.replace(temp_path, target)
+        except Exception as e:
+            logger.error(f"Error settling upload {path}: {str(e)}")
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
@@ -1,127 +1,468 @@
+import bisect
+import logging
+import random
+import threading
+import time
+import uuid
+
+import requests
 import stripe
-import os
 from flask import current_app
-from datetime import datetime
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# Stripe API gateway.
+#
+# The module used to set the process-global stripe.api_key at import and
+# call the SDK with its default HTTP client: no timeouts of ours (the SDK
+# waits up to 80s), no retries, nothing measured. The app now keeps one
+# StripeClient (app.extensions['stripe']) built from its config, talking to
+# a backend chosen by STRIPE_BACKEND:
+#   stripe - Stripe's API (or STRIPE_API_BASE) through an SDK client of our
+#            own, over a pooled keep-alive requests.Session with connect and
+#            read timeouts
+#   fake   - answers in-process after STRIPE_FAKE_LATENCY_MS, failing
+#            STRIPE_FAKE_FAILURE_RATE of the calls like a dropped
+#            connection, so checkout and refunds can be load-tested without
+#            network access (see benchmark_stripe_gateway.py)
+# Other backends register in BACKENDS under a name of their own.
+#
+# Every POST carries an idempotency key (the caller's, or one generated per
+# call) and the gateway retries connection errors, rate limits and 5xx up to
+# STRIPE_MAX_RETRIES times with the same key, so a retry after a lost
+# response never charges or refunds twice. Each call's latency, retries
+# included, goes into a per-operation histogram (GET /stripe/metrics).
+
+BUCKET_BOUNDS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+MAX_BACKOFF_SECONDS = 8
+
+
+class LatencyHistogram:
+    """Call latencies of one operation, counted in BUCKET_BOUNDS_MS buckets."""
+
+    def __init__(self, bounds=BUCKET_BOUNDS_MS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # last bucket: slower than every bound
+        self.count = 0
+        self.errors = 0
+        self.retries = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, elapsed_ms, retries=0, error=False):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.bounds, elapsed_ms)] += 1
+            self.count += 1
+            self.errors += int(error)
+            self.retries += retries
+            self.total_ms += elapsed_ms
+            self.max_ms = max(self.max_ms, elapsed_ms)
+
+    def _percentile(self, counts, count, q):
+        # Upper bound of the bucket holding the q-th call (the max for the last bucket)
+        rank = q * count
+        seen = 0
+        for index, bucket in enumerate(counts):
+            seen += bucket
+            if bucket and seen >= rank:
+                return min(self.bounds[index], self.max_ms) if index < len(self.bounds) else self.max_ms
+        return self.max_ms
+
+    def snapshot(self):
+        with self._lock:
+            counts, count = list(self.counts), self.count
+            summary = {
+                'count': count,
+                'errors': self.errors,
+                'retries': self.retries,
+                'mean_ms': round(self.total_ms / count, 2) if count else 0.0,
+                'max_ms': round(self.max_ms, 2),
+            }
+        for q in (0.5, 0.95, 0.99):
+            summary[f'p{int(q * 100)}_ms'] = round(self._percentile(counts, count, q), 2) if count else 0.0
+        labels = [f'le_{bound}' for bound in self.bounds] + ['le_inf']
+        summary['buckets'] = dict(zip(labels, counts))
+        return summary
+
+
+def _retryable(error):
+    """Whether a failed call may be sent again (with the same idempotency key)."""
+    should_retry = (getattr(error, 'headers', None) or {}).get('stripe-should-retry')
+    if should_retry in ('true', 'false'):
+        return should_retry == 'true'
+    if isinstance(error, (stripe.error.APIConnectionError, stripe.error.RateLimitError)):
+        return True
+    return isinstance(error, stripe.error.APIError) and (error.http_status or 0) >= 500
+
+
+class StripeAPIBackend:
+    """
+    Stripe's API through an SDK client with a pooled session and timeouts (no SDK-level retries).
+
+    Args:
+        api_key (str): Secret key; calls fail with AuthenticationError while it is missing
+        api_base (str): API address, Stripe's when None
+        connect_timeout (float): Seconds to wait for a connection
+        read_timeout (float): Seconds to wait for a response
+        pool_size (int): Keep-alive connections kept per host
+    """
+
+    def __init__(self, api_key, api_base=None, connect_timeout=5, read_timeout=30, pool_size=10):
+        self.api_key = api_key
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self._client = None
+        if api_key:
+            self._client = stripe.StripeClient(
+                api_key,
+                base_addresses={'api': api_base} if api_base else None,
+                max_network_retries=0,  # StripeClient (the gateway) retries
+                http_client=stripe.RequestsClient(timeout=(connect_timeout, read_timeout), session=self.session)
+            )
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            api_key=config.get('STRIPE_SECRET_KEY'),
+            api_base=config.get('STRIPE_API_BASE'),
+            connect_timeout=config.get('STRIPE_CONNECT_TIMEOUT', 5),
+            read_timeout=config.get('STRIPE_READ_TIMEOUT', 30),
+            pool_size=config.get('STRIPE_POOL_SIZE', 10)
+        )
+
+    @property
+    def client(self):
+        if self._client is None:
+            raise stripe.error.AuthenticationError("No Stripe API key provided. Set STRIPE_SECRET_KEY in your .env file.")
+        return self._client
+
+    def create_payment_intent(self, params, idempotency_key):
+        return self.client.v1.payment_intents.create(params, {'idempotency_key': idempotency_key}).to_dict()
+
+    def confirm_payment_intent(self, payment_intent_id, params, idempotency_key):
+        return self.client.v1.payment_intents.confirm(
+            payment_intent_id, params, {'idempotency_key': idempotency_key}
+        ).to_dict()
+
+    def retrieve_payment_intent(self, payment_intent_id):
+        return self.client.v1.payment_intents.retrieve(payment_intent_id).to_dict()
+
+    def create_refund(self, params, idempotency_key):
+        return self.client.v1.refunds.create(params, {'idempotency_key': idempotency_key}).to_dict()
+
+    def close(self):
+        self.session.close()
+
+
+class FakeStripeBackend:
+    """
+    In-process stand-in for Stripe's API, for load tests.
+
+    Keeps payment intents and refunds in memory and replays the stored result
+    for a repeated idempotency key, like Stripe. A simulated failure is raised
+    either before the call is applied or after (a lost response), so retries
+    are exercised both ways.
+
+    Args:
+        latency (float): Seconds every call takes
+        failure_rate (float): Share of calls that fail with APIConnectionError
+        seed (int): Seed of the failure draws
+    """
+
+    def __init__(self, latency=0.0, failure_rate=0.0, seed=None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.payment_intents = {}
+        self.refunds = {}
+        self.calls = 0
+        self.failures = 0
+        self._responses = {}  # idempotency key -> (operation, params, result)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            latency=config.get('STRIPE_FAKE_LATENCY_MS', 0) / 1000,
+            failure_rate=config.get('STRIPE_FAKE_FAILURE_RATE', 0)
+        )
+
+    def _fails(self):
+        with self._lock:
+            self.calls += 1
+            failed = self._random.random() < self.failure_rate
+            self.failures += int(failed)
+            return failed and self._random.choice(['before', 'after'])
+
+    def _idempotent(self, operation, params, idempotency_key, apply):
+        if self.latency:
+            time.sleep(self.latency)
+        failure = self._fails()
+        if failure == 'before':
+            raise stripe.error.APIConnectionError("Simulated network error before the request was sent")
+        with self._lock:
+            stored = self._responses.get(idempotency_key)
+            if stored is None:
+                result = apply(params)
+                self._responses[idempotency_key] = (operation, params, result)
+            elif stored[:2] != (operation, params):
+                raise stripe.error.IdempotencyError(
+                    "Keys for idempotent requests can only be used with the same parameters they were first used with."
+                )
+            else:
+                result = stored[2]
+        if failure == 'after':
+            raise stripe.error.APIConnectionError("Simulated network error while reading the response")
+        return dict(result)
+
+    def _payment_intent(self, payment_intent_id):
+        payment_intent = self.payment_intents.get(payment_intent_id)
+        if payment_intent is None:
+            raise stripe.error.InvalidRequestError(
+                f"No such payment_intent: '{payment_intent_id}'", 'id', code='resource_missing', http_status=404
+            )
+        return payment_intent
+
+    def _new_payment_intent(self, params):
+        payment_intent_id = f'pi_fake_{uuid.uuid4().hex[:24]}'
+        payment_intent = {
+            'id': payment_intent_id,
+            'object': 'payment_intent',
+            'amount': params['amount'],
+            'currency': params.get('currency'),
+            'metadata': dict(params.get('metadata') or {}),
+            'description': params.get('description'),
+            'client_secret': f'{payment_intent_id}_secret_{uuid.uuid4().hex[:24]}',
+            'status': 'requires_payment_method',
+        }
+        self.payment_intents[payment_intent_id] = payment_intent
+        return payment_intent
+
+    def _confirm(self, payment_intent_id):
+        def apply(params):
+            payment_intent = self._payment_intent(payment_intent_id)
+            payment_intent['status'] = 'succeeded'
+            return dict(payment_intent)
+        return apply
+
+    def _new_refund(self, params):
+        payment_intent = self._payment_intent(params['payment_intent'])
+        refunded = sum(refund['amount'] for refund in self.refunds.values()
+                       if refund['payment_intent'] == payment_intent['id'])
+        amount = params.get('amount', payment_intent['amount'] - refunded)
+        if amount <= 0 or refunded + amount > payment_intent['amount']:
+            raise stripe.error.InvalidRequestError(
+                "Refund amount is greater than the unrefunded amount of the charge", 'amount', http_status=400
+            )
+        refund = {
+            'id': f're_fake_{uuid.uuid4().hex[:24]}',
+            'object': 'refund',
+            'amount': amount,
+            'payment_intent': payment_intent['id'],
+            'reason': params.get('reason'),
+            'status': 'succeeded',
+        }
+        self.refunds[refund['id']] = refund
+        return refund
+
+    def create_payment_intent(self, params, idempotency_key):
+        return self._idempotent('payment_intents.create', params, idempotency_key, self._new_payment_intent)
+
+    def confirm_payment_intent(self, payment_intent_id, params, idempotency_key):
+        return self._idempotent(f'payment_intents.confirm:{payment_intent_id}', params, idempotency_key,
+                                self._confirm(payment_intent_id))
+
+    def retrieve_payment_intent(self, payment_intent_id):
+        if self.latency:
+            time.sleep(self.latency)
+        if self._fails():
+            raise stripe.error.APIConnectionError("Simulated network error")
+        with self._lock:
+            return dict(self._payment_intent(payment_intent_id))
+
+    def create_refund(self, params, idempotency_key):
+        return self._idempotent('refunds.create', params, idempotency_key, self._new_refund)
+
+    def close(self):
+        pass
+
+
+BACKENDS = {
+    'stripe': StripeAPIBackend,
+    'fake': FakeStripeBackend,
+}
 
-# Initialize Stripe with the secret key from config
-stripe.api_key = os.getenv('STRIPE_SECRET_KEY')
 
 class StripeClient:
-    def __init__(self):
-        self.stripe = stripe
-    
-    def create_payment_intent(self, amount, currency='kes', metadata=None):
-        """
-        Create a payment intent for bank transfer
-        """
+    """
+    Stripe calls of the app: bounded retries with idempotency keys and latency histograms around a backend.
+
+    Args:
+        backend: StripeAPIBackend, FakeStripeBackend or another BACKENDS entry
+        max_retries (int): Retries of a call that failed with a retryable error
+        backoff_factor (float): Retry backoff, backoff_factor * 2 ** (retry - 1) seconds
+    """
+
+    def __init__(self, backend, max_retries=2, backoff_factor=0.5):
+        self.backend = backend
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.latency = {}
+        self._latency_lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        name = config.get('STRIPE_BACKEND', 'stripe')
+        if name not in BACKENDS:
+            raise ValueError(f"Unknown STRIPE_BACKEND {name!r}; expected one of {sorted(BACKENDS)}")
+        return cls(
+            BACKENDS[name].from_config(config),
+            max_retries=config.get('STRIPE_MAX_RETRIES', 2),
+            backoff_factor=config.get('STRIPE_BACKOFF_FACTOR', 0.5)
+        )
+
+    def _histogram(self, operation):
+        histogram = self.latency.get(operation)
+        if histogram is None:
+            with self._latency_lock:
+                histogram = self.latency.setdefault(operation, LatencyHistogram())
+        return histogram
+
+    def _call(self, operation, send):
+        """Run send() until it succeeds, fails for good or runs out of retries; records its latency."""
+        started = time.perf_counter()
+        retries = 0
+        try:
+            while True:
+                try:
+                    result = send()
+                    break
+                except stripe.error.StripeError as e:
+                    if retries >= self.max_retries or not _retryable(e):
+                        raise
+                    retries += 1
+                    delay = min(self.backoff_factor * 2 ** (retries - 1), MAX_BACKOFF_SECONDS)
+                    logger.warning(f"Stripe {operation} failed ({str(e)}); retry {retries}/{self.max_retries} in {delay}s")
+                    time.sleep(delay)
+        except Exception:
+            self._histogram(operation).observe((time.perf_counter() - started) * 1000, retries, error=True)
+            raise
+        self._histogram(operation).observe((time.perf_counter() - started) * 1000, retries)
+        return result
+
+    def metrics(self):
+        """Latency histogram snapshot per operation."""
+        with self._latency_lock:
+            operations = dict(self.latency)
+        return {operation: histogram.snapshot() for operation, histogram in sorted(operations.items())}
+
+    def _create_intent(self, params, idempotency_key):
+        idempotency_key = idempotency_key or uuid.uuid4().hex
         try:
-            payment_intent = stripe.PaymentIntent.create(
-                amount=int(amount * 100),  # Convert to cents
-                currency=currency,
-                payment_method_types=['card'],
-                metadata=metadata or {},
-                description="Furniture purchase payment"
+            payment_intent = self._call(
+                'payment_intents.create', lambda: self.backend.create_payment_intent(params, idempotency_key)
             )
             return {
                 'success': True,
-                'payment_intent_id': payment_intent.id,
-                'client_secret': payment_intent.client_secret,
-                'amount': amount,
-                'currency': currency
+                'payment_intent_id': payment_intent['id'],
+                'client_secret': payment_intent['client_secret'],
+                'amount': params['amount'] / 100,
+                'currency': params['currency']
             }
         except stripe.error.StripeError as e:
             return {
                 'success': False,
                 'error': str(e)
             }
-    
-    def create_bank_transfer_payment_intent(self, amount, currency='kes', metadata=None):
+
+    def create_payment_intent(self, amount, currency='kes', metadata=None, idempotency_key=None):
+        """
+        Create a payment intent for bank transfer
+        """
+        return self._create_intent({
+            'amount': int(round(float(amount) * 100)),  # Convert to cents
+            'currency': currency,
+            'payment_method_types': ['card'],
+            'metadata': metadata or {},
+            'description': "Furniture purchase payment"
+        }, idempotency_key)
+
+    def create_bank_transfer_payment_intent(self, amount, currency='kes', metadata=None, idempotency_key=None):
         """
         Create a payment intent specifically for bank transfer
         """
-        try:
-            payment_intent = stripe.PaymentIntent.create(
-                amount=int(amount * 100),  # Convert to cents
-                currency=currency,
-                payment_method_types=['card'],
-                metadata=metadata or {},
-                description="Bank transfer payment for furniture purchase",
-                setup_future_usage='off_session'  # For future payments
-            )
-            return {
-                'success': True,
-                'payment_intent_id': payment_intent.id,
-                'client_secret': payment_intent.client_secret,
-                'amount': amount,
-                'currency': currency
-            }
-        except stripe.error.StripeError as e:
-            return {
-                'success': False,
-                'error': str(e)
-            }
-    
-    def confirm_payment_intent(self, payment_intent_id, payment_method_id=None):
+        return self._create_intent({
+            'amount': int(round(float(amount) * 100)),  # Convert to cents
+            'currency': currency,
+            'payment_method_types': ['card'],
+            'metadata': metadata or {},
+            'description': "Bank transfer payment for furniture purchase",
+            'setup_future_usage': 'off_session'  # For future payments
+        }, idempotency_key)
+
+    def confirm_payment_intent(self, payment_intent_id, payment_method_id=None, idempotency_key=None):
         """
         Confirm a payment intent
         """
+        params = {'payment_method': payment_method_id} if payment_method_id else {}
+        idempotency_key = idempotency_key or uuid.uuid4().hex
         try:
-            if payment_method_id:
-                payment_intent = stripe.PaymentIntent.confirm(
-                    payment_intent_id,
-                    payment_method=payment_method_id
-                )
-            else:
-                payment_intent = stripe.PaymentIntent.confirm(payment_intent_id)
-            
+            payment_intent = self._call(
+                'payment_intents.confirm',
+                lambda: self.backend.confirm_payment_intent(payment_intent_id, params, idempotency_key)
+            )
             return {
                 'success': True,
                 'payment_intent': payment_intent,
-                'status': payment_intent.status
+                'status': payment_intent['status']
             }
         except stripe.error.StripeError as e:
             return {
                 'success': False,
                 'error': str(e)
             }
-    
+
     def retrieve_payment_intent(self, payment_intent_id):
         """
         Retrieve a payment intent
         """
         try:
-            payment_intent = stripe.PaymentIntent.retrieve(payment_intent_id)
+            payment_intent = self._call(
+                'payment_intents.retrieve', lambda: self.backend.retrieve_payment_intent(payment_intent_id)
+            )
             return {
                 'success': True,
                 'payment_intent': payment_intent,
-                'status': payment_intent.status
+                'status': payment_intent['status']
             }
         except stripe.error.StripeError as e:
             return {
                 'success': False,
                 'error': str(e)
             }
-    
-    def create_refund(self, payment_intent_id, amount=None, reason='requested_by_customer'):
+
+    def create_refund(self, payment_intent_id, amount=None, reason='requested_by_customer', idempotency_key=None):
         """
         Create a refund for a payment
         """
+        refund_data = {
+            'payment_intent': payment_intent_id,
+            'reason': reason
+        }
+        if amount:
+            refund_data['amount'] = int(round(float(amount) * 100))  # Convert to cents
+        idempotency_key = idempotency_key or uuid.uuid4().hex
         try:
-            refund_data = {
-                'payment_intent': payment_intent_id,
-                'reason': reason
-            }
-            
-            if amount:
-                refund_data['amount'] = int(amount * 100)  # Convert to cents
-            
-            refund = stripe.Refund.create(**refund_data)
-            
+            refund = self._call('refunds.create', lambda: self.backend.create_refund(refund_data, idempotency_key))
             return {
                 'success': True,
-                'refund_id': refund.id,
-                'amount': refund.amount / 100,  # Convert back from cents
-                'status': refund.status
+                'refund_id': refund['id'],
+                'amount': refund['amount'] / 100,  # Convert back from cents
+                'status': refund['status']
             }
         except stripe.error.StripeError as e:
             return {
@@ -129,5 +470,20 @@ class StripeClient:
                 'error': str(e)
             }
 
-# Create a global instance
-stripe_client = StripeClient()
+    def close(self):
+        self.backend.close()
+
+
+_client_lock = threading.Lock()
+
+
+def get_stripe_client(app=None):
+    """The app's shared StripeClient, created from its config on first use."""
+    app = app or current_app._get_current_object()
+    client = app.extensions.get('stripe')
+    if client is None:
+        with _client_lock:
+            client = app.extensions.get('stripe')
+            if client is None:
+                client = app.extensions['stripe'] = StripeClient.from_config(app.config)
+    return client
@@ -0,0 +1,231 @@
+import json
+import logging
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import select, insert, update
+from sqlalchemy.exc import IntegrityError
+
+from extensions import db
+from models import StripeEvent, Payment, PaymentStatus
+from utils.payment_events import payment_state, publish_payment_state
+from utils.workers import InboxWorkers, claim_rows, RECEIVED
+
+logger = logging.getLogger(__name__)
+
+# Stripe webhook event store.
+#
+# Stripe delivers events at least once, in no particular order, and retries
+# any delivery that isn't acknowledged quickly. The webhook used to update
+# the payment inline, one lookup and commit per event, and applied every
+# redelivery again. Now it verifies the signature and stores the event under
+# its Stripe event id: a redelivery hits the primary key and is acknowledged
+# without further work.
+#
+# Event workers apply stored events in batches of STRIPE_EVENT_BATCH_SIZE,
+# all in one transaction. Events are grouped by the payment they concern
+# (the order_id in the payment intent's metadata) and only the newest one of
+# each payment (by Stripe's `created`, a success outranking a failure in the
+# same second) is applied; older ones, including events that arrive after a
+# newer one was applied, are marked superseded. The final payment state is
+# therefore the same whatever order, batching or duplication the events
+# arrive with, which lets `flask export-stripe-events` logs be replayed (see
+# benchmark_stripe_webhooks.py) to reproduce it.
+
+PROCESSED = 'processed'
+SUPERSEDED = 'superseded'
+IGNORED = 'ignored'
+FAILED = 'failed'
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_POLL_SECONDS = 2
+DEFAULT_RETRY_SECONDS = 10
+
+# Payment status each handled event type sets, and its rank among events of the same second
+EVENT_STATUSES = {
+    'payment_intent.payment_failed': PaymentStatus.FAILED,
+    'payment_intent.succeeded': PaymentStatus.COMPLETED,
+}
+EVENT_RANKS = {event_type: rank for rank, event_type in enumerate(EVENT_STATUSES)}
+
+events_table = StripeEvent.__table__
+
+
+def _order_id(payment_intent):
+    try:
+        return int((payment_intent.get('metadata') or {}).get('order_id'))
+    except (TypeError, ValueError):
+        return None
+
+
+def record_event(event):
+    """
+    Store a verified webhook event for the event workers.
+
+    Args:
+        event (dict): Event as sent by Stripe
+
+    Returns:
+        bool: False if the event id was already stored (a redelivery)
+    """
+    payment_intent = (event.get('data') or {}).get('object') or {}
+    order_id = _order_id(payment_intent)
+    handled = event.get('type') in EVENT_STATUSES and order_id is not None
+    try:
+        db.session.execute(insert(events_table).values(
+            event_id=event['id'],
+            event_type=event.get('type'),
+            object_id=payment_intent.get('id'),
+            order_id=order_id,
+            created=int(event.get('created') or 0),
+            payload=event,
+            status=RECEIVED if handled else IGNORED
+        ))
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return False
+    if handled:
+        wake()
+    return True
+
+
+def _order_key(row):
+    """Newest-wins order of events: Stripe timestamp, then success over failure, then event id."""
+    return row.created, EVENT_RANKS.get(row.event_type, -1), row.event_id
+
+
+def _claim(limit, now):
+    return claim_rows(
+        events_table,
+        events_table.c.event_id,
+        [events_table.c.created, events_table.c.event_id],
+        [events_table.c.event_id, events_table.c.event_type, events_table.c.order_id,
+         events_table.c.created, events_table.c.attempts],
+        limit,
+        now,
+        current_app.config.get('STRIPE_EVENT_RETRY_SECONDS', DEFAULT_RETRY_SECONDS)
+    )
+
+
+def _set_status(event_ids, status, error=None):
+    if not event_ids:
+        return
+    values = {'status': status, 'error': error}
+    if status != RECEIVED:
+        values['processed_at'] = datetime.utcnow()
+    db.session.execute(update(events_table).where(events_table.c.event_id.in_(event_ids)).values(**values))
+
+
+def _retry_or_fail(rows, error):
+    max_attempts = current_app.config.get('STRIPE_EVENT_MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS)
+    for row in rows:
+        status = FAILED if row.attempts >= max_attempts else RECEIVED
+        if status == FAILED:
+            logger.error(f"Giving up on Stripe event {row.event_id} for order {row.order_id}: {error}")
+        _set_status([row.event_id], status, error[:255])
+
+
+def _apply(rows):
+    """Apply claimed events in the session's transaction; returns the new states of the payments they changed."""
+    groups = {}
+    for row in rows:
+        groups.setdefault(row.order_id, []).append(row)
+    order_ids = list(groups)
+
+    # Lock the payments first so a concurrent batch touching the same ones
+    # finishes before this one reads what was already applied (PostgreSQL)
+    payments = {}
+    for payment in Payment.query.filter(Payment.order_id.in_(order_ids))\
+            .order_by(Payment.order_id, Payment.payment_id).with_for_update():
+        payments.setdefault(payment.order_id, payment)
+
+    # Newest event already applied to each payment, from earlier batches
+    applied = {}
+    for row in db.session.execute(
+        select(events_table.c.order_id, events_table.c.event_id, events_table.c.event_type, events_table.c.created)
+        .where(events_table.c.order_id.in_(order_ids), events_table.c.status == PROCESSED)
+    ):
+        if row.order_id not in applied or _order_key(row) > applied[row.order_id]:
+            applied[row.order_id] = _order_key(row)
+
+    processed, superseded, states = [], [], []
+    for order_id, events in groups.items():
+        newest = max(events, key=_order_key)
+        if order_id in applied and applied[order_id] >= _order_key(newest):
+            superseded += [row.event_id for row in events]
+            continue
+        payment = payments.get(order_id)
+        if payment is None:
+            _retry_or_fail(events, 'Payment not found')
+            continue
+        payment.payment_status = EVENT_STATUSES[newest.event_type]
+        processed.append(newest.event_id)
+        superseded += [row.event_id for row in events if row is not newest]
+        states.append(payment_state(payment))
+
+    _set_status(processed, PROCESSED)
+    _set_status(superseded, SUPERSEDED)
+    return states
+
+
+def process_batch(limit=None):
+    """
+    Claim and apply the oldest waiting events in one transaction.
+
+    Returns:
+        int: Number of events claimed (0 when none are waiting)
+    """
+    limit = limit or current_app.config.get('STRIPE_EVENT_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+    rows = _claim(limit, datetime.utcnow())
+    if not rows:
+        return 0
+
+    try:
+        states = _apply(rows)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.warning(f"Stripe event batch of {len(rows)} failed ({str(e)}); applying payment by payment")
+        groups = {}
+        for row in rows:
+            groups.setdefault(row.order_id, []).append(row)
+        states = []
+        for events in groups.values():
+            try:
+                states += _apply(events)
+                db.session.commit()
+            except Exception as group_error:
+                db.session.rollback()
+                _retry_or_fail(events, str(group_error))
+                db.session.commit()
+
+    for state in states:
+        publish_payment_state(state)
+    return len(rows)
+
+
+def drain():
+    """Process batches until no events are waiting; returns the number of events claimed."""
+    total = 0
+    while True:
+        claimed = process_batch()
+        if not claimed:
+            return total
+        total += claimed
+
+
+def export_events(stream):
+    """Write every stored event to `stream` as JSON lines in Stripe order; returns the number written."""
+    count = 0
+    for (payload,) in db.session.execute(
+        select(events_table.c.payload).order_by(events_table.c.created, events_table.c.event_id)
+    ):
+        stream.write(json.dumps(payload) + '\n')
+        count += 1
+    return count
+
+
+workers = InboxWorkers('stripe-events', drain, 'STRIPE_EVENT_WORKERS', 'STRIPE_EVENT_POLL_SECONDS',
+                       default_workers=1, default_poll_seconds=DEFAULT_POLL_SECONDS)
+wake = workers.wake
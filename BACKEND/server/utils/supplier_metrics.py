@@ -0,0 +1,80 @@
+from sqlalchemy import select, func, distinct
+
+from extensions import db
+from models import Supplier, Product, Order, OrderItem
+
+# Supplier performance metrics.
+#
+# Products supplied, distinct orders containing them, spend on their order
+# items and the latest such order, for every supplier in one grouped query.
+# Product counts and order figures are grouped separately before being joined
+# onto suppliers so one supplier's products don't multiply its order rows.
+# Listings join the subquery to sort by a metric in SQL and read the figures
+# of the page they return with supplier_metrics().
+
+METRICS = ('products', 'orders', 'total_spent', 'last_order')
+
+
+def supplier_metrics_subquery(supplier_ids=None):
+    """
+    Subquery with one row per supplier: supplier_id, products, orders, total_spent, last_order.
+
+    Args:
+        supplier_ids (iterable): Only compute these suppliers (default: all)
+    """
+    product_counts = select(
+        Product.supplier_id,
+        func.count(Product.product_id).label('products')
+    ).group_by(Product.supplier_id)
+
+    order_stats = select(
+        Product.supplier_id,
+        func.count(distinct(OrderItem.order_id)).label('orders'),
+        func.sum(OrderItem.price * OrderItem.quantity).label('total_spent'),
+        func.max(Order.order_date).label('last_order')
+    ).select_from(OrderItem)\
+        .join(Product, Product.product_id == OrderItem.product_id)\
+        .join(Order, Order.order_id == OrderItem.order_id)\
+        .group_by(Product.supplier_id)
+
+    if supplier_ids is not None:
+        supplier_ids = list(supplier_ids)
+        product_counts = product_counts.where(Product.supplier_id.in_(supplier_ids))
+        order_stats = order_stats.where(Product.supplier_id.in_(supplier_ids))
+
+    product_counts = product_counts.subquery()
+    order_stats = order_stats.subquery()
+    metrics = select(
+        Supplier.supplier_id,
+        func.coalesce(product_counts.c.products, 0).label('products'),
+        func.coalesce(order_stats.c.orders, 0).label('orders'),
+        func.coalesce(order_stats.c.total_spent, 0).label('total_spent'),
+        order_stats.c.last_order
+    ).select_from(Supplier)\
+        .outerjoin(product_counts, product_counts.c.supplier_id == Supplier.supplier_id)\
+        .outerjoin(order_stats, order_stats.c.supplier_id == Supplier.supplier_id)
+    if supplier_ids is not None:
+        metrics = metrics.where(Supplier.supplier_id.in_(supplier_ids))
+    return metrics.subquery('supplier_metrics')
+
+
+def supplier_metrics(supplier_ids):
+    """
+    Metrics for some suppliers (e.g. one page of a listing) in one query.
+
+    Returns:
+        dict: {supplier_id: {'products', 'orders', 'total_spent', 'last_order'}}
+    """
+    supplier_ids = list(supplier_ids)
+    if not supplier_ids:
+        return {}
+    metrics = supplier_metrics_subquery(supplier_ids)
+    return {
+        row.supplier_id: {
+            'products': row.products,
+            'orders': row.orders,
+            'total_spent': float(row.total_spent),
+            'last_order': row.last_order
+        }
+        for row in db.session.execute(select(metrics))
+    }
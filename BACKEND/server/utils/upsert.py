@@ -0,0 +1,35 @@
+from sqlalchemy import select, tuple_
+
+
+def insert_missing(connection, table, key, rows):
+    """
+    Insert the rows whose `key` value isn't in `table` yet, leaving existing rows untouched.
+
+    Args:
+        connection: Connection bound to the current transaction
+        table: Core Table
+        key (str or tuple): Name of the primary key column, or the names of a composite key's columns
+        rows (list): Row dicts, each including `key`
+    """
+    if not rows:
+        return
+    keys = [key] if isinstance(key, str) else list(key)
+    dialect = connection.dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        connection.execute(insert(table).on_conflict_do_nothing(index_elements=keys), rows)
+        return
+
+    def key_of(row):
+        return tuple(row[name] for name in keys)
+
+    columns = tuple_(*(table.c[name] for name in keys))
+    existing = set(connection.execute(
+        select(*(table.c[name] for name in keys)).where(columns.in_([key_of(row) for row in rows]))
+    ).tuples())
+    missing = [row for row in rows if key_of(row) not in existing]
+    if missing:
+        connection.execute(table.insert(), missing)
@@ -0,0 +1,124 @@
+import logging
+import threading
+from datetime import timedelta
+
+from flask import current_app, has_app_context
+from sqlalchemy import select, update, or_
+
+from extensions import db
+
+logger = logging.getLogger(__name__)
+
+# Background workers for inbox tables.
+#
+# Webhook-style endpoints (M-Pesa callbacks, Stripe events) store what they
+# receive and answer at once; an InboxWorkers pool applies the stored rows.
+# The threads start when the app is served (start_background_workers() in
+# app.py, called from wsgi.py and `python app.py`, or the first time a row is
+# stored in a process that skipped it), never when the app is merely imported
+# by a CLI command or script. They are woken by each new row, and also poll
+# every few seconds for rows stored by other processes, left for a retry, or
+# left pending by a restart. START_BACKGROUND_WORKERS=false keeps a process
+# from starting any.
+#
+# Inbox tables share status/attempts/claimed_at columns so claim_rows() can
+# hand each waiting row to exactly one worker.
+#
+# The same threads also run periodic jobs that are never woken, such as the
+# expired stock-reservation sweep in utils.inventory.
+
+RECEIVED = 'received'
+PROCESSING = 'processing'
+CLAIM_TIMEOUT_SECONDS = 300  # claims of a worker that died mid-batch lapse after this
+
+
+def claim_rows(table, key, order_by, returning, limit, now, retry_seconds):
+    """
+    Claim up to `limit` waiting rows of an inbox table with one conditional UPDATE and commit.
+
+    Waiting rows are new ones, retries whose last attempt is `retry_seconds`
+    old, and lapsed claims. Each claim counts as an attempt.
+
+    Args:
+        table (Table): Inbox table (status, attempts and claimed_at columns)
+        key (Column): Primary key column
+        order_by (list): Columns rows are claimed in order of
+        returning (list): Columns to return for each claimed row
+        limit (int): Batch size
+        now (datetime): Claim time
+        retry_seconds (int): Delay before a released row is claimed again
+
+    Returns:
+        list: Claimed rows (with `attempts` already incremented), unordered
+    """
+    claimable = or_(
+        (table.c.status == RECEIVED) & or_(
+            table.c.claimed_at.is_(None),
+            table.c.claimed_at <= now - timedelta(seconds=retry_seconds)
+        ),
+        (table.c.status == PROCESSING) & (table.c.claimed_at <= now - timedelta(seconds=CLAIM_TIMEOUT_SECONDS))
+    )
+    keys = select(key).where(claimable).order_by(*order_by).limit(limit).scalar_subquery()
+    rows = db.session.execute(
+        update(table)
+        .where(key.in_(keys), claimable)
+        .values(status=PROCESSING, claimed_at=now, attempts=table.c.attempts + 1)
+        .returning(*returning)
+    ).all()
+    db.session.commit()
+    return rows
+
+
+class InboxWorkers:
+    """
+    Daemon threads that run `drain` (in an app context) whenever woken, or every poll interval.
+
+    Args:
+        name (str): Thread name prefix
+        drain (callable): Processes waiting rows until there are none left
+        workers_setting (str): Config key with the number of threads per process (0: none)
+        poll_setting (str): Config key with the seconds between polls
+        default_workers (int): Thread count if the config key is missing
+        default_poll_seconds (float): Poll interval if the config key is missing
+    """
+
+    def __init__(self, name, drain, workers_setting, poll_setting, default_workers=1, default_poll_seconds=2):
+        self.name = name
+        self.drain = drain
+        self.workers_setting = workers_setting
+        self.poll_setting = poll_setting
+        self.default_workers = default_workers
+        self.default_poll_seconds = default_poll_seconds
+        self._threads = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+
+    def _work(self, app):
+        poll_seconds = app.config.get(self.poll_setting, self.default_poll_seconds)
+        while True:
+            self._wakeup.wait(poll_seconds)
+            self._wakeup.clear()
+            with app.app_context():
+                try:
+                    self.drain()
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f"{self.name} worker error: {str(e)}")
+                finally:
+                    db.session.remove()
+
+    def start(self, app):
+        """Start the threads (once per process)."""
+        with self._lock:
+            if self._threads:
+                return
+            for index in range(app.config.get(self.workers_setting, self.default_workers)):
+                thread = threading.Thread(target=self._work, args=(app,), name=f'{self.name}-{index}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def wake(self):
+        """Have the workers look for new rows now."""
+        if has_app_context() and current_app.config.get('START_BACKGROUND_WORKERS'):
+            self.start(current_app._get_current_object())
+        self._wakeup.set()
@@ -0,0 +1,16 @@
+#!/usr/bin/env python3
+"""
+WSGI entry point for production servers, e.g.
+
+    gunicorn --workers 4 wsgi:app
+
+Starts the background workers (reservation sweeper, M-Pesa and Stripe inbox
+pools) in every process that imports it. Load it in each server worker: with
+gunicorn --preload the threads would start in the master and not survive the
+fork. Set START_BACKGROUND_WORKERS=false for processes that should only serve
+requests.
+"""
+
+from app import app, start_background_workers
+
+start_background_workers()